@@ -10,6 +10,7 @@ import json
 from datetime import datetime
 from prompt_analysis import PromptAnalyzer
 from statistics_dashboard import StatisticsManager
+from src.analysis_session import AnalysisSession
 
 def generate_comprehensive_report():
     """包括的レポート生成"""
@@ -25,6 +26,8 @@ def generate_comprehensive_report():
 
     # 基本統計
     stats_manager = StatisticsManager()
+    # パターン分析・カテゴライズ・キーワード傾向は 1 回の走査でまとめて計算する
+    session = AnalysisSession(stats_manager.db_path, sections=('patterns', 'categories', 'keyword_trends'))
     basic_stats = stats_manager.get_basic_stats()
     basic = basic_stats['basic']
 
@@ -40,7 +43,7 @@ def generate_comprehensive_report():
     print("-" * 40)
 
     analyzer = PromptAnalyzer()
-    patterns = analyzer.extract_common_patterns()
+    patterns = analyzer.extract_common_patterns(session)
 
     print(f"📝 カンマ区切り形式: {patterns['comma_separated']}/{basic['total_prompts']} ({patterns['comma_separated']/basic['total_prompts']*100:.1f}%)")
     print(f"⚖️ 重み付け記法使用: {patterns['weight_usage']} ({patterns['weight_usage']/basic['total_prompts']*100:.1f}%)")
@@ -64,7 +67,7 @@ def generate_comprehensive_report():
     print("📂 3. 自動カテゴライズ結果")
     print("-" * 40)
 
-    categories = analyzer.categorize_prompts()
+    categories = analyzer.categorize_prompts(session)
     total_categorized = sum(len(prompts) for prompts in categories.values())
 
     for category, prompts in categories.items():
@@ -80,7 +83,7 @@ def generate_comprehensive_report():
     print("-" * 40)
 
     # キーワード品質分析
-    keyword_stats = stats_manager.extract_keyword_trends()
+    keyword_stats = stats_manager.extract_keyword_trends(session)
     keyword_quality = keyword_stats['keyword_quality']
 
     # 高品質キーワード
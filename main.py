@@ -38,6 +38,7 @@ try:
     categorizer = importlib.import_module('src.categorizer')
     visualizer = importlib.import_module('src.visualizer')
     database = importlib.import_module('src.database')
+    registry = importlib.import_module('src.registry')
 
     # 必要な要素を個別に取得
     CIVITAI_API_KEY = config.CIVITAI_API_KEY
@@ -48,6 +49,8 @@ try:
     process_database_prompts = categorizer.process_database_prompts
     DataVisualizer = visualizer.DataVisualizer
     DatabaseManager = database.DatabaseManager
+    get_database = registry.get_database
+    get_writer = registry.get_writer
 
     print("モジュール読み込み完了")
 
@@ -99,7 +102,7 @@ def run_collection(max_items: int = DEFAULT_MAX_ITEMS, model_id: Optional[str] =
 
     try:
         collector = CivitaiPromptCollector()
-        db = DatabaseManager()
+        writer = get_writer()
 
         if model_id:
             # 指定モデル収集
@@ -117,11 +120,8 @@ def run_collection(max_items: int = DEFAULT_MAX_ITEMS, model_id: Optional[str] =
                 max_items=max_items
             )
 
-        # データベース保存
-        saved_count = 0
-        for item in result.get('items', []):
-            if db.save_prompt_data(item):
-                saved_count += 1
+        # データベース保存（取り込みサービスが動いていればそこへ送る。新規件数を数える）
+        saved_count = writer.save_prompts_bulk(result.get('items', []))['inserted']
 
         print(f"✅ 収集完了:")
         print(f"  - 総取得数: {result.get('collected', 0)}件")
@@ -134,13 +134,13 @@ def run_collection(max_items: int = DEFAULT_MAX_ITEMS, model_id: Optional[str] =
         print(f"❌ 収集エラー: {e}")
         return False
 
-def run_categorization() -> bool:
-    """プロンプト分類実行"""
+def run_categorization(representatives_only: bool = False) -> bool:
+    """プロンプト分類実行（representatives_only なら近似重複クラスタの代表だけを分類）"""
     print(f"\n🏷️  プロンプト自動分類開始")
 
     try:
         # categorizer.pyのprocess_database_prompts()を呼び出し
-        process_database_prompts()
+        process_database_prompts(representatives_only=representatives_only)
         print("✅ 分類完了")
         return True
 
@@ -180,11 +180,10 @@ def run_visualization() -> bool:
 def show_database_status():
     """データベース状況表示"""
     try:
-        db = DatabaseManager()
+        db = get_database()
 
-        # プロンプト数取得
-        prompts = db.get_all_prompts()
-        prompt_count = len(prompts)
+        # プロンプト数取得（集計テーブルから。全件は読み込まない）
+        prompt_count = db.get_total_prompts_count()
 
         # 分類済み数取得 - SQLite直接接続で修正
         import sqlite3
@@ -206,10 +205,9 @@ def show_database_status():
         print(f"データベース状況確認エラー: {e}")
         # 基本情報のみ表示
         try:
-            db = DatabaseManager()
-            prompts = db.get_all_prompts()
+            db = get_database()
             print(f"\n📊 データベース状況:")
-            print(f"  - 総プロンプト数: {len(prompts)}件")
+            print(f"  - 総プロンプト数: {db.get_total_prompts_count()}件")
         except Exception as inner_e:
             print(f"  - データベース接続エラー: {inner_e}")
 
@@ -235,6 +233,7 @@ def main():
     parser.add_argument('--categorize-only', action='store_true', help='プロンプト分類のみ実行')
     parser.add_argument('--visualize-only', action='store_true', help='データ可視化のみ実行')
     parser.add_argument('--status', action='store_true', help='データベース状況確認のみ')
+    parser.add_argument('--dedup', action='store_true', help='近似重複クラスタの代表だけを分類する')
 
     # 収集設定
     parser.add_argument('--max-items', type=int, default=DEFAULT_MAX_ITEMS, help=f'最大収集件数 (デフォルト: {DEFAULT_MAX_ITEMS})')
@@ -279,13 +278,12 @@ def main():
     if run_category:
         # 既存データ確認
         try:
-            db = DatabaseManager()
-            prompts = db.get_all_prompts()
-            if not prompts:
+            db = get_database()
+            if not db.get_total_prompts_count():
                 print("⚠️ 分類するプロンプトがありません")
                 print("   先に --collect-only を実行してください")
             else:
-                if run_categorization():
+                if run_categorization(representatives_only=args.dedup):
                     success_count += 1
         except Exception as e:
             print(f"分類前チェックエラー: {e}")
@@ -294,9 +292,8 @@ def main():
     if run_visual:
         # 既存データ確認
         try:
-            db = DatabaseManager()
-            prompts = db.get_all_prompts()
-            if not prompts:
+            db = get_database()
+            if not db.get_total_prompts_count():
                 print("⚠️ 可視化するデータがありません")
                 print("   先に --collect-only を実行してください")
             else:
@@ -6,12 +6,12 @@
 """
 
 import sqlite3
-import re
 import json
-from collections import Counter, defaultdict
-from typing import List, Dict, Set, Tuple
+from typing import List, Dict, Set, Tuple, Optional
 import pandas as pd
 
+from src.analysis_session import AnalysisSession
+
 class PromptAnalyzer:
     def __init__(self, db_path: str = "data/civitai_dataset.db"):
         self.db_path = db_path
@@ -24,187 +24,29 @@ class PromptAnalyzer:
         if self.conn:
             self.conn.close()
 
-    def analyze_prompt_structure(self) -> Dict:
-        """プロンプト構造の基本分析"""
-        self.connect_db()
-        cursor = self.conn.cursor()
-
-        # 基本統計
-        cursor.execute("""
-            SELECT
-                COUNT(*) as total_prompts,
-                AVG(prompt_length) as avg_length,
-                MIN(prompt_length) as min_length,
-                MAX(prompt_length) as max_length,
-                AVG(tag_count) as avg_tag_count,
-                MIN(tag_count) as min_tag_count,
-                MAX(tag_count) as max_tag_count
-            FROM civitai_prompts
-        """)
-
-        stats = cursor.fetchone()
-
-        # サンプルプロンプト取得
-        cursor.execute("SELECT full_prompt, negative_prompt FROM civitai_prompts LIMIT 10")
-        samples = cursor.fetchall()
-
-        self.close_db()
-
-        return {
-            'total_prompts': stats[0],
-            'avg_length': stats[1],
-            'min_length': stats[2],
-            'max_length': stats[3],
-            'avg_tag_count': stats[4],
-            'min_tag_count': stats[5],
-            'max_tag_count': stats[6],
-            'samples': samples
-        }
-
-    def extract_common_patterns(self) -> Dict:
-        """プロンプトの共通パターン抽出"""
-        self.connect_db()
-        cursor = self.conn.cursor()
-
-        cursor.execute("SELECT full_prompt FROM civitai_prompts WHERE full_prompt IS NOT NULL")
-        prompts = [row[0] for row in cursor.fetchall()]
-
-        # パターン分析
-        patterns = {
-            'quality_terms': Counter(),
-            'style_terms': Counter(),
-            'character_terms': Counter(),
-            'technical_terms': Counter(),
-            'comma_separated': 0,
-            'parentheses_usage': 0,
-            'weight_usage': 0,
-            'embedding_usage': 0
-        }
-
-        # 品質関連キーワード
-        quality_keywords = ['masterpiece', 'best quality', 'high quality', 'extremely detailed',
-                           'ultra detailed', 'detailed', 'realistic', 'photorealistic',
-                           'high resolution', '8k', '4k', 'ultra high res']
-
-        # スタイル関連キーワード
-        style_keywords = ['anime', 'realistic', 'cartoon', 'oil painting', 'watercolor',
-                         'digital art', 'concept art', 'portrait', 'landscape', 'abstract']
-
-        # キャラクター関連キーワード
-        character_keywords = ['girl', 'boy', 'woman', 'man', 'female', 'male', 'person',
-                            'beautiful', 'cute', 'handsome', 'young', 'old']
-
-        # 技術的キーワード
-        technical_keywords = ['depth of field', 'bokeh', 'lighting', 'shadows', 'composition',
-                            'camera angle', 'perspective', 'focus', 'blur', 'sharp']
-
-        for prompt in prompts:
-            if not prompt:
-                continue
-
-            prompt_lower = prompt.lower()
-
-            # カンマ区切りチェック
-            if ',' in prompt:
-                patterns['comma_separated'] += 1
+    def _session(self, session: Optional[AnalysisSession], section: str) -> AnalysisSession:
+        """渡されたセッションを使う（なければそのセクションだけを計算する一時セッションを作る）"""
+        return session or AnalysisSession(self.db_path, sections=(section,))
 
-            # 括弧使用チェック
-            if '(' in prompt or '[' in prompt:
-                patterns['parentheses_usage'] += 1
-
-            # 重み付けチェック (:数字)
-            if re.search(r':\s*\d+\.?\d*', prompt):
-                patterns['weight_usage'] += 1
-
-            # エンベッディング使用チェック
-            if '<' in prompt and '>' in prompt:
-                patterns['embedding_usage'] += 1
-
-            # キーワード分析
-            for keyword in quality_keywords:
-                if keyword in prompt_lower:
-                    patterns['quality_terms'][keyword] += 1
-
-            for keyword in style_keywords:
-                if keyword in prompt_lower:
-                    patterns['style_terms'][keyword] += 1
-
-            for keyword in character_keywords:
-                if keyword in prompt_lower:
-                    patterns['character_terms'][keyword] += 1
-
-            for keyword in technical_keywords:
-                if keyword in prompt_lower:
-                    patterns['technical_terms'][keyword] += 1
-
-        self.close_db()
-        return patterns
-
-    def categorize_prompts(self) -> Dict:
-        """プロンプトの自動カテゴライズ試行"""
-        self.connect_db()
-        cursor = self.conn.cursor()
-
-        cursor.execute("SELECT id, full_prompt, quality_score FROM civitai_prompts WHERE full_prompt IS NOT NULL")
-        prompts = cursor.fetchall()
-
-        categories = {
-            'realistic_portrait': [],
-            'anime_character': [],
-            'landscape_scene': [],
-            'abstract_art': [],
-            'technical_photo': [],
-            'fantasy_creature': [],
-            'uncategorized': []
-        }
-
-        # カテゴライズルール
-        for pid, prompt, quality in prompts:
-            if not prompt:
-                continue
-
-            prompt_lower = prompt.lower()
-
-            # リアルポートレート
-            if any(word in prompt_lower for word in ['realistic', 'photorealistic', 'portrait', 'woman', 'man', 'girl', 'boy']):
-                if any(word in prompt_lower for word in ['realistic', 'photorealistic', 'photo']):
-                    categories['realistic_portrait'].append((pid, prompt[:100], quality))
-                    continue
-
-            # アニメキャラクター
-            if any(word in prompt_lower for word in ['anime', 'manga', 'cartoon', '1girl', '1boy', 'cute']):
-                categories['anime_character'].append((pid, prompt[:100], quality))
-                continue
-
-            # 風景シーン
-            if any(word in prompt_lower for word in ['landscape', 'scenery', 'background', 'environment', 'nature']):
-                categories['landscape_scene'].append((pid, prompt[:100], quality))
-                continue
-
-            # 抽象アート
-            if any(word in prompt_lower for word in ['abstract', 'artistic', 'concept art', 'surreal']):
-                categories['abstract_art'].append((pid, prompt[:100], quality))
-                continue
-
-            # テクニカル写真
-            if any(word in prompt_lower for word in ['macro', 'close-up', 'depth of field', 'bokeh', 'professional']):
-                categories['technical_photo'].append((pid, prompt[:100], quality))
-                continue
+    def analyze_prompt_structure(self, session: Optional[AnalysisSession] = None) -> Dict:
+        """プロンプト構造の基本分析"""
+        return self._session(session, 'structure').structure()
 
-            # ファンタジー
-            if any(word in prompt_lower for word in ['fantasy', 'dragon', 'magic', 'creature', 'monster']):
-                categories['fantasy_creature'].append((pid, prompt[:100], quality))
-                continue
+    def extract_common_patterns(self, session: Optional[AnalysisSession] = None) -> Dict:
+        """プロンプトの共通パターン抽出
 
-            # 未分類
-            categories['uncategorized'].append((pid, prompt[:100], quality))
+        キーワード表と判定は src.analysis_session に定義されている。
+        session を渡すと、同じセッションの他の分析と 1 回の走査を共有する。
+        """
+        return self._session(session, 'patterns').patterns()
 
-        self.close_db()
-        return categories
+    def categorize_prompts(self, session: Optional[AnalysisSession] = None) -> Dict:
+        """プロンプトの自動カテゴライズ試行（ルールは CATEGORY_RULES）"""
+        return self._session(session, 'categories').categories()
 
-    def suggest_tag_taxonomy(self) -> Dict:
+    def suggest_tag_taxonomy(self, session: Optional[AnalysisSession] = None) -> Dict:
         """タグ分類体系の提案"""
-        patterns = self.extract_common_patterns()
+        patterns = self.extract_common_patterns(session)
 
         taxonomy = {
             'quality_modifiers': {
@@ -240,13 +82,15 @@ class PromptAnalyzer:
 def main():
     """メイン分析実行"""
     analyzer = PromptAnalyzer()
+    # 4 つの分析を 1 回の走査でまとめて計算する
+    session = AnalysisSession(analyzer.db_path)
 
     print("🔍 プロンプトデータ分析開始...")
     print("=" * 60)
 
     # 1. 基本構造分析
     print("\n📊 1. 基本構造分析")
-    stats = analyzer.analyze_prompt_structure()
+    stats = analyzer.analyze_prompt_structure(session)
     print(f"総プロンプト数: {stats['total_prompts']}")
     print(f"平均文字数: {stats['avg_length']:.1f}")
     print(f"文字数範囲: {stats['min_length']} - {stats['max_length']}")
@@ -255,7 +99,7 @@ def main():
 
     # 2. パターン分析
     print("\n🎯 2. 共通パターン分析")
-    patterns = analyzer.extract_common_patterns()
+    patterns = analyzer.extract_common_patterns(session)
 
     print(f"カンマ区切り使用: {patterns['comma_separated']}/{stats['total_prompts']} ({patterns['comma_separated']/stats['total_prompts']*100:.1f}%)")
     print(f"重み付け使用: {patterns['weight_usage']}/{stats['total_prompts']} ({patterns['weight_usage']/stats['total_prompts']*100:.1f}%)")
@@ -272,7 +116,7 @@ def main():
 
     # 3. カテゴライズ試行
     print("\n📂 3. 自動カテゴライズ結果")
-    categories = analyzer.categorize_prompts()
+    categories = analyzer.categorize_prompts(session)
 
     for category, prompts in categories.items():
         if prompts:
@@ -283,7 +127,7 @@ def main():
 
     # 4. タグ分類体系提案
     print("\n🏗️ 4. 推奨タグ分類体系")
-    taxonomy = analyzer.suggest_tag_taxonomy()
+    taxonomy = analyzer.suggest_tag_taxonomy(session)
 
     for category, info in taxonomy.items():
         if category != 'syntax_patterns':
@@ -1,19 +1,20 @@
 #!/usr/bin/env python3
-"""Backfill prompt_resources table from civitai_prompts.raw_metadata for entire DB.
+"""Backfill the resource catalog (resources + prompt_resource_links) from civitai_prompts.raw_metadata for entire DB.
 
 Behavior:
-- Creates a timestamped backup of the DB file (data/civitai_dataset.db.YYYYMMDDHHMMSS.bak)
-- Ensures prompt_resources table exists (CREATE TABLE IF NOT EXISTS)
-- Iterates all rows in civitai_prompts, parses raw_metadata, extracts civitaiResources
-- Inserts resources via DatabaseManager.save_prompt_resources (DELETE+INSERT sync)
-
-Note: may take a few minutes on large DBs. Run from project root.
+- Creates a timestamped backup of the DB (data/civitai_dataset.db.YYYYMMDDHHMMSS.bak) with VACUUM INTO
+- Ensures the catalog tables exist (older prompt_resources tables are migrated into them)
+- Reads civitai_prompts in id-range chunks and parses raw_metadata in a process pool
+  (JSON, or the Python repr the UI collector stores)
+- Writes only the links that changed for each chunk in one short transaction
+  and records the last processed id in job_checkpoints, so an interrupted run resumes
+  and collectors can keep writing meanwhile
+
+Run from project root.
 """
 import os
 import sys
-import shutil
-import time
-import json
+import argparse
 from datetime import datetime
 
 # Ensure project root is on sys.path so `src` package imports work when run as a script
@@ -22,111 +23,51 @@ if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
 from src.database import create_database
+from src.snapshot import create_snapshot
+from src.resources import backfill_resources
 
 DB_PATH = 'data/civitai_dataset.db'
 
 def backup_db(path: str) -> str:
     ts = datetime.now().strftime('%Y%m%d%H%M%S')
     bak = f"{path}.{ts}.bak"
-    shutil.copy2(path, bak)
+    # ファイルコピーは書き込み中だと壊れるため、VACUUM INTO で一貫したコピーを取る
+    # （backup API は収集側が書き込むたびにやり直しになり終わらない）
+    create_snapshot(path, dest=bak, method='vacuum')
     return bak
 
 
-def ensure_prompt_resources_table(db_path: str):
-    import sqlite3
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS prompt_resources (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            prompt_id INTEGER,
-            resource_index INTEGER,
-            resource_type TEXT,
-            resource_name TEXT,
-            resource_model_id TEXT,
-            resource_model_version_id TEXT,
-            resource_id TEXT,
-            resource_raw TEXT,
-            FOREIGN KEY (prompt_id) REFERENCES civitai_prompts (id)
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-
-def parse_resources_from_raw(raw_text: str):
-    try:
-        parsed = json.loads(raw_text)
-    except Exception:
-        return []
-    meta = parsed.get('meta') or parsed.get('metadata') or {}
-    civres = meta.get('civitaiResources') or parsed.get('civitaiResources') or []
-    resources = []
-    if isinstance(civres, list):
-        for idx, r in enumerate(civres):
-            if not isinstance(r, dict):
-                continue
-            resources.append({
-                'index': idx,
-                'type': r.get('type') or r.get('resourceType') or '',
-                'name': r.get('name') or r.get('resourceName') or r.get('checkpointName') or '',
-                'modelId': str(r.get('modelId') or r.get('model') or ''),
-                'modelVersionId': str(r.get('modelVersionId') or r.get('id') or ''),
-                'resourceId': str(r.get('id') or r.get('resourceId') or ''),
-                'raw': json.dumps(r, ensure_ascii=False)
-            })
-    return resources
-
-
 def main():
-    if not os.path.exists(DB_PATH):
-        print('DB not found at', DB_PATH)
+    parser = argparse.ArgumentParser(description='Backfill prompt_resources from civitai_prompts.raw_metadata')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--chunk-size', type=int, default=2000, help='rows per id-range chunk')
+    parser.add_argument('--workers', type=int, default=None, help='parser processes (0 = parse in this process)')
+    parser.add_argument('--restart', action='store_true', help='ignore the saved checkpoint and start from the first id')
+    parser.add_argument('--only-missing', action='store_true', help='skip prompts that already have resources')
+    parser.add_argument('--no-backup', action='store_true')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print('DB not found at', args.db)
         return
 
-    print('Backing up DB...')
-    bak = backup_db(DB_PATH)
-    print('Backup created:', bak)
-
-    print('Ensuring prompt_resources table exists...')
-    ensure_prompt_resources_table(DB_PATH)
-
-    db = create_database(DB_PATH)
-
-    import sqlite3
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute('SELECT id, civitai_id, raw_metadata FROM civitai_prompts')
+    if not args.no_backup:
+        print('Backing up DB...')
+        bak = backup_db(args.db)
+        print('Backup created:', bak)
 
-    total = 0
-    found = 0
-    saved = 0
-    start = time.time()
+    print('Ensuring resource catalog tables exist...')
+    # スキーマ・インデックスを最新化（旧形式の prompt_resources はここでカタログへ移る）
+    create_database(args.db)
 
-    for row in cur.fetchall():
-        total += 1
-        pid = row[0]
-        raw = row[2]
-        if not raw:
-            continue
-        resources = parse_resources_from_raw(raw)
-        if resources:
-            found += 1
-            try:
-                ok = db.save_prompt_resources(pid, resources)
-                if ok:
-                    saved += 1
-            except Exception as e:
-                print(f'Failed to save resources for prompt_id={pid}: {e}')
-        if total % 1000 == 0:
-            elapsed = time.time() - start
-            print(f'  processed {total} rows ({found} with resources, {saved} saved) - elapsed {elapsed:.1f}s')
+    stats = backfill_resources(args.db, chunk_size=args.chunk_size, workers=args.workers,
+                               resume=not args.restart, only_missing=args.only_missing)
 
-    elapsed = time.time() - start
     print('\nBackfill completed')
-    print(f'  total rows processed: {total}')
-    print(f'  prompts with resources found: {found}')
-    print(f'  prompts saved to prompt_resources: {saved}')
-    print(f'  elapsed: {elapsed:.1f}s')
+    print(f"  total rows processed: {stats['rows']} (ids {stats['start_id']}..{stats['last_id']})")
+    print(f"  prompts with resources found: {stats['prompts_with_resources']}")
+    print(f"  resource links written: {stats['resources_inserted']}")
+    print(f"  elapsed: {stats['elapsed']:.1f}s")
 
 if __name__ == '__main__':
     main()
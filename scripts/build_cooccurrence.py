@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Build or update the tag co-occurrence index (data/civitai_dataset.cooccurrence.npz).
+
+Only prompts newer than the last indexed id are added, so re-running after a
+collection is cheap. Use --rebuild to recount everything (e.g. after merges
+that changed quality scores of existing rows).
+
+Usage (from project root):
+    python scripts/build_cooccurrence.py [--db data/civitai_dataset.db] [--out data/civitai_dataset.cooccurrence.npz]
+    python scripts/build_cooccurrence.py --tag "1girl" --top 10 --by lift
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+# Ensure project root is on sys.path so `src` package imports work when run as a script
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from src.cooccurrence import (CooccurrenceIndex, DEFAULT_MIN_COUNT, RANK_METRICS,
+                              index_path_for, load_or_build)
+
+DB_PATH = 'data/civitai_dataset.db'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build/update the tag co-occurrence index')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--out', default=None, help='path of the .npz index (default: next to the DB)')
+    parser.add_argument('--rebuild', action='store_true', help='recount all prompts instead of adding new ones')
+    parser.add_argument('--tag', action='append', default=[], help='print the top associated tags for this tag (repeatable)')
+    parser.add_argument('--top', type=int, default=10, help='number of associated tags to print')
+    parser.add_argument('--by', choices=RANK_METRICS, default='lift', help='ranking metric')
+    parser.add_argument('--min-count', type=int, default=DEFAULT_MIN_COUNT, help='minimum pair count')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f'DB not found: {args.db}')
+        sys.exit(1)
+
+    out = args.out or index_path_for(args.db)
+    started = time.time()
+    if args.rebuild:
+        index = CooccurrenceIndex.rebuild(args.db)
+        index.save(out)
+    else:
+        index = load_or_build(args.db, out)
+    summary = {
+        'index_path': out,
+        'prompts': index.n_prompts,
+        'tags': len(index.vocab),
+        'pairs': int(len(index.indices) // 2),
+        'last_prompt_id': index.last_prompt_id,
+        'elapsed': round(time.time() - started, 2),
+    }
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+    for tag in args.tag:
+        started = time.perf_counter()
+        related = index.top_associated(tag, k=args.top, by=args.by, min_count=args.min_count)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f"\n{tag} ({index.tag_stats(tag)}) - top {args.top} by {args.by} in {elapsed_ms:.2f} ms")
+        for r in related:
+            print(f"  {r['tag']}: count={r['count']} lift={r['lift']:.2f} pmi={r['pmi']:.2f} avg_quality={r['avg_quality']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Build or refresh the memory-mapped prompt corpus (stored next to the DB).
+
+New prompts are appended and prompts whose corpus columns changed are
+rewritten in place (from the prompt_changes log); the corpus is rebuilt only
+when a prompt was deleted or its text changed length. Optionally prints keyword counts and a histogram
+computed directly over the mapped buffers.
+
+Usage (from project root):
+    python scripts/build_corpus.py [--db data/civitai_dataset.db]
+    python scripts/build_corpus.py --keyword masterpiece --keyword "best quality" --histogram quality_score
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+# Ensure project root is on sys.path so `src` package imports work when run as a script
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from src.corpus import COLUMNS, PromptCorpus, corpus_path_for, refresh_corpus
+
+DB_PATH = 'data/civitai_dataset.db'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build/refresh the memory-mapped prompt corpus')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--out', default=None, help='corpus directory (default: next to the DB)')
+    parser.add_argument('--keyword', action='append', default=[], help='print how many prompts contain this (repeatable)')
+    parser.add_argument('--histogram', choices=COLUMNS, default=None, help='print a histogram of this column')
+    parser.add_argument('--bins', type=int, default=20)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f'DB not found: {args.db}')
+        sys.exit(1)
+
+    out = args.out or corpus_path_for(args.db)
+    started = time.time()
+    result = refresh_corpus(args.db, out)
+    result.update({'corpus_path': out, 'elapsed': round(time.time() - started, 2)})
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    with PromptCorpus(out) as corpus:
+        if args.keyword:
+            started = time.perf_counter()
+            counts = corpus.count_keywords(args.keyword)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            print(f"\nkeywords ({elapsed_ms:.2f} ms)")
+            for keyword, count in counts.items():
+                print(f"  {keyword}: {count}")
+        if args.histogram:
+            print(f"\n{args.histogram}")
+            for b in corpus.histogram(args.histogram, args.bins):
+                print(f"  {b['bin_start']:>12.1f} - {b['bin_end']:<12.1f} {b['count']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Build the near-duplicate (MinHash/LSH) index and show cluster statistics.
+
+New prompts are indexed when they are saved; this script registers rows that
+were inserted without going through DatabaseManager (old scripts, raw SQL) and
+prints the near duplicates of selected prompts.
+
+Usage (from project root):
+    python scripts/build_dedup_index.py [--db data/civitai_dataset.db]
+    python scripts/build_dedup_index.py --id 123 --threshold 0.7
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+# Ensure project root is on sys.path so `src` package imports work when run as a script
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from src.database import DatabaseManager
+from src.dedup import DUPLICATE_THRESHOLD
+
+DB_PATH = 'data/civitai_dataset.db'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the near-duplicate prompt index')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--id', type=int, action='append', default=[], help='print near duplicates of this prompt id (repeatable)')
+    parser.add_argument('--threshold', type=float, default=DUPLICATE_THRESHOLD, help='minimum estimated Jaccard similarity')
+    parser.add_argument('--limit', type=int, default=20, help='number of near duplicates to print')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f'DB not found: {args.db}')
+        sys.exit(1)
+
+    db = DatabaseManager(args.db)
+    started = time.time()
+    indexed = db.backfill_dedup_index()
+    summary = db.get_dedup_stats(backfill=False)
+    summary['newly_indexed'] = indexed
+    summary['elapsed'] = round(time.time() - started, 2)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+    for prompt_id in args.id:
+        started = time.perf_counter()
+        matches = db.get_near_duplicates(prompt_id, threshold=args.threshold, limit=args.limit)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        cluster = db.get_duplicate_cluster(prompt_id)
+        print(f"\n#{prompt_id} (cluster {cluster['cluster_id']}, {len(cluster['members'])} members) - "
+              f"{len(matches)} near duplicates in {elapsed_ms:.2f} ms")
+        for m in matches:
+            print(f"  #{m['id']} sim={m['similarity']:.2f} q={m['quality_score']} {(m['full_prompt'] or '')[:80]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Build or update the similar-prompt search index (stored next to the DB).
+
+Only prompts newer than the last indexed id are added. Use --rebuild after
+bulk edits of existing prompt texts.
+
+Usage (from project root):
+    python scripts/build_similarity_index.py [--db data/civitai_dataset.db]
+    python scripts/build_similarity_index.py --id 123 --top 10
+    python scripts/build_similarity_index.py --text "1girl, silver hair, night city"
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+# Ensure project root is on sys.path so `src` package imports work when run as a script
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from src.similarity import SimilarityIndex, index_path_for, load_or_build
+
+DB_PATH = 'data/civitai_dataset.db'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build/update the similar-prompt search index')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--out', default=None, help='path of the .npz index (default: next to the DB)')
+    parser.add_argument('--rebuild', action='store_true', help='index all prompts again instead of adding new ones')
+    parser.add_argument('--id', type=int, action='append', default=[], help='print prompts similar to this id (repeatable)')
+    parser.add_argument('--text', action='append', default=[], help='print prompts similar to this text (repeatable)')
+    parser.add_argument('--top', type=int, default=10, help='number of similar prompts to print')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f'DB not found: {args.db}')
+        sys.exit(1)
+
+    out = args.out or index_path_for(args.db)
+    started = time.time()
+    if args.rebuild:
+        index = SimilarityIndex.rebuild(args.db)
+        index.save(out)
+    else:
+        index = load_or_build(args.db, out)
+    summary = {
+        'index_path': out,
+        'prompts': len(index),
+        'tags': len(index.vocab),
+        'last_prompt_id': index.last_prompt_id,
+        'elapsed': round(time.time() - started, 2),
+    }
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+    queries = [(f'#{i}', lambda i=i: index.similar_to_id(i, args.top)) for i in args.id]
+    queries += [(repr(t), lambda t=t: index.similar_to_text(t, args.top)) for t in args.text]
+    for label, search in queries:
+        started = time.perf_counter()
+        matches = search()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f"\n{label} - top {len(matches)} in {elapsed_ms:.2f} ms")
+        for prompt_id, score in matches:
+            print(f"  #{prompt_id}: {score:.3f}")
+
+
+if __name__ == '__main__':
+    main()
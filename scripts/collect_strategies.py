@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Run the UI's NSFW x sort strategy collection as a background job.
+
+The Streamlit UI launches this script detached and polls the job's row in
+collection_jobs, so the browser stays responsive and the job keeps running
+after the tab is closed. Pages are written with save_prompts_bulk, or with
+--spool appended to the on-disk page spool for scripts/ingest_spool.py.
+
+Usage (from project root):
+    python scripts/collect_strategies.py --version-id 2091367 --nsfw Soft X --sort "Most Reactions" Newest
+"""
+import os
+import sys
+import argparse
+
+# Ensure project root is on sys.path so `src` package imports work when run as a script
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from src.config import DEFAULT_DB_PATH
+from src.strategy_job import run_strategy_collection, report_job
+from src.spool import default_spool_dir
+
+STOP_FILE = os.path.join(ROOT, 'scripts', 'collect_stop.flag')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect prompts with NSFW level x sort strategies')
+    parser.add_argument('--version-id', required=True)
+    parser.add_argument('--model-name', default='Unknown')
+    parser.add_argument('--nsfw', nargs='+', default=['Soft', 'X'], help='NSFW levels (None, Soft, Mature, X)')
+    parser.add_argument('--sort', nargs='+', default=['Most Reactions', 'Newest'], help='sort strategies')
+    parser.add_argument('--max-items', type=int, default=200, help='max items per strategy')
+    parser.add_argument('--no-continuous', action='store_true', help='do not resume from the saved cursor')
+    parser.add_argument('--job-id', default=None)
+    parser.add_argument('--db', default=DEFAULT_DB_PATH)
+    parser.add_argument('--log-file', default=None)
+    parser.add_argument('--spool', nargs='?', const='', default=None,
+                        help='append pages to the spool instead of writing the DB (default dir: next to --db)')
+    args = parser.parse_args()
+
+    if args.log_file:
+        os.makedirs(os.path.dirname(os.path.abspath(args.log_file)), exist_ok=True)
+        log = open(args.log_file, 'a', encoding='utf-8', buffering=1)
+        sys.stdout = sys.stderr = log
+
+    spool_dir = (args.spool or default_spool_dir(args.db)) if args.spool is not None else None
+    try:
+        run_strategy_collection(args.version_id, args.nsfw, args.sort, max_items=args.max_items,
+                                continuous=not args.no_continuous, model_name=args.model_name,
+                                db_path=args.db, job_id=args.job_id, stop_file=STOP_FILE, spool_dir=spool_dir)
+    except Exception as e:
+        print(f'[Strategy] job failed: {e}')
+        if args.job_id:
+            report_job(args.db, args.job_id, spool_dir, status='failed', current_strategy=None)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
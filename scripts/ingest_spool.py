@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Replay spooled API pages into the database.
+
+Collectors started with --spool append raw pages to segment files instead of
+writing SQLite. This consumer ingests sealed segments oldest-first, one
+transaction per segment, and deletes each one after it is committed. With
+--keep, ingested segments are moved to <spool>/ingested/ so that
+--replay-ingested can rebuild the rows later without touching the network
+(for example after a schema change).
+
+Usage (from project root):
+    python scripts/ingest_spool.py                 # ingest what is there and exit
+    python scripts/ingest_spool.py --follow        # keep polling for new segments
+    python scripts/ingest_spool.py --keep --replay-ingested
+"""
+import os
+import sys
+import time
+import argparse
+
+# Ensure project root is on sys.path so `src` package imports work when run as a script
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from src.config import DEFAULT_DB_PATH
+from src.spool import default_spool_dir, ingest_spool, spool_stats, STALE_SEGMENT_SECONDS
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest spooled API pages into the database')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH)
+    parser.add_argument('--spool', default=None, help='spool directory (default: next to --db)')
+    parser.add_argument('--keep', action='store_true', help='move ingested segments to <spool>/ingested/')
+    parser.add_argument('--replay-ingested', action='store_true', help='also re-ingest segments kept by --keep')
+    parser.add_argument('--follow', action='store_true', help='keep polling for new segments')
+    parser.add_argument('--interval', type=float, default=5.0, help='polling interval in seconds (--follow)')
+    parser.add_argument('--stale-seconds', type=float, default=STALE_SEGMENT_SECONDS,
+                        help='seal .open segments untouched for this long (crashed writers)')
+    args = parser.parse_args()
+
+    spool_dir = args.spool or default_spool_dir(args.db)
+    print(f'[Spool] {spool_dir}: {spool_stats(spool_dir)}')
+    replay = args.replay_ingested
+    try:
+        while True:
+            ingest_spool(spool_dir, args.db, keep=args.keep, replay_ingested=replay,
+                         stale_seconds=args.stale_seconds)
+            replay = False
+            if not args.follow:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    print(f'[Spool] {spool_dir}: {spool_stats(spool_dir)}')
+
+
+if __name__ == '__main__':
+    main()
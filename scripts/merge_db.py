@@ -1,103 +1,47 @@
-import sqlite3
+#!/usr/bin/env python3
+"""Merge one or more source databases into the main DB.
 
-src='data/civitai_dataset.db.src_backup'
-dst='data/civitai_dataset.db'
+Sources are ATTACHed (read-only) and merged with set-based INSERT…SELECT
+statements keyed on civitai_id; prompt_categories / prompt_resources get their
+prompt_id remapped through joins. Per-table counts are printed as JSON.
 
-print('Opening source:', src)
-print('Opening dest:', dst)
+Usage (from project root):
+    python scripts/merge_db.py data/civitai_dataset.db.src_backup
+    python scripts/merge_db.py --dst data/civitai_dataset.db shard1.db shard2.db --update-existing
+    python scripts/merge_db.py --dry-run shard1.db
+"""
+import os
+import sys
+import json
+import argparse
 
-s_conn=sqlite3.connect(src)
-s_cur=s_conn.cursor()
+# Ensure project root is on sys.path so `src` package imports work when run as a script
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
 
-d_conn=sqlite3.connect(dst)
-d_cur=d_conn.cursor()
+from src.merger import merge_databases
 
-# Ensure tables exist in destination
-s_cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
-print('Src tables:', s_cur.fetchall())
+DB_PATH = 'data/civitai_dataset.db'
 
-d_cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
-print('Dst tables:', d_cur.fetchall())
 
-# Copy civitai_prompts rows that do not exist in dst (by civitai_id)
-s_cur.execute('SELECT * FROM civitai_prompts')
-rows = s_cur.fetchall()
-cols = [d[0] for d in s_cur.description]
-print('src civitai_prompts cols:', cols)
+def main():
+    parser = argparse.ArgumentParser(description='Merge source SQLite DBs into the destination DB')
+    parser.add_argument('sources', nargs='+', help='source database files')
+    parser.add_argument('--dst', default=DB_PATH, help='destination database (default: %(default)s)')
+    parser.add_argument('--update-existing', action='store_true',
+                        help='refresh counters and fill empty fields of prompts that already exist in the destination')
+    parser.add_argument('--dry-run', action='store_true', help='report counts and roll back')
+    args = parser.parse_args()
 
-inserted = 0
-for r in rows:
-    rowdict = dict(zip(cols, r))
-    civid = rowdict.get('civitai_id')
-    if civid is None:
-        continue
-    d_cur.execute('SELECT id FROM civitai_prompts WHERE civitai_id=?', (civid,))
-    if d_cur.fetchone():
-        continue
-    # build insert
-    placeholders = ','.join('?' for _ in cols)
-    values = [rowdict[c] for c in cols]
-    try:
-        d_cur.execute(f"INSERT INTO civitai_prompts ({','.join(cols)}) VALUES ({placeholders})", values)
-        inserted += 1
-    except Exception as e:
-        print('insert error', e)
+    missing = [p for p in args.sources if not os.path.exists(p)]
+    if missing:
+        print(f'Source DB not found: {missing}')
+        sys.exit(1)
 
-# Copy prompt_categories: assume prompt_ids may differ; try to map by civitai_id
-s_cur.execute('SELECT * FROM prompt_categories')
-rows = s_cur.fetchall()
-cols = [d[0] for d in s_cur.description]
-print('src prompt_categories cols:', cols)
+    report = merge_databases(args.dst, args.sources, update_existing=args.update_existing, dry_run=args.dry_run)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
 
-inserted_cat=0
-for r in rows:
-    rowdict = dict(zip(cols, r))
-    pid = rowdict.get('prompt_id')
-    # find civitai_id for this prompt
-    s_cur.execute('SELECT civitai_id FROM civitai_prompts WHERE id=?',(pid,))
-    res = s_cur.fetchone()
-    if not res:
-        continue
-    civid = res[0]
-    # find new prompt id in dest
-    d_cur.execute('SELECT id FROM civitai_prompts WHERE civitai_id=?',(civid,))
-    new = d_cur.fetchone()
-    if not new:
-        continue
-    new_pid = new[0]
-    # check if category already exists
-    d_cur.execute('SELECT id FROM prompt_categories WHERE prompt_id=? AND category=?',(new_pid,rowdict.get('category')))
-    if d_cur.fetchone():
-        continue
-    try:
-        # insert with mapped prompt_id
-        cols2 = cols.copy()
-        vals = [rowdict[c] for c in cols2]
-        # replace prompt_id with new_pid
-        idx = cols2.index('prompt_id')
-        vals[idx]=new_pid
-        placeholders = ','.join('?' for _ in cols2)
-        d_cur.execute(f"INSERT INTO prompt_categories ({','.join(cols2)}) VALUES ({placeholders})", vals)
-        inserted_cat += 1
-    except Exception as e:
-        print('cat insert error', e)
 
-print('inserts prompts:', inserted, 'categories:', inserted_cat)
-
-d_conn.commit()
-d_conn.close()
-s_conn.close()
-
-# report final counts
-import sqlite3
-for p in [dst, src]:
-    conn=sqlite3.connect(p)
-    cur=conn.cursor()
-    try:
-        cur.execute('SELECT COUNT(*) FROM civitai_prompts')
-        print(p, 'civitai_prompts=', cur.fetchone()[0])
-        cur.execute('SELECT COUNT(*) FROM prompt_categories')
-        print(p, 'prompt_categories=', cur.fetchone()[0])
-    except Exception as e:
-        print('error reporting', e)
-    conn.close()
+if __name__ == '__main__':
+    main()
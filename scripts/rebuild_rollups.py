@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""Rebuild the dashboard rollup tables (prompt_rollups / category_rollups).
+
+The rollups are kept up to date by triggers on every write, so this is only
+needed after bulk edits made with triggers disabled, or to verify consistency.
+
+Usage (from project root):
+    python scripts/rebuild_rollups.py [--db data/civitai_dataset.db]
+"""
+import os
+import sys
+import json
+import argparse
+
+# Ensure project root is on sys.path so `src` package imports work when run as a script
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from src.database import create_database
+
+DB_PATH = 'data/civitai_dataset.db'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild rollup tables from civitai_prompts/prompt_categories')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f'DB not found: {args.db}')
+        sys.exit(1)
+
+    db = create_database(args.db)
+    result = db.rebuild_rollups()
+    print(json.dumps({'db_path': args.db, 'rows': result, 'totals': db.get_rollup_totals()}, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Run the single-writer ingest service for a database.
+
+While it is running, collectors, the categorizer and the UI send their
+batches here (via registry.get_writer) instead of opening their own write
+transactions. Concurrent batches are group-committed and each producer gets
+the committed prompt ids back. Stop with Ctrl+C; queued batches are written
+before exit.
+
+Usage (from project root):
+    python scripts/run_ingest_service.py
+    python scripts/run_ingest_service.py --db data/other.db --window 0.02
+"""
+import os
+import sys
+import argparse
+
+# Ensure project root is on sys.path so `src` package imports work when run as a script
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from src.config import DEFAULT_DB_PATH
+from src.ingest_service import IngestService, GROUP_COMMIT_WINDOW, MAX_GROUP_REQUESTS
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Single-writer ingest service with group commit')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH)
+    parser.add_argument('--address', default=None, help='socket path / pipe name (default: derived from --db)')
+    parser.add_argument('--window', type=float, default=GROUP_COMMIT_WINDOW,
+                        help='seconds to wait for more batches before committing')
+    parser.add_argument('--max-group', type=int, default=MAX_GROUP_REQUESTS,
+                        help='max batches per commit')
+    args = parser.parse_args()
+
+    IngestService(args.db, address=args.address, window=args.window, max_group=args.max_group).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
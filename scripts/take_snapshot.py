@@ -1,9 +1,41 @@
-import sqlite3, json, argparse
+import sys, sqlite3, json, argparse
 from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.snapshot import DEFAULT_SNAPSHOT_DIR, create_snapshot, rotate_snapshots, run_scheduled_snapshots, list_snapshots
+
 parser = argparse.ArgumentParser()
 parser.add_argument('--limit', type=int, default=20)
+parser.add_argument('--db', default=str(ROOT / 'data' / 'civitai_dataset.db'))
+# DB スナップショット（VACUUM INTO）
+parser.add_argument('--db-snapshot', action='store_true', help='take a consistent copy of the DB into --dir')
+parser.add_argument('--dir', default=str(ROOT / DEFAULT_SNAPSHOT_DIR), help='snapshot directory')
+parser.add_argument('--keep', type=int, default=None, help='keep only the newest N snapshots')
+parser.add_argument('--every', type=float, default=None, help='repeat every N seconds (runs until Ctrl+C)')
+parser.add_argument('--method', choices=['vacuum', 'backup'], default='vacuum')
+parser.add_argument('--pages', type=int, default=256, help='pages copied per backup step')
+parser.add_argument('--verify', action='store_true', help='run PRAGMA quick_check on the snapshot')
+parser.add_argument('--list', action='store_true', help='list existing snapshots')
 args = parser.parse_args()
-DB = Path(__file__).resolve().parents[1] / 'data' / 'civitai_dataset.db'
+DB = Path(args.db)
+
+if args.list:
+    print(json.dumps(list_snapshots(args.dir, str(DB)), ensure_ascii=False, indent=2))
+    sys.exit(0)
+
+if args.db_snapshot:
+    opts = {'method': args.method, 'pages': args.pages, 'verify': args.verify}
+    if args.every:
+        run_scheduled_snapshots(str(DB), interval=args.every, keep=args.keep or 24, snapshot_dir=args.dir, **opts)
+    else:
+        path = create_snapshot(str(DB), snapshot_dir=args.dir, **opts)
+        removed = rotate_snapshots(args.dir, keep=args.keep, db_path=str(DB)) if args.keep else []
+        print(json.dumps({'snapshot': path, 'removed': removed}, ensure_ascii=False, indent=2))
+    sys.exit(0)
+
 conn = sqlite3.connect(str(DB))
 c = conn.cursor()
 # collection_state recent rows
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - グラフ用の集計
+ヒストグラム・件数集計・記法の使用率を SQL 側で計算し、ビン単位の小さな結果だけを返す。
+UI は DataFrame 全体ではなくこの結果を描画するため、描画コストが行数に依存しない。
+"""
+
+import sqlite3
+from typing import Dict, List, Any, Optional
+
+from .prompt_syntax import backfill_syntax_columns
+
+# ヒストグラム名 -> (テーブル, 列, 対象条件)
+HISTOGRAM_COLUMNS = {
+    'prompt_length': ('prompts', 'prompt_length', "full_prompt IS NOT NULL AND full_prompt <> ''"),
+    'quality_score': ('prompts', 'quality_score', 'quality_score IS NOT NULL'),
+    'confidence': ('prompt_categories', 'confidence', 'confidence IS NOT NULL'),
+}
+
+# 件数集計を許可する列
+# 件数を数える列 -> (prompts のキー列, 次元テーブル)
+VALUE_COUNT_COLUMNS = {
+    'model_name': ('model_key', 'models'),
+    'model_id': ('model_key', 'models'),
+    'model_version_id': ('version_key', 'model_versions'),
+}
+
+_VALID_PROMPT = "full_prompt IS NOT NULL AND full_prompt <> ''"
+
+
+def histogram(conn: sqlite3.Connection, name: str, bins: int = 20) -> List[Dict[str, Any]]:
+    """等幅ビンのヒストグラムを返す [{'bin_start', 'bin_end', 'count'}, ...]
+
+    最小値・最大値を求めてから、ビン番号で GROUP BY する（2 回の集計クエリ）。
+    """
+    if name not in HISTOGRAM_COLUMNS:
+        raise ValueError(f"Unknown histogram: {name}")
+    table, column, condition = HISTOGRAM_COLUMNS[name]
+    bins = max(1, int(bins))
+    lo, hi = conn.execute(f'SELECT MIN({column}), MAX({column}) FROM {table} WHERE {condition}').fetchone()
+    if lo is None:
+        return []
+    width = (hi - lo) / bins if hi > lo else 1.0
+    rows = conn.execute(f'''
+        SELECT MIN(CAST(({column} - ?) / ? AS INTEGER), ?) AS bin, COUNT(*)
+        FROM {table}
+        WHERE {condition}
+        GROUP BY bin
+    ''', (lo, width, bins - 1)).fetchall()
+    counts = dict(rows)
+    return [
+        {'bin_start': lo + i * width, 'bin_end': lo + (i + 1) * width, 'count': counts.get(i, 0)}
+        for i in range(bins if hi > lo else 1)
+    ]
+
+
+def value_counts(conn: sqlite3.Connection, column: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """civitai_prompts の列の値ごとの件数を多い順に返す
+
+    整数キーの索引だけで件数を数え、次元テーブルの小さな結果に値を結合する。
+    """
+    if column not in VALUE_COUNT_COLUMNS:
+        raise ValueError(f"Unknown column: {column}")
+    key, table = VALUE_COUNT_COLUMNS[column]
+    sql = f'''
+        SELECT d.{column}, SUM(k.n) AS n
+        FROM (SELECT {key}, COUNT(*) AS n FROM prompts WHERE {key} IS NOT NULL GROUP BY {key}) k
+        JOIN {table} d ON d.id = k.{key}
+        WHERE d.{column} IS NOT NULL AND d.{column} <> ''
+        GROUP BY d.{column} ORDER BY n DESC, d.{column}
+    '''
+    params: tuple = ()
+    if limit:
+        sql += ' LIMIT ?'
+        params = (int(limit),)
+    return [{'value': v, 'count': n} for v, n in conn.execute(sql, params).fetchall()]
+
+
+def category_counts(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    """カテゴリ別の件数と平均信頼度（category_rollups をカテゴリ単位に合算）"""
+    rows = conn.execute('''
+        SELECT category, TOTAL(prompt_count), TOTAL(confidence_sum), TOTAL(confidence_n)
+        FROM category_rollups
+        GROUP BY category
+        HAVING TOTAL(prompt_count) > 0
+        ORDER BY 2 DESC, category
+    ''').fetchall()
+    return [
+        {'category': c, 'count': int(n), 'avg_confidence': (s / cn) if cn else None}
+        for c, n, s, cn in rows
+    ]
+
+
+def column_stats(conn: sqlite3.Connection, name: str, ddof: int = 1) -> Dict[str, Any]:
+    """HISTOGRAM_COLUMNS の列の基本統計（件数・平均・中央値・最小・最大・標準偏差）
+
+    ddof=1 は標本標準偏差（pandas の std）、ddof=0 は母標準偏差（numpy の std）。
+    """
+    if name not in HISTOGRAM_COLUMNS:
+        raise ValueError(f"Unknown column: {name}")
+    table, column, condition = HISTOGRAM_COLUMNS[name]
+    n, mean, lo, hi, mean_sq = conn.execute(f'''
+        SELECT COUNT({column}), AVG({column}), MIN({column}), MAX({column}),
+               AVG(CAST({column} AS REAL) * {column})
+        FROM {table} WHERE {condition}
+    ''').fetchone()
+    if not n:
+        return {'count': 0, 'mean': None, 'median': None, 'min': None, 'max': None, 'std': None}
+    # 中央値: 偶数件のときは中央の 2 値の平均
+    middle = conn.execute(f'''
+        SELECT {column} FROM {table}
+        WHERE {condition} AND {column} IS NOT NULL
+        ORDER BY {column} LIMIT ? OFFSET ?
+    ''', (2 - n % 2, (n - 1) // 2)).fetchall()
+    median = sum(r[0] for r in middle) / len(middle)
+    var = (mean_sq - mean * mean) * n / (n - ddof) if n > ddof else 0.0
+    return {'count': n, 'mean': mean, 'median': median, 'min': lo, 'max': hi, 'std': max(var, 0.0) ** 0.5}
+
+
+def length_stats(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """有効なプロンプトの長さの基本統計（平均・中央値・最小・最大・標準偏差）"""
+    return column_stats(conn, 'prompt_length')
+
+
+def syntax_usage(conn: sqlite3.Connection) -> Dict[str, int]:
+    """記法の使用件数（保存時に計算した has_* / paren_count 列を合計する）"""
+    backfill_syntax_columns(conn)
+    total, comma, weights, parens, embedding = conn.execute(f'''
+        SELECT COUNT(*), TOTAL(has_comma), TOTAL(has_weights), TOTAL(paren_count > 0), TOTAL(has_embedding)
+        FROM civitai_prompts WHERE {_VALID_PROMPT}
+    ''').fetchone()
+    return {'total': total, 'has_comma': int(comma), 'has_weights': int(weights),
+            'has_parens': int(parens), 'has_embedding': int(embedding)}
@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - 分析セッション
+総合レポートの各セクション（構造統計・共通パターン・自動カテゴライズ・キーワード傾向）を
+civitai_prompts の 1 回の走査でまとめて計算する。
+
+各行の小文字化とキーワード照合（KeywordMatcher による 1 回の走査）は行ごとに 1 回だけ行い、
+すべてのセクションの集計器で共有する。
+計算結果はセッション内に保持されるため、同じセクションを何度要求しても再走査しない。
+representatives_only=True なら近似重複クラスタ（dedup）の代表だけを集計する。
+
+NumPy があるときは SQLite を 1 行ずつ読む代わりにプロンプトコーパス（src/corpus.py）を開き、
+キーワードごとの該当行・数値列の統計を mmap したバッファの上で求める（結果は SQLite の走査と同じ）。
+代表だけを集計するとき・コーパスを用意できないときは SQLite を走査する。
+"""
+
+import re
+import sqlite3
+from collections import Counter
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from .config import DEFAULT_DB_PATH
+from .corpus import NULL_INT, NUMPY_AVAILABLE, open_corpus
+from .dedup import backfill_dedup, representative_clause
+from .text_scan import KeywordMatcher
+
+if NUMPY_AVAILABLE:
+    import numpy as np  # type: ignore[import]
+
+# 走査で読み出す列（行タプルの並び順）
+SCAN_COLUMNS = ('id', 'full_prompt', 'negative_prompt', 'quality_score', 'prompt_length', 'tag_count')
+
+# 計算できるセクション
+SECTIONS = ('structure', 'patterns', 'categories', 'keyword_trends')
+
+# 共通パターン分析のキーワード（PromptAnalyzer.extract_common_patterns）
+PATTERN_KEYWORDS = {
+    # 品質関連キーワード
+    'quality_terms': ['masterpiece', 'best quality', 'high quality', 'extremely detailed',
+                      'ultra detailed', 'detailed', 'realistic', 'photorealistic',
+                      'high resolution', '8k', '4k', 'ultra high res'],
+    # スタイル関連キーワード
+    'style_terms': ['anime', 'realistic', 'cartoon', 'oil painting', 'watercolor',
+                    'digital art', 'concept art', 'portrait', 'landscape', 'abstract'],
+    # キャラクター関連キーワード
+    'character_terms': ['girl', 'boy', 'woman', 'man', 'female', 'male', 'person',
+                        'beautiful', 'cute', 'handsome', 'young', 'old'],
+    # 技術的キーワード
+    'technical_terms': ['depth of field', 'bokeh', 'lighting', 'shadows', 'composition',
+                        'camera angle', 'perspective', 'focus', 'blur', 'sharp'],
+}
+
+# 自動カテゴライズのルール（上から順に判定し、すべての語群に 1 語以上含まれれば確定）
+CATEGORY_RULES: List[Tuple[str, Tuple[Tuple[str, ...], ...]]] = [
+    ('realistic_portrait', (('realistic', 'photorealistic', 'portrait', 'woman', 'man', 'girl', 'boy'),
+                            ('realistic', 'photorealistic', 'photo'))),
+    ('anime_character', (('anime', 'manga', 'cartoon', '1girl', '1boy', 'cute'),)),
+    ('landscape_scene', (('landscape', 'scenery', 'background', 'environment', 'nature'),)),
+    ('abstract_art', (('abstract', 'artistic', 'concept art', 'surreal'),)),
+    ('technical_photo', (('macro', 'close-up', 'depth of field', 'bokeh', 'professional'),)),
+    ('fantasy_creature', (('fantasy', 'dragon', 'magic', 'creature', 'monster'),)),
+]
+UNCATEGORIZED = 'uncategorized'
+
+# キーワード傾向分析の対象（StatisticsManager.extract_keyword_trends）
+KEYWORD_TREND_TERMS = [
+    'masterpiece', 'best quality', 'high quality', 'detailed', 'ultra detailed',
+    'realistic', 'photorealistic', 'anime', 'portrait', 'landscape',
+    '8k', '4k', 'high resolution', 'sharp', 'focus', 'depth of field',
+    'lighting', 'cinematic', 'dramatic', 'beautiful', 'stunning',
+    'girl', 'woman', 'man', 'boy', 'character', 'background'
+]
+
+# 品質統計を出すキーワードの最小出現件数
+KEYWORD_MIN_COUNT = 5
+
+# 構造分析で返すサンプル数
+SAMPLE_COUNT = 10
+
+# 重み付け記法 (:数字)。r':\s*\d+\.?\d*' の出現と同じ判定（小文字化しても変わらない）
+WEIGHT_MARK = ':weight'
+WEIGHT_PATTERN = r':\s*\d'
+# コーパス上で WEIGHT_PATTERN の候補を探す bytes の正規表現（ASCII 以外の空白・数字は UTF-8 の
+# 多バイト文字として候補に含め、候補の行だけを WEIGHT_PATTERN で判定し直す）
+_WEIGHT_CANDIDATES = re.compile(rb':[\s\x1c-\x1f\x80-\xff]*[0-9\x80-\xff]')
+
+# 全セクションのキーワードを 1 本にまとめた照合器（小文字化したプロンプトに適用する）
+MATCHER = KeywordMatcher(
+    [k for keywords in PATTERN_KEYWORDS.values() for k in keywords]
+    + [w for _, groups in CATEGORY_RULES for group in groups for w in group]
+    + KEYWORD_TREND_TERMS,
+    extra_patterns={WEIGHT_MARK: WEIGHT_PATTERN}
+)
+
+
+class AnalysisSession:
+    """civitai_prompts を 1 回だけ走査して複数の分析セクションを計算するセッション
+
+    Args:
+        db_path: データベースパス
+        sections: 最初の走査でまとめて計算するセクション（None なら全セクション）
+        batch_size: 1 回の fetchmany で読み出す行数
+        representatives_only: 近似重複クラスタの代表だけを集計する
+        use_corpus: プロンプトコーパスから計算する（None なら NumPy があれば使う。代表だけを集計するときは使わない）
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, sections: Optional[Iterable[str]] = None,
+                 batch_size: int = 1000, representatives_only: bool = False,
+                 use_corpus: Optional[bool] = None):
+        self.db_path = db_path
+        self.sections = tuple(sections) if sections is not None else SECTIONS
+        unknown = [s for s in self.sections if s not in SECTIONS]
+        if unknown:
+            raise ValueError(f"Unknown analysis sections: {unknown}")
+        self.batch_size = batch_size
+        self.representatives_only = representatives_only
+        self.use_corpus = (NUMPY_AVAILABLE if use_corpus is None else use_corpus) and not representatives_only
+        self.scans = 0
+        self._results: Dict[str, Any] = {}
+
+    # ------------------------------------------------------------------
+    # 公開 API
+    # ------------------------------------------------------------------
+    def get(self, section: str) -> Any:
+        """セクションの結果を返す（未計算なら未計算の全セクションを 1 回の走査で計算する）"""
+        if section not in SECTIONS:
+            raise ValueError(f"Unknown analysis section: {section}")
+        if section not in self._results:
+            self._scan(section)
+        return self._results[section]
+
+    def structure(self) -> Dict[str, Any]:
+        """件数・文字数・タグ数の基本統計とサンプル（PromptAnalyzer.analyze_prompt_structure の形式）"""
+        return self.get('structure')
+
+    def patterns(self) -> Dict[str, Any]:
+        """キーワード出現件数と記法の使用件数（PromptAnalyzer.extract_common_patterns の形式）"""
+        return self.get('patterns')
+
+    def categories(self) -> Dict[str, List[Tuple[Any, str, Any]]]:
+        """ルールベースの自動カテゴライズ結果（PromptAnalyzer.categorize_prompts の形式）"""
+        return self.get('categories')
+
+    def keyword_trends(self) -> Dict[str, Any]:
+        """キーワード頻度と品質統計（StatisticsManager.extract_keyword_trends の形式）"""
+        return self.get('keyword_trends')
+
+    def invalidate(self):
+        """計算結果を破棄する（データ更新後に再計算させる）"""
+        self._results.clear()
+
+    # ------------------------------------------------------------------
+    # 走査
+    # ------------------------------------------------------------------
+    def _scan(self, requested: str):
+        pending = [s for s in dict.fromkeys(self.sections + (requested,)) if s not in self._results]
+        if self.use_corpus:
+            try:
+                self._read_corpus(pending)
+                return
+            except (OSError, sqlite3.Error) as e:
+                print(f"[Analysis] prompt corpus unavailable, scanning civitai_prompts instead: {e}")
+        self._scan_sqlite(pending)
+
+    def _scan_sqlite(self, pending: List[str]):
+        states = {s: getattr(self, f'_start_{s}')() for s in pending}
+        steps = [(getattr(self, f'_step_{s}'), states[s]) for s in pending]
+        # 構造統計だけならキーワード照合は不要
+        match = MATCHER.find if any(s != 'structure' for s in pending) else None
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            where = ''
+            if self.representatives_only:
+                backfill_dedup(conn)
+                where = f" WHERE {representative_clause('civitai_prompts')}"
+            cursor = conn.execute(f"SELECT {', '.join(SCAN_COLUMNS)} FROM civitai_prompts{where} ORDER BY id")
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    prompt = row[1]
+                    # 小文字化とキーワード照合は行ごとに 1 回だけ（全セクションで共有）
+                    found = match(prompt.lower()) if prompt and match else None
+                    for step, state in steps:
+                        step(state, row, found)
+        finally:
+            conn.close()
+
+        for s in pending:
+            self._results[s] = getattr(self, f'_finish_{s}')(states[s])
+        self.scans += 1
+        print(f"[Analysis] scanned civitai_prompts once for {', '.join(pending)}")
+
+    def _read_corpus(self, pending: List[str]):
+        with open_corpus(self.db_path) as corpus:
+            rows = _CorpusRows(corpus)
+            results = {s: getattr(self, f'_corpus_{s}')(rows) for s in pending}
+        self._results.update(results)
+        self.scans += 1
+        print(f"[Analysis] read the prompt corpus once for {', '.join(pending)}")
+
+    # ------------------------------------------------------------------
+    # セクションごとの集計器（_start で状態を作り、_step で 1 行ずつ反映し、_finish で結果にする）
+    # _step の found は行に含まれるキーワードの集合（プロンプトが空なら None）
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _start_structure() -> Dict[str, Any]:
+        return {'total': 0, 'length': _MinMaxAvg(), 'tags': _MinMaxAvg(), 'samples': []}
+
+    @staticmethod
+    def _step_structure(state: Dict[str, Any], row: tuple, found: Optional[FrozenSet[str]]):
+        state['total'] += 1
+        state['length'].add(row[4])
+        state['tags'].add(row[5])
+        if len(state['samples']) < SAMPLE_COUNT:
+            state['samples'].append((row[1], row[2]))
+
+    @staticmethod
+    def _finish_structure(state: Dict[str, Any]) -> Dict[str, Any]:
+        length, tags = state['length'], state['tags']
+        return {
+            'total_prompts': state['total'],
+            'avg_length': length.avg(),
+            'min_length': length.min,
+            'max_length': length.max,
+            'avg_tag_count': tags.avg(),
+            'min_tag_count': tags.min,
+            'max_tag_count': tags.max,
+            'samples': state['samples']
+        }
+
+    @staticmethod
+    def _start_patterns() -> Dict[str, Any]:
+        patterns: Dict[str, Any] = {name: _KeywordTally(keywords) for name, keywords in PATTERN_KEYWORDS.items()}
+        patterns.update({'comma_separated': 0, 'parentheses_usage': 0, 'weight_usage': 0, 'embedding_usage': 0})
+        return patterns
+
+    @staticmethod
+    def _step_patterns(patterns: Dict[str, Any], row: tuple, found: Optional[FrozenSet[str]]):
+        prompt = row[1]
+        if not prompt:
+            return
+        # 1 文字の記法は str の in 判定（C 実装の走査）で足りるため照合器には含めない
+        patterns['comma_separated'] += ',' in prompt
+        patterns['parentheses_usage'] += '(' in prompt or '[' in prompt
+        patterns['weight_usage'] += WEIGHT_MARK in found
+        # エンベッディングは '<' と '>' の両方を含むかで判定する（従来どおり）
+        patterns['embedding_usage'] += '<' in prompt and '>' in prompt
+        for name in PATTERN_KEYWORDS:
+            patterns[name].add(found)
+
+    @staticmethod
+    def _finish_patterns(patterns: Dict[str, Any]) -> Dict[str, Any]:
+        for key in ('comma_separated', 'parentheses_usage', 'weight_usage', 'embedding_usage'):
+            patterns[key] = int(patterns[key])
+        for name in PATTERN_KEYWORDS:
+            patterns[name] = patterns[name].counter()
+        return patterns
+
+    @staticmethod
+    def _start_categories() -> Dict[str, List[Tuple[Any, str, Any]]]:
+        return {name: [] for name, _ in CATEGORY_RULES + [(UNCATEGORIZED, ())]}
+
+    @staticmethod
+    def _step_categories(categories: Dict[str, List[Tuple[Any, str, Any]]], row: tuple,
+                         found: Optional[FrozenSet[str]]):
+        pid, prompt, quality = row[0], row[1], row[3]
+        if not prompt:
+            return
+        categories[categorize_keywords(found)].append((pid, prompt[:100], quality))
+
+    @staticmethod
+    def _finish_categories(categories: Dict[str, List[Tuple[Any, str, Any]]]) -> Dict[str, List[Tuple[Any, str, Any]]]:
+        return categories
+
+    @staticmethod
+    def _start_keyword_trends() -> '_KeywordTally':
+        return _KeywordTally(KEYWORD_TREND_TERMS, keep_values=True)
+
+    @staticmethod
+    def _step_keyword_trends(tally: '_KeywordTally', row: tuple, found: Optional[FrozenSet[str]]):
+        if not row[1]:
+            return
+        tally.add(found, row[3])
+
+    @staticmethod
+    def _finish_keyword_trends(tally: '_KeywordTally') -> Dict[str, Any]:
+        return _keyword_trends(tally.counter(), tally.values())
+
+    # ------------------------------------------------------------------
+    # コーパスからの計算（_scan_sqlite の各セクションと同じ結果を返す）
+    # ------------------------------------------------------------------
+    def _corpus_structure(self, rows: '_CorpusRows') -> Dict[str, Any]:
+        conn = sqlite3.connect(self.db_path)
+        try:
+            samples = conn.execute('SELECT full_prompt, negative_prompt FROM civitai_prompts ORDER BY id LIMIT ?',
+                                   (SAMPLE_COUNT,)).fetchall()
+        finally:
+            conn.close()
+        state = {'total': len(rows.corpus), 'samples': samples,
+                 'length': _MinMaxAvg.of(rows.corpus.column('prompt_length')),
+                 'tags': _MinMaxAvg.of(rows.corpus.column('tag_count'))}
+        return self._finish_structure(state)
+
+    @staticmethod
+    def _corpus_patterns(rows: '_CorpusRows') -> Dict[str, Any]:
+        patterns: Dict[str, Any] = {name: rows.counter(keywords) for name, keywords in PATTERN_KEYWORDS.items()}
+        patterns.update({
+            'comma_separated': len(rows(',')),
+            'parentheses_usage': len(np.union1d(rows('('), rows('['))),
+            'weight_usage': len(rows.weighted()),
+            'embedding_usage': len(np.intersect1d(rows('<'), rows('>'))),
+        })
+        return patterns
+
+    @staticmethod
+    def _corpus_categories(rows: '_CorpusRows') -> Dict[str, List[Tuple[Any, str, Any]]]:
+        corpus = rows.corpus
+        names = [name for name, _ in CATEGORY_RULES] + [UNCATEGORIZED]
+        # 上のルールから順に、まだ分類されていない行のうちすべての語群に当てはまる行を割り当てる
+        remaining = corpus.text_bytes() > 0
+        assigned = np.full(len(corpus), len(CATEGORY_RULES), dtype=np.int64)
+        for i, (_, groups) in enumerate(CATEGORY_RULES):
+            hit = remaining.copy()
+            for group in groups:
+                member = np.zeros(len(corpus), dtype=bool)
+                for word in group:
+                    member[rows(word)] = True
+                hit &= member
+            assigned[hit] = i
+            remaining &= ~hit
+
+        categories: Dict[str, List[Tuple[Any, str, Any]]] = {name: [] for name in names}
+        quality = corpus.column('quality_score')
+        for row in np.flatnonzero(corpus.text_bytes() > 0):
+            value = int(quality[row])
+            categories[names[assigned[row]]].append(
+                (int(corpus.ids[row]), corpus.text(row)[:100], None if value == NULL_INT else value))
+        return categories
+
+    @staticmethod
+    def _corpus_keyword_trends(rows: '_CorpusRows') -> Dict[str, Any]:
+        quality = rows.corpus.column('quality_score')
+        counter = rows.counter(KEYWORD_TREND_TERMS)
+        qualities = {}
+        for keyword in counter:
+            values = quality[rows(keyword)]
+            qualities[keyword] = [None if v == NULL_INT else v for v in values.tolist()]
+        return _keyword_trends(counter, qualities)
+
+
+def _keyword_trends(counter: Counter, qualities: Dict[str, Sequence[Any]]) -> Dict[str, Any]:
+    """キーワードの出現件数と、キーワードを含む行の品質スコアからキーワード傾向の結果を作る"""
+    keyword_quality_stats = {}
+    for keyword, values in qualities.items():
+        values = [v for v in values if v is not None]  # 品質スコアのない行は統計に含めない
+        if len(values) >= KEYWORD_MIN_COUNT:  # 5件以上のデータがあるもののみ
+            keyword_quality_stats[keyword] = {
+                'count': len(values),
+                'avg_quality': sum(values) / len(values),
+                'max_quality': max(values),
+                'min_quality': min(values)
+            }
+    return {
+        'keyword_frequency': dict(counter.most_common(20)),
+        'keyword_quality': keyword_quality_stats
+    }
+
+
+def categorize_keywords(found: FrozenSet[str]) -> str:
+    """プロンプトに含まれるキーワード集合（MATCHER.find の結果）を CATEGORY_RULES で分類する"""
+    for name, groups in CATEGORY_RULES:
+        if all(not found.isdisjoint(group) for group in groups):
+            return name
+    return UNCATEGORIZED
+
+
+class _KeywordTally:
+    """キーワードごとの出現件数（keep_values なら値のリストも）をヒットしたキーワードだけで数える
+
+    結果の並び（Counter.most_common の同数順位や dict の順序）は、行ごとにキーワード表の
+    順で `keyword in text` を判定していた従来の集計と同じになるよう、初出の
+    (行番号, 表での位置) 順に並べ直して返す。
+    """
+
+    def __init__(self, keywords: Iterable[str], keep_values: bool = False):
+        self.position = {k: i for i, k in enumerate(dict.fromkeys(keywords))}
+        self.keyset = frozenset(self.position)
+        self.keep_values = keep_values
+        self.counts: Dict[str, int] = {}
+        self.lists: Dict[str, List[Any]] = {}
+        self.first: Dict[str, Tuple[int, int]] = {}
+        self.rows = 0
+
+    def add(self, found: FrozenSet[str], value: Any = None):
+        self.rows += 1
+        counts = self.counts
+        for keyword in self.keyset.intersection(found):
+            if keyword in counts:
+                counts[keyword] += 1
+            else:
+                counts[keyword] = 1
+                self.first[keyword] = (self.rows, self.position[keyword])
+                if self.keep_values:
+                    self.lists[keyword] = []
+            if self.keep_values:
+                self.lists[keyword].append(value)
+
+    def _ordered(self) -> List[str]:
+        return sorted(self.counts, key=self.first.__getitem__)
+
+    def counter(self) -> Counter:
+        return Counter({k: self.counts[k] for k in self._ordered()})
+
+    def values(self) -> Dict[str, List[Any]]:
+        return {k: self.lists[k] for k in self._ordered()}
+
+
+class _CorpusRows:
+    """コーパス上でキーワードを含む行番号を求め、セクション間で共有する（MATCHER の代わり）"""
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+        self._rows: Dict[str, Any] = {}
+
+    def __call__(self, keyword: str):
+        """小文字化したプロンプトに keyword を含む行番号（昇順）"""
+        if keyword not in self._rows:
+            self._rows[keyword] = self.corpus.rows_containing(keyword)
+        return self._rows[keyword]
+
+    def weighted(self) -> List[int]:
+        """重み付け記法（WEIGHT_PATTERN）を含む行番号"""
+        pattern = re.compile(WEIGHT_PATTERN)
+        return [row for row in self.corpus.rows_matching(_WEIGHT_CANDIDATES)
+                if pattern.search(self.corpus.text(row).lower())]
+
+    def counter(self, keywords: Iterable[str]) -> Counter:
+        """キーワードを含む行の数（_KeywordTally.counter と同じく初出の (行, 表での位置) 順に並べる）"""
+        hits = {k: self(k) for k in dict.fromkeys(keywords)}
+        position = {k: i for i, k in enumerate(hits)}
+        ordered = sorted((k for k in hits if len(hits[k])), key=lambda k: (int(hits[k][0]), position[k]))
+        return Counter({k: len(hits[k]) for k in ordered})
+
+
+class _MinMaxAvg:
+    """SQL の MIN / MAX / AVG と同じく NULL を無視して集計する"""
+
+    def __init__(self):
+        self.min = None
+        self.max = None
+        self.sum = 0
+        self.n = 0
+
+    @classmethod
+    def of(cls, values) -> '_MinMaxAvg':
+        """コーパスの数値列（NULL は NULL_INT）から作る"""
+        stats = cls()
+        values = values[values != NULL_INT]
+        if len(values):
+            stats.min, stats.max = int(values.min()), int(values.max())
+            stats.sum, stats.n = int(values.sum()), len(values)
+        return stats
+
+    def add(self, value):
+        if value is None:
+            return
+        self.sum += value
+        self.n += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def avg(self) -> Optional[float]:
+        return self.sum / self.n if self.n else None
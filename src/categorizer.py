@@ -385,22 +385,30 @@ def test_categorizer():
     for category, count in distribution.items():
         print(f"{category}: {count}件")
 
-def process_database_prompts():
-    """データベースから実際のプロンプトを取得して分類"""
+def process_database_prompts(representatives_only: bool = False):
+    """データベースから実際のプロンプトを取得して分類
+
+    Args:
+        representatives_only: True なら近似重複クラスタごとに 1 件だけ分類し、
+            同じクラスタの他の行には同じ結果を保存する
+    """
     try:
         # データベース接続
         try:
-            from src.database import DatabaseManager
+            from src.registry import get_database, get_writer, get_categorizer
+            from src import dedup
         except ImportError:
-            from .database import DatabaseManager
+            from .registry import get_database, get_writer, get_categorizer
+            from . import dedup
 
-        db = DatabaseManager()
-        categorizer = PromptCategorizer()
+        db = get_database()
+        writer = get_writer()
+        categorizer = get_categorizer()
 
-        # データベースからプロンプトを取得
-        prompts_data = db.get_all_prompts()
+        # データベースのプロンプト件数（本体は iter_prompts で逐次読み出す）
+        prompt_total = db.get_total_prompts_count()
 
-        if not prompts_data:
+        if not prompt_total:
             print("データベースにプロンプトが見つかりません")
             print("先に collector.py を実行してデータを収集してください")
             return
@@ -408,7 +416,7 @@ def process_database_prompts():
         from datetime import datetime, timedelta, timezone
         JST = timezone(timedelta(hours=9))
         now_jst = datetime.now(JST).strftime('%Y-%m-%d %H:%M:%S')
-        print(f"[JST:{now_jst}] データベースから {len(prompts_data)} 件のプロンプトを取得")
+        print(f"[JST:{now_jst}] データベースから {prompt_total} 件のプロンプトを取得")
         print("正しいカテゴリ(NSFW, style, lighting, composition, mood, basic, technical)で再分類中...")
 
         # 全件再分類オプション（Trueなら従来通り全件DELETE→再分類、Falseなら新規のみ分類）
@@ -421,35 +429,46 @@ def process_database_prompts():
             conn.commit()
             print("既存の分類データをクリア完了（全件再分類）")
         # 既存分類済みプロンプトIDを取得
-        cursor.execute('SELECT prompt_id FROM prompt_categories')
+        cursor.execute('SELECT DISTINCT prompt_id FROM prompt_categories')
         already_classified = set(row[0] for row in cursor.fetchall())
-        conn.close()
+        if representatives_only:
+            dedup.backfill_dedup(conn)
 
-        # プロンプト分類
+        # プロンプト分類（分布統計も同じ走査で集計する）
         classified_count = 0
-        for prompt_data in prompts_data:
-            full_prompt = prompt_data.get('full_prompt', '')
-            prompt_id = prompt_data.get('id')
-            if not full_prompt or not prompt_id:
-                continue
-            # FULL_RECLASSIFYなら全件、そうでなければ未分類のみ
-            if FULL_RECLASSIFY or prompt_id not in already_classified:
-                result = categorizer.classify(full_prompt)
-                categories_data = {
-                    result.category: {
-                        "keywords": result.matched_keywords,
-                        "confidence": result.confidence
-                    }
-                }
-                if db.save_prompt_categories(prompt_id, categories_data):
-                    classified_count += 1
+        distribution = {category: 0 for category in categorizer.category_keywords.keys()}
+        # クラスタ ID -> 分類結果（representatives_only のときだけ使う）
+        cluster_results = {}
+        try:
+            for batch in db.iter_prompt_batches(columns=('id', 'full_prompt'), where="full_prompt IS NOT NULL AND full_prompt != ''"):
+                clusters = dedup.cluster_ids(conn, [p.id for p in batch]) if representatives_only else {}
+                batch_categories = []
+                for prompt in batch:
+                    cluster_id = clusters.get(prompt.id)
+                    result = cluster_results.get(cluster_id) if cluster_id is not None else None
+                    if result is None:
+                        result = categorizer.classify_batch([prompt.full_prompt])[0]
+                        if cluster_id is not None:
+                            cluster_results[cluster_id] = result
+                    distribution[result.category] = distribution.get(result.category, 0) + 1
+                    # FULL_RECLASSIFYなら全件、そうでなければ未分類のみ
+                    if FULL_RECLASSIFY or prompt.id not in already_classified:
+                        categories_data = {
+                            result.category: {
+                                "keywords": result.matched_keywords,
+                                "confidence": result.confidence
+                            }
+                        }
+                        batch_categories.append((prompt.id, categories_data))
+                # バッチ単位で 1 トランザクションにまとめて保存する
+                classified_count += writer.save_prompt_categories_bulk(batch_categories)
+        finally:
+            conn.close()
+        if representatives_only:
+            print(f"近似重複クラスタ {len(cluster_results)} 件の代表だけを分類しました")
         now_jst = datetime.now(JST).strftime('%Y-%m-%d %H:%M:%S')
         print(f"[JST:{now_jst}] 分類完了: {classified_count} 件（新規分類のみ。全件再分類はFULL_RECLASSIFY=Trueで実行）")
 
-        # 分布統計表示
-        prompts_text = [p.get('full_prompt', '') for p in prompts_data if p.get('full_prompt')]
-        distribution = categorizer.get_category_distribution(prompts_text)
-
         print("\n=== 正しいカテゴリ分布 ===")
         for category, count in distribution.items():
             print(f"{category}: {count}件")
@@ -467,8 +486,8 @@ def main():
         # テストモード
         test_categorizer()
     else:
-        # 実データ処理モード
-        process_database_prompts()
+        # 実データ処理モード（--dedup で近似重複クラスタの代表だけを分類）
+        process_database_prompts(representatives_only="--dedup" in sys.argv[1:])
 
 if __name__ == "__main__":
     main()
@@ -15,15 +15,20 @@ from .config import (
     REQUEST_TIMEOUT, RETRY_DELAY, RATE_LIMIT_WAIT,
     QUALITY_KEYWORDS
 )
+from .column_types import to_int_id
+from .resources import extract_resources
+from .registry import get_http_session
 
 
 class CivitaiAPIClient:
     """CivitAI API呼び出しを管理するクライアント"""
 
-    def __init__(self, api_key: str = CIVITAI_API_KEY, user_agent: str = USER_AGENT):
+    def __init__(self, api_key: str = CIVITAI_API_KEY, user_agent: str = USER_AGENT, session=None):
         self.api_key = api_key
         self.user_agent = user_agent
         self.base_url = API_BASE_URL
+        # プロセス共有のセッション（keep-alive で接続を使い回す）
+        self.session = session or get_http_session()
 
     def _get_headers(self) -> Dict[str, str]:
         """APIリクエスト用ヘッダーを生成"""
@@ -52,7 +57,7 @@ class CivitaiAPIClient:
         try:
             url = f"https://civitai.com/api/v1/models/{model_id}"
             headers = self._get_headers()
-            resp = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+            resp = self.session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
             if resp.status_code == 200:
                 return resp.json()
             else:
@@ -68,7 +73,7 @@ class CivitaiAPIClient:
             url = "https://civitai.com/api/v1/images"
             headers = self._get_headers()
             params = {"modelVersionId": version_id, "limit": 1, "page": 1}
-            resp = requests.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+            resp = self.session.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
             if resp.status_code == 200:
                 return resp.json().get('metadata', {})
             else:
@@ -85,14 +90,14 @@ class CivitaiAPIClient:
         for attempt in range(1, max_retries + 1):
             try:
                 if isinstance(url_or_params, dict):
-                    response = requests.get(
+                    response = self.session.get(
                         self.base_url,
                         params=url_or_params,
                         headers=headers,
                         timeout=REQUEST_TIMEOUT
                     )
                 else:
-                    response = requests.get(
+                    response = self.session.get(
                         url_or_params,
                         headers=headers,
                         timeout=REQUEST_TIMEOUT
@@ -135,36 +140,26 @@ class PromptDataExtractor:
             full_prompt = meta.get("prompt") or ""
             negative_prompt = meta.get("negativePrompt") or ""
 
+            # ID は保存形式（INTEGER）に揃えて渡す。modelVersionIds はリストなので先頭を使う
+            version_ids = item.get('modelVersionIds')
+            if isinstance(version_ids, list):
+                version_ids = version_ids[0] if version_ids else None
             prompt_data = {
-                "civitai_id": str(item.get("id", "")),
+                "civitai_id": to_int_id(item.get("id") or ""),
                 "full_prompt": full_prompt,
                 "negative_prompt": negative_prompt,
                 "reaction_count": stats.get("reactionCount", 0),
                 "comment_count": stats.get("commentCount", 0),
                 "download_count": stats.get("downloadCount", 0),
                 "model_name": meta.get("Model") or meta.get("model") or item.get("model") or "",
-                "model_id": str(item.get("modelId") or meta.get("ModelId") or ""),
-                "model_version_id": str(item.get("modelVersionId") or item.get('modelVersionIds') or meta.get('modelVersionId') or ""),
+                "model_id": to_int_id(item.get("modelId") or meta.get("ModelId") or ""),
+                "model_version_id": to_int_id(item.get("modelVersionId") or version_ids or meta.get('modelVersionId') or ""),
                 "raw_metadata": json.dumps(item, ensure_ascii=False)
             }
 
             # Parse civitaiResources into a normalized resources list
-            resources = []
             try:
-                civres = meta.get('civitaiResources') or item.get('civitaiResources') or []
-                if isinstance(civres, list):
-                    for idx, r in enumerate(civres):
-                        if not isinstance(r, dict):
-                            continue
-                        resources.append({
-                            'index': idx,
-                            'type': r.get('type') or r.get('resourceType') or '',
-                            'name': r.get('name') or r.get('resourceName') or r.get('checkpointName') or '',
-                            'modelId': str(r.get('modelId') or r.get('model') or ''),
-                            'modelVersionId': str(r.get('modelVersionId') or r.get('id') or ''),
-                            'resourceId': str(r.get('id') or r.get('resourceId') or ''),
-                            'raw': json.dumps(r, ensure_ascii=False)
-                        })
+                resources = extract_resources(item)
             except Exception:
                 resources = []
 
@@ -295,7 +290,7 @@ class CivitaiPromptCollector:
             while collected < max_items:
                 api_url = f"https://civitai.com/api/v1/images?modelVersionId={model_id}&limit=100&page={page}"
                 print(f"[Collector] Fetching images page {page} (collected: {collected}/{max_items})")
-                resp = requests.get(api_url, timeout=15)
+                resp = self.api_client.session.get(api_url, timeout=15)
                 if resp.status_code != 200:
                     print(f"[Collector] API error: {resp.status_code}")
                     break
@@ -309,7 +304,7 @@ class CivitaiPromptCollector:
                             print("[Collector] No images returned for given id; trying model metadata lookup as modelId")
                             base_api = API_BASE_URL.rsplit('/', 1)[0]
                             model_meta_url = f"{base_api}/models/{model_id}"
-                            mresp = requests.get(model_meta_url, timeout=REQUEST_TIMEOUT)
+                            mresp = self.api_client.session.get(model_meta_url, timeout=REQUEST_TIMEOUT)
                             if mresp.status_code == 200:
                                 mj = mresp.json()
                                 versions = mj.get('modelVersions') or mj.get('versions') or []
@@ -339,7 +334,7 @@ class CivitaiPromptCollector:
                             prompt_data["model_name"] = model_name
                         # When calling images API with a numeric id, this likely is a modelVersionId
                         # store it in model_version_id to avoid confusion
-                        prompt_data["model_version_id"] = str(model_id)
+                        prompt_data["model_version_id"] = to_int_id(model_id)
                         # keep model_id field empty unless known
                         prompt_data["model_id"] = prompt_data.get('model_id') or ""
                         prompt_data["collected_at"] = datetime.now().isoformat()
@@ -375,7 +370,7 @@ class CivitaiPromptCollector:
                                 # if user supplied a model_id (non-numeric), store as model_id
                                 prompt_data["model_id"] = str(model_id)
                             if model_id and str(model_id).isdigit() and not prompt_data.get("model_version_id"):
-                                prompt_data["model_version_id"] = str(model_id)
+                                prompt_data["model_version_id"] = to_int_id(model_id)
                         prompt_data["collected_at"] = datetime.now().isoformat()
                         valid_items.append(prompt_data)
                     collected += 1
@@ -465,9 +460,8 @@ def check_total_items(model_id: Optional[str] = None, version_id: Optional[str]
             params['modelVersionId'] = version_id
         elif model_id:
             params['modelId'] = model_id
-        headers = CivitaiAPIClient()._get_headers()
-        import requests
-        resp = requests.get(url, params=params, headers=headers, timeout=timeout)
+        client = CivitaiAPIClient()
+        resp = client.session.get(url, params=params, headers=client._get_headers(), timeout=timeout)
         if resp.status_code == 200:
             meta = resp.json().get('metadata', {}) or {}
             return meta.get('totalItems')
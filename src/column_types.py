@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - 列の保存形式
+civitai_id / model_id / model_version_id は INTEGER 列に、collected_at は UNIX 秒（UTC）で保存する。
+整数の比較・範囲走査で済み、索引も小さくなる。
+
+呼び出し側は従来どおり文字列（'12345'、ISO 8601 の日時）を渡してよく、ここで保存形式に揃える。
+変換規則は SQLite の INTEGER 列の型変換と同じにしてあり、数字でない ID（手入力のモデル名など）や
+解釈できない日時は文字列のまま保存される（移行で値が失われない）。
+
+日時はマイクロ秒まで保つ（端数のある値は REAL、秒ちょうどの値は INTEGER として入る）。
+タイムゾーン付きの日時はその時差で、タイムゾーンのない日時（従来の datetime.now().isoformat()）は
+ローカル時刻として UTC に直す。表示（互換ビュー・日別の集計）ではローカル時刻に戻すため、
+移行前と同じ文字列・日付になる。
+"""
+
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Sequence
+
+# INTEGER 列に保存する ID 列
+INTEGER_ID_COLUMNS = {'civitai_id', 'model_id', 'model_version_id', 'resource_model_id',
+                      'resource_model_version_id', 'version_id'}
+# UNIX 秒で保存する日時列
+EPOCH_COLUMNS = {'collected_at'}
+
+_INT_RE = re.compile(r'^\s*[+-]?\d+\s*$')
+_INT64_MAX = (1 << 63) - 1
+_ISO_FORMAT = '%Y-%m-%dT%H:%M:%S'
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# SQL 側の変換式（{x} に列や new.列 を入れる）
+# ISO 形式の文字列だけを UNIX 秒にする（数字だけの文字列はユリウス日と解釈されるため対象外）。
+# SQLite の日付関数はミリ秒で丸めるため、秒の端数は文字列から切り出して足す
+# （'utc' 修飾子はタイムゾーンのない時刻をローカル時刻として UTC に直し、時差付きの時刻には何もしない）
+_FRACTION = "substr({x}, 20, 1) = '.'"
+_WHOLE_SECONDS = (f"CAST(strftime('%s', CASE WHEN {_FRACTION} "
+                  "THEN substr({x}, 1, 19) || ltrim(substr({x}, 21), '0123456789') ELSE {x} END, 'utc') AS INTEGER)")
+EPOCH_SQL = (
+    "(CASE WHEN typeof({x}) IN ('integer', 'real') THEN {x} "
+    "WHEN {x} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*' "
+    f"THEN COALESCE({_WHOLE_SECONDS} + CASE WHEN {_FRACTION} THEN CAST('0.' || substr({{x}}, 21) AS REAL) ELSE 0 END, "
+    "{x}) ELSE {x} END)"
+)
+# 保存した UNIX 秒をローカル時刻の ISO 形式・日付に戻す（端数はマイクロ秒 6 桁で表示する）
+ISO_SQL = (
+    f"(CASE WHEN typeof({{x}}) = 'integer' THEN strftime('{_ISO_FORMAT}', {{x}}, 'unixepoch', 'localtime') "
+    f"WHEN typeof({{x}}) = 'real' THEN strftime('{_ISO_FORMAT}', CAST({{x}} AS INTEGER), 'unixepoch', 'localtime') "
+    "|| printf('.%06d', CAST(round(({x} - CAST({x} AS INTEGER)) * 1000000) AS INTEGER)) ELSE {x} END)"
+)
+DATE_SQL = ("(CASE WHEN typeof({x}) IN ('integer', 'real') THEN DATE(CAST({x} AS INTEGER), 'unixepoch', 'localtime') "
+            "ELSE DATE({x}) END)")
+
+
+def to_int_id(value: Any) -> Any:
+    """ID を保存形式にする（整数として読める値は int、それ以外はそのまま）"""
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    if isinstance(value, str) and _INT_RE.match(value):
+        number = int(value)
+        if -_INT64_MAX - 1 <= number <= _INT64_MAX:
+            return number
+    return value
+
+
+def to_nullable_id(value: Any) -> Any:
+    """to_int_id と同じだが、空文字の ID は NULL にする（collection_state.version_id など）"""
+    value = to_int_id(value)
+    return None if isinstance(value, str) and not value.strip() else value
+
+
+def to_text_id(value: Any) -> Any:
+    """保存形式の ID を従来の文字列表現に戻す（読み出し API は ID を文字列で返す）"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value)
+    return value
+
+
+def text_ids(row: Dict[str, Any]) -> Dict[str, Any]:
+    """行の辞書の ID 列を to_text_id で文字列に戻す（row をそのまま書き換えて返す）"""
+    for column in INTEGER_ID_COLUMNS.intersection(row):
+        row[column] = to_text_id(row[column])
+    return row
+
+
+def to_epoch(value: Any) -> Any:
+    """日時を UNIX 秒にする（秒ちょうどなら int、端数があれば float）。解釈できない値はそのまま返す"""
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, datetime):
+        dt = value
+    elif isinstance(value, str):
+        text = value.strip()
+        if _INT_RE.match(text):
+            return int(text)
+        try:
+            dt = datetime.fromisoformat(text)
+        except ValueError:
+            return value
+    else:
+        return value
+    if dt.tzinfo is None:
+        # タイムゾーンのない日時はローカル時刻
+        dt = dt.astimezone()
+    delta = dt - _EPOCH
+    if delta.microseconds:
+        return delta.total_seconds()
+    return delta.days * 86400 + delta.seconds
+
+
+def now_epoch() -> Any:
+    """現在時刻を保存形式（UTC の UNIX 秒）で返す"""
+    return to_epoch(datetime.now(timezone.utc))
+
+
+def epoch_to_iso(value: Any) -> Any:
+    """UNIX 秒をローカル時刻の ISO 8601 文字列（タイムゾーンなし）に戻す。それ以外はそのまま
+
+    ISO_SQL と同じ表記（端数があればマイクロ秒 6 桁）になる。
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value).isoformat()
+    return value
+
+
+def retype_table(cursor, table: str, create_sql: str, columns: Sequence[str],
+                 conversions: Optional[Dict[str, str]] = None):
+    """列の型宣言を変えるためにテーブルを作り直す（行・id・AUTOINCREMENT の位置は保つ）
+
+    create_sql は {table} を含む CREATE TABLE 文。conversions は列 -> 変換式（{x} に旧列が入る）。
+    テーブルに付いたトリガー・索引は消えるため、呼び出し側で作り直すこと。
+    """
+    conversions = conversions or {}
+    typed = f'{table}__typed'
+    cursor.execute(f'DROP TABLE IF EXISTS {typed}')
+    cursor.execute(create_sql.format(table=typed))
+    select = ', '.join(conversions[c].format(x=c) if c in conversions else c for c in columns)
+    cursor.execute(f'INSERT INTO {typed} ({", ".join(columns)}) SELECT {select} FROM {table} ORDER BY rowid')
+    copy_sequence(cursor, table, typed)
+    cursor.execute(f'DROP TABLE {table}')
+    # 他テーブルのトリガーが元の名前を参照しているため、参照の検査・書き換えをしない旧来の RENAME を使う
+    cursor.execute('PRAGMA legacy_alter_table = ON')
+    try:
+        cursor.execute(f'ALTER TABLE {typed} RENAME TO {table}')
+    finally:
+        cursor.execute('PRAGMA legacy_alter_table = OFF')
+
+
+def copy_sequence(cursor, old: str, new: str):
+    """AUTOINCREMENT の採番位置を引き継ぐ（削除済みの id を再利用しないように）"""
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (old,))
+    row = cursor.fetchone()
+    if not row or row[0] is None:
+        return
+    cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (row[0], new))
+    if cursor.rowcount == 0:
+        cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (new, row[0]))
+
+
+def replace_definition(cursor, name: str, create_sql: str) -> bool:
+    """ビュー・トリガー name を create_sql（CREATE … IF NOT EXISTS 文）で作る
+
+    既にあって定義が違う場合（保存形式を変えた版の式が残っている場合）は作り直し、True を返す。
+    """
+    cursor.execute('SELECT type, sql FROM sqlite_master WHERE name = ?', (name,))
+    row = cursor.fetchone()
+    stale = bool(row) and ' '.join(row[1].split()) != ' '.join(create_sql.replace(' IF NOT EXISTS', '', 1).split())
+    if stale:
+        cursor.execute(f'DROP {row[0].upper()} {name}')
+    cursor.execute(create_sql)
+    return stale
+
+
+def declared_type(cursor, table: str, column: str) -> Optional[str]:
+    """列の宣言型（大文字）を返す。列・テーブルがなければ None"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    for r in cursor.fetchall():
+        if r[1] == column:
+            return (r[2] or '').upper()
+    return None
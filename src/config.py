@@ -88,26 +88,8 @@ QUALITY_KEYWORDS = {
 }
 
 # データベーススキーマ
+# civitai_prompts / prompt_resources は次元テーブルを結合する互換ビュー（dimensions.py で作成する）
 DB_SCHEMA = {
-    "civitai_prompts": """
-        CREATE TABLE IF NOT EXISTS civitai_prompts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            civitai_id TEXT UNIQUE,
-            full_prompt TEXT,
-            negative_prompt TEXT,
-            quality_score INTEGER,
-            reaction_count INTEGER,
-            comment_count INTEGER,
-            download_count INTEGER,
-            prompt_length INTEGER,
-            tag_count INTEGER,
-            model_name TEXT,
-            model_id TEXT,
-            model_version_id TEXT,
-            collected_at TIMESTAMP,
-            raw_metadata TEXT
-        )
-    """,
     "prompt_categories": """
         CREATE TABLE IF NOT EXISTS prompt_categories (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -115,29 +97,14 @@ DB_SCHEMA = {
             category TEXT,
             keywords TEXT,
             confidence REAL,
-            FOREIGN KEY (prompt_id) REFERENCES civitai_prompts (id)
-        )
-    """
-
-    ,"prompt_resources": """
-        CREATE TABLE IF NOT EXISTS prompt_resources (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            prompt_id INTEGER,
-            resource_index INTEGER,
-            resource_type TEXT,
-            resource_name TEXT,
-            resource_model_id TEXT,
-            resource_model_version_id TEXT,
-            resource_id TEXT,
-            resource_raw TEXT,
-            FOREIGN KEY (prompt_id) REFERENCES civitai_prompts (id)
+            FOREIGN KEY (prompt_id) REFERENCES prompts (id)
         )
     """,
     "collection_state": """
         CREATE TABLE IF NOT EXISTS collection_state (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            model_id TEXT NOT NULL,
-            version_id TEXT DEFAULT '',
+            model_id INTEGER NOT NULL,
+            version_id INTEGER DEFAULT NULL,
             last_offset INTEGER DEFAULT 0,
             total_collected INTEGER DEFAULT 0,
             next_page_cursor TEXT DEFAULT NULL,
@@ -150,5 +117,171 @@ DB_SCHEMA = {
             last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             UNIQUE(model_id, version_id)
         )
+    """,
+    # バックグラウンド収集ジョブの進捗（UI はジョブごとにこの 1 行だけを読む）
+    "collection_jobs": """
+        CREATE TABLE IF NOT EXISTS collection_jobs (
+            job_id TEXT PRIMARY KEY,
+            version_id TEXT DEFAULT '',
+            status TEXT DEFAULT 'pending',
+            strategies_total INTEGER DEFAULT 0,
+            strategies_done INTEGER DEFAULT 0,
+            current_strategy TEXT DEFAULT NULL,
+            fetched INTEGER DEFAULT 0,
+            saved INTEGER DEFAULT 0,
+            duplicates INTEGER DEFAULT 0,
+            errors INTEGER DEFAULT 0,
+            summary_json TEXT DEFAULT NULL,
+            started_at TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+    """
+}
+
+# 補助インデックス（prompt_id での参照・マージ時の突き合わせ用）
+DB_INDEXES = [
+    # 品質スコア順の一覧（キーセットページング）用。NULL は -1 として末尾に並べる
+    "CREATE INDEX IF NOT EXISTS idx_prompts_quality_id ON prompts (IFNULL(quality_score, -1), id)",
+    # バージョン単位の収集状態の参照（継続収集の再開位置・UI の状態表示）
+    "CREATE INDEX IF NOT EXISTS idx_collection_state_version ON collection_state (version_id, last_update)",
+]
+
+# 全文検索 (FTS5) スキーマ
+# prompts（civitai_prompts の実体）を外部コンテンツとして参照し、トリガーで索引を同期する
+FTS_SCHEMA = {
+    "civitai_prompts_fts": """
+        CREATE VIRTUAL TABLE IF NOT EXISTS civitai_prompts_fts USING fts5(
+            full_prompt,
+            negative_prompt,
+            content='prompts',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    """,
+    "civitai_prompts_fts_ai": """
+        CREATE TRIGGER IF NOT EXISTS civitai_prompts_fts_ai
+        AFTER INSERT ON prompts
+        BEGIN
+            INSERT INTO civitai_prompts_fts (rowid, full_prompt, negative_prompt)
+            VALUES (new.id, new.full_prompt, new.negative_prompt);
+        END
+    """,
+    "civitai_prompts_fts_ad": """
+        CREATE TRIGGER IF NOT EXISTS civitai_prompts_fts_ad
+        AFTER DELETE ON prompts
+        BEGIN
+            INSERT INTO civitai_prompts_fts (civitai_prompts_fts, rowid, full_prompt, negative_prompt)
+            VALUES ('delete', old.id, old.full_prompt, old.negative_prompt);
+        END
+    """,
+    "civitai_prompts_fts_au": """
+        CREATE TRIGGER IF NOT EXISTS civitai_prompts_fts_au
+        AFTER UPDATE OF full_prompt, negative_prompt ON prompts
+        WHEN old.full_prompt IS NOT new.full_prompt OR old.negative_prompt IS NOT new.negative_prompt
+        BEGIN
+            INSERT INTO civitai_prompts_fts (civitai_prompts_fts, rowid, full_prompt, negative_prompt)
+            VALUES ('delete', old.id, old.full_prompt, old.negative_prompt);
+            INSERT INTO civitai_prompts_fts (rowid, full_prompt, negative_prompt)
+            VALUES (new.id, new.full_prompt, new.negative_prompt);
+        END
+    """
+}
+
+# データ世代カウンタ
+# UI のキャッシュ無効化用。追記は MAX(id) の増加で検出できるため、
+# 既存行の更新・削除（prompts）とカテゴリの変更（categories）のみトリガーで数える。
+# 更新は UI が読み込む列の値が実際に変わった場合だけ数える（重複の upsert で全件再読み込みにしない）
+GENERATION_SCHEMA = {
+    "data_generations": """
+        CREATE TABLE IF NOT EXISTS data_generations (
+            name TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        )
+    """,
+    "data_generations_seed": """
+        INSERT OR IGNORE INTO data_generations (name, generation) VALUES ('prompts', 0), ('categories', 0)
+    """,
+    "data_generations_prompts_au": """
+        CREATE TRIGGER IF NOT EXISTS data_generations_prompts_au
+        AFTER UPDATE ON prompts
+        WHEN old.full_prompt IS NOT new.full_prompt OR old.negative_prompt IS NOT new.negative_prompt
+          OR old.quality_score IS NOT new.quality_score OR old.reaction_count IS NOT new.reaction_count
+          OR old.comment_count IS NOT new.comment_count OR old.download_count IS NOT new.download_count
+          OR old.prompt_length IS NOT new.prompt_length OR old.tag_count IS NOT new.tag_count
+          OR old.model_key IS NOT new.model_key OR old.version_key IS NOT new.version_key
+          OR old.collected_at IS NOT new.collected_at OR old.civitai_id IS NOT new.civitai_id
+        BEGIN
+            UPDATE data_generations SET generation = generation + 1 WHERE name = 'prompts';
+        END
+    """,
+    "data_generations_prompts_ad": """
+        CREATE TRIGGER IF NOT EXISTS data_generations_prompts_ad
+        AFTER DELETE ON prompts
+        BEGIN
+            UPDATE data_generations SET generation = generation + 1 WHERE name = 'prompts';
+        END
+    """,
+    "data_generations_categories_ai": """
+        CREATE TRIGGER IF NOT EXISTS data_generations_categories_ai
+        AFTER INSERT ON prompt_categories
+        BEGIN
+            UPDATE data_generations SET generation = generation + 1 WHERE name = 'categories';
+        END
+    """,
+    "data_generations_categories_au": """
+        CREATE TRIGGER IF NOT EXISTS data_generations_categories_au
+        AFTER UPDATE ON prompt_categories
+        BEGIN
+            UPDATE data_generations SET generation = generation + 1 WHERE name = 'categories';
+        END
+    """,
+    "data_generations_categories_ad": """
+        CREATE TRIGGER IF NOT EXISTS data_generations_categories_ad
+        AFTER DELETE ON prompt_categories
+        BEGIN
+            UPDATE data_generations SET generation = generation + 1 WHERE name = 'categories';
+        END
+    """
+}
+
+# プロンプトコーパス（src/corpus.py）の変更ログ
+# コーパスに書き出す列が実際に変わった行と削除された行の id を記録する。
+# 重複の upsert で値が同じまま書き直された行は記録しない（コーパスは追記と変更行の書き換えだけで済む）
+# コーパスを作らない環境でもログが増え続けないよう、直近 CHANGE_LOG_LIMIT 件より古い記録は
+# 1000 件ごとにトリガーで消す（読み終える前に消えた場合、コーパスは欠けを検出して作り直す）
+CHANGE_LOG_LIMIT = 100000
+CORPUS_CHANGE_SCHEMA = {
+    "prompt_changes": """
+        CREATE TABLE IF NOT EXISTS prompt_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            prompt_id INTEGER NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0
+        )
+    """,
+    "prompt_changes_au": """
+        CREATE TRIGGER IF NOT EXISTS prompt_changes_au
+        AFTER UPDATE OF full_prompt, quality_score, reaction_count, prompt_length, tag_count, version_key ON prompts
+        WHEN old.full_prompt IS NOT new.full_prompt OR old.quality_score IS NOT new.quality_score
+          OR old.reaction_count IS NOT new.reaction_count OR old.prompt_length IS NOT new.prompt_length
+          OR old.tag_count IS NOT new.tag_count OR old.version_key IS NOT new.version_key
+        BEGIN
+            INSERT INTO prompt_changes (prompt_id) VALUES (new.id);
+        END
+    """,
+    "prompt_changes_ad": """
+        CREATE TRIGGER IF NOT EXISTS prompt_changes_ad
+        AFTER DELETE ON prompts
+        BEGIN
+            INSERT INTO prompt_changes (prompt_id, deleted) VALUES (old.id, 1);
+        END
+    """,
+    "prompt_changes_cap": f"""
+        CREATE TRIGGER IF NOT EXISTS prompt_changes_cap
+        AFTER INSERT ON prompt_changes
+        WHEN new.seq % 1000 = 0
+        BEGIN
+            DELETE FROM prompt_changes WHERE seq <= new.seq - {CHANGE_LOG_LIMIT};
+        END
     """
 }
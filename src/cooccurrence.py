@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - タグ共起インデックス
+プロンプトをカンマ区切りのタグに分解し、タグ対ごとの共起件数と品質スコア合計を
+疎行列（CSR 形式の NumPy 配列）として保持する。任意のタグについて、共起件数・PMI・
+リフト・平均品質で上位の関連タグを行スライス 1 つから求めるため、ミリ秒で答えられる。
+
+- 対称行列として両方向 (a, b) / (b, a) を保存し、タグ a の行だけを読めば済むようにする
+- 最後に取り込んだ civitai_prompts.id を記録し、update() は新しい行だけを加算する
+- 結果は DB の隣の .npz（allow_pickle 不要の数値・文字列配列のみ）に保存する。
+  取り込み元の DB パスも記録し、別の DB や作り直された DB の索引は読み込み時に作り直す
+
+既存行の品質スコアが後から更新されても加算済みの値は変わらない。
+正確な値が必要なときは rebuild() で全件から作り直す。
+"""
+
+import os
+import re
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Any, Tuple
+
+from .config import DEFAULT_DB_PATH
+
+try:
+    import numpy as np  # type: ignore[import]
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+INDEX_VERSION = 2
+
+# 1 プロンプトから取り出すタグ数の上限（対の数はこの 2 乗で増えるため）
+MAX_TAGS_PER_PROMPT = 64
+# これより長い「タグ」は文章とみなして除外する
+MAX_TAG_LENGTH = 64
+# 上位タグの算出に使う既定の最小共起件数（少数件の PMI は不安定なため）
+DEFAULT_MIN_COUNT = 3
+RANK_METRICS = ('count', 'pmi', 'lift', 'avg_quality')
+
+_EMBEDDING_RE = re.compile(r'<[^>]*>')
+_WEIGHT_RE = re.compile(r':\s*\d+\.?\d*')
+_BRACKETS_RE = re.compile(r'[()\[\]{}]')
+_SPACES_RE = re.compile(r'\s+')
+
+
+def index_path_for(db_path: str = DEFAULT_DB_PATH) -> str:
+    """DB と同じディレクトリに置く索引ファイルのパス（civitai_dataset.db -> civitai_dataset.cooccurrence.npz）"""
+    return f"{os.path.splitext(db_path)[0]}.cooccurrence.npz"
+
+
+def split_tags(prompt: Optional[str], max_tags: int = MAX_TAGS_PER_PROMPT) -> List[str]:
+    """プロンプトを正規化したタグのリストにする（出現順・重複なし）
+
+    小文字化し、エンベッディング (<lora:...>)・重み (:1.2)・括弧を取り除いてから
+    カンマ（と改行）で分割する。
+    """
+    if not prompt:
+        return []
+    text = _EMBEDDING_RE.sub(',', prompt.lower())
+    text = _BRACKETS_RE.sub(' ', _WEIGHT_RE.sub('', text))
+    tags: Dict[str, None] = {}
+    for part in re.split(r'[,\n]', text):
+        tag = _SPACES_RE.sub(' ', part).strip(' .;:_-')
+        if tag and len(tag) <= MAX_TAG_LENGTH:
+            tags[tag] = None
+            if len(tags) >= max_tags:
+                break
+    return list(tags)
+
+
+def _require_numpy():
+    if not NUMPY_AVAILABLE:
+        raise ImportError("Tag co-occurrence index requires numpy (pip install numpy)")
+
+
+class CooccurrenceIndex:
+    """タグ共起の疎行列と周辺度数
+
+    配列:
+        vocab           : タグ文字列（インデックス = タグ ID）
+        tag_counts      : タグを含むプロンプト数
+        tag_quality     : タグを含むプロンプトの品質スコア合計
+        indptr/indices  : CSR 形式の行ポインタと列（相手タグ ID、行内は昇順）
+        pair_counts     : 共起プロンプト数
+        pair_quality    : 共起プロンプトの品質スコア合計
+    """
+
+    def __init__(self):
+        _require_numpy()
+        self.vocab: List[str] = []
+        self.tag_ids: Dict[str, int] = {}
+        self.tag_counts = np.zeros(0, dtype=np.int64)
+        self.tag_quality = np.zeros(0, dtype=np.float64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.pair_counts = np.zeros(0, dtype=np.int64)
+        self.pair_quality = np.zeros(0, dtype=np.float64)
+        self.n_prompts = 0
+        self.last_prompt_id = 0
+        # 取り込み元 DB の絶対パス（別の DB の索引を読み込まないよう保存時に記録する）
+        self.db_path = ''
+
+    # ------------------------------------------------------------------
+    # 構築・更新
+    # ------------------------------------------------------------------
+    def add_prompts(self, rows: Iterable[Tuple[Optional[str], Optional[float]]]) -> int:
+        """(full_prompt, quality_score) の列を加算し、タグを含んだプロンプト数を返す"""
+        tag_ids = self.tag_ids
+        new_counts: Dict[int, int] = {}
+        new_quality: Dict[int, float] = {}
+        pairs: Dict[int, List[float]] = {}
+        added = 0
+
+        for prompt, quality in rows:
+            tags = split_tags(prompt)
+            if not tags:
+                continue
+            added += 1
+            q = float(quality or 0)
+            ids = []
+            for tag in tags:
+                tid = tag_ids.get(tag)
+                if tid is None:
+                    tid = tag_ids[tag] = len(self.vocab)
+                    self.vocab.append(tag)
+                ids.append(tid)
+                new_counts[tid] = new_counts.get(tid, 0) + 1
+                new_quality[tid] = new_quality.get(tid, 0.0) + q
+            ids.sort()
+            for x, a in enumerate(ids):
+                for b in ids[x + 1:]:
+                    key = (a << 32) | b
+                    acc = pairs.get(key)
+                    if acc is None:
+                        pairs[key] = [1, q]
+                    else:
+                        acc[0] += 1
+                        acc[1] += q
+
+        if added:
+            self._merge(new_counts, new_quality, pairs)
+            self.n_prompts += added
+        return added
+
+    def _merge(self, new_counts: Dict[int, int], new_quality: Dict[int, float], pairs: Dict[int, List[float]]):
+        """今回分の度数と対（上三角のキー）を既存の CSR 配列に合算する"""
+        size = len(self.vocab)
+        grow = size - len(self.tag_counts)
+        if grow:
+            self.tag_counts = np.concatenate([self.tag_counts, np.zeros(grow, dtype=np.int64)])
+            self.tag_quality = np.concatenate([self.tag_quality, np.zeros(grow, dtype=np.float64)])
+        ids = np.fromiter(new_counts.keys(), dtype=np.int64, count=len(new_counts))
+        self.tag_counts[ids] += np.fromiter(new_counts.values(), dtype=np.int64, count=len(new_counts))
+        self.tag_quality[ids] += np.fromiter((new_quality[i] for i in new_counts), dtype=np.float64,
+                                             count=len(new_counts))
+
+        if not pairs:
+            self.indptr = np.concatenate([self.indptr, np.full(grow, self.indptr[-1], dtype=np.int64)])
+            return
+        keys = np.fromiter(pairs.keys(), dtype=np.int64, count=len(pairs))
+        values = np.array(list(pairs.values()), dtype=np.float64)
+        upper_a, upper_b = keys >> 32, keys & 0xFFFFFFFF
+        # 上三角の対を両方向に展開し、既存の (行, 列) と合わせて集約する
+        old_rows = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+        all_keys = np.concatenate([
+            (old_rows << 32) | self.indices.astype(np.int64),
+            (upper_a << 32) | upper_b,
+            (upper_b << 32) | upper_a,
+        ])
+        all_counts = np.concatenate([self.pair_counts, values[:, 0], values[:, 0]])
+        all_quality = np.concatenate([self.pair_quality, values[:, 1], values[:, 1]])
+        merged, inverse = np.unique(all_keys, return_inverse=True)
+        inverse = inverse.ravel()
+        self.pair_counts = np.bincount(inverse, weights=all_counts, minlength=len(merged)).astype(np.int64)
+        self.pair_quality = np.bincount(inverse, weights=all_quality, minlength=len(merged))
+        self.indices = (merged & 0xFFFFFFFF).astype(np.int32)
+        self.indptr = np.searchsorted(merged >> 32, np.arange(size + 1, dtype=np.int64)).astype(np.int64)
+
+    def update(self, db_path: str = DEFAULT_DB_PATH, batch_size: int = 5000) -> int:
+        """last_prompt_id より新しいプロンプトを取り込み、取り込んだ行数を返す"""
+        self.db_path = os.path.abspath(db_path)
+        conn = sqlite3.connect(db_path)
+        try:
+            total = 0
+            while True:
+                rows = conn.execute(
+                    'SELECT id, full_prompt, quality_score FROM civitai_prompts WHERE id > ? ORDER BY id LIMIT ?',
+                    (self.last_prompt_id, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                self.add_prompts((prompt, quality) for _, prompt, quality in rows)
+                self.last_prompt_id = rows[-1][0]
+                total += len(rows)
+        finally:
+            conn.close()
+        if total:
+            print(f"[Cooccurrence] added {total} prompts (tags={len(self.vocab)}, pairs={len(self.indices) // 2})")
+        return total
+
+    @classmethod
+    def rebuild(cls, db_path: str = DEFAULT_DB_PATH) -> 'CooccurrenceIndex':
+        """全プロンプトから作り直す"""
+        index = cls()
+        index.update(db_path)
+        return index
+
+    # ------------------------------------------------------------------
+    # 問い合わせ
+    # ------------------------------------------------------------------
+    def _tag_id(self, tag: str) -> Optional[int]:
+        """問い合わせのタグを split_tags と同じ規則で正規化して ID を返す"""
+        tags = split_tags(tag, max_tags=1)
+        return self.tag_ids.get(tags[0]) if tags else None
+
+    def tag_stats(self, tag: str) -> Optional[Dict[str, Any]]:
+        """タグ単体の出現数と平均品質"""
+        tid = self._tag_id(tag)
+        if tid is None:
+            return None
+        count = int(self.tag_counts[tid])
+        return {'tag': self.vocab[tid], 'count': count,
+                'avg_quality': float(self.tag_quality[tid]) / count if count else None}
+
+    def top_associated(self, tag: str, k: int = 10, by: str = 'lift',
+                       min_count: int = DEFAULT_MIN_COUNT) -> List[Dict[str, Any]]:
+        """tag と共起するタグの上位 k 件を by（count / pmi / lift / avg_quality）の降順で返す"""
+        if by not in RANK_METRICS:
+            raise ValueError(f"Unknown metric: {by} (choose from {RANK_METRICS})")
+        tid = self._tag_id(tag)
+        if tid is None or self.n_prompts == 0:
+            return []
+        start, end = self.indptr[tid], self.indptr[tid + 1]
+        partners = self.indices[start:end]
+        counts = self.pair_counts[start:end]
+        keep = counts >= max(1, int(min_count))
+        partners, counts = partners[keep], counts[keep]
+        if len(partners) == 0:
+            return []
+
+        quality = self.pair_quality[start:end][keep]
+        # lift = P(a,b) / (P(a) P(b)),  PMI = log(lift)
+        lift = counts * float(self.n_prompts) / (float(self.tag_counts[tid]) * self.tag_counts[partners])
+        metrics = {'count': counts.astype(np.float64), 'lift': lift, 'pmi': np.log(lift),
+                   'avg_quality': quality / counts}
+        score = metrics[by]
+        k = min(int(k), len(score))
+        top = np.argpartition(-score, k - 1)[:k] if k < len(score) else np.arange(len(score))
+        # 同点は共起件数、次にタグ ID の順
+        top = top[np.lexsort((partners[top], -counts[top], -score[top]))]
+        return [{
+            'tag': self.vocab[partners[i]],
+            'count': int(counts[i]),
+            'pmi': float(metrics['pmi'][i]),
+            'lift': float(lift[i]),
+            'avg_quality': float(metrics['avg_quality'][i]),
+        } for i in top]
+
+    # ------------------------------------------------------------------
+    # 保存・読み込み
+    # ------------------------------------------------------------------
+    def save(self, path: str):
+        """.npz に保存する（一時ファイルに書いてから置き換える）"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{path}.part"
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(
+                f,
+                version=np.array(INDEX_VERSION),
+                meta=np.array([self.n_prompts, self.last_prompt_id], dtype=np.int64),
+                db_path=np.array(self.db_path, dtype=str),
+                vocab=np.array(self.vocab, dtype=str),
+                tag_counts=self.tag_counts, tag_quality=self.tag_quality,
+                indptr=self.indptr, indices=self.indices,
+                pair_counts=self.pair_counts, pair_quality=self.pair_quality,
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'CooccurrenceIndex':
+        """save() で保存したインデックスを読み込む"""
+        index = cls()
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != INDEX_VERSION:
+                raise ValueError(f"Unsupported co-occurrence index version: {int(data['version'])}")
+            index.n_prompts, index.last_prompt_id = (int(v) for v in data['meta'])
+            index.db_path = str(data['db_path'])
+            index.vocab = data['vocab'].tolist()
+            index.tag_counts = data['tag_counts']
+            index.tag_quality = data['tag_quality']
+            index.indptr = data['indptr']
+            index.indices = data['indices']
+            index.pair_counts = data['pair_counts']
+            index.pair_quality = data['pair_quality']
+        index.tag_ids = {tag: i for i, tag in enumerate(index.vocab)}
+        return index
+
+
+def _max_prompt_id(db_path: str) -> int:
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('SELECT COALESCE(MAX(id), 0) FROM civitai_prompts').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def load_or_build(db_path: str = DEFAULT_DB_PATH, path: Optional[str] = None,
+                  save: bool = True) -> CooccurrenceIndex:
+    """保存済みのインデックスを読み込み、DB に増えた分だけ取り込んで返す（なければ全件から作る）
+
+    索引が別の DB から作られたもの、または DB の最大 id が記録済みの id より小さい
+    （DB が作り直された）場合は読み込まずに全件から作り直す。
+    """
+    path = path or index_path_for(db_path)
+    index = None
+    if os.path.exists(path):
+        try:
+            index = CooccurrenceIndex.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[Cooccurrence] Failed to load {path}, rebuilding: {e}")
+    if index is not None:
+        if index.db_path != os.path.abspath(db_path):
+            print(f"[Cooccurrence] {path} was built from {index.db_path}, rebuilding")
+            index = None
+        elif _max_prompt_id(db_path) < index.last_prompt_id:
+            print(f"[Cooccurrence] {db_path} has fewer prompts than {path}, rebuilding")
+            index = None
+    rebuilt = index is None
+    if index is None:
+        index = CooccurrenceIndex()
+    added = index.update(db_path)
+    if save and (added or rebuilt):
+        index.save(path)
+    return index
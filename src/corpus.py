@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - 分析用の列指向プロンプトコーパス（読み取り専用・mmap）
+分析のたびに SQLite から 1 行ずつ Python の文字列を作る代わりに、プロンプト本文と数値列を
+ファイルに書き出しておき、mmap した領域をそのまま NumPy 配列として読む（コピーしない）。
+
+ディレクトリの構成（civitai_dataset.db -> civitai_dataset.corpus/）:
+- text.bin        : full_prompt の UTF-8 を NUL (0x00) 区切りで連結したもの（NULL は空文字列）
+- starts.i64      : 各行の text.bin 内の開始位置
+- <列>.i64        : id / quality_score / reaction_count / prompt_length / tag_count / model_version_id
+                    （little endian の int64。NULL や整数でない値は NULL_INT）
+- manifest.json   : 行数・text.bin のバイト数・取り込んだ最大 id・読み終えた変更ログの位置
+
+refresh_corpus は id が増えた分を末尾に追記し、変更ログ（config.CORPUS_CHANGE_SCHEMA の
+prompt_changes。コーパスの列が実際に変わった行だけが記録される）に載った既存行をその場で
+書き換える。本文のバイト数が変わった行・削除された行があるとき、変更が多すぎるとき、
+ログが読み終える前に消されていたときだけ全体を作り直す。ファイルは manifest の大きさまでしか
+読まないため、追記中に開いた読み手も整合した内容を見る（書き換えた行の値は開いている読み手にも見える）。
+
+キーワードの件数は text.bin を正規表現で走査し、一致位置を starts の二分探索で行番号に変換する。
+区切りの NUL を跨いで一致することはない。NumPy がなければ ImportError になる（任意依存）。
+"""
+
+import os
+import re
+import json
+import mmap
+import shutil
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .config import DEFAULT_DB_PATH
+from .column_types import to_int_id
+
+try:
+    import numpy as np  # type: ignore[import]
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+CORPUS_VERSION = 2
+
+# 数値列（civitai_prompts の列名）
+COLUMNS = ('id', 'quality_score', 'reaction_count', 'prompt_length', 'tag_count', 'model_version_id')
+# NULL・整数でない値の番兵
+NULL_INT = -(1 << 63)
+
+TEXT_FILE = 'text.bin'
+STARTS_FILE = 'starts.i64'
+MANIFEST_FILE = 'manifest.json'
+_SEPARATOR = b'\x00'
+
+# 変更された行がこの割合（と _ID_CHUNK 行）を超えたら、書き換えずに作り直す
+REWRITE_LIMIT = 0.25
+# IN (...) に渡す id の数（SQLite の変数の上限より小さく）
+_ID_CHUNK = 500
+
+# 小文字化すると ASCII を含む文字（İ -> i̇、ケルビン記号 K -> k）の UTF-8。
+# bytes の IGNORECASE 照合では拾えないため、これを含む行だけは str.lower() で判定し直す
+_FOLDING_CHARS = re.compile(b'\xc4\xb0|\xe2\x84\xaa')
+
+
+def corpus_path_for(db_path: str = DEFAULT_DB_PATH) -> str:
+    """DB と同じディレクトリに置くコーパスのパス（civitai_dataset.db -> civitai_dataset.corpus/）"""
+    return f"{os.path.splitext(db_path)[0]}.corpus"
+
+
+def _require_numpy():
+    if not NUMPY_AVAILABLE:
+        raise ImportError("The prompt corpus requires numpy (pip install numpy)")
+
+
+def _column_file(column: str) -> str:
+    return f'{column}.i64'
+
+
+def _read_manifest(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('version') == CORPUS_VERSION else None
+
+
+def _write_manifest(path: str, manifest: Dict[str, Any]):
+    tmp = os.path.join(path, MANIFEST_FILE + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(path, MANIFEST_FILE))
+
+
+def _int_value(value: Any) -> int:
+    value = to_int_id(value)
+    return value if isinstance(value, int) and not isinstance(value, bool) else NULL_INT
+
+
+def _append_rows(conn: sqlite3.Connection, path: str, manifest: Dict[str, Any], batch_size: int) -> int:
+    """manifest の max_id より後の行をファイル末尾に追記して manifest を進める（manifest はまだ保存しない）"""
+    files = {name: open(os.path.join(path, name), 'r+b') for name in
+             [TEXT_FILE, STARTS_FILE] + [_column_file(c) for c in COLUMNS]}
+    try:
+        # 前回の書き込みが manifest の更新前に止まっていた場合の余りを捨てる
+        files[TEXT_FILE].truncate(manifest['text_bytes'])
+        files[TEXT_FILE].seek(manifest['text_bytes'])
+        for name, handle in files.items():
+            if name != TEXT_FILE:
+                handle.truncate(manifest['rows'] * 8)
+                handle.seek(manifest['rows'] * 8)
+
+        cursor = conn.execute(f"SELECT full_prompt, {', '.join(COLUMNS)} FROM civitai_prompts "
+                              "WHERE id > ? ORDER BY id", (manifest['max_id'],))
+        appended = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            texts = [(r[0] or '').encode('utf-8', 'replace') for r in rows]
+            starts = np.empty(len(rows), dtype='<i8')
+            position = manifest['text_bytes']
+            for i, text in enumerate(texts):
+                starts[i] = position
+                position += len(text) + 1
+            files[TEXT_FILE].write(_SEPARATOR.join(texts) + _SEPARATOR)
+            files[STARTS_FILE].write(starts.tobytes())
+            for j, column in enumerate(COLUMNS, start=1):
+                files[_column_file(column)].write(
+                    np.fromiter((_int_value(r[j]) for r in rows), dtype='<i8', count=len(rows)).tobytes())
+            manifest['text_bytes'] = position
+            manifest['rows'] += len(rows)
+            manifest['max_id'] = rows[-1][1]
+            appended += len(rows)
+        return appended
+    finally:
+        for handle in files.values():
+            handle.close()
+
+
+def _rewrite_rows(conn: sqlite3.Connection, path: str, manifest: Dict[str, Any], ids: List[int]) -> Optional[int]:
+    """取り込み済みの行のうち ids の行を DB の現在の値で書き換える
+
+    本文のバイト数が変わった行があれば何も書かずに None を返す（作り直しが必要）。
+    """
+    if not ids:
+        return 0
+    rows = manifest['rows']
+    corpus_ids = np.fromfile(os.path.join(path, _column_file('id')), dtype='<i8', count=rows)
+    starts = np.fromfile(os.path.join(path, STARTS_FILE), dtype='<i8', count=rows)
+    ends = np.append(starts[1:], manifest['text_bytes'])
+
+    # 先にすべての行を読んで長さを確かめてから書く（途中で作り直しになってもファイルは元のまま）
+    changes = []
+    for i in range(0, len(ids), _ID_CHUNK):
+        chunk = ids[i:i + _ID_CHUNK]
+        cursor = conn.execute(f"SELECT full_prompt, {', '.join(COLUMNS)} FROM civitai_prompts "
+                              f"WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+        for r in cursor:
+            row = int(np.searchsorted(corpus_ids, r[1]))
+            if row >= rows or corpus_ids[row] != r[1]:
+                continue
+            text = (r[0] or '').encode('utf-8', 'replace')
+            if len(text) != ends[row] - starts[row] - 1:
+                return None
+            changes.append((row, text, [_int_value(v) for v in r[1:]]))
+
+    files = {name: open(os.path.join(path, name), 'r+b') for name in
+             [TEXT_FILE] + [_column_file(c) for c in COLUMNS]}
+    try:
+        for row, text, values in changes:
+            files[TEXT_FILE].seek(int(starts[row]))
+            files[TEXT_FILE].write(text)
+            for column, value in zip(COLUMNS, values):
+                files[_column_file(column)].seek(row * 8)
+                files[_column_file(column)].write(value.to_bytes(8, 'little', signed=True))
+    finally:
+        for handle in files.values():
+            handle.close()
+    return len(changes)
+
+
+def _read_change_log(conn: sqlite3.Connection) -> Optional[Tuple[int, int]]:
+    """変更ログの (最後に振られた seq, 残っている最古の seq) を返す（ログがない DB は None）"""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'prompt_changes'").fetchone():
+        return None
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'prompt_changes'").fetchone()
+    last = row[0] if row else 0
+    oldest = conn.execute('SELECT MIN(seq) FROM prompt_changes').fetchone()[0]
+    return last, oldest if oldest is not None else last + 1
+
+
+def _changed_ids(conn: sqlite3.Connection, manifest: Dict[str, Any]) -> Optional[List[int]]:
+    """前回の refresh 以降に変わった取り込み済みの行の id（削除された行があれば None）
+
+    max_id より後の行は追記で現在の値が入るため対象にしない。
+    """
+    changed = []
+    for prompt_id, deleted in conn.execute(
+            'SELECT prompt_id, MAX(deleted) FROM prompt_changes WHERE seq > ? AND prompt_id <= ? '
+            'GROUP BY prompt_id ORDER BY prompt_id', (manifest['change_seq'], manifest['max_id'])):
+        if deleted:
+            return None
+        changed.append(prompt_id)
+    return changed
+
+
+def _prune_change_log(db_path: str, seq: int):
+    """読み終えた変更ログを消す（書き込み中で消せなければ次回に回す）
+
+    既定以外の場所に置いた別のコーパスがまだ読んでいない分も消えるが、そのコーパスは
+    次の refresh でログの欠けを検出して作り直す。
+    """
+    conn = sqlite3.connect(db_path, timeout=1.0)
+    try:
+        conn.execute('DELETE FROM prompt_changes WHERE seq <= ?', (seq,))
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"[Corpus] Could not prune the change log: {e}")
+    finally:
+        conn.close()
+
+
+def _create_empty(path: str, change_seq: int) -> Dict[str, Any]:
+    os.makedirs(path, exist_ok=True)
+    for name in [TEXT_FILE, STARTS_FILE] + [_column_file(c) for c in COLUMNS]:
+        open(os.path.join(path, name), 'wb').close()
+    return {'version': CORPUS_VERSION, 'rows': 0, 'text_bytes': 0, 'max_id': 0, 'change_seq': change_seq}
+
+
+def refresh_corpus(db_path: str = DEFAULT_DB_PATH, path: Optional[str] = None,
+                   batch_size: int = 5000) -> Dict[str, Any]:
+    """DB の新しい行をコーパスへ追記し、変わった既存行を書き換える（できなければ作り直す）
+
+    返り値: {'rows': 全行数, 'appended': 追記した行数, 'updated': 書き換えた行数, 'rebuilt': 作り直したか}
+    """
+    _require_numpy()
+    path = path or corpus_path_for(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        # 変更ログの読み取りと行の走査を同じ読み取りトランザクションで行う（途中の書き込みは次回に回る）
+        conn.execute('BEGIN')
+        log = _read_change_log(conn)
+        change_seq = log[0] if log else 0
+        max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM prompts').fetchone()[0]
+
+        manifest = _read_manifest(path)
+        # 変更ログがない DB では既存行の変化を追えないため毎回作り直す
+        rebuild = (log is None or manifest is None or manifest['max_id'] > max_id
+                   or log[1] > manifest['change_seq'] + 1)
+        if not rebuild:
+            changed = _changed_ids(conn, manifest)
+            updated = None
+            if changed is not None and len(changed) <= max(manifest['rows'] * REWRITE_LIMIT, _ID_CHUNK):
+                updated = _rewrite_rows(conn, path, manifest, changed)
+            rebuild = updated is None
+        if not rebuild:
+            appended = _append_rows(conn, path, manifest, batch_size)
+            consumed = manifest['change_seq'] != change_seq
+            if appended or consumed:
+                manifest['change_seq'] = change_seq
+                _write_manifest(path, manifest)
+            conn.rollback()
+            if consumed:
+                _prune_change_log(db_path, change_seq)
+            return {'rows': manifest['rows'], 'appended': appended, 'updated': updated, 'rebuilt': False}
+
+        # 別のディレクトリに作ってから入れ替える（開いている読み手は古いファイルを読み続ける）
+        building = path + '.new'
+        shutil.rmtree(building, ignore_errors=True)
+        manifest = _create_empty(building, change_seq)
+        appended = _append_rows(conn, building, manifest, batch_size)
+        _write_manifest(building, manifest)
+        if os.path.exists(path):
+            retired = path + '.old'
+            shutil.rmtree(retired, ignore_errors=True)
+            os.replace(path, retired)
+            shutil.rmtree(retired, ignore_errors=True)
+        os.replace(building, path)
+        print(f"[Corpus] Rebuilt {path}: {manifest['rows']} rows, {manifest['text_bytes']} bytes of text")
+        conn.rollback()
+        if log:
+            _prune_change_log(db_path, change_seq)
+        return {'rows': manifest['rows'], 'appended': appended, 'updated': 0, 'rebuilt': True}
+    finally:
+        conn.close()
+
+
+class PromptCorpus:
+    """コーパスを mmap で開いた読み取り専用のビュー
+
+    配列（ids・column()・starts）は mmap 上の NumPy 配列そのもので、書き込みはできない。
+    開いた時点の manifest の行数までを読むため、後から追記・作り直しされても影響を受けない。
+    新しい行を見るには開き直す（open_corpus は refresh してから開く）。
+    """
+
+    def __init__(self, path: str):
+        _require_numpy()
+        manifest = _read_manifest(path)
+        if manifest is None:
+            raise FileNotFoundError(f"No prompt corpus at {path} (run scripts/build_corpus.py)")
+        self.path = path
+        self.rows = manifest['rows']
+        self.max_id = manifest['max_id']
+        self._maps: List[mmap.mmap] = []
+        self._text = self._map(TEXT_FILE, manifest['text_bytes'])
+        self._bytes = np.frombuffer(self._text, dtype=np.uint8)
+        self._folding = None
+        self.starts = self._array(STARTS_FILE)
+        self._columns = {c: self._array(_column_file(c)) for c in COLUMNS}
+        self.ids = self._columns['id']
+
+    def _map(self, name: str, length: int):
+        if length == 0:
+            return b''
+        with open(os.path.join(self.path, name), 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return mapped
+
+    def _array(self, name: str):
+        return np.frombuffer(self._map(name, self.rows * 8), dtype='<i8', count=self.rows)
+
+    def close(self):
+        # 配列が mmap を参照しているため、先に配列を手放してから閉じる
+        self.starts = self.ids = self._bytes = self._folding = None
+        self._columns = {}
+        self._text = b''
+        for mapped in self._maps:
+            try:
+                mapped.close()
+            except BufferError:
+                # 呼び出し側がまだ配列を持っている（参照が消えたときに閉じられる）
+                pass
+        self._maps = []
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __enter__(self) -> 'PromptCorpus':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # 列
+    # ------------------------------------------------------------------
+    def column(self, name: str):
+        """数値列（NULL は NULL_INT）を返す"""
+        if name not in self._columns:
+            raise ValueError(f"Unknown corpus column: {name}")
+        return self._columns[name]
+
+    def valid(self, name: str):
+        """NULL でない行のマスク"""
+        return self.column(name) != NULL_INT
+
+    def text_bytes(self):
+        """各行の本文の UTF-8 バイト数"""
+        ends = np.empty(self.rows, dtype=np.int64)
+        ends[:-1] = self.starts[1:]
+        if self.rows:
+            ends[-1] = len(self._text)
+        return ends - self.starts - 1
+
+    def text(self, row: int) -> str:
+        """row 番目（0 始まり）の本文"""
+        start = int(self.starts[row])
+        end = int(self.starts[row + 1]) - 1 if row + 1 < self.rows else len(self._text) - 1
+        return self._text[start:end].decode('utf-8')
+
+    def row_of(self, prompt_id: int) -> Optional[int]:
+        """prompts.id の行番号（id は昇順に並んでいる）"""
+        row = int(np.searchsorted(self.ids, prompt_id))
+        return row if row < self.rows and self.ids[row] == prompt_id else None
+
+    # ------------------------------------------------------------------
+    # 集計
+    # ------------------------------------------------------------------
+    def histogram(self, name: str, bins: int = 20) -> List[Dict[str, Any]]:
+        """等幅ビンのヒストグラム（aggregations.histogram と同じ形式。NULL は除く）"""
+        values = self.column(name)
+        values = values[values != NULL_INT]
+        if not len(values):
+            return []
+        bins = max(1, int(bins))
+        lo, hi = int(values.min()), int(values.max())
+        width = (hi - lo) / bins if hi > lo else 1.0
+        count = bins if hi > lo else 1
+        index = np.minimum(((values - lo) / width).astype(np.int64), count - 1)
+        counts = np.bincount(index, minlength=count)
+        return [{'bin_start': lo + i * width, 'bin_end': lo + (i + 1) * width, 'count': int(counts[i])}
+                for i in range(count)]
+
+    def value_counts(self, name: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """数値列の値ごとの件数を多い順に返す（NULL は除く）"""
+        values = self.column(name)
+        unique, counts = np.unique(values[values != NULL_INT], return_counts=True)
+        order = np.argsort(-counts, kind='stable')[:limit]
+        return [{'value': int(unique[i]), 'count': int(counts[i])} for i in order]
+
+    def _rows_at(self, positions):
+        return np.unique(np.searchsorted(self.starts, positions, side='right') - 1)
+
+    def rows_matching(self, pattern: 're.Pattern[bytes]'):
+        """正規表現（bytes）に一致する箇所を含む行番号（昇順・重複なし）を返す"""
+        if not self.rows:
+            return np.empty(0, dtype=np.int64)
+        return self._rows_at(np.fromiter((m.start() for m in pattern.finditer(self._text)), dtype=np.int64))
+
+    def rows_containing(self, keyword: str, case_sensitive: bool = False):
+        """keyword を部分文字列として含む行番号（昇順・重複なし）を返す
+
+        case_sensitive=False は小文字化した本文での `keyword.lower() in text` 判定と同じ。
+        """
+        if not keyword or not self.rows:
+            return np.empty(0, dtype=np.int64)
+        needle = keyword.encode('utf-8')
+        if len(needle) == 1 and (case_sensitive or not needle.isalpha()):
+            # 1 バイトの記号は正規表現を使わずにバイト列の比較で探す
+            rows = self._rows_at(np.flatnonzero(self._bytes == needle[0]))
+        else:
+            rows = self.rows_matching(re.compile(re.escape(needle), 0 if case_sensitive else re.IGNORECASE))
+        if not case_sensitive:
+            if self._folding is None:
+                self._folding = self.rows_matching(_FOLDING_CHARS)
+            folded = [row for row in self._folding if keyword.lower() in self.text(row).lower()]
+            if folded:
+                rows = np.union1d(rows, np.array(folded, dtype=np.int64))
+        return rows
+
+    def count_keywords(self, keywords: Iterable[str], case_sensitive: bool = False,
+                       mask=None) -> Dict[str, int]:
+        """キーワードごとに、含む行の数を返す（mask を渡すとその行だけを数える）"""
+        counts = {}
+        for keyword in dict.fromkeys(keywords):
+            rows = self.rows_containing(keyword, case_sensitive)
+            counts[keyword] = int(mask[rows].sum()) if mask is not None else len(rows)
+        return counts
+
+    def keyword_stats(self, keywords: Iterable[str], column: str = 'quality_score',
+                      case_sensitive: bool = False) -> Dict[str, Dict[str, Any]]:
+        """キーワードを含む行の件数と、列の平均・最大・最小（NULL は除く）"""
+        values = self.column(column)
+        stats = {}
+        for keyword in dict.fromkeys(keywords):
+            selected = values[self.rows_containing(keyword, case_sensitive)]
+            selected = selected[selected != NULL_INT]
+            if len(selected):
+                stats[keyword] = {'count': int(len(selected)), 'avg': float(selected.mean()),
+                                  'max': int(selected.max()), 'min': int(selected.min())}
+        return stats
+
+
+def open_corpus(db_path: str = DEFAULT_DB_PATH, path: Optional[str] = None, refresh: bool = True) -> PromptCorpus:
+    """コーパスを（refresh=True なら DB の新しい行を追記してから）開く"""
+    path = path or corpus_path_for(db_path)
+    if refresh:
+        refresh_corpus(db_path, path)
+    return PromptCorpus(path)
@@ -7,10 +7,96 @@ SQLiteデータベースの作成、保存、取得を担当
 import sqlite3
 import json
 import os
-from datetime import datetime
-from typing import Dict, List, Optional, Any
+import re
+import threading
+from collections import namedtuple
+from typing import Dict, List, Optional, Any, Tuple, Iterator, Sequence
 
-from .config import DEFAULT_DB_PATH, DB_SCHEMA
+from .config import DEFAULT_DB_PATH, DB_SCHEMA, DB_INDEXES, FTS_SCHEMA, GENERATION_SCHEMA, CORPUS_CHANGE_SCHEMA
+from . import rollups, aggregations, dedup, similarity, dimensions
+from .prompt_syntax import syntax_features, ensure_syntax_columns, backfill_syntax_columns
+from .resources import ResourceCatalog, ensure_catalog_schema, sync_links, CATALOG_TABLE, LINKS_TABLE
+from .column_types import (INTEGER_ID_COLUMNS, to_int_id, to_epoch, now_epoch, text_ids, to_text_id,
+                           retype_table, declared_type, replace_definition)
+
+# 類似検索の索引は取り込みのたびに更新し、この件数が貯まるごとにファイルへ保存する
+SIMILARITY_SAVE_EVERY = 1000
+
+# FTS5 の演算子（大文字のみ演算子として扱われる）
+_FTS_OPERATORS = {'AND', 'OR', 'NOT'}
+_FTS_TOKEN_RE = re.compile(r'"[^"]*"\*?|\(|\)|[^\s()"]+')
+
+
+def build_fts_query(text: str) -> str:
+    """ユーザー入力を FTS5 の MATCH 式に変換する
+
+    - "a b"   : フレーズ検索（そのまま渡す）
+    - mast*   : 前方一致
+    - AND / OR / NOT と括弧 : ブール演算
+    それ以外の語は記号を含んでも構文エラーにならないよう引用符で囲む。
+    """
+    parts = []
+    for tok in _FTS_TOKEN_RE.findall(text or ''):
+        if tok in ('(', ')') or tok in _FTS_OPERATORS:
+            # FTS5 の NOT は二項演算子のため "a AND NOT b" は "a NOT b" に読み替える
+            if tok == 'NOT' and parts and parts[-1] == 'AND':
+                parts.pop()
+            parts.append(tok)
+        elif tok.startswith('"'):
+            if tok.strip('"*'):
+                parts.append(tok)
+        else:
+            prefix = tok.endswith('*')
+            core = tok.rstrip('*')
+            if not core:
+                continue
+            parts.append('"' + core.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(parts)
+
+
+_RECORD_TYPES: Dict[Tuple[str, ...], type] = {}
+
+
+def prompt_record_type(columns: Sequence[str]) -> type:
+    """列構成ごとの軽量レコード型（namedtuple: __slots__ = () でインスタンス辞書を持たない）"""
+    key = tuple(columns)
+    if key not in _RECORD_TYPES:
+        _RECORD_TYPES[key] = namedtuple('PromptRecord', key)
+    return _RECORD_TYPES[key]
+
+
+DataVersion = namedtuple('DataVersion', ['max_id', 'prompts', 'categories'])
+
+
+def read_data_version(db_path: str = DEFAULT_DB_PATH) -> DataVersion:
+    """DB の変更トークンを返す（索引の末尾と 2 行を読むだけなので毎回呼んでも軽い）
+
+    max_id     : civitai_prompts の最大 id（追記のみならこれだけが増える）
+    prompts    : 既存プロンプトの更新・削除回数
+    categories : prompt_categories の変更回数
+    DatabaseManager のセットアップを伴わないため、UI の再描画ごとに呼んでよい。
+    """
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            row = conn.execute("""
+                SELECT (SELECT MAX(id) FROM prompts),
+                       (SELECT generation FROM data_generations WHERE name = 'prompts'),
+                       (SELECT generation FROM data_generations WHERE name = 'categories')
+            """).fetchone()
+        finally:
+            conn.close()
+        return DataVersion(row[0] or 0, row[1] or 0, row[2] or 0)
+    except Exception:
+        # 世代テーブルがない古い DB でもキャッシュが永久に固定されないようにする
+        mtime = os.path.getmtime(db_path) if os.path.exists(db_path) else 0
+        return DataVersion(0, mtime, mtime)
+
+
+def _quote_fts_terms(text: str) -> str:
+    """build_fts_query が構文エラーになった場合のフォールバック（全語を AND で検索）"""
+    terms = [t for t in re.split(r'\s+', (text or '').replace('"', ' ')) if t.strip('*')]
+    return ' '.join('"' + t.rstrip('*') + '"' + ('*' if t.endswith('*') else '') for t in terms)
 
 
 class DatabaseManager:
@@ -18,6 +104,13 @@ class DatabaseManager:
 
     def __init__(self, db_path: str = DEFAULT_DB_PATH):
         self.db_path = db_path
+        # 類似検索の索引（初回の問い合わせで読み込み、以後はプロセス内で使い回す）
+        self._similarity_index = None
+        self._similarity_unsaved = 0
+        self._similarity_lock = threading.Lock()
+        # モデル・バージョン・リソースの値 -> 次元キー（取り込み時の問い合わせを省く）
+        self._dimensions = dimensions.DimensionCache()
+        self._resources = ResourceCatalog()
         self._ensure_directory()
         self.setup_database()
 
@@ -32,13 +125,27 @@ class DatabaseManager:
         """内部用: 生の sqlite3.Connection を返す"""
         return sqlite3.connect(self.db_path)
 
+    def ping(self) -> bool:
+        """DB ファイルが存在し、スキーマ作成済みで問い合わせに応答するか（共有インスタンスのヘルスチェック用）"""
+        if not os.path.exists(self.db_path):
+            return False
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            try:
+                conn.execute('SELECT 1 FROM civitai_prompts LIMIT 1').fetchall()
+            finally:
+                conn.close()
+            return True
+        except sqlite3.Error:
+            return False
+
     def get_prompt_count(self) -> int:
         """保存されているプロンプトの総数を返す (Streamlit UI 互換)"""
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM civitai_prompts')
-            count = cursor.fetchone()[0]
+            cursor.execute("SELECT TOTAL(prompt_count) FROM prompt_rollups WHERE dimension = 'model'")
+            count = int(cursor.fetchone()[0])
             conn.close()
             return count
         except Exception:
@@ -54,19 +161,15 @@ class DatabaseManager:
             for table_name, schema in DB_SCHEMA.items():
                 cursor.execute(schema)
 
-            # Migration: ensure model_version_id column exists (backwards compatible)
-            try:
-                cursor.execute("PRAGMA table_info(civitai_prompts)")
-                cols = [r[1] for r in cursor.fetchall()]
-                if 'model_version_id' not in cols:
-                    cursor.execute('ALTER TABLE civitai_prompts ADD COLUMN model_version_id TEXT')
-                    print('[DB] Migrated: added column model_version_id')
-                # Ensure prompt_resources table exists (DB_SCHEMA should include it)
-                if 'prompt_resources' not in cols:
-                    # This check is simply to avoid failing on older DBs; actual creation handled by DB_SCHEMA
-                    pass
-            except Exception as e:
-                print(f'[DB] Migration warning: {e}')
+            # 次元テーブル（models / model_versions / resources）と実体テーブル、互換ビュー。
+            # 旧形式（civitai_prompts が実テーブル）の DB はここで id を保ったまま書き換える
+            migrated = dimensions.ensure_dimension_schema(cursor)
+            for name, count in migrated.items():
+                print(f'[DB] Migrated: moved {count} rows of {name} onto dimension keys')
+            # 使用リソースのカタログとリンク表（旧形式の行ごとの JSON はカタログへまとめる）
+            migrated = ensure_catalog_schema(cursor)
+            for name, count in migrated.items():
+                print(f'[DB] Migrated: moved {count} rows of {name} into the resource catalog')
 
             # Ensure collection_state table exists
             try:
@@ -74,10 +177,82 @@ class DatabaseManager:
                 if not cursor.fetchone():
                     cursor.execute(DB_SCHEMA['collection_state'])
                     print('[DB] Migrated: created collection_state table')
+                elif declared_type(cursor, 'collection_state', 'version_id') == 'TEXT':
+                    # ID を TEXT で宣言していた版（既定値 ''）から INTEGER 列へ作り直す。
+                    # バージョンのない行の '' は NULL にする
+                    cursor.execute('PRAGMA table_info(collection_state)')
+                    columns = [r[1] for r in cursor.fetchall()]
+                    retype_table(cursor, 'collection_state',
+                                 DB_SCHEMA['collection_state'].replace('collection_state', '{table}', 1), columns,
+                                 {'version_id': "NULLIF({x}, '')"})
+                    print('[DB] Migrated: collection_state ids are now INTEGER')
             except Exception as e:
                 print(f'[DB] Migration warning for collection_state: {e}')
 
+            # 記法の特徴量列（集計を SQL で行うため保存時に計算する）
+            syntax_added = False
+            try:
+                syntax_added = ensure_syntax_columns(cursor)
+                if syntax_added:
+                    print('[DB] Migrated: added prompt syntax columns')
+            except Exception as e:
+                print(f'[DB] Migration warning for syntax columns: {e}')
+
+            for stmt in DB_INDEXES:
+                cursor.execute(stmt)
+
+            # 近似重複検出の MinHash 署名と LSH バンド
+            try:
+                dedup.ensure_dedup_tables(cursor)
+            except Exception as e:
+                print(f'[DB] Dedup index setup warning: {e}')
+
+            # Full-text index: 初回作成時のみ既存行から索引を構築する
+            try:
+                cursor.execute("SELECT name FROM sqlite_master WHERE name='civitai_prompts_fts'")
+                fts_exists = cursor.fetchone() is not None
+                for stmt in FTS_SCHEMA.values():
+                    cursor.execute(stmt)
+                if not fts_exists:
+                    cursor.execute("INSERT INTO civitai_prompts_fts (civitai_prompts_fts) VALUES ('rebuild')")
+                    print('[DB] Migrated: built full-text index civitai_prompts_fts')
+            except Exception as e:
+                print(f'[DB] Full-text index unavailable (FTS5): {e}')
+
+            # データ世代カウンタ（UI キャッシュの無効化判定用）
+            try:
+                for name, stmt in GENERATION_SCHEMA.items():
+                    if stmt.lstrip().startswith('CREATE TRIGGER'):
+                        # 条件を変えた版のトリガーが残っていれば作り直す
+                        replace_definition(cursor, name, stmt)
+                    else:
+                        cursor.execute(stmt)
+            except Exception as e:
+                print(f'[DB] Data generation setup warning: {e}')
+
+            # プロンプトコーパスの変更ログ（変わった行だけを書き換えるため）
+            try:
+                for stmt in CORPUS_CHANGE_SCHEMA.values():
+                    cursor.execute(stmt)
+            except Exception as e:
+                print(f'[DB] Corpus change log setup warning: {e}')
+
+            # Rollups: ダッシュボード用の集計テーブル（初回作成時は既存行から構築）
+            try:
+                if rollups.ensure_rollups(cursor):
+                    print('[DB] Migrated: built rollup tables prompt_rollups/category_rollups')
+            except Exception as e:
+                print(f'[DB] Rollup setup warning: {e}')
+
             conn.commit()
+
+            # 列を設定しない経路（マージ・旧スクリプト）で入った行の特徴量を補完
+            try:
+                filled = backfill_syntax_columns(conn)
+                if filled and syntax_added:
+                    print(f'[DB] Migrated: computed syntax columns for {filled} prompts')
+            except Exception as e:
+                print(f'[DB] Syntax backfill warning: {e}')
             print(f"[DB] Database initialized: {self.db_path}")
 
         except Exception as e:
@@ -97,20 +272,25 @@ class DatabaseManager:
         cursor = conn.cursor()
 
         try:
+            # 呼び出し側は文字列の ID・ISO 形式の日時を渡してよい（保存形式へはここで揃える）
+            civitai_id = to_int_id(prompt_data["civitai_id"])
+            collected_at = to_epoch(prompt_data.get("collected_at", now_epoch()))
             # Check existence first to determine insert vs update
-            cursor.execute('SELECT id FROM civitai_prompts WHERE civitai_id = ?', (prompt_data["civitai_id"],))
+            cursor.execute('SELECT id FROM prompts WHERE civitai_id = ?', (civitai_id,))
             existing = cursor.fetchone()
+            keys = self._dimensions.session(cursor)
 
             if existing is None:
                 # Insert new
                 cursor.execute('''
-                INSERT INTO civitai_prompts
+                INSERT INTO prompts
                 (civitai_id, full_prompt, negative_prompt, quality_score,
                  reaction_count, comment_count, download_count, prompt_length, tag_count,
-                 model_name, model_id, model_version_id, collected_at, raw_metadata)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                 model_key, version_key, collected_at, raw_metadata,
+                 has_comma, has_weights, has_embedding, paren_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (
-                    prompt_data["civitai_id"],
+                    civitai_id,
                     prompt_data["full_prompt"],
                     prompt_data["negative_prompt"],
                     prompt_data.get("quality_score"),
@@ -119,18 +299,17 @@ class DatabaseManager:
                     prompt_data.get("download_count", 0),
                     prompt_data.get("prompt_length", 0),
                     prompt_data.get("tag_count", 0),
-                    prompt_data.get("model_name"),
-                    prompt_data.get("model_id"),
-                    prompt_data.get("model_version_id"),
-                    prompt_data.get("collected_at", datetime.now().isoformat()),
-                    prompt_data.get("raw_metadata")
+                    keys.model_key(prompt_data.get("model_id"), prompt_data.get("model_name")),
+                    keys.version_key(prompt_data.get("model_version_id")),
+                    collected_at,
+                    prompt_data.get("raw_metadata"),
+                    *syntax_features(prompt_data["full_prompt"]).values()
                 ))
+                prompt_id = cursor.lastrowid
                 conn.commit()
-
-                # prompt_idを取得
-                cursor.execute('SELECT id FROM civitai_prompts WHERE civitai_id = ?', (prompt_data["civitai_id"],))
-                row = cursor.fetchone()
-                prompt_id = row[0] if row else None
+                keys.publish()
+                if prompt_id is not None:
+                    self._index_duplicates(conn, [(prompt_id, prompt_data["full_prompt"])])
                 # Save resources if present
                 try:
                     if prompt_id and prompt_data.get('resources'):
@@ -143,7 +322,7 @@ class DatabaseManager:
                 # Update existing row
                 # Merge incoming model_version_id into existing row if DB value is empty
                 try:
-                    cursor.execute('SELECT model_version_id, raw_metadata FROM civitai_prompts WHERE civitai_id = ?', (prompt_data["civitai_id"],))
+                    cursor.execute('SELECT model_version_id, raw_metadata FROM civitai_prompts WHERE civitai_id = ?', (civitai_id,))
                     existing_row = cursor.fetchone()
                     existing_mv = existing_row[0] if existing_row else None
                     existing_raw = existing_row[1] if existing_row else None
@@ -186,23 +365,11 @@ class DatabaseManager:
                 # Prefer incoming raw_metadata if it provides more/different info
                 final_raw = prompt_data.get("raw_metadata") or existing_raw
 
-                cursor.execute('''
-                UPDATE civitai_prompts SET
-                    full_prompt = ?,
-                    negative_prompt = ?,
-                    quality_score = ?,
-                    reaction_count = ?,
-                    comment_count = ?,
-                    download_count = ?,
-                    prompt_length = ?,
-                    tag_count = ?,
-                    model_name = ?,
-                    model_id = ?,
-                    model_version_id = ?,
-                    collected_at = ?,
-                    raw_metadata = ?
-                WHERE civitai_id = ?
-                ''', (
+                features = syntax_features(prompt_data.get("full_prompt"))
+                columns = ['full_prompt', 'negative_prompt', 'quality_score', 'reaction_count', 'comment_count',
+                           'download_count', 'prompt_length', 'tag_count', 'model_key', 'version_key',
+                           'raw_metadata', *features]
+                values = (
                     prompt_data.get("full_prompt"),
                     prompt_data.get("negative_prompt"),
                     prompt_data.get("quality_score"),
@@ -211,21 +378,23 @@ class DatabaseManager:
                     prompt_data.get("download_count", 0),
                     prompt_data.get("prompt_length", 0),
                     prompt_data.get("tag_count", 0),
-                    prompt_data.get("model_name"),
-                    prompt_data.get("model_id"),
-                    final_mv,
-                    prompt_data.get("collected_at", datetime.now().isoformat()),
+                    keys.model_key(prompt_data.get("model_id"), prompt_data.get("model_name")),
+                    keys.version_key(final_mv),
                     final_raw,
-                    prompt_data["civitai_id"]
-                ))
+                    *features.values(),
+                )
+                # 値が何も変わらない再取得では行に触れない（collected_at も最初に保存した時刻のまま）
+                cursor.execute(f"SELECT {', '.join(columns)} FROM prompts WHERE civitai_id = ?", (civitai_id,))
+                if cursor.fetchone() != values:
+                    cursor.execute(f"UPDATE prompts SET {', '.join(f'{c} = ?' for c in columns)}, collected_at = ? "
+                                   "WHERE civitai_id = ?", (*values, collected_at, civitai_id))
                 conn.commit()
+                keys.publish()
                 # Save resources if present (update/replace)
                 try:
-                    # get prompt id
-                    cursor.execute('SELECT id FROM civitai_prompts WHERE civitai_id = ?', (prompt_data['civitai_id'],))
-                    prow = cursor.fetchone()
-                    if prow:
-                        prompt_id = prow[0]
+                    prompt_id = existing[0]
+                    if prompt_id:
+                        self._index_duplicates(conn, [(prompt_id, prompt_data.get("full_prompt"))])
                         if prompt_data.get('resources'):
                             self.save_prompt_resources(prompt_id, prompt_data.get('resources'))
                 except Exception:
@@ -241,66 +410,219 @@ class DatabaseManager:
         finally:
             conn.close()
 
+    def save_prompts_bulk(self, prompts: List[Dict[str, Any]]) -> Dict[str, int]:
+        """複数のプロンプト（API の 1 ページ分など）を 1 トランザクションで保存する
+
+        save_prompt_data と同じ規則（新規は挿入、既存は上書き、ただし model_version_id は既存値を優先）を
+        executemany の UPSERT で行う。resources を持つ行は使用リソースのリンクを差分で更新する。
+        モデル・バージョンの文字列とリソースはプロセス内のキャッシュで次元キー・カタログ id に置き換えて書き込む。
+
+        返り値: {'inserted': 新規件数, 'updated': 既存行の更新件数}
+        """
+        result = {'inserted': 0, 'updated': 0}
+        if not any(p and p.get('civitai_id') for p in prompts):
+            return result
+
+        conn = sqlite3.connect(self.db_path, timeout=30)
+
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            sessions: List[Any] = []
+            result, _ = self.write_prompts(conn, prompts, sessions)
+            conn.commit()
+            for session in sessions:
+                session.publish()
+            return result
+
+        except Exception as e:
+            conn.rollback()
+            print(f"[DB] Error saving prompt batch: {e}")
+            raise
+
+        finally:
+            conn.close()
+
+    def write_prompts(self, conn: sqlite3.Connection, prompts: List[Dict[str, Any]],
+                      sessions: List[Any]) -> Tuple[Dict[str, int], Dict[Any, int]]:
+        """save_prompts_bulk の書き込み本体（呼び出し側のトランザクション内で実行し、コミットしない）
+
+        複数のバッチを 1 回のコミットにまとめる取り込みサービス（ingest_service）からも使う。
+        次元キー・カタログのセッションを sessions に追加するので、コミットできたら各 publish() を呼ぶこと。
+        返り値: ({'inserted', 'updated'}, civitai_id -> prompts.id)
+        """
+        # 同じページ内で civitai_id が重複した場合は後勝ち（'12' と 12 は同じ ID）
+        rows: Dict[Any, Dict[str, Any]] = {}
+        for p in prompts:
+            if p and p.get('civitai_id'):
+                rows[to_int_id(p['civitai_id'])] = p
+        result = {'inserted': 0, 'updated': 0}
+        if not rows:
+            return result, {}
+
+        cursor = conn.cursor()
+        keys = self._dimensions.session(cursor)
+        ids = list(rows)
+        existing = set()
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cursor.execute(f"SELECT civitai_id FROM prompts WHERE civitai_id IN ({','.join('?' * len(chunk))})", chunk)
+            existing.update(r[0] for r in cursor.fetchall())
+
+        now = now_epoch()
+        params = [(
+            civitai_id,
+            p.get("full_prompt"),
+            p.get("negative_prompt"),
+            p.get("quality_score"),
+            p.get("reaction_count", 0),
+            p.get("comment_count", 0),
+            p.get("download_count", 0),
+            p.get("prompt_length", 0),
+            p.get("tag_count", 0),
+            keys.model_key(p.get("model_id"), p.get("model_name")),
+            keys.version_key(p.get("model_version_id")),
+            to_epoch(p.get("collected_at", now)),
+            p.get("raw_metadata"),
+            *syntax_features(p.get("full_prompt")).values()
+        ) for civitai_id, p in rows.items()]
+        # 既存のバージョンが空（NULL または ''）のときだけ新しい値で埋める
+        cursor.executemany('''
+        INSERT INTO prompts
+        (civitai_id, full_prompt, negative_prompt, quality_score,
+         reaction_count, comment_count, download_count, prompt_length, tag_count,
+         model_key, version_key, collected_at, raw_metadata,
+         has_comma, has_weights, has_embedding, paren_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (civitai_id) DO UPDATE SET
+            full_prompt = excluded.full_prompt,
+            negative_prompt = excluded.negative_prompt,
+            quality_score = excluded.quality_score,
+            reaction_count = excluded.reaction_count,
+            comment_count = excluded.comment_count,
+            download_count = excluded.download_count,
+            prompt_length = excluded.prompt_length,
+            tag_count = excluded.tag_count,
+            model_key = excluded.model_key,
+            version_key = CASE
+                WHEN prompts.version_key IS NULL
+                  OR prompts.version_key IN (SELECT id FROM model_versions WHERE model_version_id = '')
+                THEN excluded.version_key ELSE prompts.version_key END,
+            collected_at = excluded.collected_at,
+            raw_metadata = COALESCE(excluded.raw_metadata, prompts.raw_metadata),
+            has_comma = excluded.has_comma,
+            has_weights = excluded.has_weights,
+            has_embedding = excluded.has_embedding,
+            paren_count = excluded.paren_count
+        -- 値が何も変わらない再取得では行に触れない（collected_at も最初に保存した時刻のまま）
+        WHERE prompts.full_prompt IS NOT excluded.full_prompt
+           OR prompts.negative_prompt IS NOT excluded.negative_prompt
+           OR prompts.quality_score IS NOT excluded.quality_score
+           OR prompts.reaction_count IS NOT excluded.reaction_count
+           OR prompts.comment_count IS NOT excluded.comment_count
+           OR prompts.download_count IS NOT excluded.download_count
+           OR prompts.prompt_length IS NOT excluded.prompt_length
+           OR prompts.tag_count IS NOT excluded.tag_count
+           OR prompts.model_key IS NOT excluded.model_key
+           OR (prompts.version_key IS NOT excluded.version_key
+               AND (prompts.version_key IS NULL
+                    OR prompts.version_key IN (SELECT id FROM model_versions WHERE model_version_id = '')))
+           OR (excluded.raw_metadata IS NOT NULL AND prompts.raw_metadata IS NOT excluded.raw_metadata)
+           OR prompts.has_comma IS NOT excluded.has_comma
+           OR prompts.has_weights IS NOT excluded.has_weights
+           OR prompts.has_embedding IS NOT excluded.has_embedding
+           OR prompts.paren_count IS NOT excluded.paren_count
+        ''', params)
+
+        prompt_ids = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cursor.execute(f"SELECT civitai_id, id FROM prompts WHERE civitai_id IN ({','.join('?' * len(chunk))})", chunk)
+            prompt_ids.update(cursor.fetchall())
+
+        catalog = self._resources.session(cursor)
+        sync_links(cursor, catalog, [(prompt_ids[cid], p['resources']) for cid, p in rows.items()
+                                     if p.get('resources') and cid in prompt_ids])
+
+        # 近似重複の索引（失敗してもプロンプトの保存は取り消さない）
+        self._index_duplicates(conn, [(prompt_ids[cid], p.get('full_prompt'))
+                                      for cid, p in rows.items() if cid in prompt_ids], commit=False)
+
+        sessions.extend([keys, catalog])
+        result['updated'] = len(existing)
+        result['inserted'] = len(rows) - len(existing)
+        return result, prompt_ids
+
+    def _index_duplicates(self, conn: sqlite3.Connection, rows: List[Tuple[int, Optional[str]]], commit: bool = True):
+        """保存した行を近似重複の索引に登録する（失敗時は索引だけを巻き戻し、後で backfill される）"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SAVEPOINT dedup_index')
+            dedup.index_prompts(cursor, rows)
+            cursor.execute('RELEASE SAVEPOINT dedup_index')
+        except Exception as e:
+            cursor.execute('ROLLBACK TO SAVEPOINT dedup_index')
+            cursor.execute('RELEASE SAVEPOINT dedup_index')
+            print(f"[DB] Dedup index warning: {e}")
+        if commit:
+            conn.commit()
+
     def save_prompt_categories(self, prompt_id: int, categories: Dict[str, Dict]) -> bool:
         """プロンプトのカテゴリデータを保存"""
-        conn = sqlite3.connect(self.db_path)
+        return self.save_prompt_categories_bulk([(prompt_id, categories)]) == 1
+
+    def save_prompt_categories_bulk(self, items: List[Tuple[int, Dict[str, Dict]]]) -> int:
+        """複数プロンプトのカテゴリを 1 トランザクションで保存し、保存したプロンプト数を返す"""
+        if not items:
+            return 0
+        conn = sqlite3.connect(self.db_path, timeout=30)
         cursor = conn.cursor()
 
         try:
-            # 既存のカテゴリを削除（重複防止）
-            cursor.execute('DELETE FROM prompt_categories WHERE prompt_id = ?', (prompt_id,))
-
-            # 新しいカテゴリを挿入
-            for category, data in categories.items():
-                cursor.execute('''
-                INSERT INTO prompt_categories (prompt_id, category, keywords, confidence)
-                VALUES (?, ?, ?, ?)
-                ''', (
-                    prompt_id,
-                    category,
-                    json.dumps(data["keywords"], ensure_ascii=False),
-                    data["confidence"]
-                ))
-
+            saved = self.write_categories(cursor, items)
             conn.commit()
-            return True
+            return saved
 
         except Exception as e:
+            conn.rollback()
             print(f"[DB] Error saving categories: {e}")
-            return False
+            return 0
 
         finally:
             conn.close()
 
+    @staticmethod
+    def write_categories(cursor, items: List[Tuple[int, Dict[str, Dict]]]) -> int:
+        """カテゴリの書き込み本体（呼び出し側のトランザクション内で実行し、コミットしない）"""
+        # 既存のカテゴリを削除（重複防止）
+        cursor.executemany('DELETE FROM prompt_categories WHERE prompt_id = ?', [(pid,) for pid, _ in items])
+
+        # 新しいカテゴリを挿入
+        cursor.executemany('''
+        INSERT INTO prompt_categories (prompt_id, category, keywords, confidence)
+        VALUES (?, ?, ?, ?)
+        ''', [(
+            prompt_id,
+            category,
+            json.dumps(data["keywords"], ensure_ascii=False),
+            data["confidence"]
+        ) for prompt_id, categories in items for category, data in categories.items()])
+        return len(items)
+
     def save_prompt_resources(self, prompt_id: int, resources: List[Dict[str, Any]]) -> bool:
         """プロンプトに紐づく civitaiResources を正規化して保存/更新する
 
-        resources: list of dicts with keys: index,type,name,modelId,modelVersionId,resourceId,raw
+        resources: list of dicts with keys: index,type,name,modelId,modelVersionId,resourceId,weight,raw
+        リソースはカタログに 1 回だけ登録し、リンクは変わった idx だけを書き換える。
         """
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
 
         try:
-            # Remove existing resources for prompt
-            cursor.execute('DELETE FROM prompt_resources WHERE prompt_id = ?', (prompt_id,))
-
-            for r in resources:
-                cursor.execute('''
-                INSERT INTO prompt_resources
-                (prompt_id, resource_index, resource_type, resource_name, resource_model_id, resource_model_version_id, resource_id, resource_raw)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    prompt_id,
-                    r.get('index'),
-                    r.get('type'),
-                    r.get('name'),
-                    r.get('modelId'),
-                    r.get('modelVersionId'),
-                    r.get('resourceId'),
-                    r.get('raw')
-                ))
-
+            sessions: List[Any] = []
+            self.write_resources(cursor, [(prompt_id, resources)], sessions)
             conn.commit()
+            for session in sessions:
+                session.publish()
             return True
 
         except Exception as e:
@@ -310,13 +632,21 @@ class DatabaseManager:
         finally:
             conn.close()
 
+    def write_resources(self, cursor, items: List[Tuple[int, List[Dict[str, Any]]]],
+                        sessions: List[Any]) -> Dict[str, int]:
+        """(prompt_id, resources) のリンクを差分で書き込む（コミットしない。publish は write_prompts と同じ）"""
+        catalog = self._resources.session(cursor)
+        counts = sync_links(cursor, catalog, items)
+        sessions.append(catalog)
+        return counts
+
     def get_prompt_resources(self, prompt_id: int) -> List[Dict[str, Any]]:
         """指定プロンプトのリソース一覧を返す"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
 
         try:
-            cursor.execute('SELECT resource_index, resource_type, resource_name, resource_model_id, resource_model_version_id, resource_id, resource_raw FROM prompt_resources WHERE prompt_id = ? ORDER BY resource_index', (prompt_id,))
+            cursor.execute('SELECT resource_index, resource_type, resource_name, resource_model_id, resource_model_version_id, resource_id, resource_raw, weight FROM prompt_resources WHERE prompt_id = ? ORDER BY resource_index', (prompt_id,))
             rows = cursor.fetchall()
             result = []
             for r in rows:
@@ -327,7 +657,8 @@ class DatabaseManager:
                     'modelId': r[3],
                     'modelVersionId': r[4],
                     'resourceId': r[5],
-                    'raw': r[6]
+                    'raw': r[6],
+                    'weight': r[7]
                 })
             return result
 
@@ -338,18 +669,56 @@ class DatabaseManager:
         finally:
             conn.close()
 
+    def get_prompts_using_resource(self, model_version_id: Any = None, name: Optional[str] = None,
+                                   resource_type: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """指定リソース（modelVersionId、または modelVersionId を持たないリソースの名前）を使ったプロンプトを新しい順に返す
+
+        カタログの一意索引でリソースを引き、リンク表の resource_id 索引でプロンプトを引く。
+        resource_type を省略するとすべての種類が対象。
+        """
+        if model_version_id in (None, '') and not name:
+            return []
+        clauses, params = [], []
+        if model_version_id not in (None, ''):
+            clauses.append('resource_model_version_id = ?')
+            params.append(to_int_id(model_version_id))
+        else:
+            clauses += ['resource_model_version_id IS NULL', 'resource_name = ?']
+            params.append(name)
+        if resource_type:
+            clauses.append('resource_type = ?')
+            params.append(resource_type)
+        conn = sqlite3.connect(self.db_path)
+
+        try:
+            rows = conn.execute(f'''
+                SELECT p.id, p.civitai_id, p.full_prompt, p.quality_score, p.model_name, MAX(l.weight)
+                FROM {LINKS_TABLE} l JOIN civitai_prompts p ON p.id = l.prompt_id
+                WHERE l.resource_id IN (SELECT id FROM {CATALOG_TABLE} WHERE {' AND '.join(clauses)})
+                GROUP BY l.prompt_id ORDER BY l.prompt_id DESC LIMIT ?
+            ''', params + [int(limit)]).fetchall()
+            return [{'id': r[0], 'civitai_id': r[1], 'full_prompt': r[2], 'quality_score': r[3],
+                     'model_name': r[4], 'weight': r[5]} for r in rows]
+
+        except Exception as e:
+            print(f"[DB] Error getting prompts by resource: {e}")
+            return []
+
+        finally:
+            conn.close()
+
     def get_prompt_by_civitai_id(self, civitai_id: str) -> Optional[Dict[str, Any]]:
         """CivitAI IDでプロンプトを取得"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
 
         try:
-            cursor.execute('SELECT * FROM civitai_prompts WHERE civitai_id = ?', (civitai_id,))
+            cursor.execute('SELECT * FROM civitai_prompts WHERE civitai_id = ?', (to_int_id(civitai_id),))
             row = cursor.fetchone()
 
             if row:
                 columns = [description[0] for description in cursor.description]
-                return dict(zip(columns, row))
+                return text_ids(dict(zip(columns, row)))
             return None
 
         except Exception as e:
@@ -360,7 +729,11 @@ class DatabaseManager:
             conn.close()
 
     def get_all_prompts(self, model_name: Optional[str] = None) -> List[Dict[str, Any]]:
-        """全プロンプトを取得（オプション：モデル名でフィルタ）"""
+        """全プロンプトを取得（オプション：モデル名でフィルタ）
+
+        全列を辞書で一括取得するため大きな DB ではメモリを消費する。
+        走査用途には iter_prompts を使うこと。
+        """
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
 
@@ -373,7 +746,7 @@ class DatabaseManager:
             rows = cursor.fetchall()
             columns = [description[0] for description in cursor.description]
 
-            return [dict(zip(columns, row)) for row in rows]
+            return [text_ids(dict(zip(columns, row))) for row in rows]
 
         except Exception as e:
             print(f"[DB] Error getting prompts: {e}")
@@ -382,29 +755,285 @@ class DatabaseManager:
         finally:
             conn.close()
 
-    def get_category_statistics(self) -> Dict[str, Dict[str, int]]:
-        """カテゴリ別統計を取得"""
+    def _prompt_columns(self, cursor) -> List[str]:
+        cursor.execute('PRAGMA table_info(civitai_prompts)')
+        return [r[1] for r in cursor.fetchall()]
+
+    def iter_prompt_batches(self, columns: Sequence[str] = ('id', 'full_prompt'), where: Optional[str] = None,
+                            params: Sequence[Any] = (), batch_size: int = 1000,
+                            records: bool = True) -> Iterator[List[Any]]:
+        """civitai_prompts を id のキーセットページングで batch_size 件ずつ読み出す
+
+        Args:
+            columns: 取得する列（指定列のみ SELECT する）
+            where: 追加の WHERE 条件（プレースホルダ ? を使い、値は params で渡す）
+            params: where のパラメータ
+            batch_size: 1 回の読み出し件数
+            records: True なら属性アクセス可能な PromptRecord、False なら素のタプルを返す
+
+        Yields:
+            List[PromptRecord] または List[tuple]（ID 列は他の読み出し API と同じく文字列）
+        """
+        columns = list(columns)
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
 
         try:
-            cursor.execute('''
-            SELECT p.model_name, c.category, COUNT(*) as count
-            FROM civitai_prompts p
-            JOIN prompt_categories c ON p.id = c.prompt_id
-            GROUP BY p.model_name, c.category
-            ORDER BY p.model_name, c.category
-            ''')
+            valid = set(self._prompt_columns(cursor))
+            unknown = [c for c in columns if c not in valid]
+            if unknown:
+                raise ValueError(f"Unknown columns for civitai_prompts: {unknown}")
+
+            # キーセット用に id は常に取得し、要求されていなければ結果から外す
+            strip_id = 'id' not in columns
+            select_cols = (['id'] if strip_id else []) + columns
+            id_pos = select_cols.index('id')
+            sql = f"SELECT {', '.join(select_cols)} FROM civitai_prompts WHERE id > ?"
+            if where:
+                sql += f" AND ({where})"
+            sql += " ORDER BY id LIMIT ?"
+            record = prompt_record_type(columns) if records else None
+            id_positions = [i for i, c in enumerate(columns) if c in INTEGER_ID_COLUMNS]
+
+            last_id = 0
+            while True:
+                cursor.execute(sql, [last_id, *params, batch_size])
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][id_pos]
+                if strip_id:
+                    rows = [r[1:] for r in rows]
+                if id_positions:
+                    rows = [tuple(to_text_id(v) if i in id_positions else v for i, v in enumerate(r)) for r in rows]
+                yield [record._make(r) for r in rows] if record else rows
+                if len(rows) < batch_size:
+                    break
 
-            rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+    def iter_prompts(self, columns: Sequence[str] = ('id', 'full_prompt'), where: Optional[str] = None,
+                     params: Sequence[Any] = (), batch_size: int = 1000,
+                     records: bool = True) -> Iterator[Any]:
+        """iter_prompt_batches の結果を 1 行ずつ返す（全件をメモリに載せずに走査する）"""
+        for batch in self.iter_prompt_batches(columns, where, params, batch_size, records):
+            yield from batch
+
+    def _browse_filters(self, version_id: Optional[str] = None, model_name: Optional[str] = None,
+                        min_quality: Optional[int] = None, category: Optional[str] = None) -> Tuple[str, List[Any]]:
+        """一覧表示用の絞り込み条件を組み立てる"""
+        clauses = ['p.full_prompt IS NOT NULL']
+        params: List[Any] = []
+        if version_id:
+            clauses.append('p.model_version_id = ?')
+            params.append(to_int_id(version_id))
+        if model_name:
+            clauses.append('p.model_name = ?')
+            params.append(model_name)
+        if min_quality is not None:
+            clauses.append('p.quality_score >= ?')
+            params.append(int(min_quality))
+        if category:
+            clauses.append('EXISTS (SELECT 1 FROM prompt_categories cf WHERE cf.prompt_id = p.id AND cf.category = ?)')
+            params.append(category)
+        return ' AND '.join(clauses), params
+
+    def browse_prompts(self, after: Optional[Tuple[int, int]] = None, limit: int = 50,
+                       version_id: Optional[str] = None, model_name: Optional[str] = None,
+                       min_quality: Optional[int] = None, category: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[Tuple[int, int]]]:
+        """品質スコア降順の一覧を 1 ページ分取得する（(quality_score, id) のキーセットページング）
+
+        Args:
+            after: 前ページの末尾カーソル (quality_key, id)。None なら先頭ページ
+            limit: 1 ページの件数
+
+        Returns:
+            (行のリスト, 次ページ用カーソル)。次ページがなければカーソルは None
+        """
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+
+        try:
+            where, params = self._browse_filters(version_id, model_name, min_quality, category)
+            # 行値比較 (a, b) < (?, ?) では索引の範囲検索にならないため展開して書く
+            if after is not None:
+                where += ' AND IFNULL(p.quality_score, -1) <= ? AND (IFNULL(p.quality_score, -1) < ? OR p.id < ?)'
+                params += [after[0], after[0], after[1]]
+            cursor.execute(f'''
+                SELECT p.id, p.civitai_id, p.full_prompt, p.negative_prompt, p.quality_score,
+                       p.reaction_count, p.model_name, p.model_id, p.model_version_id, p.collected_at,
+                       IFNULL(p.quality_score, -1) AS quality_key,
+                       c.category, c.confidence
+                FROM civitai_prompts p
+                LEFT JOIN prompt_categories c ON c.id = (
+                    SELECT id FROM prompt_categories WHERE prompt_id = p.id ORDER BY confidence DESC LIMIT 1
+                )
+                WHERE {where}
+                ORDER BY IFNULL(p.quality_score, -1) DESC, p.id DESC
+                LIMIT ?
+            ''', params + [limit + 1])
+            rows = [text_ids(dict(r)) for r in cursor.fetchall()]
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            next_cursor = (rows[-1]['quality_key'], rows[-1]['id']) if has_more and rows else None
+            return rows, next_cursor
+
+        except Exception as e:
+            print(f"[DB] Error browsing prompts: {e}")
+            return [], None
+
+        finally:
+            conn.close()
+
+    def count_prompts(self, version_id: Optional[str] = None, model_name: Optional[str] = None,
+                      min_quality: Optional[int] = None, category: Optional[str] = None) -> int:
+        """browse_prompts と同じ条件の件数
+
+        絞り込みなし・バージョンのみ・モデルのみの場合は集計テーブルから定数時間で返す
+        （この場合 full_prompt が NULL の行も件数に含まれる）。
+        """
+        if not (min_quality is not None or category) and not (version_id and model_name):
+            if version_id:
+                return self.get_prompt_count_by_version(version_id)
+            if model_name:
+                rows = [r for r in self.get_rollup('model') if r['key'] == model_name]
+                return rows[0]['prompt_count'] if rows else 0
+            return self.get_total_prompts_count()
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        try:
+            where, params = self._browse_filters(version_id, model_name, min_quality, category)
+            cursor.execute(f'SELECT COUNT(*) FROM civitai_prompts p WHERE {where}', params)
+            return cursor.fetchone()[0]
 
+        except Exception as e:
+            print(f"[DB] Error counting prompts: {e}")
+            return 0
+
+        finally:
+            conn.close()
+
+    def _search_filters(self, version_id: Optional[str], min_quality: Optional[int]) -> Tuple[str, List[Any]]:
+        """検索系クエリ共通の追加条件を組み立てる"""
+        clauses = []
+        params: List[Any] = []
+        if version_id:
+            clauses.append('p.model_version_id = ?')
+            params.append(to_int_id(version_id))
+        if min_quality is not None:
+            clauses.append('p.quality_score >= ?')
+            params.append(int(min_quality))
+        return ''.join(f' AND {c}' for c in clauses), params
+
+    def _run_fts(self, cursor, sql: str, query: str, params_before: List[Any], params_after: List[Any]):
+        """MATCH 式を実行し、構文エラー時は全語を引用したクエリで再試行する"""
+        match = build_fts_query(query)
+        try:
+            cursor.execute(sql, params_before + [match] + params_after)
+        except sqlite3.OperationalError as e:
+            if 'fts5' not in str(e) and 'syntax' not in str(e):
+                raise
+            cursor.execute(sql, params_before + [_quote_fts_terms(query)] + params_after)
+        return cursor.fetchall()
+
+    def search_prompts(self, query: str, limit: int = 50, offset: int = 0,
+                       version_id: Optional[str] = None, min_quality: Optional[int] = None,
+                       order_by: str = 'rank', highlight: Tuple[str, str] = ('[', ']'),
+                       snippet_tokens: int = 16) -> List[Dict[str, Any]]:
+        """全文検索 (FTS5) でプロンプトを検索する
+
+        query はフレーズ ("best quality")・前方一致 (mast*)・ブール演算 (AND/OR/NOT) を受け付ける。
+        order_by: 'rank' (bm25 関連度順) または 'quality' (品質スコア順)
+        返り値の各行には prompt_snippet / negative_snippet / rank が含まれる。
+        """
+        if not query or not query.strip():
+            return []
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        try:
+            extra, extra_params = self._search_filters(version_id, min_quality)
+            order = 'p.quality_score DESC, p.id DESC' if order_by == 'quality' else 'rank'
+            sql = f'''
+            SELECT p.id, p.civitai_id, p.full_prompt, p.negative_prompt, p.quality_score,
+                   p.reaction_count, p.model_name, p.model_id, p.model_version_id, p.collected_at,
+                   snippet(civitai_prompts_fts, 0, ?, ?, '…', ?) AS prompt_snippet,
+                   snippet(civitai_prompts_fts, 1, ?, ?, '…', ?) AS negative_snippet,
+                   bm25(civitai_prompts_fts, 1.0, 0.3) AS rank
+            FROM civitai_prompts_fts
+            JOIN civitai_prompts p ON p.id = civitai_prompts_fts.rowid
+            WHERE civitai_prompts_fts MATCH ?{extra}
+            ORDER BY {order}
+            LIMIT ? OFFSET ?
+            '''
+            hl_open, hl_close = highlight
+            before = [hl_open, hl_close, snippet_tokens, hl_open, hl_close, snippet_tokens]
+            rows = self._run_fts(cursor, sql, query, before, extra_params + [int(limit), int(offset)])
+            columns = [description[0] for description in cursor.description]
+            return [text_ids(dict(zip(columns, row))) for row in rows]
+
+        except Exception as e:
+            print(f"[DB] Error searching prompts: {e}")
+            return []
+
+        finally:
+            conn.close()
+
+    def count_search_results(self, query: str, version_id: Optional[str] = None,
+                             min_quality: Optional[int] = None) -> int:
+        """search_prompts と同じ条件でのヒット件数を返す"""
+        if not query or not query.strip():
+            return 0
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        try:
+            extra, extra_params = self._search_filters(version_id, min_quality)
+            sql = f'''
+            SELECT COUNT(*)
+            FROM civitai_prompts_fts
+            JOIN civitai_prompts p ON p.id = civitai_prompts_fts.rowid
+            WHERE civitai_prompts_fts MATCH ?{extra}
+            '''
+            rows = self._run_fts(cursor, sql, query, [], extra_params)
+            return rows[0][0] if rows else 0
+
+        except Exception as e:
+            print(f"[DB] Error counting search results: {e}")
+            return 0
+
+        finally:
+            conn.close()
+
+    def rebuild_search_index(self) -> bool:
+        """全文検索索引を civitai_prompts から再構築する（整合性が崩れた場合の保守用）"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("INSERT INTO civitai_prompts_fts (civitai_prompts_fts) VALUES ('rebuild')")
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"[DB] Error rebuilding search index: {e}")
+            return False
+        finally:
+            conn.close()
+
+    def get_category_statistics(self) -> Dict[str, Dict[str, int]]:
+        """カテゴリ別統計を取得（category_rollups から読み出す）"""
+        conn = sqlite3.connect(self.db_path)
+
+        try:
             # データ構造: {model_name: {category: count}}
             stats = {}
-            for model_name, category, count in rows:
-                model_name = model_name or "Unknown"
+            for row in rollups.read_categories(conn):
+                model_name = row['model_name'] or "Unknown"
                 if model_name not in stats:
                     stats[model_name] = {}
-                stats[model_name][category] = count
+                stats[model_name][row['category']] = row['count']
 
             return stats
 
@@ -415,14 +1044,287 @@ class DatabaseManager:
         finally:
             conn.close()
 
+    def get_category_rollup(self) -> List[Dict[str, Any]]:
+        """モデル×カテゴリの集計行（件数・平均信頼度）を返す"""
+        conn = sqlite3.connect(self.db_path)
+
+        try:
+            return rollups.read_categories(conn)
+
+        except Exception as e:
+            print(f"[DB] Error reading category rollups: {e}")
+            return []
+
+        finally:
+            conn.close()
+
+    def get_rollup(self, dimension: str) -> List[Dict[str, Any]]:
+        """次元別（model/version/day/quality_tier/length_tier）の集計行を返す"""
+        conn = sqlite3.connect(self.db_path)
+
+        try:
+            return rollups.read_dimension(conn, dimension)
+
+        except Exception as e:
+            print(f"[DB] Error reading rollups ({dimension}): {e}")
+            return []
+
+        finally:
+            conn.close()
+
+    def get_rollup_totals(self) -> Dict[str, Any]:
+        """全体の件数・ユニークモデル数・平均値などを集計テーブルから返す"""
+        conn = sqlite3.connect(self.db_path)
+
+        try:
+            totals = rollups.read_totals(conn)
+            totals.update(rollups.read_collected_range(conn))
+            return totals
+
+        except Exception as e:
+            print(f"[DB] Error reading rollup totals: {e}")
+            return {}
+
+        finally:
+            conn.close()
+
+    def get_daily_stats(self, since: Any = None, until: Any = None) -> List[Dict[str, Any]]:
+        """collected_at が [since, until) の行を日別に集計する（ISO 文字列・datetime・UNIX 秒を受け付ける）
+
+        collected_at は UNIX 秒の INTEGER 列なので、期間の絞り込みは idx_prompts_collected_at の範囲走査になる。
+        期間を指定しない全期間の日別集計は get_rollup('day') の方が速い。
+        """
+        conn = sqlite3.connect(self.db_path)
+
+        try:
+            return rollups.read_daily(conn, since, until)
+
+        except Exception as e:
+            print(f"[DB] Error reading daily stats: {e}")
+            return []
+
+        finally:
+            conn.close()
+
+    def get_histogram(self, name: str, bins: int = 20) -> List[Dict[str, Any]]:
+        """SQL で集計したヒストグラム（prompt_length / quality_score / confidence）を返す"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return aggregations.histogram(conn, name, bins)
+        except sqlite3.Error as e:
+            print(f"[DB] Error computing histogram {name}: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def get_value_counts(self, column: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """civitai_prompts の列の値ごとの件数（model_name など）を返す"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return aggregations.value_counts(conn, column, limit)
+        except sqlite3.Error as e:
+            print(f"[DB] Error computing value counts for {column}: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def get_category_counts(self) -> List[Dict[str, Any]]:
+        """カテゴリ別の件数と平均信頼度を返す"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return aggregations.category_counts(conn)
+        except sqlite3.Error as e:
+            print(f"[DB] Error reading category counts: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def get_length_stats(self) -> Dict[str, Any]:
+        """プロンプト長の平均・中央値・最小・最大・標準偏差を返す"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return aggregations.length_stats(conn)
+        except sqlite3.Error as e:
+            print(f"[DB] Error computing length stats: {e}")
+            return {}
+        finally:
+            conn.close()
+
+    def get_syntax_usage(self) -> Dict[str, int]:
+        """カンマ・重み付け・括弧・エンベッディングの使用件数を返す"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return aggregations.syntax_usage(conn)
+        except sqlite3.Error as e:
+            print(f"[DB] Error computing syntax usage: {e}")
+            return {}
+        finally:
+            conn.close()
+
+    def get_near_duplicates(self, prompt_id: int, threshold: float = dedup.DUPLICATE_THRESHOLD,
+                            limit: int = 50) -> List[Dict[str, Any]]:
+        """prompt_id の近似重複（MinHash の推定 Jaccard 係数が threshold 以上）を類似度の降順で返す"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            matches = dedup.near_duplicates(conn, int(prompt_id), threshold, limit)
+            if not matches:
+                return []
+            scores = dict(matches)
+            rows = conn.execute(
+                f"SELECT id, civitai_id, full_prompt, quality_score, model_name FROM civitai_prompts "
+                f"WHERE id IN ({','.join('?' * len(scores))})", list(scores)
+            ).fetchall()
+            result = [{'id': r[0], 'civitai_id': r[1], 'full_prompt': r[2], 'quality_score': r[3],
+                       'model_name': r[4], 'similarity': scores[r[0]]} for r in rows]
+            result.sort(key=lambda r: (-r['similarity'], r['id']))
+            return result
+        except sqlite3.Error as e:
+            print(f"[DB] Error finding near duplicates: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def get_duplicate_cluster(self, prompt_id: int) -> Dict[str, Any]:
+        """prompt_id が属する近似重複クラスタ（{'cluster_id', 'members'}）を返す"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cluster_id = dedup.cluster_ids(conn, [int(prompt_id)]).get(int(prompt_id))
+            if cluster_id is None:
+                return {'cluster_id': None, 'members': []}
+            return {'cluster_id': cluster_id, 'members': dedup.cluster_members(conn, cluster_id)}
+        except sqlite3.Error as e:
+            print(f"[DB] Error reading duplicate cluster: {e}")
+            return {'cluster_id': None, 'members': []}
+        finally:
+            conn.close()
+
+    def get_dedup_stats(self, backfill: bool = True) -> Dict[str, Any]:
+        """近似重複索引の件数・クラスタ数・重複件数（backfill=True なら未登録行を先に登録する）"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            if backfill:
+                dedup.backfill_dedup(conn)
+            return dedup.dedup_stats(conn)
+        except sqlite3.Error as e:
+            print(f"[DB] Error reading dedup stats: {e}")
+            return {}
+        finally:
+            conn.close()
+
+    def backfill_dedup_index(self) -> int:
+        """近似重複索引に未登録の行を登録し、登録した行数を返す"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return dedup.backfill_dedup(conn)
+        finally:
+            conn.close()
+
+    def _load_similarity_index(self):
+        """類似検索の索引を返す（DB に増えた行を取り込み、SIMILARITY_SAVE_EVERY 件ごとに保存する）"""
+        path = similarity.index_path_for(self.db_path)
+        if self._similarity_index is None:
+            self._similarity_index = similarity.load_or_build(self.db_path, path)
+            self._similarity_unsaved = 0
+            return self._similarity_index
+        self._similarity_unsaved += self._similarity_index.update(self.db_path)
+        if self._similarity_unsaved >= SIMILARITY_SAVE_EVERY:
+            self._similarity_index.save(path)
+            self._similarity_unsaved = 0
+        return self._similarity_index
+
+    def find_similar_prompts(self, prompt_id: Optional[int] = None, text: Optional[str] = None, k: int = 10,
+                             skip_duplicates: bool = False) -> List[Dict[str, Any]]:
+        """prompt_id（または任意の text）に似たプロンプトを TF-IDF コサイン類似度の降順で返す
+
+        skip_duplicates=True なら近似重複クラスタ（dedup）ごとに 1 件にまとめ、
+        prompt_id と同じクラスタの行は除く。NumPy がなければ空のリストを返す。
+        """
+        if not similarity.NUMPY_AVAILABLE:
+            print("[DB] Similar-prompt search requires numpy")
+            return []
+        if prompt_id is None and not text:
+            return []
+        fetch = k * 3 if skip_duplicates else k
+        try:
+            with self._similarity_lock:
+                index = self._load_similarity_index()
+                if prompt_id is not None:
+                    matches = index.similar_to_id(int(prompt_id), fetch)
+                else:
+                    matches = index.similar_to_text(text, fetch)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"[DB] Error searching similar prompts: {e}")
+            return []
+        if not matches:
+            return []
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            scores = dict(matches)
+            rows = conn.execute(
+                f"SELECT id, civitai_id, full_prompt, negative_prompt, quality_score, model_name, collected_at "
+                f"FROM civitai_prompts WHERE id IN ({','.join('?' * len(scores))})", list(scores)
+            ).fetchall()
+            result = [{'id': r[0], 'civitai_id': r[1], 'full_prompt': r[2], 'negative_prompt': r[3],
+                       'quality_score': r[4], 'model_name': r[5], 'collected_at': r[6],
+                       'similarity': scores[r[0]]} for r in rows]
+            result.sort(key=lambda r: (-r['similarity'], r['id']))
+            if skip_duplicates:
+                ids = [r['id'] for r in result] + ([int(prompt_id)] if prompt_id is not None else [])
+                clusters = dedup.cluster_ids(conn, ids)
+                seen = {clusters.get(int(prompt_id))} if prompt_id is not None else set()
+                unique = []
+                for r in result:
+                    cluster_id = clusters.get(r['id'], r['id'])
+                    if cluster_id not in seen:
+                        seen.add(cluster_id)
+                        unique.append(r)
+                result = unique
+            return result[:k]
+        except sqlite3.Error as e:
+            print(f"[DB] Error reading similar prompts: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def rebuild_similarity_index(self) -> int:
+        """類似検索の索引を全件から作り直して保存し、索引の文書数を返す"""
+        if not similarity.NUMPY_AVAILABLE:
+            print("[DB] Similar-prompt search requires numpy")
+            return 0
+        with self._similarity_lock:
+            index = similarity.SimilarityIndex.rebuild(self.db_path)
+            index.save(similarity.index_path_for(self.db_path))
+            self._similarity_index = index
+            self._similarity_unsaved = 0
+        return len(index)
+
+    def rebuild_rollups(self) -> Dict[str, int]:
+        """集計テーブルを元テーブルから再構築する（整合性が崩れた場合の保守用）"""
+        conn = sqlite3.connect(self.db_path)
+
+        try:
+            result = rollups.rebuild_rollups(conn)
+            conn.commit()
+            print(f"[DB] Rollups rebuilt: {result}")
+            return result
+
+        except Exception as e:
+            conn.rollback()
+            print(f"[DB] Error rebuilding rollups: {e}")
+            return {}
+
+        finally:
+            conn.close()
+
     def get_total_prompts_count(self) -> int:
         """保存されているプロンプトの総数を取得"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
 
         try:
-            cursor.execute('SELECT COUNT(*) FROM civitai_prompts')
-            count = cursor.fetchone()[0]
+            cursor.execute("SELECT TOTAL(prompt_count) FROM prompt_rollups WHERE dimension = 'model'")
+            count = int(cursor.fetchone()[0])
             return count
 
         except Exception as e:
@@ -437,7 +1339,7 @@ class DatabaseManager:
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM civitai_prompts WHERE model_version_id = ?', (str(version_id),))
+            cursor.execute("SELECT COALESCE(MAX(prompt_count), 0) FROM prompt_rollups WHERE dimension = 'version' AND key = ?", (str(to_int_id(version_id)),))
             count = cursor.fetchone()[0]
             conn.close()
             return count
@@ -451,28 +1353,11 @@ class DatabaseManager:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             # Ensure table exists
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS collection_state (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                model_id TEXT NOT NULL,
-                version_id TEXT DEFAULT '',
-                last_offset INTEGER DEFAULT 0,
-                total_collected INTEGER DEFAULT 0,
-                next_page_cursor TEXT DEFAULT NULL,
-                status TEXT DEFAULT 'idle',
-                planned_total INTEGER DEFAULT NULL,
-                attempted INTEGER DEFAULT 0,
-                duplicates INTEGER DEFAULT 0,
-                saved INTEGER DEFAULT 0,
-                summary_json TEXT DEFAULT NULL,
-                last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(model_id, version_id)
-            )
-            ''')
+            cursor.execute(DB_SCHEMA['collection_state'])
             cursor.execute('SELECT model_id, version_id, last_offset, total_collected, status, planned_total, attempted, duplicates, saved, summary_json, last_update FROM collection_state ORDER BY last_update DESC')
             rows = cursor.fetchall()
             cols = ['model_id', 'version_id', 'last_offset', 'total_collected', 'status', 'planned_total', 'attempted', 'duplicates', 'saved', 'summary_json', 'last_update']
-            result = [dict(zip(cols, r)) for r in rows]
+            result = [text_ids(dict(zip(cols, r))) for r in rows]
             conn.close()
             return result
         except Exception as e:
@@ -485,12 +1370,12 @@ class DatabaseManager:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             if version_id:
-                cursor.execute('SELECT model_id, version_id, last_offset, total_collected, status, planned_total, attempted, duplicates, saved, summary_json, last_update FROM collection_state WHERE version_id = ? ORDER BY last_update DESC', (str(version_id),))
+                cursor.execute('SELECT model_id, version_id, last_offset, total_collected, status, planned_total, attempted, duplicates, saved, summary_json, last_update FROM collection_state WHERE version_id = ? ORDER BY last_update DESC', (to_int_id(version_id),))
             else:
                 cursor.execute('SELECT model_id, version_id, last_offset, total_collected, status, planned_total, attempted, duplicates, saved, summary_json, last_update FROM collection_state ORDER BY last_update DESC')
             rows = cursor.fetchall()
             cols = ['model_id', 'version_id', 'last_offset', 'total_collected', 'status', 'planned_total', 'attempted', 'duplicates', 'saved', 'summary_json', 'last_update']
-            result = [dict(zip(cols, r)) for r in rows]
+            result = [text_ids(dict(zip(cols, r))) for r in rows]
             conn.close()
             return result
         except Exception as e:
@@ -505,19 +1390,16 @@ def create_database(db_path: str = DEFAULT_DB_PATH) -> DatabaseManager:
 
 
 def save_prompts_batch(db_manager: DatabaseManager, prompts_data: List[Dict[str, Any]]) -> int:
-    """プロンプトデータをバッチで保存
+    """プロンプトデータをバッチで保存（1 トランザクション）
 
     戻り値は"新規に追加された件数"を返す。
     """
-    new_count = 0
-
-    for prompt_data in prompts_data:
-        try:
-            is_new = db_manager.save_prompt_data(prompt_data)
-            if is_new:
-                new_count += 1
-        except Exception as e:
-            print(f"[DB] Failed to save prompt: {prompt_data.get('civitai_id', 'unknown')} - {e}")
+    try:
+        result = db_manager.save_prompts_bulk(prompts_data)
+    except Exception as e:
+        print(f"[DB] Failed to save batch of {len(prompts_data)} prompts - {e}")
+        return 0
 
+    new_count = result['inserted']
     print(f"[DB] Batch save completed: {new_count}/{len(prompts_data)} new items")
     return new_count
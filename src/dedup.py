@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - 近似重複プロンプトの検出（MinHash + LSH）
+シードや重み・タグの順番だけが違うプロンプトを同じクラスタにまとめ、
+分析・エクスポート・分類をクラスタの代表 1 件だけで行えるようにする。
+
+- シングル: split_tags で正規化したタグの集合（重み・括弧・エンベッディング・順序を無視）。
+  数字だけのタグ（シード値・解像度など）は除外する
+- 署名: NUM_PERM 個のハッシュ関数による MinHash。Python の hash() と違いプロセス間で
+  同じ値になるよう blake2b を使う
+- LSH: 署名を BANDS 個のバンドに分け、(band, bucket) を prompt_lsh_buckets に保存する。
+  バンドが 1 つでも一致したものだけを候補にし、署名の一致率（Jaccard 係数の推定値）で確かめる
+- クラスタ: 保存時に、しきい値以上の既存プロンプトがあればそのクラスタに入れ、なければ
+  自分が代表（cluster_id = 自分の id）になる。代表は後から変わらない
+"""
+
+import re
+import random
+import struct
+import hashlib
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Any, Tuple
+
+from .cooccurrence import split_tags
+
+# 署名の長さとバンド分割（BANDS * ROWS = NUM_PERM）。一致率 0.5 付近から候補に上がり始める
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# 近似重複とみなす推定 Jaccard 係数
+DUPLICATE_THRESHOLD = 0.8
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS: List[Tuple[int, int]] = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_SIGNATURE = struct.Struct(f'<{NUM_PERM}Q')
+_NUMERIC_TAG_RE = re.compile(r'^[\d\s.,:x×+-]+$')
+
+DEDUP_SCHEMA = {
+    'prompt_minhash': '''
+        CREATE TABLE IF NOT EXISTS prompt_minhash (
+            prompt_id INTEGER PRIMARY KEY,
+            signature BLOB,
+            cluster_id INTEGER NOT NULL,
+            FOREIGN KEY (prompt_id) REFERENCES prompts (id)
+        )
+    ''',
+    'prompt_lsh_buckets': '''
+        CREATE TABLE IF NOT EXISTS prompt_lsh_buckets (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            prompt_id INTEGER NOT NULL,
+            PRIMARY KEY (band, bucket, prompt_id)
+        ) WITHOUT ROWID
+    ''',
+    'idx_prompt_minhash_cluster': 'CREATE INDEX IF NOT EXISTS idx_prompt_minhash_cluster ON prompt_minhash (cluster_id)',
+    'idx_prompt_lsh_buckets_prompt': 'CREATE INDEX IF NOT EXISTS idx_prompt_lsh_buckets_prompt ON prompt_lsh_buckets (prompt_id)',
+    # 削除された行の索引を消す。代表が消えたクラスタは構成員の登録も消し、backfill で組み直させる
+    'prompt_minhash_ad': '''
+        CREATE TRIGGER IF NOT EXISTS prompt_minhash_ad
+        AFTER DELETE ON prompts
+        BEGIN
+            DELETE FROM prompt_lsh_buckets
+            WHERE prompt_id = old.id
+               OR prompt_id IN (SELECT prompt_id FROM prompt_minhash WHERE cluster_id = old.id);
+            DELETE FROM prompt_minhash WHERE prompt_id = old.id OR cluster_id = old.id;
+        END
+    ''',
+}
+
+
+def ensure_dedup_tables(cursor) -> None:
+    """署名・バンドのテーブルを作成する"""
+    for stmt in DEDUP_SCHEMA.values():
+        cursor.execute(stmt)
+
+
+def representative_clause(alias: str = 'civitai_prompts') -> str:
+    """代表行（または未索引の行）だけに絞り込む WHERE 条件を返す"""
+    return (f'NOT EXISTS (SELECT 1 FROM prompt_minhash dm '
+            f'WHERE dm.prompt_id = {alias}.id AND dm.cluster_id <> dm.prompt_id)')
+
+
+# ----------------------------------------------------------------------
+# 署名
+# ----------------------------------------------------------------------
+def shingles(prompt: Optional[str]) -> List[str]:
+    """近似重複判定に使うタグ集合（数字だけのタグは除く）"""
+    return [t for t in split_tags(prompt) if not _NUMERIC_TAG_RE.match(t)]
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def minhash_signature(prompt: Optional[str]) -> Optional[Tuple[int, ...]]:
+    """MinHash 署名を返す（タグがなければ None）"""
+    values = [_hash64(t) % _PRIME for t in shingles(prompt)]
+    if not values:
+        return None
+    return tuple(min([(a * x + b) % _PRIME for x in values]) for a, b in _PERMUTATIONS)
+
+
+def band_buckets(signature: Tuple[int, ...]) -> List[Tuple[int, int]]:
+    """(band, bucket) のリスト。bucket は ROWS 個の値のハッシュ（SQLite の INTEGER に収まる符号付き 64bit）"""
+    buckets = []
+    for band in range(BANDS):
+        chunk = struct.pack(f'<{ROWS}Q', *signature[band * ROWS:(band + 1) * ROWS])
+        digest = hashlib.blake2b(chunk, digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, 'little', signed=True)))
+    return buckets
+
+
+def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """署名の一致率（Jaccard 係数の推定値）"""
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+
+def _pack(signature: Optional[Tuple[int, ...]]) -> Optional[bytes]:
+    return _SIGNATURE.pack(*signature) if signature else None
+
+
+def _unpack(blob: Optional[bytes]) -> Optional[Tuple[int, ...]]:
+    return _SIGNATURE.unpack(blob) if blob else None
+
+
+# ----------------------------------------------------------------------
+# 索引の更新
+# ----------------------------------------------------------------------
+def _candidates(cursor, signature: Tuple[int, ...], exclude: Optional[int] = None) -> List[Tuple[int, float, int]]:
+    """バンドが一致するプロンプトを (prompt_id, 一致率, cluster_id) の一致率降順で返す"""
+    ids = set()
+    for band, bucket in band_buckets(signature):
+        cursor.execute('SELECT prompt_id FROM prompt_lsh_buckets WHERE band = ? AND bucket = ?', (band, bucket))
+        ids.update(r[0] for r in cursor.fetchall())
+    ids.discard(exclude)
+    if not ids:
+        return []
+    found = []
+    id_list = list(ids)
+    for i in range(0, len(id_list), 500):
+        chunk = id_list[i:i + 500]
+        cursor.execute(f"SELECT prompt_id, signature, cluster_id FROM prompt_minhash "
+                       f"WHERE prompt_id IN ({','.join('?' * len(chunk))})", chunk)
+        for pid, blob, cluster_id in cursor.fetchall():
+            other = _unpack(blob)
+            if other:
+                found.append((pid, similarity(signature, other), cluster_id))
+    found.sort(key=lambda r: (-r[1], r[0]))
+    return found
+
+
+def index_prompts(cursor, rows: Iterable[Tuple[int, Optional[str]]],
+                  threshold: float = DUPLICATE_THRESHOLD) -> int:
+    """(prompt_id, full_prompt) を索引に登録し、クラスタを割り当てる（呼び出し側のトランザクション内で実行）
+
+    すでに登録済みで署名が変わらない行は何もしない。戻り値は登録・更新した行数。
+    """
+    updated = 0
+    for prompt_id, prompt in rows:
+        signature = minhash_signature(prompt)
+        cursor.execute('SELECT signature, cluster_id FROM prompt_minhash WHERE prompt_id = ?', (prompt_id,))
+        existing = cursor.fetchone()
+        if existing is not None and _unpack(existing[0]) == signature:
+            continue
+
+        cluster_id = prompt_id
+        if existing is not None:
+            cursor.execute('DELETE FROM prompt_lsh_buckets WHERE prompt_id = ?', (prompt_id,))
+            # 他の行の代表になっている場合は代表のまま（クラスタ ID を変えない）
+            cursor.execute('SELECT 1 FROM prompt_minhash WHERE cluster_id = ? AND prompt_id <> ? LIMIT 1',
+                           (prompt_id, prompt_id))
+            is_representative = cursor.fetchone() is not None
+        else:
+            is_representative = False
+
+        if signature is not None:
+            if not is_representative:
+                # 最も似ている既存行がしきい値以上なら、そのクラスタに入る
+                candidates = _candidates(cursor, signature, exclude=prompt_id)
+                if candidates and candidates[0][1] >= threshold:
+                    cluster_id = candidates[0][2]
+            cursor.executemany('INSERT OR IGNORE INTO prompt_lsh_buckets (band, bucket, prompt_id) VALUES (?, ?, ?)',
+                               [(band, bucket, prompt_id) for band, bucket in band_buckets(signature)])
+        cursor.execute('INSERT OR REPLACE INTO prompt_minhash (prompt_id, signature, cluster_id) VALUES (?, ?, ?)',
+                       (prompt_id, _pack(signature), cluster_id))
+        updated += 1
+    return updated
+
+
+def backfill_dedup(conn: sqlite3.Connection, chunk_size: int = 2000) -> int:
+    """索引に未登録の行（マージや旧スクリプトで入った行）を id 順に登録し、登録した行数を返す"""
+    total = 0
+    while True:
+        rows = conn.execute('''
+            SELECT p.id, p.full_prompt FROM prompts p
+            WHERE NOT EXISTS (SELECT 1 FROM prompt_minhash m WHERE m.prompt_id = p.id)
+            ORDER BY p.id LIMIT ?
+        ''', (chunk_size,)).fetchall()
+        if not rows:
+            break
+        cursor = conn.cursor()
+        index_prompts(cursor, rows)
+        conn.commit()
+        total += len(rows)
+        if len(rows) < chunk_size:
+            break
+    return total
+
+
+# ----------------------------------------------------------------------
+# 問い合わせ
+# ----------------------------------------------------------------------
+def near_duplicates(conn: sqlite3.Connection, prompt_id: int, threshold: float = DUPLICATE_THRESHOLD,
+                    limit: int = 50) -> List[Tuple[int, float]]:
+    """prompt_id の近似重複を (prompt_id, 推定 Jaccard 係数) の降順で返す"""
+    row = conn.execute('SELECT signature FROM prompt_minhash WHERE prompt_id = ?', (prompt_id,)).fetchone()
+    signature = _unpack(row[0]) if row else None
+    if signature is None:
+        return []
+    return [(pid, score) for pid, score, _ in _candidates(conn.cursor(), signature, exclude=prompt_id)
+            if score >= threshold][:limit]
+
+
+def near_duplicates_of_text(conn: sqlite3.Connection, prompt: str, threshold: float = DUPLICATE_THRESHOLD,
+                            limit: int = 50) -> List[Tuple[int, float]]:
+    """DB にない任意のプロンプト文字列の近似重複を返す"""
+    signature = minhash_signature(prompt)
+    if signature is None:
+        return []
+    return [(pid, score) for pid, score, _ in _candidates(conn.cursor(), signature) if score >= threshold][:limit]
+
+
+def cluster_ids(conn: sqlite3.Connection, prompt_ids: List[int]) -> Dict[int, int]:
+    """prompt_id -> cluster_id（未登録の行は含まれない）"""
+    result: Dict[int, int] = {}
+    for i in range(0, len(prompt_ids), 500):
+        chunk = prompt_ids[i:i + 500]
+        result.update(conn.execute(
+            f"SELECT prompt_id, cluster_id FROM prompt_minhash WHERE prompt_id IN ({','.join('?' * len(chunk))})",
+            chunk
+        ).fetchall())
+    return result
+
+
+def cluster_members(conn: sqlite3.Connection, cluster_id: int) -> List[int]:
+    """クラスタに属するプロンプト ID（代表を含む）"""
+    return [r[0] for r in conn.execute(
+        'SELECT prompt_id FROM prompt_minhash WHERE cluster_id = ? ORDER BY prompt_id', (cluster_id,)
+    ).fetchall()]
+
+
+def dedup_stats(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """索引済み件数・クラスタ数・重複（代表以外）件数と最大クラスタ"""
+    indexed, clusters = conn.execute(
+        'SELECT COUNT(*), COUNT(DISTINCT cluster_id) FROM prompt_minhash'
+    ).fetchone()
+    largest = conn.execute('''
+        SELECT cluster_id, COUNT(*) AS n FROM prompt_minhash
+        GROUP BY cluster_id HAVING n > 1 ORDER BY n DESC, cluster_id LIMIT 10
+    ''').fetchall()
+    return {
+        'indexed': indexed,
+        'clusters': clusters,
+        'duplicates': indexed - clusters,
+        'largest_clusters': [{'cluster_id': c, 'size': n} for c, n in largest],
+    }
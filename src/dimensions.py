@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - 次元テーブル（辞書符号化）
+何百万行にも繰り返し現れるモデル名・モデル ID・バージョン ID の文字列を
+models / model_versions に 1 回だけ保存し、本体の行は整数キーだけを持つ。
+（使用リソースはリソースカタログ resources とリンク表で持つ。resources.py 参照）
+
+- prompts         : civitai_prompts の実体（model_key / version_key を持つ）
+- civitai_prompts は同名・同じ列順の互換ビュー。INSTEAD OF トリガーで
+  INSERT / UPDATE / DELETE も受け付けるため、既存の読み書きのクエリはそのまま動く
+- 旧形式の DB（civitai_prompts が実テーブル）は ensure_dimension_schema が id を保ったまま書き換える
+
+大量に書き込む経路（DatabaseManager の保存処理・マージ）はビューを経由せず、
+DimensionCache でキーを引いて実体テーブルに直接書き込む。
+空文字と NULL は別の値として扱う（旧スキーマとの往復で値が変わらないように）。
+値の組は一意索引で 1 行に保ち、追加は INSERT … ON CONFLICT DO NOTHING で行う
+（同時に書き込む接続・マージ・取り込みサービスが同じ値を重ねて追加しないように）。
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .prompt_syntax import SYNTAX_COLUMNS
+from .column_types import (EPOCH_COLUMNS, EPOCH_SQL, ISO_SQL, INTEGER_ID_COLUMNS,
+                           copy_sequence, declared_type, replace_definition, retype_table, to_int_id)
+
+PROMPTS_TABLE = 'prompts'
+LEGACY_FTS_TABLE = 'civitai_prompts_fts'
+
+# 次元テーブル -> 値の列（この組で 1 行）
+DIMENSIONS: Dict[str, Tuple[str, ...]] = {
+    'models': ('model_id', 'model_name'),
+    'model_versions': ('model_version_id',),
+}
+
+# 互換ビューの列順（旧テーブルと同じ）と、次元の列がどのキーから来るか
+PROMPT_COLUMNS = [
+    'id', 'civitai_id', 'full_prompt', 'negative_prompt', 'quality_score',
+    'reaction_count', 'comment_count', 'download_count', 'prompt_length', 'tag_count',
+    'model_name', 'model_id', 'model_version_id', 'collected_at', 'raw_metadata',
+] + list(SYNTAX_COLUMNS)
+# 実体テーブルのキー列 -> (次元テーブル, ビュー側の別名)
+PROMPT_KEYS = {'model_key': ('models', 'm'), 'version_key': ('model_versions', 'v')}
+
+# 次元テーブル・実体テーブル（{table} は作り直しの際に一時名へ置き換える）
+# ID は INTEGER、collected_at は UNIX 秒で保存する（column_types 参照）
+TABLE_SCHEMA = {
+    'models': '''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            model_id INTEGER,
+            model_name TEXT
+        )
+    ''',
+    'model_versions': '''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            model_version_id INTEGER NOT NULL UNIQUE
+        )
+    ''',
+    PROMPTS_TABLE: f'''
+        CREATE TABLE IF NOT EXISTS {{table}} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            civitai_id INTEGER UNIQUE,
+            full_prompt TEXT,
+            negative_prompt TEXT,
+            quality_score INTEGER,
+            reaction_count INTEGER,
+            comment_count INTEGER,
+            download_count INTEGER,
+            prompt_length INTEGER,
+            tag_count INTEGER,
+            model_key INTEGER REFERENCES models (id),
+            version_key INTEGER REFERENCES model_versions (id),
+            collected_at INTEGER,
+            raw_metadata TEXT,
+            {', '.join(f'{name} {col_type}' for name, col_type in SYNTAX_COLUMNS.items())}
+        )
+    ''',
+}
+
+# 値の組は一意索引で 1 行に保つ。一意索引では NULL 同士が別の値になるため、
+# 片方が NULL の組は部分索引で一意にする（両方 NULL の行は追加しない）
+DIMENSION_INDEXES = [
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_models_identity ON models (model_id, model_name)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_models_identity_no_id ON models (model_name) WHERE model_id IS NULL',
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_models_identity_no_name ON models (model_id) WHERE model_name IS NULL',
+    'CREATE INDEX IF NOT EXISTS idx_models_name ON models (model_name)',
+    f'CREATE INDEX IF NOT EXISTS idx_prompts_version ON {PROMPTS_TABLE} (version_key)',
+]
+
+# ID を TEXT で宣言していた版から作り直すテーブル（旧 resources 次元は resources.py がカタログへ移す）
+_RETYPED_TABLES = ['models', 'model_versions', PROMPTS_TABLE]
+
+
+# ----------------------------------------------------------------------
+# SQL 断片
+# ----------------------------------------------------------------------
+def _value(column: str, expr: str) -> str:
+    # ID 列は INTEGER 列の型変換に任せ（'12' と 12 は同じ値）、文字列の列は旧スキーマと同じく文字列で照合する
+    return expr if column in INTEGER_ID_COLUMNS else f'CAST({expr} AS TEXT)'
+
+
+def match_sql(table: str, ref: str, alias: Optional[str] = None) -> str:
+    """次元テーブルの行が ref（new / 別名）の値と一致する条件（NULL 同士も一致）"""
+    prefix = f'{alias}.' if alias else ''
+    return ' AND '.join(f'{prefix}{c} IS {_value(c, f"{ref}.{c}")}' for c in DIMENSIONS[table])
+
+
+def key_sql(table: str, ref: str) -> str:
+    """ref の値に対応する次元キーを返すスカラー副問い合わせ（値がすべて NULL なら NULL）"""
+    return f'(SELECT id FROM {table} WHERE {match_sql(table, ref)})'
+
+
+def intern_sql(table: str, ref: str) -> str:
+    """ref の値が次元テーブルになければ追加する INSERT 文
+
+    INSERT OR IGNORE は外側の文の競合解決（OR REPLACE など）に置き換えられるため使わず、
+    一意索引に対する ON CONFLICT DO NOTHING で既にある値を読み飛ばす。
+    """
+    cols = DIMENSIONS[table]
+    values = ', '.join(_value(c, f'{ref}.{c}') for c in cols)
+    any_value = ' OR '.join(f'{ref}.{c} IS NOT NULL' for c in cols)
+    return (f'INSERT INTO {table} ({", ".join(cols)}) SELECT {values} '
+            f'WHERE {any_value} ON CONFLICT DO NOTHING;')
+
+
+def _view_sql(view: str, base: str, columns: List[str], keys: Dict[str, Tuple[str, str]]) -> str:
+    dim_alias = {}
+    for key, (table, alias) in keys.items():
+        for c in DIMENSIONS[table]:
+            dim_alias[c] = alias
+    # 日時は UNIX 秒で保存し、ビューでは従来どおり ISO 形式の文字列として見せる
+    select = ', '.join(f'{dim_alias[c]}.{c}' if c in dim_alias
+                       else f'{ISO_SQL.format(x=f"b.{c}")} AS {c}' if c in EPOCH_COLUMNS
+                       else f'b.{c}' for c in columns)
+    joins = ''.join(f' LEFT JOIN {table} {alias} ON {alias}.id = b.{key}' for key, (table, alias) in keys.items())
+    return f'CREATE VIEW IF NOT EXISTS {view} AS SELECT {select} FROM {base} b{joins}'
+
+
+def _view_triggers(view: str, base: str, columns: List[str], keys: Dict[str, Tuple[str, str]]) -> Dict[str, str]:
+    dim_columns = {c for table, _ in keys.values() for c in DIMENSIONS[table]}
+    base_columns = [c for c in columns if c not in dim_columns]
+    interns = ''.join(f'\n            {intern_sql(table, "new")}' for table, _ in keys.values())
+    insert_cols = base_columns + list(keys)
+    stored = {c: (EPOCH_SQL.format(x=f'new.{c}') if c in EPOCH_COLUMNS else f'new.{c}') for c in base_columns}
+    insert_values = [stored[c] for c in base_columns] + [key_sql(table, 'new') for table, _ in keys.values()]
+    sets = [f'{c} = {stored[c]}' for c in base_columns] + [f'{key} = {key_sql(table, "new")}' for key, (table, _) in keys.items()]
+    return {
+        f'{view}_ii': f'''
+        CREATE TRIGGER IF NOT EXISTS {view}_ii
+        INSTEAD OF INSERT ON {view}
+        BEGIN{interns}
+            INSERT INTO {base} ({", ".join(insert_cols)}) VALUES ({", ".join(insert_values)});
+        END''',
+        f'{view}_iu': f'''
+        CREATE TRIGGER IF NOT EXISTS {view}_iu
+        INSTEAD OF UPDATE ON {view}
+        BEGIN{interns}
+            UPDATE {base} SET {", ".join(sets)} WHERE id = old.id;
+        END''',
+        f'{view}_id': f'''
+        CREATE TRIGGER IF NOT EXISTS {view}_id
+        INSTEAD OF DELETE ON {view}
+        BEGIN
+            DELETE FROM {base} WHERE id = old.id;
+        END''',
+    }
+
+
+COMPAT_VIEWS = {
+    'civitai_prompts': _view_sql('civitai_prompts', PROMPTS_TABLE, PROMPT_COLUMNS, PROMPT_KEYS),
+    **_view_triggers('civitai_prompts', PROMPTS_TABLE, PROMPT_COLUMNS, PROMPT_KEYS),
+}
+
+
+def intern_select(cursor, table: str, source: str, exprs: Dict[str, str], schema: str = 'main'):
+    """source（FROM 句）の各行の値 exprs（次元の列 -> 式）を次元テーブルにまとめて追加する
+
+    マージなど INSERT…SELECT で取り込む経路用。既にある値・すべて NULL の値は追加しない。
+    """
+    cols = DIMENSIONS[table]
+    values = ', '.join(_value(c, exprs[c]) for c in cols)
+    any_value = ' OR '.join(f'{exprs[c]} IS NOT NULL' for c in cols)
+    cursor.execute(f'''
+        INSERT INTO {schema}.{table} ({", ".join(cols)})
+        SELECT DISTINCT {values} FROM {source}
+        WHERE {any_value}
+        ON CONFLICT DO NOTHING
+    ''')
+
+
+def join_condition(table: str, alias: str, exprs: Dict[str, str]) -> str:
+    """次元テーブルの別名 alias の行が exprs の値と一致する結合条件"""
+    return ' AND '.join(f'{alias}.{c} IS {_value(c, exprs[c])}' for c in DIMENSIONS[table])
+
+
+# ----------------------------------------------------------------------
+# スキーマ作成・移行
+# ----------------------------------------------------------------------
+def object_type(cursor, name: str, schema: str = 'main') -> Optional[str]:
+    cursor.execute(f"SELECT type FROM {schema}.sqlite_master WHERE name = ?", (name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _migrate_table(cursor, legacy: str, base: str, columns: List[str], keys: Dict[str, Tuple[str, str]]) -> int:
+    """旧形式の実テーブル legacy の行を、次元キーに置き換えて base に移す（移した行数を返す）"""
+    cursor.execute(f'PRAGMA table_info({legacy})')
+    present = {r[1] for r in cursor.fetchall()}
+
+    def col(c: str) -> str:
+        return f'l.{c}' if c in present else 'NULL'
+
+    for table, _ in keys.values():
+        intern_select(cursor, table, f'{legacy} l', {c: col(c) for c in DIMENSIONS[table]})
+
+    dim_columns = {c for table, _ in keys.values() for c in DIMENSIONS[table]}
+    base_columns = [c for c in columns if c not in dim_columns]
+    select = [EPOCH_SQL.format(x=col(c)) if c in EPOCH_COLUMNS else col(c) for c in base_columns]
+    joins = ''
+    for key, (table, alias) in keys.items():
+        select.append(f'{alias}.id')
+        joins += f' LEFT JOIN {table} {alias} ON {join_condition(table, alias, {c: col(c) for c in DIMENSIONS[table]})}'
+    cursor.execute(f'''
+        INSERT INTO {base} ({", ".join(base_columns + list(keys))})
+        SELECT {", ".join(select)} FROM {legacy} l{joins}
+        ORDER BY l.id
+    ''')
+    moved = cursor.rowcount
+    copy_sequence(cursor, legacy, base)
+    cursor.execute(f'DROP TABLE {legacy}')
+    return moved
+
+
+def _retype_tables(cursor) -> Dict[str, int]:
+    """ID を TEXT、collected_at を ISO 文字列で保存していた版のテーブルを INTEGER 列へ作り直す
+
+    行・id はそのまま。付いていたトリガー・索引は消えるため、setup_database が作り直す。
+    """
+    retyped: Dict[str, int] = {}
+    cursor.execute('SAVEPOINT dimension_retype')
+    try:
+        # ビューは新しい列の見せ方で作り直す
+        cursor.execute('DROP VIEW IF EXISTS civitai_prompts')
+        for table in _RETYPED_TABLES:
+            # 列名は前の版と同じで、宣言型だけが変わる
+            cursor.execute(f'PRAGMA table_info({table})')
+            columns = [r[1] for r in cursor.fetchall()]
+            retype_table(cursor, table, TABLE_SCHEMA[table], columns,
+                         {c: EPOCH_SQL for c in columns if c in EPOCH_COLUMNS})
+            cursor.execute(f'SELECT COUNT(*) FROM {table}')
+            retyped[table] = cursor.fetchone()[0]
+        cursor.execute('RELEASE SAVEPOINT dimension_retype')
+    except Exception:
+        cursor.execute('ROLLBACK TO SAVEPOINT dimension_retype')
+        cursor.execute('RELEASE SAVEPOINT dimension_retype')
+        raise
+    return retyped
+
+
+def ensure_dimension_schema(cursor) -> Dict[str, int]:
+    """次元テーブル・prompts・互換ビュー civitai_prompts を作成し、旧形式のテーブルがあれば移行する
+
+    Returns:
+        移行したテーブル名 -> 行数（移行がなければ空）
+    """
+    for name, create_sql in TABLE_SCHEMA.items():
+        cursor.execute(create_sql.format(table=name))
+    migrated: Dict[str, int] = {}
+    if object_type(cursor, 'civitai_prompts') == 'table':
+        # 途中で失敗しても旧テーブルが残るよう、移行全体を 1 つのセーブポイントにまとめる
+        cursor.execute('SAVEPOINT dimension_migration')
+        try:
+            migrated['civitai_prompts'] = _migrate_table(cursor, 'civitai_prompts', PROMPTS_TABLE,
+                                                         PROMPT_COLUMNS, PROMPT_KEYS)
+            # 旧テーブルを外部コンテンツにしていた全文検索索引は、prompts を参照する形で作り直させる
+            cursor.execute(f'DROP TABLE IF EXISTS {LEGACY_FTS_TABLE}')
+            cursor.execute('RELEASE SAVEPOINT dimension_migration')
+        except Exception:
+            cursor.execute('ROLLBACK TO SAVEPOINT dimension_migration')
+            cursor.execute('RELEASE SAVEPOINT dimension_migration')
+            raise
+    elif declared_type(cursor, PROMPTS_TABLE, 'civitai_id') == 'TEXT':
+        migrated.update(_retype_tables(cursor))
+    for stmt in DIMENSION_INDEXES:
+        cursor.execute(stmt)
+    # 変換式を変えた版のビュー・トリガーは作り直す
+    for name, stmt in COMPAT_VIEWS.items():
+        replace_definition(cursor, name, stmt)
+    return migrated
+
+
+# ----------------------------------------------------------------------
+# 取り込み時のキー解決
+# ----------------------------------------------------------------------
+def _normalize(column: str, value: Any) -> Any:
+    """列に保存されたときと同じ表現にする（ID 列は整数へ、文字列の列は数値も文字列へ）"""
+    if column in INTEGER_ID_COLUMNS:
+        return to_int_id(value)
+    if value is None or isinstance(value, (str, bytes)):
+        return value
+    return str(value)
+
+
+class DimensionCache:
+    """次元の値 -> キーをプロセス内に保持し、取り込み時の問い合わせを省く
+
+    次元テーブルの行は削除されないため、一度確定したキーは DB が置き換えられない限り有効。
+    書き込みトランザクションごとに session() を使い、コミットできたときだけ publish() で
+    キャッシュへ反映する（ロールバックされた行のキーを覚えないように）。
+    validate() は最後に覚えたキーの値を確かめ、DB が差し替えられていたら破棄する。
+    """
+
+    def __init__(self):
+        self._keys: Dict[str, Dict[Tuple[Any, ...], int]] = {table: {} for table in DIMENSIONS}
+        self._last: Dict[str, Tuple[int, Tuple[Any, ...]]] = {}
+
+    def clear(self):
+        for keys in self._keys.values():
+            keys.clear()
+        self._last.clear()
+
+    def validate(self, cursor):
+        """覚えているキーが今の DB でも同じ値を指しているか確かめる（違えば全て破棄）"""
+        for table, (key, values) in list(self._last.items()):
+            cols = DIMENSIONS[table]
+            cursor.execute(f'SELECT {", ".join(cols)} FROM {table} WHERE id = ?', (key,))
+            row = cursor.fetchone()
+            if row is None or tuple(row) != values:
+                print('[DB] Dimension keys changed on disk; clearing the in-memory cache')
+                self.clear()
+                return
+
+    def session(self, cursor) -> 'DimensionSession':
+        """cursor のトランザクション内でキーを引くためのセッションを返す"""
+        self.validate(cursor)
+        return DimensionSession(self, cursor)
+
+    def _publish(self, pending: Dict[str, Dict[Tuple[Any, ...], int]]):
+        for table, keys in pending.items():
+            if keys:
+                self._keys[table].update(keys)
+                self._last[table] = next(reversed(keys.items()))[::-1]
+
+
+class DimensionSession:
+    """1 つの書き込みトランザクションの間のキー解決（新しく引いたキーは publish まで保留）"""
+
+    def __init__(self, cache: DimensionCache, cursor):
+        self._cache = cache
+        self._cursor = cursor
+        self._pending: Dict[str, Dict[Tuple[Any, ...], int]] = {table: {} for table in DIMENSIONS}
+
+    def key(self, table: str, values: Sequence[Any]) -> Optional[int]:
+        """values に対応するキーを返す（なければ次元テーブルに追加する。すべて None なら None）"""
+        cols = DIMENSIONS[table]
+        values = tuple(_normalize(c, v) for c, v in zip(cols, values))
+        if all(v is None for v in values):
+            return None
+        key = self._cache._keys[table].get(values)
+        if key is None:
+            key = self._pending[table].get(values)
+        if key is not None:
+            return key
+        # 他の接続が先に同じ値を追加していても、一意索引で読み飛ばしてから既存の行を引く
+        self._cursor.execute(f'INSERT INTO {table} ({", ".join(cols)}) VALUES ({", ".join("?" * len(cols))}) '
+                             'ON CONFLICT DO NOTHING', values)
+        if self._cursor.rowcount == 1:
+            key = self._cursor.lastrowid
+        else:
+            self._cursor.execute(f'SELECT id FROM {table} WHERE {" AND ".join(f"{c} IS ?" for c in cols)}', values)
+            key = self._cursor.fetchone()[0]
+        self._pending[table][values] = key
+        return key
+
+    def model_key(self, model_id: Any, model_name: Any) -> Optional[int]:
+        return self.key('models', (model_id, model_name))
+
+    def version_key(self, model_version_id: Any) -> Optional[int]:
+        return self.key('model_versions', (model_version_id,))
+
+    def publish(self):
+        """コミット後に呼び、このセッションで引いたキーをキャッシュに反映する"""
+        self._cache._publish(self._pending)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - データエクスポート
+プロンプト（＋カテゴリ）をキーセットページングで少しずつ読み出し、
+CSV / JSONL / Parquet に逐次書き出す（DB サイズに依存しない一定メモリ）
+"""
+
+import os
+import csv
+import json
+import sqlite3
+from typing import Dict, List, Optional, Any, Iterator, Tuple
+
+from .config import DEFAULT_DB_PATH
+from .column_types import to_int_id
+from .dedup import backfill_dedup, representative_clause
+
+try:
+    import pyarrow as pa  # type: ignore[import]
+    import pyarrow.parquet as pq  # type: ignore[import]
+    PYARROW_AVAILABLE = True
+except ImportError:
+    pa = None
+    pq = None
+    PYARROW_AVAILABLE = False
+
+# 出力可能な列: 列名 -> (SQL 式, 型)
+# ID は INTEGER 列だが、数字でない ID も混ざりうるため出力では文字列に揃える
+EXPORT_COLUMNS: Dict[str, Tuple[str, str]] = {
+    'id': ('p.id', 'int'),
+    'civitai_id': ('CAST(p.civitai_id AS TEXT)', 'str'),
+    'full_prompt': ('p.full_prompt', 'str'),
+    'negative_prompt': ('p.negative_prompt', 'str'),
+    'quality_score': ('p.quality_score', 'int'),
+    'reaction_count': ('p.reaction_count', 'int'),
+    'comment_count': ('p.comment_count', 'int'),
+    'download_count': ('p.download_count', 'int'),
+    'prompt_length': ('p.prompt_length', 'int'),
+    'tag_count': ('p.tag_count', 'int'),
+    'model_name': ('p.model_name', 'str'),
+    'model_id': ('CAST(p.model_id AS TEXT)', 'str'),
+    'model_version_id': ('CAST(p.model_version_id AS TEXT)', 'str'),
+    'collected_at': ('p.collected_at', 'str'),
+    'raw_metadata': ('p.raw_metadata', 'str'),
+    'category': ('c.category', 'str'),
+    'keywords': ('c.keywords', 'str'),
+    'confidence': ('c.confidence', 'float'),
+}
+
+# DataVisualizer.export_data_csv と同じ既定の列構成
+DEFAULT_EXPORT_COLUMNS = [
+    'civitai_id', 'full_prompt', 'negative_prompt', 'quality_score', 'reaction_count',
+    'comment_count', 'download_count', 'model_name', 'collected_at', 'category', 'confidence',
+]
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+
+_CATEGORY_COLUMNS = {'category', 'keywords', 'confidence'}
+
+
+def detect_format(path: str) -> str:
+    """拡張子から出力形式を推定する"""
+    ext = os.path.splitext(str(path))[1].lower().lstrip('.')
+    if ext in ('json', 'ndjson'):
+        ext = 'jsonl'
+    if ext == 'pq':
+        ext = 'parquet'
+    return ext if ext in EXPORT_FORMATS else 'csv'
+
+
+class PromptExporter:
+    """プロンプトデータのストリーミングエクスポート"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, batch_size: int = 5000):
+        self.db_path = db_path
+        self.batch_size = max(1, int(batch_size))
+
+    def _build_queries(self, columns: List[str], version_id: Optional[str], category: Optional[str],
+                       min_quality: Optional[int], max_quality: Optional[int],
+                       representatives_only: bool = False) -> Tuple[str, str, List[Any], List[Any]]:
+        """プロンプト ID ページ取得用と行取得用の SQL を組み立てる"""
+        unknown = [c for c in columns if c not in EXPORT_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown export columns: {unknown}")
+
+        where = []
+        params: List[Any] = []
+        if version_id:
+            where.append('p.model_version_id = ?')
+            params.append(to_int_id(version_id))
+        if min_quality is not None:
+            where.append('p.quality_score >= ?')
+            params.append(int(min_quality))
+        if max_quality is not None:
+            where.append('p.quality_score <= ?')
+            params.append(int(max_quality))
+        if category:
+            where.append('EXISTS (SELECT 1 FROM prompt_categories cf WHERE cf.prompt_id = p.id AND cf.category = ?)')
+            params.append(category)
+        if representatives_only:
+            # 近似重複クラスタごとに代表 1 件だけを出力する
+            where.append(representative_clause('p'))
+        filters = ''.join(f' AND {w}' for w in where)
+
+        page_sql = f'SELECT p.id FROM civitai_prompts p WHERE p.id > ?{filters} ORDER BY p.id LIMIT ?'
+
+        select = ', '.join(f'{EXPORT_COLUMNS[c][0]} AS {c}' for c in columns)
+        join = ''
+        join_params: List[Any] = []
+        order = 'p.id'
+        if _CATEGORY_COLUMNS.intersection(columns):
+            # カテゴリ指定時は該当カテゴリの行のみ出力する
+            join = ' LEFT JOIN prompt_categories c ON c.prompt_id = p.id'
+            if category:
+                join += ' AND c.category = ?'
+                join_params.append(category)
+            order = 'p.id, c.id'
+        rows_sql = (f'SELECT {select} FROM civitai_prompts p{join} '
+                    f'WHERE p.id > ? AND p.id <= ?{filters} ORDER BY {order}')
+        return page_sql, rows_sql, params, join_params
+
+    def iter_batches(self, columns: Optional[List[str]] = None, version_id: Optional[str] = None,
+                     category: Optional[str] = None, min_quality: Optional[int] = None,
+                     max_quality: Optional[int] = None, representatives_only: bool = False) -> Iterator[List[tuple]]:
+        """batch_size 件のプロンプトごとに出力行のリストを返すジェネレータ
+
+        p.id によるキーセットページングのため、OFFSET と違い後半のページでも読み出しコストは一定。
+        representatives_only=True なら近似重複クラスタの代表だけを返す。
+        """
+        columns = list(columns or DEFAULT_EXPORT_COLUMNS)
+        page_sql, rows_sql, params, join_params = self._build_queries(columns, version_id, category, min_quality,
+                                                                      max_quality, representatives_only)
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        try:
+            if representatives_only:
+                # 未索引の行が残っていると重複が代表として出てしまうため先に登録する
+                backfill_dedup(conn)
+            last_id = 0
+            while True:
+                cursor.execute(page_sql, [last_id] + params + [self.batch_size])
+                ids = cursor.fetchall()
+                if not ids:
+                    break
+                upper = ids[-1][0]
+                cursor.execute(rows_sql, join_params + [last_id, upper] + params)
+                yield cursor.fetchall()
+                last_id = upper
+                if len(ids) < self.batch_size:
+                    break
+        finally:
+            conn.close()
+
+    def preview(self, columns: Optional[List[str]] = None, limit: int = 5, **filters) -> List[Dict[str, Any]]:
+        """先頭 limit 行をプレビュー用に返す"""
+        columns = list(columns or DEFAULT_EXPORT_COLUMNS)
+        saved = self.batch_size
+        self.batch_size = max(1, int(limit))
+        try:
+            for rows in self.iter_batches(columns, **filters):
+                return [dict(zip(columns, r)) for r in rows[:limit]]
+            return []
+        finally:
+            self.batch_size = saved
+
+    def export(self, path: str, fmt: Optional[str] = None, columns: Optional[List[str]] = None,
+               version_id: Optional[str] = None, category: Optional[str] = None,
+               min_quality: Optional[int] = None, max_quality: Optional[int] = None,
+               representatives_only: bool = False) -> int:
+        """path にエクスポートし、書き出した行数を返す
+
+        一時ファイル (*.part) に書いてから置き換えるため、途中で失敗しても既存ファイルは壊れない。
+        """
+        fmt = (fmt or detect_format(path)).lower()
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        if fmt == 'parquet' and not PYARROW_AVAILABLE:
+            raise ImportError("Parquet export requires pyarrow (pip install pyarrow)")
+
+        columns = list(columns or DEFAULT_EXPORT_COLUMNS)
+        batches = self.iter_batches(columns, version_id=version_id, category=category,
+                                    min_quality=min_quality, max_quality=max_quality,
+                                    representatives_only=representatives_only)
+
+        out_dir = os.path.dirname(str(path))
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        tmp_path = f"{path}.part"
+        try:
+            writer = {'csv': self._write_csv, 'jsonl': self._write_jsonl, 'parquet': self._write_parquet}[fmt]
+            written = writer(tmp_path, columns, batches)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        print(f"[Export] {fmt} -> {path} ({written} rows)")
+        return written
+
+    def _write_csv(self, path: str, columns: List[str], batches: Iterator[List[tuple]]) -> int:
+        written = 0
+        # Excel で文字化けしないよう従来どおり BOM 付き UTF-8
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for rows in batches:
+                writer.writerows(rows)
+                written += len(rows)
+        return written
+
+    def _write_jsonl(self, path: str, columns: List[str], batches: Iterator[List[tuple]]) -> int:
+        written = 0
+        with open(path, 'w', encoding='utf-8') as f:
+            for rows in batches:
+                f.writelines(json.dumps(dict(zip(columns, r)), ensure_ascii=False) + '\n' for r in rows)
+                written += len(rows)
+        return written
+
+    def _write_parquet(self, path: str, columns: List[str], batches: Iterator[List[tuple]]) -> int:
+        types = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string()}
+        schema = pa.schema([(c, types[EXPORT_COLUMNS[c][1]]) for c in columns])
+        written = 0
+        # バッチごとに 1 つの row group として追記する
+        with pq.ParquetWriter(path, schema) as writer:
+            for rows in batches:
+                if not rows:
+                    continue
+                data = {c: [r[i] for r in rows] for i, c in enumerate(columns)}
+                writer.write_table(pa.Table.from_pydict(data, schema=schema))
+                written += len(rows)
+        return written
+
+
+def export_prompts(path: str, db_path: str = DEFAULT_DB_PATH, fmt: Optional[str] = None,
+                   columns: Optional[List[str]] = None, batch_size: int = 5000, **filters) -> int:
+    """便利関数: PromptExporter(db_path).export(path, ...)"""
+    return PromptExporter(db_path, batch_size=batch_size).export(path, fmt=fmt, columns=columns, **filters)
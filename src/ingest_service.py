@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - 単一ライターの取り込みサービス
+収集スクリプト・分類・UI など複数のプロセスが同じ DB に書くと、SQLite の書き込みロックを奪い合い、
+1 バッチごとに fsync を待つことになる。このサービスは DB への書き込みを 1 つのスレッドに集め、
+同時に届いたバッチを 1 回のコミットにまとめる（グループコミット）。コミットが終わってから
+各送り手に保存済みの prompts.id を返すので、返事を受け取った行は必ず DB に残っている。
+
+- 接続は multiprocessing.connection（POSIX は DB の隣の Unix ソケット、Windows は名前付きパイプ）。
+  認証キーは DB ごとに乱数で作り、DB の隣のファイル（所有者だけが読める 0600）に置く
+  （環境変数 CIVITAI_INGEST_AUTHKEY があればそちらを使う）。
+  要求・返事は JSON のバイト列で送る（pickle は受け取った側で任意のコードを実行できるため使わない）
+- 要求の種類: prompts（save_prompts_bulk と同じ辞書。resources も同時に保存）、
+  categories（(prompt_id, categories) の組）、resources（(prompt_id, resources) の組）
+- 1 つの要求が失敗してもセーブポイントで巻き戻すだけで、同じコミットの他の要求は保存される
+- サービスが動いていなければ registry.get_writer は共有の DatabaseManager を返すため、
+  呼び出し側は同じメソッド（save_prompts_bulk など）で書き込める
+
+起動: python scripts/run_ingest_service.py
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import hashlib
+import secrets
+import sqlite3
+import threading
+from datetime import datetime
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import DEFAULT_DB_PATH
+
+# 最初の要求が届いてから、同じコミットに入れる要求を待つ時間（秒）
+GROUP_COMMIT_WINDOW = 0.01
+# 1 回のコミットにまとめる要求数の上限
+MAX_GROUP_REQUESTS = 64
+# 認証キーを直接渡す環境変数（未設定なら DB ごとの鍵ファイルを使う）
+AUTHKEY_ENV = 'CIVITAI_INGEST_AUTHKEY'
+# Unix ソケットのパス長の上限（sun_path は 108 バイト）
+_MAX_SOCKET_PATH = 100
+# 1 つの要求・返事の大きさの上限（これを超える送り手は切断する）
+_MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+
+class IngestError(RuntimeError):
+    """サービスが要求を保存できなかった（またはサービスに接続できない）"""
+
+
+def default_address(db_path: str = DEFAULT_DB_PATH) -> str:
+    """DB ごとのサービスのアドレスを返す"""
+    path = os.path.abspath(db_path)
+    digest = hashlib.sha1(path.lower().encode('utf-8')).hexdigest()[:16]
+    if sys.platform == 'win32':
+        return rf'\\.\pipe\civitai-ingest-{digest}'
+    address = path + '.ingest.sock'
+    if len(address.encode('utf-8')) > _MAX_SOCKET_PATH:
+        address = os.path.join('/tmp', f'civitai-ingest-{digest}.sock')
+    return address
+
+
+def authkey_path(db_path: str = DEFAULT_DB_PATH) -> str:
+    """DB ごとの認証キーのファイル"""
+    return os.path.abspath(db_path) + '.ingest.key'
+
+
+def load_authkey(db_path: str = DEFAULT_DB_PATH, create: bool = False) -> Optional[bytes]:
+    """DB の取り込みサービスの認証キーを返す（読めなければ None）
+
+    create=True（サービス側）ではキーがなければ乱数で作り、所有者だけが読めるファイルに置く。
+    他のユーザーも読めるファイルは漏れたものとみなして作り直す。
+    """
+    if os.environ.get(AUTHKEY_ENV):
+        return os.environ[AUTHKEY_ENV].encode('utf-8')
+    path = authkey_path(db_path)
+    if create:
+        if sys.platform != 'win32' and os.path.exists(path) and os.stat(path).st_mode & 0o077:
+            print(f"[Ingest] Replacing authkey readable by other users: {path}")
+            os.remove(path)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(secrets.token_hex(32))
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            key = f.read().strip()
+    except OSError:
+        return None
+    return key.encode('utf-8') or None
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _send(conn, message: Dict[str, Any]):
+    conn.send_bytes(json.dumps(message, ensure_ascii=False, default=_json_default).encode('utf-8'))
+
+
+def _recv(conn) -> Any:
+    return json.loads(conn.recv_bytes(_MAX_MESSAGE_BYTES).decode('utf-8'))
+
+
+class _Request:
+    """キューに入った 1 つの要求と、返事を送る接続"""
+
+    def __init__(self, conn, send_lock: threading.Lock, op: str, items: List[Any]):
+        self.conn = conn
+        self.send_lock = send_lock
+        self.op = op
+        self.items = items
+
+    def reply(self, message: Dict[str, Any]):
+        try:
+            with self.send_lock:
+                _send(self.conn, message)
+        except (OSError, EOFError):
+            # 送り手が先に切断した（保存は済んでいる）
+            pass
+
+
+class IngestService:
+    """DB への書き込みを 1 スレッドに集めてグループコミットするサービス"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, address: Optional[str] = None,
+                 authkey: Optional[bytes] = None, window: float = GROUP_COMMIT_WINDOW,
+                 max_group: int = MAX_GROUP_REQUESTS):
+        self.db_path = db_path
+        self.address = address or default_address(db_path)
+        self.authkey = authkey or load_authkey(db_path, create=True)
+        self.window = window
+        self.max_group = max_group
+        self.stats = {'requests': 0, 'commits': 0, 'prompts': 0, 'categories': 0, 'resources': 0, 'errors': 0}
+        self._queue: 'queue.Queue[Optional[_Request]]' = queue.Queue()
+        self._listener = None
+        self._writer: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._db = None
+
+    def start(self) -> 'IngestService':
+        """接続の受け付けと書き込みスレッドを開始する"""
+        from .registry import get_database
+        self._db = get_database(self.db_path)
+        if sys.platform != 'win32' and os.path.exists(self.address):
+            # 前回のサービスが残したソケット（動いているサービスがあれば二重起動しない）
+            if ping(self.address, self.authkey):
+                raise IngestError(f'ingest service already running at {self.address}')
+            os.remove(self.address)
+        self._listener = Listener(self.address, authkey=self.authkey)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+        print(f"[Ingest] Listening on {self.address} (db={self.db_path})")
+        return self
+
+    def serve_forever(self):
+        """start して stop されるまで（または Ctrl+C まで）待つ"""
+        if self._listener is None:
+            self.start()
+        try:
+            while not self._stopped.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        """受け付けを止め、キューに残った要求を書き終えてから終了する"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._queue.put(None)
+        if self._listener is not None:
+            try:
+                self._listener.close()
+            except OSError:
+                pass
+        # 受け付けスレッドは accept() で止まったままのことがあるため、書き込みスレッドだけを待つ
+        if self._writer is not None and self._writer is not threading.current_thread():
+            self._writer.join()
+        # 停止後に届いた要求は保存せずに断る（送り手が返事を待ち続けないように）
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request.reply({'ok': False, 'error': 'ingest service stopped'})
+        if sys.platform != 'win32' and os.path.exists(self.address):
+            os.remove(self.address)
+        print(f"[Ingest] Stopped: {self.stats}")
+
+    def _accept_loop(self):
+        while not self._stopped.is_set():
+            try:
+                conn = self._listener.accept()
+            except Exception:
+                # close() で待ち受けが解除された、または認証に失敗した接続
+                if self._stopped.is_set():
+                    return
+                continue
+            threading.Thread(target=self._reader_loop, args=(conn,), daemon=True).start()
+
+    def _reader_loop(self, conn):
+        """1 つの送り手からの要求をキューへ入れる（返事は書き込みスレッドがコミット後に送る）"""
+        send_lock = threading.Lock()
+        try:
+            while not self._stopped.is_set():
+                try:
+                    message = _recv(conn)
+                except ValueError:
+                    message = None
+                op = message.get('op') if isinstance(message, dict) else None
+                if op == 'ping':
+                    _Request(conn, send_lock, op, []).reply({'ok': True, 'db_path': self.db_path,
+                                                             'stats': dict(self.stats)})
+                elif op in ('prompts', 'categories', 'resources'):
+                    self._queue.put(_Request(conn, send_lock, op, list(message.get('items') or [])))
+                else:
+                    _Request(conn, send_lock, str(op), []).reply({'ok': False, 'error': f'unknown op: {op}'})
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _writer_loop(self):
+        conn = sqlite3.connect(self._db.db_path, timeout=30)
+        try:
+            while True:
+                group, last = self._next_group()
+                if group:
+                    self._commit_group(conn, group)
+                if last:
+                    return
+        finally:
+            conn.close()
+
+    def _next_group(self) -> Tuple[List[_Request], bool]:
+        """次のコミットにまとめる要求を取り出す（2 つ目は停止要求を受け取ったか）"""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        group = [first]
+        deadline = time.monotonic() + self.window
+        while len(group) < self.max_group:
+            try:
+                request = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if request is None:
+                return group, True
+            group.append(request)
+        return group, False
+
+    def _commit_group(self, conn: sqlite3.Connection, group: List[_Request]):
+        """要求をセーブポイントで区切って 1 トランザクションで書き、コミット後に返事を送る"""
+        cursor = conn.cursor()
+        replies: List[Tuple[_Request, Dict[str, Any]]] = []
+        sessions: List[Any] = []
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for request in group:
+                pending: List[Any] = []
+                cursor.execute('SAVEPOINT ingest_request')
+                try:
+                    result = self._apply(conn, request, pending)
+                    cursor.execute('RELEASE SAVEPOINT ingest_request')
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO SAVEPOINT ingest_request')
+                    cursor.execute('RELEASE SAVEPOINT ingest_request')
+                    self.stats['errors'] += 1
+                    print(f"[Ingest] Rejected {request.op} batch of {len(request.items)}: {e}")
+                    replies.append((request, {'ok': False, 'error': str(e)}))
+                    continue
+                sessions.extend(pending)
+                replies.append((request, dict(result, ok=True)))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            self.stats['errors'] += len(group)
+            print(f"[Ingest] Group commit failed: {e}")
+            replies = [(request, {'ok': False, 'error': str(e)}) for request in group]
+            sessions = []
+
+        for session in sessions:
+            session.publish()
+        self.stats['commits'] += 1
+        self.stats['requests'] += len(group)
+        for request, reply in replies:
+            if reply['ok']:
+                self.stats[request.op] += len(request.items)
+            request.reply(reply)
+
+    def _apply(self, conn: sqlite3.Connection, request: _Request, sessions: List[Any]) -> Dict[str, Any]:
+        db = self._db
+        if request.op == 'prompts':
+            result, prompt_ids = db.write_prompts(conn, request.items, sessions)
+            # JSON のオブジェクトのキーは文字列になるため、civitai_id の型を保つよう組の列で返す
+            return dict(result, ids=list(prompt_ids.items()))
+        if request.op == 'categories':
+            return {'saved': db.write_categories(conn.cursor(), [tuple(item) for item in request.items])}
+        return db.write_resources(conn.cursor(), [tuple(item) for item in request.items], sessions)
+
+
+class IngestClient:
+    """取り込みサービスへの接続
+
+    DatabaseManager と同じ名前の保存メソッドを持つため、呼び出し側は書き込み先を区別しなくてよい。
+    1 つの接続をスレッド間で共有できる（要求と返事の組ごとにロックする）。
+    """
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self._lock = threading.Lock()
+        try:
+            self._conn = Client(address, authkey=authkey)
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise IngestError(f'cannot connect to ingest service at {address}: {e}') from e
+
+    def _call(self, op: str, items: Optional[List[Any]] = None) -> Dict[str, Any]:
+        try:
+            payload = json.dumps({'op': op, 'items': items or []}, ensure_ascii=False,
+                                 default=_json_default).encode('utf-8')
+        except (TypeError, ValueError) as e:
+            raise IngestError(f'cannot encode {op} request: {e}') from e
+        with self._lock:
+            try:
+                self._conn.send_bytes(payload)
+                reply = _recv(self._conn)
+            except (OSError, EOFError, ValueError) as e:
+                raise IngestError(f'ingest service connection lost: {e}') from e
+        if not reply.get('ok'):
+            raise IngestError(reply.get('error') or 'ingest failed')
+        return reply
+
+    def ingest_prompts(self, prompts: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """プロンプトを保存し、{'inserted', 'updated', 'ids': civitai_id -> prompts.id} を返す（コミット済み）"""
+        reply = self._call('prompts', [p for p in prompts if p])
+        reply['ids'] = dict(reply.get('ids') or [])
+        return reply
+
+    def save_prompts_bulk(self, prompts: List[Dict[str, Any]]) -> Dict[str, int]:
+        """DatabaseManager.save_prompts_bulk と同じ返り値"""
+        reply = self.ingest_prompts(prompts)
+        return {'inserted': reply['inserted'], 'updated': reply['updated']}
+
+    def save_prompt_data(self, prompt_data: Dict[str, Any]) -> bool:
+        """1 件保存する（新規なら True。DatabaseManager.save_prompt_data と同じ）"""
+        try:
+            return self.save_prompts_bulk([prompt_data])['inserted'] == 1
+        except IngestError as e:
+            print(f"[Ingest] Error saving prompt data: {e}")
+            return False
+
+    def save_prompt_categories_bulk(self, items: List[Tuple[int, Dict[str, Dict]]]) -> int:
+        try:
+            return self._call('categories', list(items))['saved'] if items else 0
+        except IngestError as e:
+            print(f"[Ingest] Error saving categories: {e}")
+            return 0
+
+    def save_prompt_categories(self, prompt_id: int, categories: Dict[str, Dict]) -> bool:
+        return self.save_prompt_categories_bulk([(prompt_id, categories)]) == 1
+
+    def save_prompt_resources(self, prompt_id: int, resources: List[Dict[str, Any]]) -> bool:
+        try:
+            self._call('resources', [(prompt_id, resources)])
+            return True
+        except IngestError as e:
+            print(f"[Ingest] Error saving resources: {e}")
+            return False
+
+    def ping(self) -> bool:
+        try:
+            return bool(self._call('ping'))
+        except IngestError:
+            return False
+
+    def close(self):
+        try:
+            self._conn.close()
+        except OSError:
+            pass
+
+
+def ping(address: str, authkey: Optional[bytes]) -> bool:
+    """address でサービスが応答するか"""
+    if not authkey or (sys.platform != 'win32' and not os.path.exists(address)):
+        return False
+    try:
+        client = IngestClient(address, authkey)
+    except IngestError:
+        return False
+    try:
+        return client.ping()
+    finally:
+        client.close()
+
+
+def is_running(db_path: str = DEFAULT_DB_PATH) -> bool:
+    """DB の取り込みサービスが動いているか"""
+    return ping(default_address(db_path), load_authkey(db_path))
+
+
+def connect(db_path: str = DEFAULT_DB_PATH, address: Optional[str] = None) -> Optional[IngestClient]:
+    """DB のサービスが動いていれば接続したクライアントを、なければ None を返す"""
+    address = address or default_address(db_path)
+    authkey = load_authkey(db_path)
+    if not authkey or (sys.platform != 'win32' and not os.path.exists(address)):
+        return None
+    try:
+        client = IngestClient(address, authkey)
+    except IngestError:
+        return None
+    if not client.ping():
+        client.close()
+        return None
+    return client
@@ -168,13 +168,22 @@ class KeywordTargetCollector:
 
         return gaps
 
-    def recommend_collection_targets(self, model_analysis: Dict) -> Dict[str, Any]:
-        """収集ターゲット推奨"""
+    def recommend_collection_targets(self, model_analysis: Dict, associations=None,
+                                     per_keyword: int = 3) -> Dict[str, Any]:
+        """収集ターゲット推奨
+
+        Args:
+            model_analysis: 既存データの分析結果（sexual_expression_rate など）
+            associations: src.cooccurrence.CooccurrenceIndex。渡すと、推奨キーワードと
+                収集済みデータで共起しやすいタグを 'associated' に追加する
+            per_keyword: キーワードあたりの関連タグ数
+        """
 
         recommendations = {
             'high_priority': [],
             'medium_priority': [],
             'experimental': [],
+            'associated': {},
             'reasoning': {}
         }
 
@@ -196,6 +205,18 @@ class KeywordTargetCollector:
             recommendations['experimental'].extend(self.pregnancy_lactation[:5])
             recommendations['reasoning']['experimental'] = "豊富な性的表現があるため、特殊フェチや専門カテゴリを実験"
 
+        # 収集済みデータのタグ共起（リフト順）から、各推奨キーワードと一緒に使われるタグを追加
+        if associations is not None:
+            targets = (recommendations['high_priority'] + recommendations['medium_priority']
+                       + recommendations['experimental'])
+            for keyword in targets:
+                related = [r['tag'] for r in associations.top_associated(keyword, k=per_keyword, by='lift')
+                           if r['tag'] not in targets]
+                if related:
+                    recommendations['associated'][keyword] = related
+            if recommendations['associated']:
+                recommendations['reasoning']['associated'] = "収集済みデータで推奨キーワードと共起しやすいタグ"
+
         return recommendations
 
 def add_keyword_target_ui():
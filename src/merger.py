@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - データベースマージ
+複数のソース DB を ATTACH し、civitai_id をキーに集合演算 (INSERT…SELECT) で取り込む
+
+- civitai_prompts  : civitai_id で UPSERT（既定は既存行を残す）。モデル・バージョンは宛先の次元キーに置き換える
+- prompt_categories: ソースの prompt_id を civitai_id 経由の JOIN で付け替え、(prompt_id, category) で重複排除
+- prompt_resources : 同様に付け替え、宛先に資源が未登録のプロンプトのみ取り込む（リソースは宛先のカタログに登録）
+"""
+
+import sqlite3
+from pathlib import Path
+from typing import Dict, List, Any, Sequence
+
+from .database import DatabaseManager
+from . import dimensions, resources
+from .column_types import EPOCH_COLUMNS, EPOCH_SQL
+from .prompt_syntax import SYNTAX_COLUMNS, backfill_syntax_columns
+from .dedup import backfill_dedup
+
+# SQLite の既定 ATTACH 上限 (10) から main/temp 分の余裕を残す
+MAX_ATTACH_PER_TRANSACTION = 8
+
+# update_existing=True のとき上書きする列（集計値は新しい値、その他は空欄のみ補完）
+_COUNTER_COLUMNS = ['quality_score', 'reaction_count', 'comment_count', 'download_count']
+
+
+def _uri(path: str, readonly: bool = False) -> str:
+    uri = Path(path).resolve().as_uri()
+    return uri + ('?mode=ro' if readonly else '')
+
+
+def _columns(cursor: sqlite3.Cursor, schema: str, table: str) -> List[str]:
+    cursor.execute(f'PRAGMA {schema}.table_info({table})')
+    return [r[1] for r in cursor.fetchall()]
+
+
+def _merge_prompts(cursor: sqlite3.Cursor, alias: str, update_existing: bool) -> Dict[str, int]:
+    # ソースは旧形式の実テーブルでも互換ビューでもよい。宛先は実体テーブルに直接書き込む
+    # （ビュー経由の INSERT では rowcount が得られないため）
+    dst_cols = _columns(cursor, 'main', dimensions.PROMPTS_TABLE)
+    src_cols = set(_columns(cursor, alias, 'civitai_prompts'))
+    # 記法の特徴量はコピーせず、マージ後に宛先で計算し直す（NULL = 未計算）
+    cols = [c for c in dst_cols if c != 'id' and c in src_cols and c not in SYNTAX_COLUMNS]
+    source = f'{alias}.civitai_prompts s'
+
+    # モデル・バージョンの文字列は宛先の次元テーブルに登録してキーに置き換える
+    # 日時は宛先の保存形式（UNIX 秒）へ、ID は INTEGER 列の型変換で揃う
+    select = [EPOCH_SQL.format(x=f's.{c}') if c in EPOCH_COLUMNS else f's.{c}' for c in cols]
+    joins = ''
+    keys = []
+    for key, (table, dim_alias) in dimensions.PROMPT_KEYS.items():
+        exprs = {c: (f's.{c}' if c in src_cols else 'NULL') for c in dimensions.DIMENSIONS[table]}
+        if all(e == 'NULL' for e in exprs.values()):
+            continue
+        dimensions.intern_select(cursor, table, source, exprs)
+        joins += f' LEFT JOIN main.{table} {dim_alias} ON {dimensions.join_condition(table, dim_alias, exprs)}'
+        select.append(f'{dim_alias}.id')
+        keys.append(key)
+    col_list = ', '.join(cols + keys)
+
+    cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM main.{dimensions.PROMPTS_TABLE}')
+    max_before = cursor.fetchone()[0]
+
+    if update_existing:
+        sets = []
+        for c in cols:
+            if c == 'civitai_id':
+                continue
+            if c in _COUNTER_COLUMNS:
+                sets.append(f'{c} = COALESCE(excluded.{c}, prompts.{c})')
+            else:
+                sets.append(f"{c} = COALESCE(NULLIF(prompts.{c}, ''), excluded.{c})")
+        if 'model_key' in keys:
+            sets.append('model_key = COALESCE(prompts.model_key, excluded.model_key)')
+        if 'version_key' in keys:
+            sets.append("""version_key = CASE
+                WHEN prompts.version_key IS NULL
+                  OR prompts.version_key IN (SELECT id FROM main.model_versions WHERE model_version_id = '')
+                THEN excluded.version_key ELSE prompts.version_key END""")
+        sets += [f'{c} = NULL' for c in SYNTAX_COLUMNS]
+        conflict = 'DO UPDATE SET ' + ', '.join(sets)
+    else:
+        conflict = 'DO NOTHING'
+
+    # WHERE 句は INSERT…SELECT と ON CONFLICT の構文上の曖昧さ回避のためにも必要
+    cursor.execute(f'''
+        INSERT INTO main.{dimensions.PROMPTS_TABLE} ({col_list})
+        SELECT {', '.join(select)} FROM {source}{joins} WHERE s.civitai_id IS NOT NULL
+        ON CONFLICT (civitai_id) {conflict}
+    ''')
+    touched = max(cursor.rowcount, 0)
+    cursor.execute(f'SELECT COUNT(*) FROM main.{dimensions.PROMPTS_TABLE} WHERE id > ?', (max_before,))
+    inserted = cursor.fetchone()[0]
+    cursor.execute(f'SELECT COUNT(*) FROM {alias}.civitai_prompts')
+    source_rows = cursor.fetchone()[0]
+    return {
+        'source': source_rows,
+        'inserted': inserted,
+        'updated': touched - inserted if update_existing else 0,
+        'skipped': source_rows - touched,
+    }
+
+
+def _merge_categories(cursor: sqlite3.Cursor, alias: str) -> Dict[str, int]:
+    cursor.execute(f'''
+        INSERT INTO main.prompt_categories (prompt_id, category, keywords, confidence)
+        SELECT d.id, sc.category, sc.keywords, MAX(sc.confidence)
+        FROM {alias}.prompt_categories sc
+        JOIN {alias}.civitai_prompts sp ON sp.id = sc.prompt_id
+        JOIN main.{dimensions.PROMPTS_TABLE} d ON d.civitai_id = sp.civitai_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM main.prompt_categories dc
+            WHERE dc.prompt_id = d.id AND dc.category IS sc.category
+        )
+        GROUP BY d.id, sc.category
+    ''')
+    inserted = max(cursor.rowcount, 0)
+    cursor.execute(f'SELECT COUNT(*) FROM {alias}.prompt_categories')
+    return {'source': cursor.fetchone()[0], 'inserted': inserted}
+
+
+def _merge_resources(cursor: sqlite3.Cursor, alias: str) -> Dict[str, int]:
+    # ソースは旧形式の実テーブル・旧互換ビュー・カタログの互換ビューのいずれでもよい
+    src_cols = set(_columns(cursor, alias, 'prompt_resources'))
+    exprs = {c: f'sr.{c}' for c in resources.LEGACY_RESOURCE_COLUMNS + ['weight'] if c in src_cols}
+    exprs['prompt_id'] = 'd.id'
+    source = (f'{alias}.prompt_resources sr '
+              f'JOIN {alias}.civitai_prompts sp ON sp.id = sr.prompt_id '
+              f'JOIN main.{dimensions.PROMPTS_TABLE} d ON d.civitai_id = sp.civitai_id')
+    resources.intern_catalog(cursor, source, exprs)
+    links = resources.LINKS_TABLE
+    catalog_id = resources.catalog_id_sql(exprs)
+    # SELECT 側が宛先テーブルを参照するため、SQLite は結果を確定させてから挿入する
+    # （同じプロンプトの複数資源がまとめて取り込まれる）
+    cursor.execute(f'''
+        INSERT INTO main.{links} (prompt_id, idx, resource_id, weight)
+        SELECT d.id, COALESCE({exprs.get('resource_index', 'NULL')}, 0), {catalog_id}, {resources.link_weight_sql(exprs)}
+        FROM {source}
+        WHERE {catalog_id} IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM main.{links} dl WHERE dl.prompt_id = d.id)
+        ON CONFLICT (prompt_id, idx) DO NOTHING
+    ''')
+    inserted = max(cursor.rowcount, 0)
+    cursor.execute(f'SELECT COUNT(*) FROM {alias}.prompt_resources')
+    return {'source': cursor.fetchone()[0], 'inserted': inserted}
+
+
+def _has_table(cursor: sqlite3.Cursor, alias: str, table: str) -> bool:
+    # 新しい形式の DB では civitai_prompts / prompt_resources は互換ビュー
+    cursor.execute(f"SELECT 1 FROM {alias}.sqlite_master WHERE type IN ('table', 'view') AND name=?", (table,))
+    return cursor.fetchone() is not None
+
+
+def merge_databases(dst_path: str, src_paths: Sequence[str], update_existing: bool = False,
+                    dry_run: bool = False) -> Dict[str, Any]:
+    """src_paths の各 DB を dst_path に取り込み、ソースごと・テーブルごとの件数を返す
+
+    ATTACH 上限のためソースは MAX_ATTACH_PER_TRANSACTION 件ずつ 1 トランザクションで処理する。
+    dry_run=True の場合は件数のみ集計してロールバックする。
+    """
+    # 宛先のスキーマ・トリガー（全文検索・集計）を最新化
+    DatabaseManager(dst_path)
+
+    report: Dict[str, Any] = {'dst': dst_path, 'dry_run': dry_run, 'sources': []}
+    conn = sqlite3.connect(_uri(dst_path), uri=True, isolation_level=None)
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA temp_store = MEMORY')
+
+    try:
+        paths = list(src_paths)
+        for start in range(0, len(paths), MAX_ATTACH_PER_TRANSACTION):
+            group = paths[start:start + MAX_ATTACH_PER_TRANSACTION]
+            aliases = []
+            for i, path in enumerate(group):
+                alias = f'src{i}'
+                cursor.execute('ATTACH DATABASE ? AS ' + alias, (_uri(path, readonly=True),))
+                aliases.append((alias, path))
+
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                for alias, path in aliases:
+                    entry: Dict[str, Any] = {'path': path}
+                    if not _has_table(cursor, alias, 'civitai_prompts'):
+                        entry['error'] = 'civitai_prompts table not found'
+                        report['sources'].append(entry)
+                        continue
+                    entry['civitai_prompts'] = _merge_prompts(cursor, alias, update_existing)
+                    if _has_table(cursor, alias, 'prompt_categories'):
+                        entry['prompt_categories'] = _merge_categories(cursor, alias)
+                    if _has_table(cursor, alias, 'prompt_resources'):
+                        entry['prompt_resources'] = _merge_resources(cursor, alias)
+                    report['sources'].append(entry)
+                    print(f"[Merge] {path}: {entry}")
+                cursor.execute('ROLLBACK' if dry_run else 'COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            finally:
+                for alias, _ in aliases:
+                    cursor.execute(f'DETACH DATABASE {alias}')
+
+        totals: Dict[str, Dict[str, int]] = {}
+        for entry in report['sources']:
+            for table, counts in entry.items():
+                if isinstance(counts, dict):
+                    bucket = totals.setdefault(table, {})
+                    for k, v in counts.items():
+                        bucket[k] = bucket.get(k, 0) + v
+        report['totals'] = totals
+        if not dry_run:
+            # 自動コミットの接続では 1 行ずつコミットになるため、通常の接続でチャンク単位に更新する
+            # 取り込んだ行は近似重複の索引にも登録する
+            backfill_conn = sqlite3.connect(dst_path)
+            try:
+                backfill_syntax_columns(backfill_conn)
+                backfill_dedup(backfill_conn)
+            finally:
+                backfill_conn.close()
+        return report
+
+    finally:
+        conn.close()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - プロンプト記法の特徴量
+カンマ区切り・重み付け (:1.2)・括弧・エンベッディング (<lora:...>) の使用有無を
+保存時に計算して prompts（civitai_prompts の実体）の列に持たせ、集計を SQL だけで行えるようにする。
+"""
+
+import re
+import sqlite3
+from typing import Dict, Optional
+
+# 列名 -> 型（prompts に追加する）
+SYNTAX_COLUMNS = {
+    'has_comma': 'INTEGER',
+    'has_weights': 'INTEGER',
+    'has_embedding': 'INTEGER',
+    'paren_count': 'INTEGER',
+}
+
+# 未計算の行を索引だけで見つけるための部分インデックス
+SYNTAX_PENDING_INDEX = (
+    "CREATE INDEX IF NOT EXISTS idx_prompts_syntax_pending "
+    "ON prompts (id) WHERE has_comma IS NULL"
+)
+
+_WEIGHT_RE = re.compile(r':\s*\d+\.?\d*')
+_EMBEDDING_RE = re.compile(r'<[^>]+>')
+
+
+def syntax_features(text: Optional[str]) -> Dict[str, int]:
+    """プロンプト文字列から記法の特徴量を返す（UI の詳細分析と同じ判定）"""
+    text = text or ''
+    return {
+        'has_comma': int(',' in text),
+        'has_weights': int(_WEIGHT_RE.search(text) is not None),
+        'has_embedding': int(_EMBEDDING_RE.search(text) is not None),
+        'paren_count': text.count('(') + text.count('['),
+    }
+
+
+def ensure_syntax_columns(cursor) -> bool:
+    """不足している特徴量の列を追加する（追加した場合 True）"""
+    cursor.execute("PRAGMA table_info(prompts)")
+    existing = {r[1] for r in cursor.fetchall()}
+    added = False
+    for name, col_type in SYNTAX_COLUMNS.items():
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE prompts ADD COLUMN {name} {col_type}')
+            added = True
+    cursor.execute(SYNTAX_PENDING_INDEX)
+    return added
+
+
+def backfill_syntax_columns(conn: sqlite3.Connection, chunk_size: int = 5000) -> int:
+    """特徴量が未計算（has_comma IS NULL）の行を計算して埋め、更新した行数を返す
+
+    マージや旧スクリプトなど、列を設定しない経路で入った行もここで補完される。
+    """
+    updated = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, full_prompt FROM prompts WHERE has_comma IS NULL LIMIT ?', (chunk_size,)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            'UPDATE prompts SET has_comma = ?, has_weights = ?, has_embedding = ?, paren_count = ? WHERE id = ?',
+            [(f['has_comma'], f['has_weights'], f['has_embedding'], f['paren_count'], prompt_id)
+             for prompt_id, f in ((pid, syntax_features(text)) for pid, text in rows)]
+        )
+        conn.commit()
+        updated += len(rows)
+        if len(rows) < chunk_size:
+            break
+    return updated
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - プロセス内の共有リソース
+DatabaseManager・取り込みサービスへの接続・分類器・HTTP セッションをプロセスごとに 1 つだけ作って使い回す。
+
+Streamlit の再実行はスクリプトを再評価するだけで import 済みモジュールは残るため、
+UI でも CLI でも同じ関数で取得できる。取得時に一定間隔でヘルスチェックを行い、
+失敗したリソース（DB ファイルが消えた、など）は作り直す。
+"""
+
+import os
+import time
+import atexit
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from .config import DEFAULT_DB_PATH
+
+# ヘルスチェックの最短間隔（秒）。取得のたびに DB へ問い合わせないようにする
+HEALTH_CHECK_INTERVAL = 30.0
+
+_lock = threading.RLock()
+_resources: Dict[str, Dict[str, Any]] = {}
+
+
+def get_resource(name: str, factory: Callable[[], Any],
+                 health_check: Optional[Callable[[Any], bool]] = None,
+                 close: Optional[Callable[[Any], None]] = None) -> Any:
+    """name のリソースを返す（なければ factory で作成して登録する）"""
+    with _lock:
+        entry = _resources.get(name)
+        if entry is not None:
+            now = time.time()
+            if entry['health_check'] is None or now - entry['checked_at'] < HEALTH_CHECK_INTERVAL:
+                return entry['value']
+            if _is_healthy(name, entry):
+                entry['checked_at'] = now
+                return entry['value']
+            print(f"[Registry] {name} failed health check; recreating")
+            release(name)
+        value = factory()
+        _resources[name] = {'value': value, 'health_check': health_check, 'close': close,
+                            'created_at': time.time(), 'checked_at': time.time()}
+        return value
+
+
+def _is_healthy(name: str, entry: Dict[str, Any]) -> bool:
+    try:
+        return bool(entry['health_check'](entry['value']))
+    except Exception as e:
+        print(f"[Registry] {name} health check error: {e}")
+        return False
+
+
+def release(name: str) -> bool:
+    """リソースを閉じて登録を解除する（登録がなければ False）"""
+    with _lock:
+        entry = _resources.pop(name, None)
+    if entry is None:
+        return False
+    if entry['close'] is not None:
+        try:
+            entry['close'](entry['value'])
+        except Exception as e:
+            print(f"[Registry] Failed to close {name}: {e}")
+    return True
+
+
+def release_all():
+    """すべてのリソースを閉じる（プロセス終了時にも呼ばれる）"""
+    for name in list(_resources):
+        release(name)
+
+
+def health_check() -> Dict[str, bool]:
+    """登録中の全リソースのヘルスチェック結果を返す（間隔に関係なく実行する）"""
+    with _lock:
+        result = {}
+        for name, entry in _resources.items():
+            healthy = entry['health_check'] is None or _is_healthy(name, entry)
+            if healthy:
+                entry['checked_at'] = time.time()
+            result[name] = healthy
+        return result
+
+
+def get_database(db_path: str = DEFAULT_DB_PATH):
+    """パスごとに共有の DatabaseManager を返す（setup_database はプロセスで 1 回だけ実行される）"""
+    from .database import DatabaseManager
+    return get_resource(f"db:{os.path.abspath(db_path)}", lambda: DatabaseManager(db_path),
+                        health_check=lambda db: db.ping())
+
+
+def get_writer(db_path: str = DEFAULT_DB_PATH):
+    """書き込み先を返す（取り込みサービスが動いていればそのクライアント、なければ共有の DatabaseManager）
+
+    どちらも save_prompts_bulk / save_prompt_data / save_prompt_categories(_bulk) / save_prompt_resources を持つ。
+    サービスの有無はヘルスチェックの間隔ごとに確かめ直す。
+    """
+    from .ingest_service import connect, is_running
+    # サービスがない（None）状態は、サービスが起動されるまで正常とみなす
+    client = get_resource(f"ingest:{os.path.abspath(db_path)}", lambda: connect(db_path),
+                          health_check=lambda c: c.ping() if c is not None else not is_running(db_path),
+                          close=lambda c: c is not None and c.close())
+    return client if client is not None else get_database(db_path)
+
+
+def get_categorizer():
+    """キーワード表を構築済みの PromptCategorizer を返す"""
+    from .categorizer import PromptCategorizer
+    return get_resource('categorizer', PromptCategorizer)
+
+
+def get_http_session():
+    """CivitAI API 用の requests.Session を返す（接続を使い回す）"""
+    import requests
+    return get_resource('http', requests.Session, close=lambda s: s.close())
+
+
+atexit.register(release_all)
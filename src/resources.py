@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - civitaiResources の抽出・リソースカタログ・バックフィル
+raw_metadata（JSON、または UI が保存した Python repr 形式）から使用リソースを取り出して保存する
+
+- resources             : リソースカタログ。(type, modelVersionId) ごとに 1 行だけ持ち、
+                          元の JSON もここに 1 回だけ保存する（modelVersionId がないものは (type, name) ごと）
+- prompt_resource_links : プロンプト -> 使用リソースの細いリンク表 (prompt_id, idx, resource_id, weight)
+- prompt_resources      : 従来の列で読める互換ビュー（resource_raw は weight を戻した JSON）
+
+リンクは差分で更新する（変わった idx の行だけ書き換え、消えた idx だけ削除する）。
+「LoRA X を使ったプロンプト」は links の resource_id 索引で引ける。
+"""
+
+import ast
+import os
+import json
+import time
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Iterator, Sequence, Tuple
+
+from .config import DEFAULT_DB_PATH
+from .column_types import to_int_id
+from .dimensions import PROMPTS_TABLE, object_type
+
+BACKFILL_JOB_NAME = 'prompt_resources_backfill'
+
+CHECKPOINT_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS job_checkpoints (
+        name TEXT PRIMARY KEY,
+        last_id INTEGER DEFAULT 0,
+        updated_at TIMESTAMP
+    )
+"""
+
+
+CATALOG_TABLE = 'resources'
+LINKS_TABLE = 'prompt_resource_links'
+
+CATALOG_SCHEMA = {
+    CATALOG_TABLE: f'''
+        CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} (
+            id INTEGER PRIMARY KEY,
+            resource_type TEXT NOT NULL,
+            resource_model_version_id INTEGER,
+            resource_name TEXT NOT NULL,
+            resource_model_id INTEGER,
+            civitai_resource_id TEXT,
+            resource_raw TEXT
+        )
+    ''',
+    # カタログの同一性: modelVersionId があれば (modelVersionId, type)、なければ (name, type)
+    'idx_resources_version': f'''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_resources_version
+        ON {CATALOG_TABLE} (resource_model_version_id, resource_type) WHERE resource_model_version_id IS NOT NULL
+    ''',
+    'idx_resources_unversioned': f'''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_resources_unversioned
+        ON {CATALOG_TABLE} (resource_name, resource_type) WHERE resource_model_version_id IS NULL
+    ''',
+    LINKS_TABLE: f'''
+        CREATE TABLE IF NOT EXISTS {LINKS_TABLE} (
+            prompt_id INTEGER NOT NULL REFERENCES {PROMPTS_TABLE} (id),
+            idx INTEGER NOT NULL,
+            resource_id INTEGER NOT NULL REFERENCES {CATALOG_TABLE} (id),
+            weight REAL,
+            PRIMARY KEY (prompt_id, idx)
+        ) WITHOUT ROWID
+    ''',
+    'idx_prompt_resource_links_resource': f'''
+        CREATE INDEX IF NOT EXISTS idx_prompt_resource_links_resource ON {LINKS_TABLE} (resource_id)
+    ''',
+    # プロンプトを削除したらリンクも消す
+    'prompt_resource_links_ad': f'''
+        CREATE TRIGGER IF NOT EXISTS prompt_resource_links_ad AFTER DELETE ON {PROMPTS_TABLE}
+        BEGIN
+            DELETE FROM {LINKS_TABLE} WHERE prompt_id = old.id;
+        END
+    ''',
+    # 互換ビュー（旧 prompt_resources の行ごとの id はない。行は (prompt_id, resource_index) で決まる）
+    'prompt_resources': f'''
+        CREATE VIEW IF NOT EXISTS prompt_resources AS
+        SELECT l.prompt_id, l.idx AS resource_index, c.resource_type, c.resource_name, c.resource_model_id,
+               c.resource_model_version_id, c.civitai_resource_id AS resource_id,
+               CASE WHEN l.weight IS NOT NULL AND json_valid(c.resource_raw)
+                    THEN json_set(c.resource_raw, '$.weight', l.weight) ELSE c.resource_raw END AS resource_raw,
+               l.weight
+        FROM {LINKS_TABLE} l JOIN {CATALOG_TABLE} c ON c.id = l.resource_id
+    ''',
+}
+
+# 旧形式の使用リソース（(prompt_id, resource_index) ごとに種類・名前・JSON を持つ行）の列
+LEGACY_RESOURCE_COLUMNS = ['prompt_id', 'resource_index', 'resource_type', 'resource_name', 'resource_model_id',
+                   'resource_model_version_id', 'resource_id', 'resource_raw']
+
+
+def load_raw_metadata(raw: Any) -> Optional[Dict[str, Any]]:
+    """raw_metadata を辞書に変換する
+
+    collector は json.dumps、UI の収集処理は str(item)（Python の repr）で保存しているため、
+    JSON として読めない場合は ast.literal_eval（リテラルのみ評価する安全なパーサ）で読む。
+    """
+    if isinstance(raw, dict):
+        return raw
+    if not raw or not isinstance(raw, (str, bytes)):
+        return None
+    try:
+        parsed = json.loads(raw)
+    except (ValueError, TypeError):
+        try:
+            parsed = ast.literal_eval(raw if isinstance(raw, str) else raw.decode('utf-8', 'replace'))
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def extract_resources(item: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """API のアイテム（画像）辞書から civitaiResources を正規化したリストを返す"""
+    meta = item.get('meta') or item.get('metadata') or {}
+    if not isinstance(meta, dict):
+        meta = {}
+    civres = meta.get('civitaiResources') or item.get('civitaiResources') or []
+    resources = []
+    if isinstance(civres, list):
+        for idx, r in enumerate(civres):
+            if not isinstance(r, dict):
+                continue
+            resources.append({
+                'index': idx,
+                'type': r.get('type') or r.get('resourceType') or '',
+                'name': r.get('name') or r.get('resourceName') or r.get('checkpointName') or '',
+                'modelId': str(r.get('modelId') or r.get('model') or ''),
+                'modelVersionId': str(r.get('modelVersionId') or r.get('id') or ''),
+                'resourceId': str(r.get('id') or r.get('resourceId') or ''),
+                'weight': _weight(r.get('weight')),
+                'raw': json.dumps(r, ensure_ascii=False, default=str)
+            })
+    return resources
+
+
+def parse_resources_from_raw(raw_text: Any) -> List[Dict[str, Any]]:
+    """raw_metadata 文字列から正規化済みリソースのリストを返す（読めない場合は空リスト）"""
+    item = load_raw_metadata(raw_text)
+    return extract_resources(item) if item else []
+
+
+def _weight(value: Any) -> Optional[float]:
+    """適用強度（LoRA の weight など）。数値として読めなければ None"""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# ----------------------------------------------------------------------
+# リソースカタログ
+# ----------------------------------------------------------------------
+def catalog_identity(resource: Dict[str, Any]) -> Optional[Tuple[str, Any, Optional[str]]]:
+    """カタログ上の同一性 (type, modelVersionId, name) を返す（name は modelVersionId がないときだけ使う）
+
+    type・modelVersionId・name がどれも空なら None（カタログに載せない）。
+    """
+    rtype = '' if resource.get('type') is None else str(resource.get('type'))
+    version = to_int_id(resource.get('modelVersionId'))
+    if version == '':
+        version = None
+    name = '' if resource.get('name') is None else str(resource.get('name'))
+    if not rtype and version is None and not name:
+        return None
+    return (rtype, version, None if version is not None else name)
+
+
+def _split_raw(resource: Dict[str, Any]) -> Tuple[Any, Optional[float]]:
+    """元の JSON からプロンプトごとに変わる weight を外し、(カタログに保存する JSON, weight) を返す"""
+    raw = resource.get('raw')
+    weight = _weight(resource.get('weight'))
+    try:
+        parsed = json.loads(raw) if isinstance(raw, str) else None
+    except ValueError:
+        parsed = None
+    if isinstance(parsed, dict) and 'weight' in parsed:
+        if 'weight' not in resource:
+            weight = _weight(parsed['weight'])
+        parsed.pop('weight')
+        raw = json.dumps(parsed, ensure_ascii=False, default=str)
+    return raw, weight
+
+
+def _catalog_sql(exprs: Dict[str, str]) -> Dict[str, str]:
+    """旧形式の列（またはビュー・new）の式 exprs を、カタログの保存形式に揃えた SQL 式にする"""
+    raw = exprs.get('resource_raw', 'NULL')
+    weight_from_raw = (f"(CASE WHEN json_valid({raw}) THEN CASE WHEN json_type({raw}, '$.weight') IN ('integer', 'real') "
+                       f"THEN json_extract({raw}, '$.weight') END END)")
+    weight = exprs.get('weight', 'NULL')
+    return {
+        'resource_type': f"COALESCE(CAST({exprs.get('resource_type', 'NULL')} AS TEXT), '')",
+        'resource_model_version_id': f"NULLIF({exprs.get('resource_model_version_id', 'NULL')}, '')",
+        'resource_name': f"COALESCE(CAST({exprs.get('resource_name', 'NULL')} AS TEXT), '')",
+        'resource_model_id': f"NULLIF({exprs.get('resource_model_id', 'NULL')}, '')",
+        'civitai_resource_id': f"CAST({exprs.get('resource_id', 'NULL')} AS TEXT)",
+        'resource_raw': f"(CASE WHEN json_valid({raw}) THEN json_remove({raw}, '$.weight') ELSE {raw} END)",
+        'weight': f'COALESCE({weight}, {weight_from_raw})',
+        'present': ' OR '.join(f"NULLIF({exprs[c]}, '') IS NOT NULL"
+                               for c in ('resource_type', 'resource_model_version_id', 'resource_name') if c in exprs) or '0',
+    }
+
+
+def catalog_id_sql(exprs: Dict[str, str], schema: Optional[str] = 'main') -> str:
+    """exprs の行に対応するカタログの id を引く式（部分索引のどちらかを 1 回引くだけ）
+
+    トリガー本体ではスキーマ名を付けられないため schema=None を渡す。
+    """
+    v = _catalog_sql(exprs)
+    table = f'{schema}.{CATALOG_TABLE}' if schema else CATALOG_TABLE
+    return (f"(CASE WHEN {v['resource_model_version_id']} IS NOT NULL "
+            f"THEN (SELECT id FROM {table} WHERE resource_model_version_id = {v['resource_model_version_id']} "
+            f"AND resource_type = {v['resource_type']}) "
+            f"ELSE (SELECT id FROM {table} WHERE resource_model_version_id IS NULL "
+            f"AND resource_name = {v['resource_name']} AND resource_type = {v['resource_type']}) END)")
+
+
+_CATALOG_COLUMNS = ['resource_type', 'resource_model_version_id', 'resource_name', 'resource_model_id',
+                    'civitai_resource_id', 'resource_raw']
+
+
+def intern_catalog(cursor, source: str, exprs: Dict[str, str], schema: str = 'main', order: str = ''):
+    """source（FROM 句）の各行のリソースをカタログにまとめて登録する（既にある同一性の行は先勝ちで残す）"""
+    v = _catalog_sql(exprs)
+    # 同じバッチ内の重複（'7' と 7 など）も一意索引で弾くため OR IGNORE を使う
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO {schema}.{CATALOG_TABLE} ({", ".join(_CATALOG_COLUMNS)})
+        SELECT {", ".join(v[c] for c in _CATALOG_COLUMNS)} FROM {source}
+        WHERE {v['present']}{f' ORDER BY {order}' if order else ''}
+    ''')
+
+
+def link_weight_sql(exprs: Dict[str, str]) -> str:
+    """リンクの weight の式（weight 列がなければ元の JSON から取り出す）"""
+    return _catalog_sql(exprs)['weight']
+
+
+def _view_triggers() -> Dict[str, str]:
+    new = {c: f'new.{c}' for c in LEGACY_RESOURCE_COLUMNS + ['weight']}
+    v = _catalog_sql(new)
+    catalog_id = catalog_id_sql(new, schema=None)
+    return {
+        'prompt_resources_ii': f'''
+        CREATE TRIGGER IF NOT EXISTS prompt_resources_ii
+        INSTEAD OF INSERT ON prompt_resources
+        BEGIN
+            INSERT INTO {CATALOG_TABLE} ({", ".join(_CATALOG_COLUMNS)})
+            SELECT {", ".join(v[c] for c in _CATALOG_COLUMNS)}
+            WHERE ({v['present']}) AND {catalog_id} IS NULL;
+            INSERT INTO {LINKS_TABLE} (prompt_id, idx, resource_id, weight)
+            SELECT new.prompt_id, COALESCE(new.resource_index, 0), {catalog_id}, {v['weight']}
+            WHERE {catalog_id} IS NOT NULL
+            ON CONFLICT (prompt_id, idx) DO UPDATE SET resource_id = excluded.resource_id, weight = excluded.weight;
+        END''',
+        'prompt_resources_id': f'''
+        CREATE TRIGGER IF NOT EXISTS prompt_resources_id
+        INSTEAD OF DELETE ON prompt_resources
+        BEGIN
+            DELETE FROM {LINKS_TABLE} WHERE prompt_id = old.prompt_id AND idx = old.resource_index;
+        END''',
+    }
+
+
+CATALOG_SCHEMA.update(_view_triggers())
+
+
+def _columns(cursor, table: str) -> List[str]:
+    cursor.execute(f'PRAGMA table_info({table})')
+    return [r[1] for r in cursor.fetchall()]
+
+
+def _migrate_links(cursor, source: str, exprs: Dict[str, str], order: str) -> int:
+    """旧形式の行（source）をカタログとリンクに移し、リンクの件数を返す"""
+    intern_catalog(cursor, source, exprs, order=order)
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO {LINKS_TABLE} (prompt_id, idx, resource_id, weight)
+        SELECT {exprs['prompt_id']}, COALESCE({exprs.get('resource_index', 'NULL')}, 0), {catalog_id_sql(exprs)},
+               {link_weight_sql(exprs)}
+        FROM {source}
+        WHERE {exprs['prompt_id']} IS NOT NULL AND {catalog_id_sql(exprs)} IS NOT NULL
+        ORDER BY {order}
+    ''')
+    return max(cursor.rowcount, 0)
+
+
+def ensure_catalog_schema(cursor) -> Dict[str, int]:
+    """カタログ・リンク表・互換ビューを作成し、旧形式の使用リソースがあれば移行する
+
+    旧形式は 2 通り: prompt_resources が実テーブル（行ごとに JSON を持つ）、または
+    prompt_resource_rows + resources 次元（(type, name, modelId, modelVersionId) ごとのキー）。
+
+    Returns:
+        移行したテーブル名 -> リンク件数（移行がなければ空）
+    """
+    migrated: Dict[str, int] = {}
+    legacy_table = object_type(cursor, 'prompt_resources') == 'table'
+    legacy_rows = object_type(cursor, 'prompt_resource_rows') == 'table'
+    old_dimension = (object_type(cursor, CATALOG_TABLE) == 'table'
+                     and 'resource_raw' not in _columns(cursor, CATALOG_TABLE))
+    if legacy_table or legacy_rows or old_dimension:
+        # 途中で失敗しても旧テーブルが残るよう、移行全体を 1 つのセーブポイントにまとめる
+        cursor.execute('SAVEPOINT resource_catalog_migration')
+        try:
+            if object_type(cursor, 'prompt_resources') == 'view':
+                cursor.execute('DROP VIEW prompt_resources')
+            if old_dimension:
+                cursor.execute('PRAGMA legacy_alter_table = ON')
+                try:
+                    cursor.execute(f'ALTER TABLE {CATALOG_TABLE} RENAME TO resources__dimension')
+                finally:
+                    cursor.execute('PRAGMA legacy_alter_table = OFF')
+            for name in (CATALOG_TABLE, 'idx_resources_version', 'idx_resources_unversioned', LINKS_TABLE):
+                cursor.execute(CATALOG_SCHEMA[name])
+            if legacy_table:
+                present = set(_columns(cursor, 'prompt_resources'))
+                exprs = {c: (f'l.{c}' if c in present else 'NULL') for c in LEGACY_RESOURCE_COLUMNS}
+                migrated['prompt_resources'] = _migrate_links(cursor, 'prompt_resources l', exprs, 'l.rowid')
+                cursor.execute('DROP TABLE prompt_resources')
+            if legacy_rows:
+                exprs = {'prompt_id': 'l.prompt_id', 'resource_index': 'l.resource_index',
+                         'resource_id': 'l.resource_id', 'resource_raw': 'l.resource_raw'}
+                source = 'prompt_resource_rows l'
+                if old_dimension:
+                    source += ' LEFT JOIN resources__dimension d ON d.id = l.resource_key'
+                    exprs.update({c: f'd.{c}' for c in ('resource_type', 'resource_name', 'resource_model_id',
+                                                        'resource_model_version_id')})
+                migrated['prompt_resource_rows'] = _migrate_links(cursor, source, exprs, 'l.id')
+                cursor.execute('DROP TABLE prompt_resource_rows')
+            if old_dimension:
+                cursor.execute('DROP TABLE resources__dimension')
+            cursor.execute('RELEASE SAVEPOINT resource_catalog_migration')
+        except Exception:
+            cursor.execute('ROLLBACK TO SAVEPOINT resource_catalog_migration')
+            cursor.execute('RELEASE SAVEPOINT resource_catalog_migration')
+            raise
+    for stmt in CATALOG_SCHEMA.values():
+        cursor.execute(stmt)
+    return migrated
+
+
+class ResourceCatalog:
+    """カタログの同一性 -> resources.id をプロセス内に保持し、取り込み時の問い合わせを省く
+
+    使い方は dimensions.DimensionCache と同じ（書き込みトランザクションごとに session()、
+    コミット後に publish()。DB が差し替えられていれば validate() が破棄する）。
+    """
+
+    def __init__(self):
+        self._ids: Dict[Tuple[str, Any, Optional[str]], int] = {}
+        self._last: Optional[Tuple[int, Tuple[str, Any, Optional[str]]]] = None
+
+    def clear(self):
+        self._ids.clear()
+        self._last = None
+
+    def validate(self, cursor):
+        """最後に覚えた id が今の DB でも同じリソースを指しているか確かめる（違えば全て破棄）"""
+        if self._last is None:
+            return
+        resource_id, identity = self._last
+        cursor.execute(f'SELECT resource_type, resource_model_version_id, resource_name FROM {CATALOG_TABLE} WHERE id = ?',
+                       (resource_id,))
+        row = cursor.fetchone()
+        if row is None or catalog_identity({'type': row[0], 'modelVersionId': row[1], 'name': row[2]}) != identity:
+            print('[DB] Resource catalog changed on disk; clearing the in-memory cache')
+            self.clear()
+
+    def session(self, cursor) -> 'CatalogSession':
+        """cursor のトランザクション内で id を引くためのセッションを返す"""
+        self.validate(cursor)
+        return CatalogSession(self, cursor)
+
+    def _publish(self, pending: Dict[Tuple[str, Any, Optional[str]], int]):
+        if pending:
+            self._ids.update(pending)
+            self._last = next(reversed(pending.items()))[::-1]
+
+
+class CatalogSession:
+    """1 つの書き込みトランザクションの間のカタログ id 解決（新しく登録した id は publish まで保留）"""
+
+    def __init__(self, catalog: ResourceCatalog, cursor):
+        self._catalog = catalog
+        self._cursor = cursor
+        self._pending: Dict[Tuple[str, Any, Optional[str]], int] = {}
+
+    def resource_id(self, resource: Dict[str, Any]) -> Optional[int]:
+        """civitaiResources の 1 件のカタログ id を返す（なければ登録する。空のリソースは None）"""
+        identity = catalog_identity(resource)
+        if identity is None:
+            return None
+        resource_id = self._catalog._ids.get(identity) or self._pending.get(identity)
+        if resource_id is not None:
+            return resource_id
+        rtype, version, name = identity
+        if version is not None:
+            self._cursor.execute(f'SELECT id FROM {CATALOG_TABLE} WHERE resource_model_version_id = ? AND resource_type = ?',
+                                 (version, rtype))
+        else:
+            self._cursor.execute(f'SELECT id FROM {CATALOG_TABLE} WHERE resource_model_version_id IS NULL '
+                                 'AND resource_name = ? AND resource_type = ?', (name, rtype))
+        row = self._cursor.fetchone()
+        if row:
+            resource_id = row[0]
+        else:
+            model_id = to_int_id(resource.get('modelId'))
+            raw, _ = _split_raw(resource)
+            self._cursor.execute(f'''
+                INSERT INTO {CATALOG_TABLE} ({", ".join(_CATALOG_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)
+            ''', (rtype, version, '' if resource.get('name') is None else str(resource.get('name')),
+                  None if model_id == '' else model_id, resource.get('resourceId'), raw))
+            resource_id = self._cursor.lastrowid
+        self._pending[identity] = resource_id
+        return resource_id
+
+    def publish(self):
+        """コミット後に呼び、このセッションで登録した id をキャッシュに反映する"""
+        self._catalog._publish(self._pending)
+
+
+def sync_links(cursor, session: CatalogSession,
+               items: Sequence[Tuple[int, List[Dict[str, Any]]]]) -> Dict[str, int]:
+    """プロンプトごとの使用リソースを、今のリンクとの差分だけ書き込む
+
+    items: (prompt_id, 正規化済みリソースのリスト)。リストにない idx のリンクは削除する。
+    返り値: {'inserted', 'updated', 'deleted', 'unchanged'} の件数
+    """
+    stats = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    wanted: Dict[int, Dict[int, Tuple[int, Optional[float]]]] = {}
+    for prompt_id, resources in items:
+        links = wanted.setdefault(prompt_id, {})
+        links.clear()
+        for pos, r in enumerate(resources or []):
+            resource_id = session.resource_id(r)
+            if resource_id is None:
+                continue
+            idx = r.get('index') if r.get('index') is not None else pos
+            links[idx] = (resource_id, _split_raw(r)[1])
+
+    current: Dict[int, Dict[int, Tuple[int, Optional[float]]]] = {}
+    prompt_ids = list(wanted)
+    for i in range(0, len(prompt_ids), 500):
+        chunk = prompt_ids[i:i + 500]
+        cursor.execute(f"SELECT prompt_id, idx, resource_id, weight FROM {LINKS_TABLE} "
+                       f"WHERE prompt_id IN ({','.join('?' * len(chunk))})", chunk)
+        for prompt_id, idx, resource_id, weight in cursor.fetchall():
+            current.setdefault(prompt_id, {})[idx] = (resource_id, weight)
+
+    upserts, deletes = [], []
+    for prompt_id, links in wanted.items():
+        have = current.get(prompt_id, {})
+        deletes += [(prompt_id, idx) for idx in have if idx not in links]
+        for idx, link in links.items():
+            if have.get(idx) == link:
+                stats['unchanged'] += 1
+                continue
+            stats['updated' if idx in have else 'inserted'] += 1
+            upserts.append((prompt_id, idx) + link)
+    if deletes:
+        cursor.executemany(f'DELETE FROM {LINKS_TABLE} WHERE prompt_id = ? AND idx = ?', deletes)
+    if upserts:
+        cursor.executemany(f'''
+            INSERT INTO {LINKS_TABLE} (prompt_id, idx, resource_id, weight) VALUES (?, ?, ?, ?)
+            ON CONFLICT (prompt_id, idx) DO UPDATE SET resource_id = excluded.resource_id, weight = excluded.weight
+        ''', upserts)
+    stats['deleted'] = len(deletes)
+    return stats
+
+
+def _parse_chunk(rows: List[Tuple[int, Any]]) -> List[Tuple[int, List[Dict[str, Any]]]]:
+    """(prompt_id, raw_metadata) のリストを解析する（ワーカープロセスで実行）"""
+    parsed = []
+    for prompt_id, raw in rows:
+        resources = parse_resources_from_raw(raw)
+        if resources:
+            parsed.append((prompt_id, resources))
+    return parsed
+
+
+def _iter_raw_chunks(db_path: str, start_id: int, chunk_size: int, only_missing: bool) -> Iterator[List[Tuple[int, Any]]]:
+    """id 範囲ごとに (id, raw_metadata) を読み出す（読み取りトランザクションはチャンク単位で終わる）"""
+    sql = 'SELECT id, raw_metadata FROM civitai_prompts WHERE id > ? AND raw_metadata IS NOT NULL'
+    if only_missing:
+        sql += f' AND NOT EXISTS (SELECT 1 FROM {LINKS_TABLE} r WHERE r.prompt_id = civitai_prompts.id)'
+    sql += ' ORDER BY id LIMIT ?'
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        last_id = start_id
+        while True:
+            rows = conn.execute(sql, (last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            yield rows
+            if len(rows) < chunk_size:
+                break
+    finally:
+        conn.close()
+
+
+def get_checkpoint(conn: sqlite3.Connection, name: str) -> int:
+    conn.execute(CHECKPOINT_SCHEMA)
+    row = conn.execute('SELECT last_id FROM job_checkpoints WHERE name = ?', (name,)).fetchone()
+    return int(row[0]) if row and row[0] else 0
+
+
+def set_checkpoint(conn: sqlite3.Connection, name: str, last_id: int):
+    conn.execute('''
+        INSERT INTO job_checkpoints (name, last_id, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET last_id = excluded.last_id, updated_at = excluded.updated_at
+    ''', (name, int(last_id), datetime.now().isoformat()))
+
+
+def _write_chunk(conn: sqlite3.Connection, parsed: List[Tuple[int, List[Dict[str, Any]]]],
+                 last_id: int, job_name: str, catalog: Optional[ResourceCatalog] = None) -> int:
+    """1 チャンク分を短い書き込みトランザクションで保存し、書き込んだ（追加・変更した）リンク数を返す"""
+    catalog = catalog or ResourceCatalog()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        cursor = conn.cursor()
+        session = catalog.session(cursor)
+        stats = sync_links(cursor, session, parsed)
+        set_checkpoint(conn, job_name, last_id)
+        conn.execute('COMMIT')
+        session.publish()
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return stats['inserted'] + stats['updated']
+
+
+def backfill_resources(db_path: str = DEFAULT_DB_PATH, chunk_size: int = 2000, workers: Optional[int] = None,
+                       resume: bool = True, only_missing: bool = False,
+                       job_name: str = BACKFILL_JOB_NAME) -> Dict[str, Any]:
+    """raw_metadata から使用リソース（カタログとリンク）を一括で再構築する
+
+    - id 範囲のチャンクで読み出し、解析はプロセスプールで並列実行（workers=0 で同一プロセス）
+    - チャンクごとに今のリンクとの差分だけを書き込み、同じトランザクションで最終 id をチェックポイントに記録
+    - 書き込みはチャンク単位の短いトランザクションなので、収集処理と同時に実行できる
+    """
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    start_id = get_checkpoint(conn, job_name) if resume else 0
+    if not resume:
+        set_checkpoint(conn, job_name, 0)
+
+    stats = {'start_id': start_id, 'last_id': start_id, 'rows': 0, 'prompts_with_resources': 0,
+             'resources_inserted': 0, 'chunks': 0}
+    started = time.time()
+    chunks = _iter_raw_chunks(db_path, start_id, max(1, int(chunk_size)), only_missing)
+    # 同じリソースは何万回も現れるため、カタログ id はジョブの間プロセス内に保持する
+    catalog = ResourceCatalog()
+
+    def record(rows, parsed):
+        stats['resources_inserted'] += _write_chunk(conn, parsed, rows[-1][0], job_name, catalog)
+        stats['rows'] += len(rows)
+        stats['prompts_with_resources'] += len(parsed)
+        stats['last_id'] = rows[-1][0]
+        stats['chunks'] += 1
+        if stats['chunks'] % 10 == 0:
+            print(f"[Backfill] processed {stats['rows']} rows (last id {stats['last_id']}, "
+                  f"{stats['prompts_with_resources']} with resources) - {time.time() - started:.1f}s")
+
+    try:
+        if workers == 0:
+            for rows in chunks:
+                record(rows, _parse_chunk(rows))
+        else:
+            workers = workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                # 先読みするチャンク数を制限してメモリ使用量を一定に保つ
+                window = workers * 2
+                pending: deque = deque()
+                for rows in chunks:
+                    pending.append((rows, pool.submit(_parse_chunk, rows)))
+                    if len(pending) >= window:
+                        done_rows, future = pending.popleft()
+                        record(done_rows, future.result())
+                while pending:
+                    done_rows, future = pending.popleft()
+                    record(done_rows, future.result())
+    finally:
+        conn.close()
+
+    stats['elapsed'] = round(time.time() - started, 2)
+    print(f"[Backfill] completed: {stats}")
+    return stats
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - 集計ロールアップ
+ダッシュボード用の集計テーブルを作成し、トリガーで増分更新する
+
+prompt_rollups   : prompts（civitai_prompts の実体）の次元別（モデル/バージョン/日付/品質帯/長さ帯）件数・合計
+category_rollups : prompt_categories のモデル×カテゴリ別件数・信頼度合計
+
+どちらも書き込みと同じトランザクション内でトリガーが更新するため、
+読み出し側は小さな集計行を読むだけで済む。
+"""
+
+import sqlite3
+from typing import Dict, List, Any, Optional
+
+from .column_types import DATE_SQL, epoch_to_iso, replace_definition, to_epoch
+
+# 品質帯・長さ帯の表示順（statistics_dashboard の区分と同じ）
+QUALITY_TIERS = ['Very High (500+)', 'High (100-499)', 'Medium (50-99)', 'Low (10-49)', 'Very Low (0-9)']
+LENGTH_TIERS = ['Very Short (0-49)', 'Short (50-199)', 'Medium (200-499)', 'Long (500-999)', 'Very Long (1000+)']
+
+# 次元名 -> キー式（{r} は new / old / prompts に置換される）
+# モデル名・バージョンは次元テーブルのキーから引く（集計キーは従来どおり文字列）
+MODEL_NAME_SQL = "COALESCE((SELECT model_name FROM models WHERE id = {r}.model_key), '')"
+ROLLUP_DIMENSIONS: Dict[str, str] = {
+    'model': MODEL_NAME_SQL,
+    'version': "COALESCE((SELECT model_version_id FROM model_versions WHERE id = {r}.version_key), '')",
+    'day': f"COALESCE({DATE_SQL.format(x='{r}.collected_at')}, '')",
+    'quality_tier': (
+        "CASE WHEN {r}.quality_score >= 500 THEN 'Very High (500+)' "
+        "WHEN {r}.quality_score >= 100 THEN 'High (100-499)' "
+        "WHEN {r}.quality_score >= 50 THEN 'Medium (50-99)' "
+        "WHEN {r}.quality_score >= 10 THEN 'Low (10-49)' "
+        "ELSE 'Very Low (0-9)' END"
+    ),
+    'length_tier': (
+        "CASE WHEN {r}.prompt_length >= 1000 THEN 'Very Long (1000+)' "
+        "WHEN {r}.prompt_length >= 500 THEN 'Long (500-999)' "
+        "WHEN {r}.prompt_length >= 200 THEN 'Medium (200-499)' "
+        "WHEN {r}.prompt_length >= 50 THEN 'Short (50-199)' "
+        "ELSE 'Very Short (0-49)' END"
+    ),
+}
+
+# quality_max を保持する次元（削除・減少時に索引を使って再計算する）
+MAX_TRACKED_DIMENSION = 'model'
+
+# 集計に影響する prompts の列
+_TRACKED_COLUMNS = ['model_key', 'version_key', 'collected_at', 'quality_score', 'reaction_count', 'prompt_length']
+
+ROLLUP_TABLES = {
+    "prompt_rollups": """
+        CREATE TABLE IF NOT EXISTS prompt_rollups (
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            prompt_count INTEGER NOT NULL DEFAULT 0,
+            quality_n INTEGER NOT NULL DEFAULT 0,
+            quality_sum REAL NOT NULL DEFAULT 0,
+            quality_max INTEGER,
+            reaction_n INTEGER NOT NULL DEFAULT 0,
+            reaction_sum INTEGER NOT NULL DEFAULT 0,
+            length_n INTEGER NOT NULL DEFAULT 0,
+            length_sum INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dimension, key)
+        ) WITHOUT ROWID
+    """,
+    "category_rollups": """
+        CREATE TABLE IF NOT EXISTS category_rollups (
+            model_name TEXT NOT NULL,
+            category TEXT NOT NULL,
+            prompt_count INTEGER NOT NULL DEFAULT 0,
+            confidence_n INTEGER NOT NULL DEFAULT 0,
+            confidence_sum REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (model_name, category)
+        ) WITHOUT ROWID
+    """,
+}
+
+ROLLUP_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_prompts_model_quality ON prompts (model_key, quality_score)",
+    "CREATE INDEX IF NOT EXISTS idx_prompts_collected_at ON prompts (collected_at)",
+    "CREATE INDEX IF NOT EXISTS idx_prompt_categories_prompt_id ON prompt_categories (prompt_id)",
+]
+
+
+def _add_prompt_sql(dimension: str, ref: str) -> str:
+    """ref 行（new/old）を次元 dimension の集計に加算する UPSERT 文"""
+    key = ROLLUP_DIMENSIONS[dimension].format(r=ref)
+    qmax = f"{ref}.quality_score" if dimension == MAX_TRACKED_DIMENSION else "NULL"
+    return f"""
+            INSERT INTO prompt_rollups
+                (dimension, key, prompt_count, quality_n, quality_sum, quality_max,
+                 reaction_n, reaction_sum, length_n, length_sum)
+            VALUES ('{dimension}', {key}, 1,
+                    {ref}.quality_score IS NOT NULL, COALESCE({ref}.quality_score, 0), {qmax},
+                    {ref}.reaction_count IS NOT NULL, COALESCE({ref}.reaction_count, 0),
+                    {ref}.prompt_length IS NOT NULL, COALESCE({ref}.prompt_length, 0))
+            ON CONFLICT (dimension, key) DO UPDATE SET
+                prompt_count = prompt_count + 1,
+                quality_n = quality_n + excluded.quality_n,
+                quality_sum = quality_sum + excluded.quality_sum,
+                quality_max = CASE
+                    WHEN excluded.quality_max IS NULL THEN quality_max
+                    WHEN quality_max IS NULL OR excluded.quality_max > quality_max THEN excluded.quality_max
+                    ELSE quality_max END,
+                reaction_n = reaction_n + excluded.reaction_n,
+                reaction_sum = reaction_sum + excluded.reaction_sum,
+                length_n = length_n + excluded.length_n,
+                length_sum = length_sum + excluded.length_sum;"""
+
+
+def _remove_prompt_sql(dimension: str) -> str:
+    """old 行を次元 dimension の集計から減算する文（必要なら quality_max を再計算）"""
+    key = ROLLUP_DIMENSIONS[dimension].format(r='old')
+    sql = f"""
+            UPDATE prompt_rollups SET
+                prompt_count = prompt_count - 1,
+                quality_n = quality_n - (old.quality_score IS NOT NULL),
+                quality_sum = quality_sum - COALESCE(old.quality_score, 0),
+                reaction_n = reaction_n - (old.reaction_count IS NOT NULL),
+                reaction_sum = reaction_sum - COALESCE(old.reaction_count, 0),
+                length_n = length_n - (old.prompt_length IS NOT NULL),
+                length_sum = length_sum - COALESCE(old.prompt_length, 0)
+            WHERE dimension = '{dimension}' AND key = {key};"""
+    if dimension == MAX_TRACKED_DIMENSION:
+        # 同名のモデルキーごとに (model_key, quality_score) 索引で最大値を引く
+        sql += f"""
+            UPDATE prompt_rollups SET
+                quality_max = (SELECT MAX(q) FROM (
+                    SELECT MAX(quality_score) AS q FROM prompts
+                    WHERE model_key IN (SELECT id FROM models WHERE COALESCE(model_name, '') = {key})
+                    UNION ALL
+                    SELECT MAX(quality_score) FROM prompts WHERE model_key IS NULL AND {key} = ''))
+            WHERE dimension = '{dimension}' AND key = {key}
+              AND old.quality_score IS NOT NULL AND quality_max <= old.quality_score;"""
+    return sql
+
+
+# プロンプトより先に保存されたカテゴリ（その時点では集計されない）は、行の追加時にまとめて加算する
+_ADD_CATEGORIES_OF_PROMPT = f"""
+            INSERT INTO category_rollups (model_name, category, prompt_count, confidence_n, confidence_sum)
+            SELECT {MODEL_NAME_SQL.format(r='new')}, COALESCE(category, ''), COUNT(*), COUNT(confidence), TOTAL(confidence)
+            FROM prompt_categories WHERE prompt_id = new.id
+            GROUP BY COALESCE(category, '')
+            ON CONFLICT (model_name, category) DO UPDATE SET
+                prompt_count = prompt_count + excluded.prompt_count,
+                confidence_n = confidence_n + excluded.confidence_n,
+                confidence_sum = confidence_sum + excluded.confidence_sum;"""
+
+_REMOVE_CATEGORIES_OF_PROMPT = f"""
+            UPDATE category_rollups SET
+                prompt_count = prompt_count - s.n,
+                confidence_n = confidence_n - s.cn,
+                confidence_sum = confidence_sum - s.cs
+            FROM (SELECT COALESCE(category, '') AS category, COUNT(*) AS n, COUNT(confidence) AS cn, TOTAL(confidence) AS cs
+                  FROM prompt_categories WHERE prompt_id = old.id
+                  GROUP BY COALESCE(category, '')) AS s
+            WHERE category_rollups.model_name = {MODEL_NAME_SQL.format(r='old')}
+              AND category_rollups.category = s.category;"""
+
+
+def _category_row_sql(ref: str, sign: str) -> str:
+    """prompt_categories の ref 行（new/old）を category_rollups に加算(+)/減算(-)する文"""
+    if sign == '+':
+        return f"""
+            INSERT INTO category_rollups (model_name, category, prompt_count, confidence_n, confidence_sum)
+            SELECT {MODEL_NAME_SQL.format(r='p')}, COALESCE({ref}.category, ''), 1,
+                   {ref}.confidence IS NOT NULL, COALESCE({ref}.confidence, 0)
+            FROM prompts p WHERE p.id = {ref}.prompt_id
+            ON CONFLICT (model_name, category) DO UPDATE SET
+                prompt_count = prompt_count + 1,
+                confidence_n = confidence_n + excluded.confidence_n,
+                confidence_sum = confidence_sum + excluded.confidence_sum;"""
+    return f"""
+            UPDATE category_rollups SET
+                prompt_count = prompt_count - 1,
+                confidence_n = confidence_n - ({ref}.confidence IS NOT NULL),
+                confidence_sum = confidence_sum - COALESCE({ref}.confidence, 0)
+            WHERE model_name = COALESCE((SELECT m.model_name FROM prompts p JOIN models m ON m.id = p.model_key
+                                         WHERE p.id = {ref}.prompt_id), '')
+              AND category = COALESCE({ref}.category, '')
+              AND EXISTS (SELECT 1 FROM prompts WHERE id = {ref}.prompt_id);"""
+
+
+def build_rollup_triggers() -> Dict[str, str]:
+    """集計を維持するトリガー定義を返す（名前 -> CREATE TRIGGER 文）"""
+    dims = list(ROLLUP_DIMENSIONS)
+    changed = ' OR '.join(f'old.{c} IS NOT new.{c}' for c in _TRACKED_COLUMNS)
+
+    triggers = {
+        'prompt_rollups_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS prompt_rollups_ai
+        AFTER INSERT ON prompts
+        BEGIN{''.join(_add_prompt_sql(d, 'new') for d in dims)}{_ADD_CATEGORIES_OF_PROMPT}
+        END""",
+        'prompt_rollups_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS prompt_rollups_ad
+        AFTER DELETE ON prompts
+        BEGIN{''.join(_remove_prompt_sql(d) for d in dims)}{_REMOVE_CATEGORIES_OF_PROMPT}
+        END""",
+        'prompt_rollups_au': f"""
+        CREATE TRIGGER IF NOT EXISTS prompt_rollups_au
+        AFTER UPDATE OF {', '.join(_TRACKED_COLUMNS)} ON prompts
+        WHEN {changed}
+        BEGIN{''.join(_remove_prompt_sql(d) + _add_prompt_sql(d, 'new') for d in dims)}
+        END""",
+        'category_rollups_model_au': f"""
+        CREATE TRIGGER IF NOT EXISTS category_rollups_model_au
+        AFTER UPDATE OF model_key ON prompts
+        WHEN {MODEL_NAME_SQL.format(r='old')} IS NOT {MODEL_NAME_SQL.format(r='new')}
+        BEGIN{_REMOVE_CATEGORIES_OF_PROMPT}{_ADD_CATEGORIES_OF_PROMPT}
+        END""",
+        'category_rollups_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS category_rollups_ai
+        AFTER INSERT ON prompt_categories
+        BEGIN{_category_row_sql('new', '+')}
+        END""",
+        'category_rollups_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS category_rollups_ad
+        AFTER DELETE ON prompt_categories
+        BEGIN{_category_row_sql('old', '-')}
+        END""",
+        'category_rollups_au': f"""
+        CREATE TRIGGER IF NOT EXISTS category_rollups_au
+        AFTER UPDATE OF prompt_id, category, confidence ON prompt_categories
+        BEGIN{_category_row_sql('old', '-')}{_category_row_sql('new', '+')}
+        END""",
+    }
+    return triggers
+
+
+def rebuild_rollups(conn: sqlite3.Connection) -> Dict[str, int]:
+    """集計テーブルを元テーブルから作り直す（呼び出し側で commit する）"""
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM prompt_rollups')
+    cursor.execute('DELETE FROM category_rollups')
+    for dimension, expr in ROLLUP_DIMENSIONS.items():
+        key = expr.format(r='prompts')
+        qmax = 'MAX(quality_score)' if dimension == MAX_TRACKED_DIMENSION else 'NULL'
+        cursor.execute(f'''
+            INSERT INTO prompt_rollups
+                (dimension, key, prompt_count, quality_n, quality_sum, quality_max,
+                 reaction_n, reaction_sum, length_n, length_sum)
+            SELECT '{dimension}', {key}, COUNT(*),
+                   COUNT(quality_score), TOTAL(quality_score), {qmax},
+                   COUNT(reaction_count), TOTAL(reaction_count),
+                   COUNT(prompt_length), TOTAL(prompt_length)
+            FROM prompts
+            GROUP BY {key}
+        ''')
+    cursor.execute('''
+        INSERT INTO category_rollups (model_name, category, prompt_count, confidence_n, confidence_sum)
+        SELECT COALESCE(m.model_name, ''), COALESCE(c.category, ''), COUNT(*), COUNT(c.confidence), TOTAL(c.confidence)
+        FROM prompt_categories c
+        JOIN prompts p ON p.id = c.prompt_id
+        LEFT JOIN models m ON m.id = p.model_key
+        GROUP BY COALESCE(m.model_name, ''), COALESCE(c.category, '')
+    ''')
+    cursor.execute('SELECT COUNT(*) FROM prompt_rollups')
+    prompt_rows = cursor.fetchone()[0]
+    cursor.execute('SELECT COUNT(*) FROM category_rollups')
+    category_rows = cursor.fetchone()[0]
+    return {'prompt_rollups': prompt_rows, 'category_rollups': category_rows}
+
+
+def ensure_rollups(cursor: sqlite3.Cursor) -> bool:
+    """集計テーブル・索引・トリガーを作成する
+
+    新規作成時と、集計キーの式が変わったトリガーを作り直したときは既存データから構築して True を返す。
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='prompt_rollups'")
+    existed = cursor.fetchone() is not None
+    for stmt in ROLLUP_TABLES.values():
+        cursor.execute(stmt)
+    for stmt in ROLLUP_INDEXES:
+        cursor.execute(stmt)
+    replaced = [replace_definition(cursor, name, stmt) for name, stmt in build_rollup_triggers().items()]
+    if not existed or any(replaced):
+        rebuild_rollups(cursor.connection)
+        return True
+    return False
+
+
+def _avg(total: float, n: int):
+    return (total / n) if n else None
+
+
+def read_dimension(conn: sqlite3.Connection, dimension: str) -> List[Dict[str, Any]]:
+    """指定次元の集計行（件数 > 0）を平均値付きで返す"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT key, prompt_count, quality_n, quality_sum, quality_max,
+               reaction_n, reaction_sum, length_n, length_sum
+        FROM prompt_rollups
+        WHERE dimension = ? AND prompt_count > 0
+        ORDER BY key
+    ''', (dimension,))
+    rows = []
+    for key, count, qn, qs, qmax, rn, rs, ln, ls in cursor.fetchall():
+        rows.append({
+            'key': key,
+            'prompt_count': count,
+            'quality_sum': qs,
+            'avg_quality': _avg(qs, qn),
+            'max_quality': qmax,
+            'avg_reactions': _avg(rs, rn),
+            'avg_length': _avg(ls, ln),
+        })
+    if dimension == 'quality_tier':
+        rows.sort(key=lambda r: QUALITY_TIERS.index(r['key']) if r['key'] in QUALITY_TIERS else len(QUALITY_TIERS))
+    elif dimension == 'length_tier':
+        rows.sort(key=lambda r: LENGTH_TIERS.index(r['key']) if r['key'] in LENGTH_TIERS else len(LENGTH_TIERS))
+    return rows
+
+
+def read_totals(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """全体の件数・平均値を model 次元の集計行から求める"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT TOTAL(prompt_count), TOTAL(quality_n), TOTAL(quality_sum), TOTAL(reaction_n), TOTAL(reaction_sum),
+               TOTAL(length_n), TOTAL(length_sum), SUM(prompt_count > 0 AND key <> '')
+        FROM prompt_rollups WHERE dimension = 'model'
+    ''')
+    total, qn, qs, rn, rs, ln, ls, models = cursor.fetchone()
+    cursor.execute("SELECT COUNT(*) FROM prompt_rollups WHERE dimension = 'version' AND prompt_count > 0 AND key <> ''")
+    versions = cursor.fetchone()[0]
+    return {
+        'total_prompts': int(total),
+        'unique_models': int(models or 0),
+        'unique_versions': versions,
+        'avg_quality': _avg(qs, qn),
+        'avg_reactions': _avg(rs, rn),
+        'avg_length': _avg(ls, ln),
+    }
+
+
+def read_categories(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    """モデル×カテゴリの集計行（件数 > 0）を返す"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT model_name, category, prompt_count, confidence_n, confidence_sum
+        FROM category_rollups
+        WHERE prompt_count > 0
+        ORDER BY model_name, category
+    ''')
+    return [
+        {
+            'model_name': model_name,
+            'category': category,
+            'count': count,
+            'confidence_sum': cs,
+            'confidence_n': cn,
+            'avg_confidence': _avg(cs, cn),
+        }
+        for model_name, category, count, cn, cs in cursor.fetchall()
+    ]
+
+
+def read_collected_range(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """最初・最後の collected_at（collected_at の索引の両端を読むだけで済む）"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT MIN(collected_at) FROM prompts')
+    first = cursor.fetchone()[0]
+    cursor.execute('SELECT MAX(collected_at) FROM prompts')
+    last = cursor.fetchone()[0]
+    return {'first_collected': epoch_to_iso(first), 'last_collected': epoch_to_iso(last)}
+
+
+def read_daily(conn: sqlite3.Connection, since: Any = None, until: Any = None) -> List[Dict[str, Any]]:
+    """collected_at が [since, until) の行を日別に集計する（idx_prompts_collected_at の範囲走査）"""
+    clauses = ['collected_at IS NOT NULL']
+    params: List[Any] = []
+    if since is not None:
+        clauses.append('collected_at >= ?')
+        params.append(to_epoch(since))
+    if until is not None:
+        clauses.append('collected_at < ?')
+        params.append(to_epoch(until))
+    day = ROLLUP_DIMENSIONS['day'].format(r='prompts')
+    rows = conn.execute(f'''
+        SELECT {day} AS day, COUNT(*), AVG(quality_score), AVG(reaction_count)
+        FROM prompts
+        WHERE {' AND '.join(clauses)}
+        GROUP BY day ORDER BY day
+    ''', params).fetchall()
+    return [{'day': r[0], 'prompt_count': r[1], 'avg_quality': r[2], 'avg_reactions': r[3]} for r in rows]
+
+
+def read_empty_model_name(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+    """モデル名が空文字列（NULL ではない）の行だけの集計
+
+    model 次元の集計行はモデル名の NULL と '' を同じキー '' にまとめるため、
+    両者を区別したい呼び出し側（名前が NULL の行だけを除く集計）が使う。
+    idx_prompts_model_quality で該当するキーの行だけを読む。
+    """
+    row = conn.execute('''
+        SELECT COUNT(*), AVG(quality_score), MAX(quality_score), AVG(reaction_count), AVG(prompt_length)
+        FROM prompts WHERE model_key IN (SELECT id FROM models WHERE model_name = '')
+    ''').fetchone()
+    if not row[0]:
+        return None
+    return {'key': '', 'prompt_count': row[0], 'avg_quality': row[1], 'max_quality': row[2],
+            'avg_reactions': row[3], 'avg_length': row[4]}
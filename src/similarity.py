@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - 類似プロンプト検索（TF-IDF + ランダム射影 LSH）
+「このプロンプトに似たもの」を、全件と比較せずに求める CPU のみの近傍検索。
+
+- ベクトル: split_tags で正規化したタグの TF-IDF（1 プロンプト内でタグは重複しないため TF は 0/1）。
+  文書 x タグの疎行列を CSR 形式の NumPy 配列で保持する
+- 近似近傍索引: タグごとに blake2b から決まる ±1 の乱数ベクトルを足し合わせる符号付き
+  ランダム射影（SimHash）。TABLES 個のテーブルにそれぞれ BITS ビットのコードを持ち、
+  コードが一致するか 1 ビット違いのバケット（マルチプローブ）の文書を候補にする
+- 再順位付け: 候補だけを現在の IDF による TF-IDF のコサイン類似度で並べ直す
+
+コードはタグ集合だけから決まる（IDF に依存しない）ため、増分で追加しても全件から作り直しても
+同じ索引になる。IDF は問い合わせ時に文書頻度から計算するので、件数が増えても古くならない。
+最後に取り込んだ civitai_prompts.id を記録し、update() は新しい行だけを追加する。
+既存行の本文が書き換わった場合は rebuild() で作り直す（削除された行は結果の取得時に落ちる）。
+"""
+
+import os
+import hashlib
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .config import DEFAULT_DB_PATH
+from .cooccurrence import split_tags
+
+try:
+    import numpy as np  # type: ignore[import]
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+INDEX_VERSION = 1
+
+# ハッシュテーブル数とテーブルごとのコード長（BITS <= 16）
+TABLES = 32
+BITS = 10
+_HASH_BYTES = TABLES * BITS // 8
+# 候補として再順位付けする最大件数（衝突したテーブル数の多い順に残す）
+MAX_CANDIDATES = 2000
+# 1 バケットから取り出す最大件数（「masterpiece, best quality」だけの巨大バケット対策）
+MAX_BUCKET = 4096
+# この件数以下なら索引を使わず全件を再順位付けする（小さい DB では厳密な結果になる）
+EXACT_LIMIT = 5000
+# 未整列の末尾がこの件数（かつ全体の RESORT_RATIO）を超えたらテーブルを整列し直す
+RESORT_MIN = 5000
+RESORT_RATIO = 0.1
+
+
+def index_path_for(db_path: str = DEFAULT_DB_PATH) -> str:
+    """DB と同じディレクトリに置く索引ファイルのパス（civitai_dataset.db -> civitai_dataset.similarity.npz）"""
+    return f"{os.path.splitext(db_path)[0]}.similarity.npz"
+
+
+def _require_numpy():
+    if not NUMPY_AVAILABLE:
+        raise ImportError("Similar-prompt search requires numpy (pip install numpy)")
+
+
+def _tag_hash(tag: str) -> bytes:
+    """タグの射影ベクトル（TABLES * BITS 個の ±1 をビットで表したもの）"""
+    return hashlib.blake2b(tag.encode('utf-8'), digest_size=_HASH_BYTES).digest()
+
+
+class SimilarityIndex:
+    """タグ TF-IDF の疎行列とランダム射影 LSH のテーブル
+
+    配列:
+        vocab / df       : タグ文字列と文書頻度（インデックス = タグ ID）
+        tag_bits         : タグごとの射影ビット (len(vocab), _HASH_BYTES)
+        doc_ids          : 文書の civitai_prompts.id（昇順）
+        indptr/indices   : CSR 形式の文書 -> タグ ID
+        codes            : 文書ごとの LSH コード (文書数, TABLES)
+        order/sorted_codes: 先頭 n_sorted 件をテーブルごとにコード順に並べた位置とコード
+    """
+
+    def __init__(self):
+        _require_numpy()
+        self.vocab: List[str] = []
+        self.tag_ids: Dict[str, int] = {}
+        self.df = np.zeros(0, dtype=np.int64)
+        self.tag_bits = np.zeros((0, _HASH_BYTES), dtype=np.uint8)
+        self.doc_ids = np.zeros(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.codes = np.zeros((0, TABLES), dtype=np.uint16)
+        self.order = np.zeros((TABLES, 0), dtype=np.int32)
+        self.sorted_codes = np.zeros((TABLES, 0), dtype=np.uint16)
+        self.n_sorted = 0
+        self.last_prompt_id = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    # ------------------------------------------------------------------
+    # 構築・更新
+    # ------------------------------------------------------------------
+    def add_prompts(self, rows: Iterable[Tuple[int, Optional[str]]]) -> int:
+        """(prompt_id, full_prompt) を id の昇順で追加し、追加した文書数を返す（タグのない行は除く）"""
+        tag_ids = self.tag_ids
+        new_tags: List[str] = []
+        ids: List[int] = []
+        lengths: List[int] = []
+        flat: List[int] = []
+        for prompt_id, prompt in rows:
+            tags = split_tags(prompt)
+            if not tags:
+                continue
+            for tag in tags:
+                tid = tag_ids.get(tag)
+                if tid is None:
+                    tid = tag_ids[tag] = len(self.vocab)
+                    self.vocab.append(tag)
+                    new_tags.append(tag)
+                flat.append(tid)
+            ids.append(prompt_id)
+            lengths.append(len(tags))
+        if not ids:
+            return 0
+
+        if new_tags:
+            bits = np.frombuffer(b''.join(_tag_hash(t) for t in new_tags), dtype=np.uint8)
+            self.tag_bits = np.concatenate([self.tag_bits, bits.reshape(-1, _HASH_BYTES)])
+            self.df = np.concatenate([self.df, np.zeros(len(new_tags), dtype=np.int64)])
+        indices = np.array(flat, dtype=np.int32)
+        lengths_arr = np.array(lengths, dtype=np.int64)
+        self.df += np.bincount(indices, minlength=len(self.vocab))
+        self.doc_ids = np.concatenate([self.doc_ids, np.array(ids, dtype=np.int64)])
+        self.indptr = np.concatenate([self.indptr, self.indptr[-1] + np.cumsum(lengths_arr)])
+        self.indices = np.concatenate([self.indices, indices])
+        starts = np.concatenate([[0], np.cumsum(lengths_arr)[:-1]])
+        self.codes = np.concatenate([self.codes, self._codes(self.tag_bits[indices], starts)])
+        self._maybe_resort()
+        return len(ids)
+
+    @staticmethod
+    def _codes(bits: 'np.ndarray', starts: 'np.ndarray') -> 'np.ndarray':
+        """文書ごとにタグの ±1 ベクトルを合計し、符号をテーブルごとのコードにまとめる"""
+        signs = np.unpackbits(bits, axis=1).astype(np.int16) * 2 - 1
+        projected = np.add.reduceat(signs, starts, axis=0) > 0
+        weights = (1 << np.arange(BITS, dtype=np.uint32))
+        return (projected.reshape(len(starts), TABLES, BITS) @ weights).astype(np.uint16)
+
+    def _maybe_resort(self, force: bool = False):
+        """未整列の末尾が大きくなったらテーブルを整列し直す（それまでは末尾だけ線形に照合する）"""
+        tail = len(self.doc_ids) - self.n_sorted
+        if not force and tail < max(RESORT_MIN, int(self.n_sorted * RESORT_RATIO)):
+            return
+        self.order = np.argsort(self.codes, axis=0, kind='stable').T.astype(np.int32)
+        self.sorted_codes = np.take_along_axis(self.codes.T, self.order.astype(np.int64), axis=1)
+        self.n_sorted = len(self.doc_ids)
+
+    def update(self, db_path: str = DEFAULT_DB_PATH, batch_size: int = 2000) -> int:
+        """last_prompt_id より新しいプロンプトを取り込み、読み込んだ行数を返す"""
+        conn = sqlite3.connect(db_path)
+        try:
+            total = 0
+            while True:
+                rows = conn.execute(
+                    'SELECT id, full_prompt FROM civitai_prompts WHERE id > ? ORDER BY id LIMIT ?',
+                    (self.last_prompt_id, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                self.add_prompts(rows)
+                self.last_prompt_id = rows[-1][0]
+                total += len(rows)
+        finally:
+            conn.close()
+        if total:
+            print(f"[Similarity] added {total} prompts (docs={len(self)}, tags={len(self.vocab)})")
+        return total
+
+    @classmethod
+    def rebuild(cls, db_path: str = DEFAULT_DB_PATH) -> 'SimilarityIndex':
+        """全プロンプトから作り直す"""
+        index = cls()
+        index.update(db_path)
+        index._maybe_resort(force=True)
+        return index
+
+    # ------------------------------------------------------------------
+    # 問い合わせ
+    # ------------------------------------------------------------------
+    def similar_to_id(self, prompt_id: int, k: int = 10) -> List[Tuple[int, float]]:
+        """索引済みプロンプトに似たプロンプトを (prompt_id, コサイン類似度) の降順で返す（自分自身は除く）"""
+        pos = int(np.searchsorted(self.doc_ids, prompt_id))
+        if pos >= len(self.doc_ids) or self.doc_ids[pos] != prompt_id:
+            return []
+        tags = self.indices[self.indptr[pos]:self.indptr[pos + 1]]
+        return self._search(tags, 0, self.codes[pos], k, exclude=pos)
+
+    def similar_to_text(self, prompt: str, k: int = 10) -> List[Tuple[int, float]]:
+        """任意のプロンプト文字列に似たプロンプトを返す"""
+        tags = split_tags(prompt)
+        if not tags:
+            return []
+        known = np.array([self.tag_ids[t] for t in tags if t in self.tag_ids], dtype=np.int32)
+        bits = np.frombuffer(b''.join(_tag_hash(t) for t in tags), dtype=np.uint8).reshape(-1, _HASH_BYTES)
+        codes = self._codes(bits, np.zeros(1, dtype=np.int64))[0]
+        return self._search(known, len(tags) - len(known), codes, k)
+
+    def _idf(self, tag_ids: 'np.ndarray') -> 'np.ndarray':
+        # scikit-learn の smooth_idf と同じ式
+        return np.log((1.0 + len(self.doc_ids)) / (1.0 + self.df[tag_ids])) + 1.0
+
+    def _search(self, query_tags: 'np.ndarray', unknown_tags: int, codes: 'np.ndarray', k: int,
+                exclude: Optional[int] = None) -> List[Tuple[int, float]]:
+        if len(self.doc_ids) == 0 or len(query_tags) == 0 or k <= 0:
+            return []
+        if len(self.doc_ids) <= EXACT_LIMIT:
+            candidates = np.arange(len(self.doc_ids), dtype=np.int64)
+        else:
+            candidates = self._candidates(codes)
+        if exclude is not None:
+            candidates = candidates[candidates != exclude]
+        if len(candidates) == 0:
+            return []
+
+        # 候補文書のタグを CSR から一括で取り出す
+        starts = self.indptr[candidates]
+        lengths = self.indptr[candidates + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.arange(int(lengths.sum()), dtype=np.int64) - np.repeat(offsets, lengths) + np.repeat(starts, lengths)
+        doc_tags = self.indices[positions]
+        segment = np.repeat(np.arange(len(candidates)), lengths)
+        weights = self._idf(doc_tags)
+
+        query_sorted = np.sort(query_tags)
+        query_weights = self._idf(query_sorted)
+        # 未知のタグは文書頻度 0 として問い合わせ側のノルムにだけ効く
+        unknown_weight = np.log(1.0 + len(self.doc_ids)) + 1.0
+        query_norm = np.sqrt(np.sum(query_weights ** 2) + unknown_tags * unknown_weight ** 2)
+        hit = np.searchsorted(query_sorted, doc_tags).clip(max=len(query_sorted) - 1)
+        matched = query_sorted[hit] == doc_tags
+        dots = np.bincount(segment, weights=np.where(matched, weights * query_weights[hit], 0.0),
+                           minlength=len(candidates))
+        norms = np.sqrt(np.bincount(segment, weights=weights ** 2, minlength=len(candidates)))
+        scores = dots / (norms * query_norm)
+
+        keep = scores > 0
+        candidates, scores = candidates[keep], scores[keep]
+        k = min(int(k), len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.lexsort((self.doc_ids[candidates[top]], -scores[top]))]
+        return [(int(self.doc_ids[candidates[i]]), float(scores[i])) for i in top]
+
+    def _candidates(self, codes: 'np.ndarray') -> 'np.ndarray':
+        """一致または 1 ビット違いのバケットに入っている文書の位置（衝突数の多い順に MAX_CANDIDATES 件）"""
+        flips = np.concatenate([[0], 1 << np.arange(BITS)]).astype(np.uint16)
+        probes = codes.astype(np.uint16)[:, None] ^ flips[None, :]
+        parts = []
+        for t in range(TABLES):
+            column = self.sorted_codes[t]
+            probe = np.sort(probes[t])
+            lo = np.searchsorted(column, probe, 'left')
+            hi = np.minimum(np.searchsorted(column, probe, 'right'), lo + MAX_BUCKET)
+            parts.extend(self.order[t, a:b] for a, b in zip(lo, hi) if b > a)
+            if self.n_sorted < len(self.doc_ids):
+                tail = np.nonzero(np.isin(self.codes[self.n_sorted:, t], probe))[0] + self.n_sorted
+                parts.append(tail.astype(np.int32))
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        found, hits = np.unique(np.concatenate(parts), return_counts=True)
+        if len(found) > MAX_CANDIDATES:
+            found = found[np.argpartition(-hits, MAX_CANDIDATES - 1)[:MAX_CANDIDATES]]
+        return found.astype(np.int64)
+
+    # ------------------------------------------------------------------
+    # 保存・読み込み
+    # ------------------------------------------------------------------
+    def save(self, path: str):
+        """.npz に保存する（一時ファイルに書いてから置き換える）"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{path}.part"
+        with open(tmp, 'wb') as f:
+            np.savez(
+                f,
+                version=np.array(INDEX_VERSION),
+                meta=np.array([self.last_prompt_id, self.n_sorted, TABLES, BITS], dtype=np.int64),
+                vocab=np.array(self.vocab, dtype=str), df=self.df, tag_bits=self.tag_bits,
+                doc_ids=self.doc_ids, indptr=self.indptr, indices=self.indices, codes=self.codes,
+                order=self.order, sorted_codes=self.sorted_codes,
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'SimilarityIndex':
+        """save() で保存した索引を読み込む"""
+        index = cls()
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != INDEX_VERSION:
+                raise ValueError(f"Unsupported similarity index version: {int(data['version'])}")
+            last_prompt_id, n_sorted, tables, bits = (int(v) for v in data['meta'])
+            if (tables, bits) != (TABLES, BITS):
+                raise ValueError(f"Similarity index was built with TABLES={tables}, BITS={bits}")
+            index.last_prompt_id, index.n_sorted = last_prompt_id, n_sorted
+            index.vocab = data['vocab'].tolist()
+            for name in ('df', 'tag_bits', 'doc_ids', 'indptr', 'indices', 'codes', 'order', 'sorted_codes'):
+                setattr(index, name, data[name])
+        index.tag_ids = {tag: i for i, tag in enumerate(index.vocab)}
+        return index
+
+
+def load_or_build(db_path: str = DEFAULT_DB_PATH, path: Optional[str] = None,
+                  save: bool = True) -> SimilarityIndex:
+    """保存済みの索引を読み込み、DB に増えた分だけ取り込んで返す（なければ全件から作る）"""
+    path = path or index_path_for(db_path)
+    index = None
+    if os.path.exists(path):
+        try:
+            index = SimilarityIndex.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[Similarity] Failed to load {path}, rebuilding: {e}")
+    if index is None:
+        index = SimilarityIndex()
+    added = index.update(db_path)
+    if save and added:
+        index.save(path)
+    return index
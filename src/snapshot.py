@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - DB スナップショット
+SQLite の VACUUM INTO（またはオンラインバックアップ API）で稼働中の DB から
+一貫したコピーを作成する。ファイルコピーと違い、収集中の書き込みと重なっても壊れない。
+
+- create_snapshot : 1 回の読み取りトランザクションでコピーする（backup は書き込みで最初からやり直しになる）
+- rotate_snapshots: 古いスナップショットを削除して最新 N 件を残す
+- open_snapshot   : ダッシュボード用の読み取り専用ハンドル（ライブ DB に触れない）
+"""
+
+import os
+import time
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Callable
+
+from .config import DEFAULT_DB_PATH
+
+DEFAULT_SNAPSHOT_DIR = 'data/snapshots'
+SNAPSHOT_SUFFIX = '.snapshot.db'
+# backup がこの回数やり直しになったら VACUUM INTO に切り替える
+MAX_BACKUP_RESTARTS = 3
+
+
+class _BackupRestarted(Exception):
+    """他の接続の書き込みで backup が何度も最初からやり直しになった"""
+
+
+def _ro_uri(path: str, immutable: bool = False) -> str:
+    uri = Path(path).resolve().as_uri() + '?mode=ro'
+    return uri + ('&immutable=1' if immutable else '')
+
+
+def snapshot_name(db_path: str, when: Optional[datetime] = None) -> str:
+    """<DB名>.<YYYYmmdd_HHMMSS>.snapshot.db 形式のファイル名を返す（名前順 = 時刻順）"""
+    stem = Path(db_path).stem
+    return f"{stem}.{(when or datetime.now()).strftime('%Y%m%d_%H%M%S')}{SNAPSHOT_SUFFIX}"
+
+
+def create_snapshot(db_path: str = DEFAULT_DB_PATH, dest: Optional[str] = None,
+                    snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, method: str = 'vacuum',
+                    pages: int = 256, sleep: float = 0.005, verify: bool = False,
+                    max_restarts: int = MAX_BACKUP_RESTARTS,
+                    progress: Optional[Callable[[int, int, int], None]] = None) -> str:
+    """db_path の一貫したスナップショットを作成してパスを返す
+
+    Args:
+        dest: 出力先（省略時は snapshot_dir にタイムスタンプ付きで作成）
+        method: 'vacuum'（VACUUM INTO, 既定）または 'backup'（オンラインバックアップ API, pages ページずつコピー）。
+            backup は他の接続が書き込むたびに最初からやり直すため、収集中は終わらないことがある。
+            max_restarts 回やり直しになったら VACUUM INTO に切り替える
+        pages / sleep: 1 ステップでコピーするページ数とステップ間の待ち時間（書き込み側に譲る）
+        verify: True なら作成後に PRAGMA quick_check を実行する
+        progress: backup 時の進捗コールバック (status, remaining, total)
+    """
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(db_path)
+    if dest is None:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        dest = os.path.join(snapshot_dir, snapshot_name(db_path))
+    else:
+        dest_dir = os.path.dirname(str(dest))
+        if dest_dir:
+            os.makedirs(dest_dir, exist_ok=True)
+
+    # 途中のファイルを読まれないよう一時名で作ってから置き換える
+    tmp = f"{dest}.part"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    if method not in ('vacuum', 'backup'):
+        raise ValueError(f"Unknown snapshot method: {method}")
+
+    started = time.time()
+    used = method
+    src = sqlite3.connect(_ro_uri(db_path), uri=True)
+    try:
+        if method == 'backup':
+            try:
+                _backup(src, tmp, pages, sleep, max_restarts, progress)
+            except _BackupRestarted:
+                print(f"[Snapshot] Backup of {db_path} restarted {max_restarts} times; falling back to VACUUM INTO")
+                os.remove(tmp)
+                used = 'vacuum'
+        if used == 'vacuum':
+            src.execute('VACUUM INTO ?', (tmp,))
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        src.close()
+
+    if verify:
+        check = sqlite3.connect(tmp)
+        try:
+            result = check.execute('PRAGMA quick_check').fetchone()[0]
+        finally:
+            check.close()
+        if result != 'ok':
+            os.remove(tmp)
+            raise sqlite3.DatabaseError(f"Snapshot integrity check failed: {result}")
+
+    os.replace(tmp, dest)
+    print(f"[Snapshot] {db_path} -> {dest} ({used}, {time.time() - started:.1f}s)")
+    return str(dest)
+
+
+def _backup(src: sqlite3.Connection, tmp: str, pages: int, sleep: float, max_restarts: int,
+            progress: Optional[Callable[[int, int, int], None]]) -> None:
+    """オンラインバックアップ API で tmp にコピーする
+
+    残りページ数が前回から減らなければやり直しとみなし、max_restarts 回で _BackupRestarted を送出する。
+    """
+    state = {'remaining': None, 'restarts': 0}
+
+    def _progress(status, remaining, total):
+        if state['remaining'] is not None and remaining >= state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] >= max_restarts:
+                raise _BackupRestarted()
+        state['remaining'] = remaining
+        if progress:
+            progress(status, remaining, total)
+
+    dst = sqlite3.connect(tmp)
+    try:
+        src.backup(dst, pages=max(1, int(pages)), progress=_progress, sleep=sleep)
+    finally:
+        dst.close()
+
+
+def list_snapshots(snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, db_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """スナップショット一覧を新しい順で返す（db_path 指定時はその DB のもののみ）"""
+    if not os.path.isdir(snapshot_dir):
+        return []
+    prefix = f"{Path(db_path).stem}." if db_path else ''
+    result = []
+    for name in os.listdir(snapshot_dir):
+        if not name.endswith(SNAPSHOT_SUFFIX) or not name.startswith(prefix):
+            continue
+        path = os.path.join(snapshot_dir, name)
+        st = os.stat(path)
+        result.append({'path': path, 'name': name, 'size': st.st_size,
+                       'created_at': datetime.fromtimestamp(st.st_mtime).isoformat()})
+    result.sort(key=lambda r: r['name'], reverse=True)
+    return result
+
+
+def latest_snapshot(snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, db_path: Optional[str] = None) -> Optional[str]:
+    snapshots = list_snapshots(snapshot_dir, db_path)
+    return snapshots[0]['path'] if snapshots else None
+
+
+def rotate_snapshots(snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, keep: int = 5, db_path: Optional[str] = None) -> List[str]:
+    """最新 keep 件を残して古いスナップショットを削除し、削除したパスを返す"""
+    removed = []
+    for snap in list_snapshots(snapshot_dir, db_path)[max(0, int(keep)):]:
+        try:
+            os.remove(snap['path'])
+            removed.append(snap['path'])
+        except OSError as e:
+            print(f"[Snapshot] Failed to remove {snap['path']}: {e}")
+    return removed
+
+
+def open_snapshot(path: Optional[str] = None, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR,
+                  db_path: Optional[str] = None) -> sqlite3.Connection:
+    """スナップショットを読み取り専用で開く（省略時は最新のもの）
+
+    スナップショットは作成後に変更されないため immutable=1 で開き、ロック処理を省く。
+    """
+    path = path or latest_snapshot(snapshot_dir, db_path)
+    if not path or not os.path.exists(path):
+        raise FileNotFoundError(f"No snapshot found in {snapshot_dir}")
+    return sqlite3.connect(_ro_uri(path, immutable=True), uri=True)
+
+
+def run_scheduled_snapshots(db_path: str = DEFAULT_DB_PATH, interval: float = 3600, keep: int = 24,
+                            snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, max_runs: Optional[int] = None,
+                            **snapshot_kwargs) -> int:
+    """interval 秒ごとにスナップショットを作成・ローテーションする（Ctrl+C で終了）
+
+    戻り値は作成したスナップショット数。
+    """
+    runs = 0
+    try:
+        while max_runs is None or runs < max_runs:
+            started = time.time()
+            try:
+                create_snapshot(db_path, snapshot_dir=snapshot_dir, **snapshot_kwargs)
+                runs += 1
+                removed = rotate_snapshots(snapshot_dir, keep=keep, db_path=db_path)
+                if removed:
+                    print(f"[Snapshot] Rotated out {len(removed)} old snapshot(s)")
+            except Exception as e:
+                print(f"[Snapshot] Error: {e}")
+            if max_runs is not None and runs >= max_runs:
+                break
+            time.sleep(max(0.0, interval - (time.time() - started)))
+    except KeyboardInterrupt:
+        print("[Snapshot] Stopped")
+    return runs
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - 取得ページのディスクスプール
+API から取得したページをそのまま（生の JSON で）セグメントファイルへ追記し、DB への取り込みは
+別のコンシューマ（scripts/ingest_spool.py）が行う。DB が遅い間（VACUUM・大きな分類ジョブ・UI の走査）も
+収集は API の速度で進み、カーソルを失わない。スキーマを変えた後の再取り込みも、ネットワークを使わずに
+保存済みのページから行える（--keep で取り込み済みのセグメントを ingested/ に残す）。
+
+セグメントの形式:
+  先頭 8 バイトの識別子 SEGMENT_MAGIC のあと、レコードを並べる。
+  レコード = [圧縮後の長さ (4 バイト, big endian)] [CRC32 (4 バイト)] [zlib 圧縮した JSON]
+- 書き込み中のセグメントは *.open。サイズか経過時間が上限に達したら fsync して *.seg に改名する（封印）
+- コンシューマは封印済みの *.seg だけを古い順に読み、DB にコミットできてから削除する
+- 書き手が落ちて残った *.open は、一定時間更新がなければ壊れた末尾を切り捨てて封印する
+
+収集の続きのカーソル（cursors.json）とジョブの進捗（jobs/<job_id>.json）もスプールに置き、
+収集中は DB に依存しない。カーソルはそのページを含むセグメントを封印（fsync）してから進める。
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .config import DEFAULT_DB_PATH
+
+SEGMENT_MAGIC = b'CVSPOOL1'
+_RECORD_HEADER = struct.Struct('>II')
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.seg'
+# 取り込み済みのセグメントを残すサブディレクトリ（keep=True のとき）
+INGESTED_DIR = 'ingested'
+# バージョン ID -> 次のページのカーソル
+CURSOR_FILE = 'cursors.json'
+# ジョブの進捗（collection_jobs の行と同じ列）を置くサブディレクトリ
+JOBS_DIR = 'jobs'
+
+# セグメントを封印するサイズ（圧縮後のバイト数）と、最初の追記からの経過時間（秒）
+SEGMENT_MAX_BYTES = 8 * 1024 * 1024
+SEGMENT_MAX_AGE = 30.0
+# この時間（秒）更新のない *.open は書き手が落ちたものとみなす
+STALE_SEGMENT_SECONDS = 600.0
+
+
+def default_spool_dir(db_path: str = DEFAULT_DB_PATH) -> str:
+    """DB と同じディレクトリに置くスプールのパス（civitai_dataset.db -> civitai_dataset.spool/）"""
+    return f"{os.path.splitext(db_path)[0]}.spool"
+
+
+def _fsync_dir(path: str):
+    """改名・削除をディレクトリのエントリとして永続化する（Windows では不要・不可）"""
+    if sys.platform == 'win32':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def encode_record(record: Dict[str, Any]) -> bytes:
+    payload = zlib.compress(json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _scan_segment(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(レコード末尾のオフセット, レコード) を返す。途中で切れた・壊れたレコード以降は読まない"""
+    with open(path, 'rb') as f:
+        if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+            print(f"[Spool] Not a spool segment: {path}")
+            return
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) < _RECORD_HEADER.size:
+                print(f"[Spool] Truncated record header in {os.path.basename(path)}")
+                return
+            length, crc = _RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                print(f"[Spool] Torn record in {os.path.basename(path)}; ignoring the rest")
+                return
+            yield f.tell(), json.loads(zlib.decompress(payload).decode('utf-8'))
+
+
+def read_segment(path: str) -> Iterator[Dict[str, Any]]:
+    """セグメントのレコードを順に返す"""
+    for _, record in _scan_segment(path):
+        yield record
+
+
+class SpoolWriter:
+    """セグメントファイルへの追記（1 プロセスに 1 つ。複数の書き手が同じスプールを共有してよい）"""
+
+    def __init__(self, spool_dir: str, max_bytes: int = SEGMENT_MAX_BYTES, max_age: float = SEGMENT_MAX_AGE):
+        self.spool_dir = spool_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._file = None
+        self._path: Optional[str] = None
+        self._opened_at = 0.0
+        self._counter = 0
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def append(self, record: Dict[str, Any]) -> Optional[str]:
+        """レコードを追記する（OS には毎回書き出し、fsync は封印時にセグメント単位で行う）
+
+        上限に達してセグメントを封印したらそのパスを返す（それまでのレコードはディスクに残っている）。
+        """
+        if self._file is None:
+            self._open()
+        self._file.write(encode_record(record))
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes or time.time() - self._opened_at >= self.max_age:
+            return self.seal()
+        return None
+
+    def _open(self):
+        # 時刻 + pid + 連番で、複数の書き手でも名前が衝突せず、名前順がおおよそ取得順になる
+        self._counter += 1
+        name = f"{time.time_ns():020d}-{os.getpid()}-{self._counter:04d}"
+        self._path = os.path.join(self.spool_dir, name + OPEN_SUFFIX)
+        self._file = open(self._path, 'wb')
+        self._file.write(SEGMENT_MAGIC)
+        self._opened_at = time.time()
+
+    def seal(self) -> Optional[str]:
+        """書き込み中のセグメントを fsync して封印し、そのパスを返す（空なら何もしない）"""
+        if self._file is None:
+            return None
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        sealed = self._path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX
+        os.replace(self._path, sealed)
+        _fsync_dir(self.spool_dir)
+        self._path = None
+        return sealed
+
+    def close(self):
+        self.seal()
+
+    def __enter__(self) -> 'SpoolWriter':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def recover_segments(spool_dir: str, stale_seconds: float = STALE_SEGMENT_SECONDS) -> int:
+    """書き手が落ちて残った *.open を、読める所まで切り詰めて封印する。封印した数を返す"""
+    if not os.path.isdir(spool_dir):
+        return 0
+    recovered = 0
+    now = time.time()
+    for name in sorted(os.listdir(spool_dir)):
+        path = os.path.join(spool_dir, name)
+        if not name.endswith(OPEN_SUFFIX) or now - os.path.getmtime(path) < stale_seconds:
+            continue
+        end = len(SEGMENT_MAGIC)
+        for end, _ in _scan_segment(path):
+            pass
+        with open(path, 'r+b') as f:
+            f.truncate(end)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path, path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        recovered += 1
+    if recovered:
+        _fsync_dir(spool_dir)
+        print(f"[Spool] Recovered {recovered} abandoned segment(s)")
+    return recovered
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _write_json(path: str, data: Dict[str, Any], durable: bool):
+    """一時ファイルに書いてから改名する（読み手が書きかけの内容を見ないように）"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    if durable:
+        _fsync_dir(os.path.dirname(path))
+
+
+def load_cursor(spool_dir: str, version_id: Any) -> Optional[str]:
+    """スプールに保存した version_id の続きのカーソル（なければ None）"""
+    entry = (_read_json(os.path.join(spool_dir, CURSOR_FILE)) or {}).get(str(version_id)) or {}
+    return entry.get('cursor') or None
+
+
+def save_cursor(spool_dir: str, version_id: Any, cursor: str):
+    """version_id の続きのカーソルを fsync してから置き換える
+
+    そのカーソルより前のページを含むセグメントを封印した後に呼ぶこと（落ちてもページを取りこぼさない）。
+    """
+    os.makedirs(spool_dir, exist_ok=True)
+    path = os.path.join(spool_dir, CURSOR_FILE)
+    cursors = _read_json(path) or {}
+    cursors[str(version_id)] = {'cursor': cursor, 'updated_at': datetime.now().isoformat()}
+    _write_json(path, cursors, durable=True)
+
+
+def write_job_progress(spool_dir: str, job_id: str, fields: Dict[str, Any]):
+    """ジョブの進捗を jobs/<job_id>.json に書き足す（fsync しない。UI の表示用）"""
+    jobs_dir = os.path.join(spool_dir, JOBS_DIR)
+    os.makedirs(jobs_dir, exist_ok=True)
+    path = os.path.join(jobs_dir, f"{os.path.basename(job_id)}.json")
+    progress = _read_json(path) or {'job_id': job_id}
+    progress.update(fields)
+    _write_json(path, progress, durable=False)
+
+
+def read_job_progress(spool_dir: str, job_id: str) -> Optional[Dict[str, Any]]:
+    """write_job_progress で書いた進捗（なければ None）"""
+    return _read_json(os.path.join(spool_dir, JOBS_DIR, f"{os.path.basename(job_id)}.json"))
+
+
+def sealed_segments(spool_dir: str, ingested: bool = False) -> List[str]:
+    """封印済みのセグメントを古い順に返す（ingested=True なら取り込み済みのものも先に含める）"""
+    dirs = ([os.path.join(spool_dir, INGESTED_DIR)] if ingested else []) + [spool_dir]
+    paths = []
+    for d in dirs:
+        if os.path.isdir(d):
+            paths.extend(sorted(os.path.join(d, n) for n in os.listdir(d) if n.endswith(SEALED_SUFFIX)))
+    return paths
+
+
+def spool_stats(spool_dir: str) -> Dict[str, int]:
+    """スプールの状態（書き込み中・未取り込み・取り込み済みのセグメント数と、未取り込みのバイト数）"""
+    stats = {'open': 0, 'sealed': 0, 'ingested': 0, 'pending_bytes': 0}
+    if os.path.isdir(spool_dir):
+        for name in os.listdir(spool_dir):
+            if name.endswith(OPEN_SUFFIX):
+                stats['open'] += 1
+            elif name.endswith(SEALED_SUFFIX):
+                stats['sealed'] += 1
+                stats['pending_bytes'] += os.path.getsize(os.path.join(spool_dir, name))
+    ingested_dir = os.path.join(spool_dir, INGESTED_DIR)
+    if os.path.isdir(ingested_dir):
+        stats['ingested'] = sum(1 for n in os.listdir(ingested_dir) if n.endswith(SEALED_SUFFIX))
+    return stats
+
+
+def page_record(page: Dict[str, Any], version_id: Any, model_name: str) -> Dict[str, Any]:
+    """API の画像一覧 1 ページ分のレコード（再取り込みに必要な情報をすべて含める）"""
+    return {'source': 'images', 'version_id': str(version_id), 'model_name': model_name,
+            'fetched_at': datetime.now().isoformat(), 'page': page}
+
+
+def prompts_from_record(record: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """レコードを save_prompts_bulk 用の辞書に変換する（取り込み時の規則で毎回作り直す）"""
+    from .strategy_job import build_prompt_data
+    if record.get('source') != 'images':
+        print(f"[Spool] Skipping record of unknown source: {record.get('source')}")
+        return []
+    items = (record.get('page') or {}).get('items') or []
+    prompts = (build_prompt_data(item, record.get('version_id'), record.get('model_name'),
+                                 collected_at=record.get('fetched_at')) for item in items)
+    return [p for p in prompts if p]
+
+
+def ingest_spool(spool_dir: str, db_path: str = DEFAULT_DB_PATH, keep: bool = False,
+                 replay_ingested: bool = False, stale_seconds: float = STALE_SEGMENT_SECONDS) -> Dict[str, int]:
+    """封印済みのセグメントを古い順に DB へ取り込む（1 レコード = 1 ページごとに 1 回の保存）
+
+    セグメント全体を 1 回で送ると取り込みサービスの要求サイズの上限を超えるため、レコードごとに送る。
+    全レコードを保存できたセグメントは削除する（keep=True なら ingested/ へ移す）。
+    replay_ingested=True なら ingested/ のセグメントも読み直す（スキーマ変更後の再取り込み）。
+    書き込みは registry.get_writer 経由（取り込みサービスが動いていればそこへ送る）。
+    DB への保存に失敗したらそのセグメントを残して止まり、次回そのセグメントの先頭から
+    取り込み直す（保存は civitai_id での upsert なので、保存済みのレコードを再送しても重複しない）。
+    """
+    from .registry import get_writer
+    recover_segments(spool_dir, stale_seconds)
+    writer = get_writer(db_path)
+    stats = {'segments': 0, 'records': 0, 'prompts': 0, 'inserted': 0, 'updated': 0}
+    ingested_dir = os.path.join(spool_dir, INGESTED_DIR)
+    for path in sealed_segments(spool_dir, ingested=replay_ingested):
+        records = list(read_segment(path))
+        saved = {'prompts': 0, 'inserted': 0, 'updated': 0}
+        try:
+            for record in records:
+                prompts = prompts_from_record(record)
+                if not prompts:
+                    continue
+                result = writer.save_prompts_bulk(prompts)
+                saved['prompts'] += len(prompts)
+                saved['inserted'] += result['inserted']
+                saved['updated'] += result['updated']
+        except Exception as e:
+            print(f"[Spool] Failed to ingest {os.path.basename(path)}: {e}")
+            break
+        if os.path.dirname(path) != ingested_dir:
+            if keep:
+                os.makedirs(ingested_dir, exist_ok=True)
+                os.replace(path, os.path.join(ingested_dir, os.path.basename(path)))
+            else:
+                os.remove(path)
+            _fsync_dir(spool_dir)
+        stats['segments'] += 1
+        stats['records'] += len(records)
+        for key in ('prompts', 'inserted', 'updated'):
+            stats[key] += saved[key]
+    if stats['segments']:
+        print(f"[Spool] Ingested {stats}")
+    return stats
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - NSFW × ソート戦略のバックグラウンド収集
+UI の「効率的収集戦略」を Streamlit の外（scripts/collect_strategies.py）で実行する。
+
+- 各戦略（NSFW レベル × ソート）をページ単位で取得し、save_prompts_bulk で 1 ページ 1 トランザクションで保存
+  （取り込みサービスが動いていれば、他の収集と同じ単一ライターに送ってまとめてコミットする）
+- 進捗は collection_jobs テーブルのジョブ行に書き込み、UI はその 1 行だけを読む
+- 継続収集モードでは collection_state.next_page_cursor から再開し、取得後に更新する
+- spool_dir を渡すとページを DB に書かずにスプールへ追記する（取り込みは scripts/ingest_spool.py）。
+  このときカーソルと進捗はスプールに置き、DB へは短い待ち時間で書ける時だけ書く
+  （VACUUM・分類・取り込みで DB が塞がっていても収集は止まらない）
+"""
+
+import os
+import json
+import time
+import sqlite3
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+
+from .column_types import to_nullable_id
+from .config import DEFAULT_DB_PATH, API_BASE_URL, DB_SCHEMA
+from .registry import get_writer, get_http_session
+from .resources import extract_resources
+from .spool import (SpoolWriter, default_spool_dir, page_record, load_cursor as load_spool_cursor,
+                    save_cursor as save_spool_cursor, read_job_progress, write_job_progress)
+
+# CivitAI API の 1 リクエストあたりの上限
+API_PAGE_LIMIT = 200
+# スプールモードで DB に進捗・カーソルを書くときに待つ時間（秒）。塞がっていれば書かずに続ける
+SPOOL_DB_TIMEOUT = 1.0
+
+
+def build_prompt_data(item: Dict[str, Any], version_id: str, model_name: str,
+                      collected_at: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """API のアイテムから civitai_prompts 用の辞書を作る（UI の従来の保存形式と同じ）
+
+    collected_at はスプールから取り込むときの取得時刻（省略時は現在時刻）
+    """
+    if not item or not item.get('id'):
+        return None
+    meta = item.get('meta') or {}
+    stats = item.get('stats') or {}
+    if not isinstance(meta, dict):
+        meta = {}
+    if not isinstance(stats, dict):
+        stats = {}
+    full_prompt = meta.get('prompt', '') or ''
+    return {
+        'civitai_id': str(item['id']),
+        'full_prompt': full_prompt,
+        'negative_prompt': meta.get('negativePrompt', '') or '',
+        'model_version_id': str(version_id),
+        'model_id': str(item.get('modelVersionId', '') or ''),
+        'model_name': model_name or 'Unknown',
+        'quality_score': stats.get('likeCount', 0),
+        'reaction_count': stats.get('reactionCount', 0),
+        'comment_count': stats.get('commentCount', 0),
+        'download_count': stats.get('downloadCount', 0),
+        'prompt_length': len(full_prompt),
+        'tag_count': len(full_prompt.split(',')) if full_prompt else 0,
+        'collected_at': collected_at or datetime.now().isoformat(),
+        'raw_metadata': json.dumps(item, ensure_ascii=False, default=str),
+        'resources': extract_resources(item)
+    }
+
+
+def update_job(db_path: str, job_id: str, timeout: float = 30, **fields):
+    """collection_jobs のジョブ行を更新（なければ作成）する"""
+    fields['updated_at'] = datetime.now().isoformat()
+    cols = list(fields)
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    try:
+        conn.execute(DB_SCHEMA['collection_jobs'])
+        conn.execute(
+            f"INSERT INTO collection_jobs (job_id, {', '.join(cols)}) VALUES (?, {', '.join('?' * len(cols))}) "
+            f"ON CONFLICT (job_id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in cols)}",
+            [job_id] + [fields[c] for c in cols]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_job(db_path: str, job_id: str, spool_dir: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """ジョブの最新の進捗行を返す（UI のポーリング用。DatabaseManager を作らない軽い読み取り）
+
+    スプールモードのジョブは進捗をスプール（既定は DB の隣）にも書くため、新しい方を返す。
+    """
+    row = None
+    if os.path.exists(db_path):
+        try:
+            conn = sqlite3.connect(db_path)
+            try:
+                conn.row_factory = sqlite3.Row
+                row = conn.execute('SELECT * FROM collection_jobs WHERE job_id = ?', (job_id,)).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            row = None
+    job = dict(row) if row is not None else None
+    progress = read_job_progress(spool_dir or default_spool_dir(db_path), job_id)
+    if progress and (job is None or (progress.get('updated_at') or '') > (job.get('updated_at') or '')):
+        job = dict(job or {}, **progress)
+    if job is None:
+        return None
+    try:
+        job['summary'] = json.loads(job.get('summary_json') or '{}')
+    except ValueError:
+        job['summary'] = {}
+    return job
+
+
+def _load_cursor(db_path: str, version_id: str, timeout: float = 30) -> Optional[str]:
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    try:
+        row = conn.execute(
+            "SELECT next_page_cursor FROM collection_state WHERE version_id IS ? ORDER BY last_update DESC LIMIT 1",
+            (to_nullable_id(version_id),)
+        ).fetchone()
+        return row[0] if row and row[0] else None
+    finally:
+        conn.close()
+
+
+def _save_cursor(db_path: str, version_id: str, cursor_value: str, timeout: float = 30):
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    try:
+        conn.execute(
+            "UPDATE collection_state SET next_page_cursor = ?, last_update = datetime('now') WHERE version_id IS ?",
+            (cursor_value, to_nullable_id(version_id))
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def report_job(db_path: str, job_id: str, spool_dir: Optional[str], **fields):
+    """ジョブの進捗を書く（スプールモードでは進捗ファイルに書き、DB へは書ける時だけ書く）"""
+    if not spool_dir:
+        update_job(db_path, job_id, **fields)
+        return
+    fields['updated_at'] = datetime.now().isoformat()
+    try:
+        write_job_progress(spool_dir, job_id, fields)
+    except OSError as e:
+        print(f"[Strategy] progress file not written: {e}")
+    try:
+        update_job(db_path, job_id, timeout=SPOOL_DB_TIMEOUT, **fields)
+    except sqlite3.Error as e:
+        print(f"[Strategy] progress not written to DB: {e}")
+
+
+def _resume_spool_cursor(db_path: str, spool_dir: str, version_id: str) -> Optional[str]:
+    """スプールのカーソル（なければ DB の collection_state のカーソルを、読める時だけ）"""
+    cursor = load_spool_cursor(spool_dir, version_id)
+    if cursor:
+        return cursor
+    try:
+        return _load_cursor(db_path, version_id, timeout=SPOOL_DB_TIMEOUT)
+    except sqlite3.Error:
+        return None
+
+
+def _commit_spool_cursor(db_path: str, spool_dir: str, version_id: str, cursor_value: str):
+    """封印済みのページの続きのカーソルをスプールに保存する（DB へは書ける時だけ書く）"""
+    try:
+        save_spool_cursor(spool_dir, version_id, cursor_value)
+    except OSError as e:
+        print(f"[Strategy] spool cursor not saved: {e}")
+        return
+    try:
+        _save_cursor(db_path, version_id, cursor_value, timeout=SPOOL_DB_TIMEOUT)
+    except sqlite3.Error as e:
+        print(f"[Strategy] cursor not saved to DB: {e}")
+
+
+def _stop_requested(stop_file: Optional[str], started: float) -> bool:
+    """ジョブ開始後に作られた停止フラグがあれば True（以前のジョブの古いフラグは無視する）"""
+    return bool(stop_file) and os.path.exists(stop_file) and os.path.getmtime(stop_file) >= started
+
+
+def run_strategy_collection(version_id: str, nsfw_levels: List[str], sort_strategies: List[str],
+                            max_items: int = 200, continuous: bool = True, model_name: str = 'Unknown',
+                            db_path: str = DEFAULT_DB_PATH, job_id: Optional[str] = None,
+                            stop_file: Optional[str] = None, request_interval: float = 0.5,
+                            session: Any = None, spool_dir: Optional[str] = None) -> Dict[str, Any]:
+    """NSFW レベル × ソート戦略ごとに最大 max_items 件を収集して保存する
+
+    進捗は job_id のジョブ行に逐次書き込む。戻り値は collection_jobs.summary_json と同じ内容。
+    spool_dir を渡すと取得したページはスプールへ追記するだけにし（戦略ごとに封印）、
+    saved / duplicates の代わりに spooled を数える。カーソルはページを封印してから進める。
+    """
+    job_id = job_id or datetime.now().strftime('strategy_%Y%m%d_%H%M%S')
+    db = None if spool_dir else get_writer(db_path)
+    spool = SpoolWriter(spool_dir) if spool_dir else None
+    http = session or get_http_session()
+    strategies = [(n, s) for n in nsfw_levels for s in sort_strategies]
+    started = time.time()
+    totals = {'fetched': 0, 'saved': 0, 'duplicates': 0, 'errors': 0}
+    summary: Dict[str, Any] = {'strategies': [], 'errors': []}
+
+    report_job(db_path, job_id, spool_dir, version_id=str(version_id), status='running',
+            strategies_total=len(strategies), strategies_done=0, started_at=datetime.now().isoformat(),
+            summary_json=json.dumps(summary))
+    print(f"[Strategy] job {job_id}: version={version_id} strategies={len(strategies)} max_items={max_items}")
+
+    status = 'completed'
+    for done, (nsfw_level, sort_strategy) in enumerate(strategies):
+        name = f"{nsfw_level}+{sort_strategy}"
+        result = {'strategy': name, 'fetched': 0, 'saved': 0, 'duplicates': 0, 'errors': 0, 'spooled': 0}
+        summary['strategies'].append(result)
+        if not continuous:
+            next_cursor = None
+        elif spool is not None:
+            next_cursor = _resume_spool_cursor(db_path, spool_dir, version_id)
+        else:
+            next_cursor = _load_cursor(db_path, version_id)
+        # スプールに追記したが、まだ封印していないページの続きのカーソル
+        unsealed_cursor = None
+
+        while result['fetched'] < max_items:
+            if _stop_requested(stop_file, started):
+                status = 'stopped'
+                break
+            report_job(db_path, job_id, spool_dir, current_strategy=name)
+            params = {
+                'modelVersionId': version_id,
+                'nsfw': nsfw_level,
+                'sort': sort_strategy,
+                'limit': min(max_items - result['fetched'], API_PAGE_LIMIT)
+            }
+            if next_cursor:
+                params['cursor'] = next_cursor
+            try:
+                response = http.get(API_BASE_URL, params=params, timeout=30)
+                if response.status_code != 200:
+                    try:
+                        detail = response.json().get('error', {}).get('message', 'Unknown error')
+                    except Exception:
+                        detail = ''
+                    raise RuntimeError(f"HTTP {response.status_code}" + (f" - {detail}" if detail else ''))
+                data = response.json()
+            except Exception as e:
+                summary['errors'].append(f"{name}: {e}")
+                print(f"[Strategy] {name}: {e}")
+                break
+
+            items = data.get('items', []) or []
+            result['fetched'] += len(items)
+            if spool is not None:
+                # 生のページをそのまま残す（DB への変換・保存はコンシューマが行う）
+                try:
+                    sealed = spool.append(page_record(data, version_id, model_name))
+                    result['spooled'] += len(items)
+                except OSError as e:
+                    result['errors'] += len(items)
+                    summary['errors'].append(f"{name}: spool: {e}")
+                    print(f"[Strategy] {name}: spool: {e}")
+                    break
+            else:
+                prompts = [p for p in (build_prompt_data(item, version_id, model_name) for item in items) if p]
+                try:
+                    saved = db.save_prompts_bulk(prompts)
+                    result['saved'] += saved['inserted']
+                    result['duplicates'] += saved['updated']
+                except Exception as e:
+                    result['errors'] += len(prompts)
+                    summary['errors'].append(f"{name}: {e}")
+
+            next_cursor = (data.get('metadata') or {}).get('nextCursor')
+            if continuous and next_cursor and spool is not None:
+                # ページがディスクに残るまでカーソルは進めない（追記は封印時にまとめて fsync される）
+                unsealed_cursor = next_cursor
+                if sealed:
+                    _commit_spool_cursor(db_path, spool_dir, version_id, unsealed_cursor)
+                    unsealed_cursor = None
+            elif continuous and next_cursor:
+                try:
+                    _save_cursor(db_path, version_id, next_cursor)
+                except sqlite3.Error as e:
+                    # DB が塞がっていても収集は続ける（次のページはメモリ上のカーソルで取得する）
+                    print(f"[Strategy] {name}: cursor not saved: {e}")
+            if spool is not None:
+                print(f"[Strategy] {name}: fetched={result['fetched']} spooled={result['spooled']}")
+            else:
+                print(f"[Strategy] {name}: fetched={result['fetched']} saved={result['saved']} duplicates={result['duplicates']}")
+
+            page = {k: totals[k] + result[k] for k in totals}
+            report_job(db_path, job_id, spool_dir, summary_json=json.dumps(summary, ensure_ascii=False), **page)
+            if not items or not next_cursor:
+                break
+            time.sleep(request_interval)  # API制限対策
+
+        if spool is not None:
+            try:
+                spool.seal()
+                if unsealed_cursor:
+                    _commit_spool_cursor(db_path, spool_dir, version_id, unsealed_cursor)
+            except OSError as e:
+                # 封印できなかったページはカーソルを進めず、次回取り直す
+                summary['errors'].append(f"{name}: spool: {e}")
+                print(f"[Strategy] {name}: spool: {e}")
+        for k in totals:
+            totals[k] += result[k]
+        report_job(db_path, job_id, spool_dir, strategies_done=done + 1,
+                summary_json=json.dumps(summary, ensure_ascii=False), **totals)
+        if status == 'stopped':
+            break
+
+    summary['totals'] = dict(totals)
+    summary['elapsed'] = round(time.time() - started, 1)
+    report_job(db_path, job_id, spool_dir, status=status, current_strategy=None,
+            summary_json=json.dumps(summary, ensure_ascii=False), **totals)
+    print(f"[Strategy] job {job_id} {status}: {totals}")
+    return summary
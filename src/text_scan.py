@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+CivitAI Prompt Collector - 複数キーワードの一括照合
+分析の各セクションがそれぞれ `keyword in text` を繰り返す代わりに、全セクションの
+キーワードを重複なく 1 つの照合器にまとめ、1 行につき 1 回だけ照合して
+「含まれるキーワードの集合」を共有する。集計側はこの集合（ヒットしたキーワード）
+だけを数えればよく、キーワード表を行ごとに走査し直す必要がなくなる。
+
+照合そのものは CPython の部分文字列検索（C 実装）を使う。トライ木から組み立てた
+1 本の正規表現（先読みで重なりも検出する方式）も試したが、re モジュールは
+全位置で照合を試みるため、この規模のキーワード数ではかえって遅かった。
+"""
+
+import re
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+
+class KeywordMatcher:
+    """キーワード群（と追加の正規表現）をまとめて照合する
+
+    判定は `keyword in text` と完全に同じ（部分文字列一致。大文字小文字は区別するので、
+    必要なら呼び出し側で小文字化しておく）。
+
+    Args:
+        keywords: 照合するキーワード（重複は 1 つにまとめる）
+        extra_patterns: 名前 -> 正規表現。text 内に出現すれば名前が結果に含まれる
+    """
+
+    def __init__(self, keywords: Iterable[str], extra_patterns: Optional[Dict[str, str]] = None):
+        self.keywords: Tuple[str, ...] = tuple(dict.fromkeys(k for k in keywords if k))
+        self._extras: List[Tuple[str, 're.Pattern']] = [
+            (name, re.compile(pattern)) for name, pattern in (extra_patterns or {}).items()
+        ]
+
+    def find(self, text: Optional[str]) -> FrozenSet[str]:
+        """text に含まれるキーワード（と追加パターン名）の集合を返す"""
+        if not text:
+            return frozenset()
+        found = {k for k in self.keywords if k in text}
+        for name, pattern in self._extras:
+            if pattern.search(text):
+                found.add(name)
+        return frozenset(found)
@@ -5,20 +5,28 @@ CivitAI Prompt Collector - Data Visualization Module
 
 import matplotlib.pyplot as plt
 import seaborn as sns
-import pandas as pd
-import numpy as np
+import os
+import json
+import hashlib
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Any
 import logging
 
 try:
-    from .database import DatabaseManager
+    from .database import DatabaseManager, read_data_version
+    from .registry import get_database
+    from . import aggregations, rollups
     from .config import CATEGORIES
+    from .exporter import PromptExporter, DEFAULT_EXPORT_COLUMNS
 except Exception:
     # 実行方法によっては相対インポートが失敗するためフォールバック
-    from src.database import DatabaseManager
+    from src.database import DatabaseManager, read_data_version
+    from src.registry import get_database
+    from src import aggregations, rollups
     from src.config import CATEGORIES
+    from src.exporter import PromptExporter, DEFAULT_EXPORT_COLUMNS
 
 # 日本語フォント設定（Windows環境対応）
 plt.rcParams['font.family'] = ['DejaVu Sans', 'Yu Gothic', 'Hiragino Sans', 'Meiryo']
@@ -29,14 +37,117 @@ plt.rcParams['figure.dpi'] = 100
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# グラフの描画内容を変えたときに上げる（既存の描画キャッシュを無効にする）
+RENDER_VERSION = 1
+# グラフ名 -> 入力データの指紋（同じ指紋で出力ファイルがあれば再描画しない）
+RENDER_CACHE_FILE = '.render_cache.json'
+
+
+def _fingerprint(name: str, payload) -> str:
+    """描画入力（集計値・色・描画バージョン）の指紋"""
+    blob = json.dumps({'v': RENDER_VERSION, 'chart': name, 'data': payload}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+def _init_render_worker():
+    """描画ワーカー: 画面を持たない Agg バックエンドに切り替える"""
+    plt.switch_backend('Agg')
+
+
+def render_category_pie(distribution: Dict[str, int], colors: Dict[str, str], save_path: str) -> str:
+    """カテゴリ分布円グラフを描画して保存する（プロセスプールから呼ばれる）"""
+    fig, ax = plt.subplots(figsize=(10, 8))
+
+    categories = list(distribution.keys())
+    values = list(distribution.values())
+
+    wedges, texts, autotexts = ax.pie(
+        values,
+        labels=categories,
+        colors=[colors.get(cat, '#CCCCCC') for cat in categories],
+        autopct='%1.1f%%',
+        startangle=90
+    )
+
+    for autotext in autotexts:
+        autotext.set_color('white')
+        autotext.set_fontweight('bold')
+
+    ax.set_title('プロンプトカテゴリ分布', fontsize=16, fontweight='bold', pad=20)
+    ax.legend(wedges, [f'{cat}: {val}件' for cat, val in zip(categories, values)],
+             title="カテゴリ別件数",
+             loc="center left",
+             bbox_to_anchor=(1, 0, 0.5, 1))
+
+    plt.tight_layout()
+    plt.savefig(save_path, dpi=300, bbox_inches='tight')
+    plt.close(fig)
+    return str(save_path)
+
+
+def render_category_bar(distribution: Dict[str, int], colors: Dict[str, str], save_path: str) -> str:
+    """カテゴリ分布棒グラフを描画して保存する"""
+    categories = list(distribution.keys())
+    values = list(distribution.values())
+
+    fig, ax = plt.subplots(figsize=(12, 6))
+    bars = ax.bar(categories, values, color=[colors.get(cat, '#CCCCCC') for cat in categories], alpha=0.8)
+
+    for bar in bars:
+        height = bar.get_height()
+        ax.annotate(f'{height}',
+                   xy=(bar.get_x() + bar.get_width() / 2, height),
+                   xytext=(0, 3),
+                   textcoords="offset points",
+                   ha='center', va='bottom',
+                   fontweight='bold')
+
+    ax.set_title('カテゴリ別プロンプト数', fontsize=16, fontweight='bold')
+    ax.set_xlabel('カテゴリ', fontsize=12)
+    ax.set_ylabel('プロンプト数', fontsize=12)
+    ax.tick_params(axis='x', rotation=45)
+    ax.grid(axis='y', alpha=0.3)
+
+    plt.tight_layout()
+    plt.savefig(save_path, dpi=300, bbox_inches='tight')
+    plt.close(fig)
+    return str(save_path)
+
+
+def render_confidence_histogram(bins: List[Dict[str, float]], mean: float, save_path: str) -> str:
+    """SQL で集計済みの信頼度ビンからヒストグラムを描画して保存する"""
+    fig, ax = plt.subplots(figsize=(10, 6))
+
+    # ビンの中心を件数で重み付けすると、元データに ax.hist を使った場合と同じ図になる
+    edges = [b['bin_start'] for b in bins] + [bins[-1]['bin_end']]
+    centers = [(b['bin_start'] + b['bin_end']) / 2 for b in bins]
+    ax.hist(centers, bins=edges, weights=[b['count'] for b in bins], color='skyblue', alpha=0.7, edgecolor='black')
+
+    ax.axvline(mean, color='red', linestyle='--', linewidth=2,
+              label=f'平均: {mean:.3f}')
+
+    ax.set_title('プロンプト分類信頼度分布', fontsize=16, fontweight='bold')
+    ax.set_xlabel('信頼度', fontsize=12)
+    ax.set_ylabel('件数', fontsize=12)
+    ax.legend()
+    ax.grid(alpha=0.3)
+
+    plt.tight_layout()
+    plt.savefig(save_path, dpi=300, bbox_inches='tight')
+    plt.close(fig)
+    return str(save_path)
+
+
 class DataVisualizer:
     """データ可視化クラス"""
 
     def __init__(self, db_manager: Optional[DatabaseManager] = None):
         """初期化"""
-        self.db_manager = db_manager or DatabaseManager()
+        self.db_manager = db_manager or get_database()
         self.output_dir = Path("data/visualizations")
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        # collect_chart_data の結果（DB の変更トークンが同じ間は再利用）
+        self._chart_data: Optional[Dict[str, Any]] = None
 
         # 正しいカテゴリ色設定
         self.category_colors = {
@@ -49,21 +160,40 @@ class DataVisualizer:
             'technical': '#A8E6CF'  # ライトグリーン
         }
 
-    def get_category_distribution(self) -> Dict[str, int]:
-        """カテゴリ別分布データを取得 - prompt_categoriesテーブルから正しくデータを取得"""
-        try:
-            # データベースから既存の統計機能を使用
-            stats = self.db_manager.get_category_statistics()
-            distribution = {}
+    def collect_chart_data(self) -> Dict[str, Any]:
+        """全グラフ・サマリーの入力を 1 回の接続でまとめて取得する（DB が変わるまでインスタンスに保持）"""
+        token = read_data_version(self.db_manager.db_path)
+        if self._chart_data is not None and self._chart_data['token'] == token:
+            return self._chart_data
 
-            # 全モデルの統計を合計
-            for model_stats in stats.values():
-                for category, count in model_stats.items():
-                    distribution[category] = distribution.get(category, 0) + count
+        conn = sqlite3.connect(self.db_manager.db_path)
+        try:
+            distribution = {r['category']: r['count'] for r in aggregations.category_counts(conn)}
+            confidence_bins = aggregations.histogram(conn, 'confidence', bins=20)
+            # numpy の std と同じ母標準偏差
+            confidence_stats = aggregations.column_stats(conn, 'confidence', ddof=0)
+            low_confidence = conn.execute(
+                'SELECT COUNT(*) FROM prompt_categories WHERE confidence < 0.5'
+            ).fetchone()[0]
+            total_prompts = rollups.read_totals(conn)['total_prompts']
+        finally:
+            conn.close()
 
-            logger.info(f"カテゴリ分布データ取得完了: {sum(distribution.values())}件")
-            return distribution
+        self._chart_data = {
+            'token': token,
+            'total_prompts': total_prompts,
+            'distribution': distribution,
+            'confidence_bins': confidence_bins,
+            'confidence_stats': confidence_stats,
+            'low_confidence': low_confidence,
+        }
+        logger.info(f"グラフ用データ取得完了: カテゴリ {len(distribution)}種 / 信頼度 {confidence_stats['count']}件")
+        return self._chart_data
 
+    def get_category_distribution(self) -> Dict[str, int]:
+        """カテゴリ別分布データを取得（category_rollups をカテゴリ単位に合算）"""
+        try:
+            return dict(self.collect_chart_data()['distribution'])
         except Exception as e:
             logger.error(f"分布データ取得エラー: {e}")
             return {}
@@ -88,167 +218,63 @@ class DataVisualizer:
             logger.error(f"信頼度データ取得エラー: {e}")
             return []
 
-    def create_category_pie_chart(self, save_path: Optional[str] = None) -> str:
-        """カテゴリ分布円グラフ作成"""
-        distribution = self.get_category_distribution()
-
-        if not distribution:
+    def _chart_jobs(self, data: Dict[str, Any]) -> Dict[str, Tuple[Any, tuple, str]]:
+        """グラフ名 -> (描画関数, 引数, 既定の出力ファイル名)。データがないグラフは含めない"""
+        jobs = {}
+        if data['distribution']:
+            jobs['pie_chart'] = (render_category_pie, (data['distribution'], self.category_colors), 'category_pie_chart.png')
+            jobs['bar_chart'] = (render_category_bar, (data['distribution'], self.category_colors), 'category_bar_chart.png')
+        if data['confidence_bins']:
+            jobs['histogram'] = (render_confidence_histogram,
+                                 (data['confidence_bins'], data['confidence_stats']['mean']), 'confidence_histogram.png')
+        return jobs
+
+    def _render_one(self, name: str, save_path: Optional[str] = None) -> str:
+        jobs = self._chart_jobs(self.collect_chart_data())
+        if name not in jobs:
             logger.warning("表示するデータがありません")
             return ""
+        renderer, args, filename = jobs[name]
+        path = renderer(*args, str(save_path or self.output_dir / filename))
+        logger.info(f"{name} 保存完了: {path}")
+        return path
 
-        # グラフ作成
-        fig, ax = plt.subplots(figsize=(10, 8))
-
-        categories = list(distribution.keys())
-        values = list(distribution.values())
-        colors = [self.category_colors.get(cat, '#CCCCCC') for cat in categories]
-
-        # 円グラフ描画
-        wedges, texts, autotexts = ax.pie(
-            values,
-            labels=categories,
-            colors=colors,
-            autopct='%1.1f%%',
-            startangle=90
-        )
-
-        # スタイル調整
-        for autotext in autotexts:
-            autotext.set_color('white')
-            autotext.set_fontweight('bold')
-
-        ax.set_title('プロンプトカテゴリ分布', fontsize=16, fontweight='bold', pad=20)
-
-        # 凡例追加
-        ax.legend(wedges, [f'{cat}: {val}件' for cat, val in zip(categories, values)],
-                 title="カテゴリ別件数",
-                 loc="center left",
-                 bbox_to_anchor=(1, 0, 0.5, 1))
-
-        plt.tight_layout()
-
-        # 保存
-        if not save_path:
-            save_path = self.output_dir / "category_pie_chart.png"
-
-        plt.savefig(save_path, dpi=300, bbox_inches='tight')
-        logger.info(f"円グラフ保存完了: {save_path}")
-
-        plt.close()
-        return str(save_path)
+    def create_category_pie_chart(self, save_path: Optional[str] = None) -> str:
+        """カテゴリ分布円グラフ作成"""
+        return self._render_one('pie_chart', save_path)
 
     def create_category_bar_chart(self, save_path: Optional[str] = None) -> str:
         """カテゴリ分布棒グラフ作成"""
-        distribution = self.get_category_distribution()
-
-        if not distribution:
-            logger.warning("表示するデータがありません")
-            return ""
-
-        # データ準備
-        categories = list(distribution.keys())
-        values = list(distribution.values())
-        colors = [self.category_colors.get(cat, '#CCCCCC') for cat in categories]
-
-        # グラフ作成
-        fig, ax = plt.subplots(figsize=(12, 6))
-
-        bars = ax.bar(categories, values, color=colors, alpha=0.8)
-
-        # 値ラベル追加
-        for bar in bars:
-            height = bar.get_height()
-            ax.annotate(f'{height}',
-                       xy=(bar.get_x() + bar.get_width() / 2, height),
-                       xytext=(0, 3),
-                       textcoords="offset points",
-                       ha='center', va='bottom',
-                       fontweight='bold')
-
-        # スタイル調整
-        ax.set_title('カテゴリ別プロンプト数', fontsize=16, fontweight='bold')
-        ax.set_xlabel('カテゴリ', fontsize=12)
-        ax.set_ylabel('プロンプト数', fontsize=12)
-        ax.tick_params(axis='x', rotation=45)
-        ax.grid(axis='y', alpha=0.3)
-
-        plt.tight_layout()
-
-        # 保存
-        if not save_path:
-            save_path = self.output_dir / "category_bar_chart.png"
-
-        plt.savefig(save_path, dpi=300, bbox_inches='tight')
-        logger.info(f"棒グラフ保存完了: {save_path}")
-
-        plt.close()
-        return str(save_path)
+        return self._render_one('bar_chart', save_path)
 
     def create_confidence_histogram(self, save_path: Optional[str] = None) -> str:
         """信頼度分布ヒストグラム作成"""
-        confidences = self.get_confidence_data()
-
-        if not confidences:
-            logger.warning("表示するデータがありません")
-            return ""
-
-        # グラフ作成
-        fig, ax = plt.subplots(figsize=(10, 6))
-
-        # ヒストグラム描画
-        ax.hist(confidences, bins=20, color='skyblue', alpha=0.7, edgecolor='black')
-
-        # 統計線追加
-        mean_conf = np.mean(confidences)
-        ax.axvline(mean_conf, color='red', linestyle='--', linewidth=2,
-                  label=f'平均: {mean_conf:.3f}')
-
-        # スタイル調整
-        ax.set_title('プロンプト分類信頼度分布', fontsize=16, fontweight='bold')
-        ax.set_xlabel('信頼度', fontsize=12)
-        ax.set_ylabel('件数', fontsize=12)
-        ax.legend()
-        ax.grid(alpha=0.3)
-
-        plt.tight_layout()
-
-        # 保存
-        if not save_path:
-            save_path = self.output_dir / "confidence_histogram.png"
-
-        plt.savefig(save_path, dpi=300, bbox_inches='tight')
-        logger.info(f"ヒストグラム保存完了: {save_path}")
-
-        plt.close()
-        return str(save_path)
+        return self._render_one('histogram', save_path)
 
     def generate_statistics_summary(self) -> Dict[str, any]:
-        """統計サマリー生成"""
+        """統計サマリー生成（集計は SQL 側で行う）"""
         try:
-            # 基本統計
-            data = self.db_manager.get_all_prompts()
-            total_prompts = len(data)
+            data = self.collect_chart_data()
+            total_prompts = data['total_prompts']
 
             if total_prompts == 0:
                 return {"error": "データがありません"}
 
-            # カテゴリ分布
-            distribution = self.get_category_distribution()
-
-            # 信頼度統計
-            confidences = self.get_confidence_data()
+            distribution = data['distribution']
+            conf = data['confidence_stats']
+            has_conf = bool(conf['count'])
 
             summary = {
                 "総プロンプト数": total_prompts,
                 "カテゴリ分布": distribution,
                 "信頼度統計": {
-                    "平均": round(np.mean(confidences), 3) if confidences else 0,
-                    "中央値": round(np.median(confidences), 3) if confidences else 0,
-                    "標準偏差": round(np.std(confidences), 3) if confidences else 0,
-                    "最小値": round(min(confidences), 3) if confidences else 0,
-                    "最大値": round(max(confidences), 3) if confidences else 0
+                    "平均": round(conf['mean'], 3) if has_conf else 0,
+                    "中央値": round(conf['median'], 3) if has_conf else 0,
+                    "標準偏差": round(conf['std'], 3) if has_conf else 0,
+                    "最小値": round(conf['min'], 3) if has_conf else 0,
+                    "最大値": round(conf['max'], 3) if has_conf else 0
                 },
-                "低信頼度プロンプト数": len([c for c in confidences if c < 0.5]) if confidences else 0,
+                "低信頼度プロンプト数": data['low_confidence'],
                 "最多カテゴリ": max(distribution.items(), key=lambda x: x[1])[0] if distribution else "なし"
             }
 
@@ -260,49 +286,22 @@ class DataVisualizer:
             return {"error": str(e)}
 
     def export_data_csv(self, save_path: Optional[str] = None) -> str:
-        """データCSVエクスポート - プロンプトとカテゴリ情報を結合して出力"""
-        try:
-            # プロンプトデータを取得
-            prompts_data = self.db_manager.get_all_prompts()
+        """データCSVエクスポート - プロンプトとカテゴリ情報を結合して出力
 
-            if not prompts_data:
+        PromptExporter でキーセットページングしながら逐次書き出すため、DB サイズによらず一定メモリ
+        """
+        try:
+            if self.db_manager.get_total_prompts_count() == 0:
                 logger.warning("エクスポートするデータがありません")
                 return ""
 
-            # カテゴリ情報を結合するため、SQLクエリで結合データを取得
-            conn = sqlite3.connect(self.db_manager.db_path)
-            cursor = conn.cursor()
-
-            cursor.execute('''
-                SELECT
-                    p.civitai_id,
-                    p.full_prompt,
-                    p.negative_prompt,
-                    p.quality_score,
-                    p.reaction_count,
-                    p.comment_count,
-                    p.download_count,
-                    p.model_name,
-                    p.collected_at,
-                    c.category,
-                    c.confidence
-                FROM civitai_prompts p
-                LEFT JOIN prompt_categories c ON p.id = c.prompt_id
-            ''')
-
-            rows = cursor.fetchall()
-            columns = [description[0] for description in cursor.description]
-
-            # DataFrame作成
-            df = pd.DataFrame(rows, columns=columns)
-            conn.close()
-
             # 保存
             if not save_path:
                 save_path = self.output_dir / "prompt_data_with_categories.csv"
 
-            df.to_csv(save_path, index=False, encoding='utf-8-sig')
-            logger.info(f"CSVエクスポート完了: {save_path} ({len(df)}件)")
+            exporter = PromptExporter(self.db_manager.db_path)
+            written = exporter.export(str(save_path), fmt='csv', columns=DEFAULT_EXPORT_COLUMNS)
+            logger.info(f"CSVエクスポート完了: {save_path} ({written}件)")
 
             return str(save_path)
 
@@ -310,16 +309,78 @@ class DataVisualizer:
             logger.error(f"CSVエクスポートエラー: {e}")
             return ""
 
-    def generate_all_visualizations(self) -> Dict[str, str]:
-        """全可視化ファイル生成"""
+    def _load_render_cache(self) -> Dict[str, str]:
+        try:
+            with open(self.output_dir / RENDER_CACHE_FILE, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_render_cache(self, cache: Dict[str, str]):
+        tmp = self.output_dir / (RENDER_CACHE_FILE + '.part')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.output_dir / RENDER_CACHE_FILE)
+
+    def _render_parallel(self, jobs: Dict[str, Tuple[Any, tuple, str]], workers: Optional[int]) -> Dict[str, str]:
+        """描画をプロセスプール（Agg バックエンド）に分散する。1 件のみ、または workers=0 なら同一プロセスで描画"""
+        results = {}
+        if len(jobs) > 1 and workers != 0:
+            try:
+                max_workers = min(len(jobs), workers or os.cpu_count() or 1)
+                with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_render_worker) as pool:
+                    futures = {name: pool.submit(renderer, *args, path) for name, (renderer, args, path) in jobs.items()}
+                    for name, future in futures.items():
+                        results[name] = future.result()
+                return results
+            except Exception as e:
+                # プロセスを起動できない環境では逐次描画に切り替える
+                logger.warning(f"並列描画に失敗したため逐次描画します: {e}")
+                results = {}
+        for name, (renderer, args, path) in jobs.items():
+            results[name] = renderer(*args, path)
+        return results
+
+    def generate_all_visualizations(self, workers: Optional[int] = None, force: bool = False) -> Dict[str, str]:
+        """全可視化ファイル生成
+
+        入力データの指紋が前回と同じで出力ファイルが残っているグラフは再描画せず、そのパスを返す。
+        force=True で全て描き直す。
+        """
         results = {}
 
         try:
-            # 各グラフ生成
-            results["pie_chart"] = self.create_category_pie_chart()
-            results["bar_chart"] = self.create_category_bar_chart()
-            results["histogram"] = self.create_confidence_histogram()
-            results["csv_export"] = self.export_data_csv()
+            data = self.collect_chart_data()
+            cache = {} if force else self._load_render_cache()
+            new_cache = {}
+
+            pending = {}
+            for name, (renderer, args, filename) in self._chart_jobs(data).items():
+                path = self.output_dir / filename
+                fp = _fingerprint(name, args)
+                new_cache[name] = fp
+                if cache.get(name) == fp and path.exists():
+                    results[name] = str(path)
+                else:
+                    pending[name] = (renderer, args, str(path))
+            for name in ('pie_chart', 'bar_chart', 'histogram'):
+                results.setdefault(name, "")
+
+            if pending:
+                logger.info(f"グラフ描画: {', '.join(pending)}（キャッシュ済み {len(results) - len(pending)}件）")
+                results.update(self._render_parallel(pending, workers))
+            else:
+                logger.info("グラフは前回から変更なし（キャッシュを使用）")
+
+            # CSV は DB の変更トークンが同じなら書き出し済みのファイルを使う
+            csv_path = self.output_dir / "prompt_data_with_categories.csv"
+            csv_fp = _fingerprint('csv_export', list(data['token']))
+            if cache.get('csv_export') == csv_fp and csv_path.exists():
+                results["csv_export"] = str(csv_path)
+            else:
+                results["csv_export"] = self.export_data_csv(str(csv_path))
+            if results["csv_export"]:
+                new_cache['csv_export'] = csv_fp
 
             # 統計サマリー保存
             summary = self.generate_statistics_summary()
@@ -331,6 +392,7 @@ class DataVisualizer:
                     f.write(f"{key}: {value}\n")
 
             results["summary"] = str(summary_path)
+            self._save_render_cache(new_cache)
 
             logger.info("全可視化ファイル生成完了")
             return results
@@ -14,7 +14,11 @@ import streamlit as st
 from datetime import datetime, timedelta
 import json
 import re
-from collections import Counter
+from typing import Any, Callable, Optional
+
+from src import rollups
+from src.analysis_session import AnalysisSession
+from src.cooccurrence import NUMPY_AVAILABLE, load_or_build
 
 class StatisticsManager:
     def __init__(self, db_path: str = "data/civitai_dataset.db"):
@@ -23,159 +27,101 @@ class StatisticsManager:
     def get_connection(self):
         return sqlite3.connect(self.db_path)
 
+    def _read(self, reader: Callable[[sqlite3.Connection], Any], default: Any) -> Any:
+        """集計テーブルを読み取り専用の接続で読む（スキーマの作成・移行は行わない）
+
+        集計テーブルは収集側の DatabaseManager が作成・維持する。まだない DB では default を返す。
+        """
+        conn = self.get_connection()
+        try:
+            return reader(conn)
+        except sqlite3.Error as e:
+            print(f"[Stats] Error reading rollups: {e}")
+            return default
+        finally:
+            conn.close()
+
     def get_basic_stats(self) -> dict:
-        """基本統計情報取得"""
-        with self.get_connection() as conn:
-            # 基本カウント
-            basic_query = """
-                SELECT
-                    COUNT(*) as total_prompts,
-                    COUNT(DISTINCT model_name) as unique_models,
-                    COUNT(DISTINCT model_version_id) as unique_versions,
-                    AVG(quality_score) as avg_quality,
-                    AVG(reaction_count) as avg_reactions,
-                    AVG(prompt_length) as avg_length,
-                    MIN(collected_at) as first_collected,
-                    MAX(collected_at) as last_collected
-                FROM civitai_prompts
-            """
-
-            basic_df = pd.read_sql_query(basic_query, conn)
+        """基本統計情報取得（集計テーブル prompt_rollups から読み出す）"""
+        totals = self._read(lambda conn: dict(rollups.read_totals(conn), **rollups.read_collected_range(conn)), {})
+        basic_keys = ['total_prompts', 'unique_models', 'unique_versions', 'avg_quality',
+                      'avg_reactions', 'avg_length', 'first_collected', 'last_collected']
+        basic = {k: totals.get(k) for k in basic_keys}
+
+        # 品質分布
+        quality_rows = self._read(lambda conn: rollups.read_dimension(conn, 'quality_tier'), [])
+        quality_df = pd.DataFrame(
+            [{'quality_tier': r['key'], 'count': r['prompt_count']} for r in quality_rows],
+            columns=['quality_tier', 'count']
+        )
 
-            # 品質分布
-            quality_query = """
-                SELECT
-                    CASE
-                        WHEN quality_score >= 500 THEN 'Very High (500+)'
-                        WHEN quality_score >= 100 THEN 'High (100-499)'
-                        WHEN quality_score >= 50 THEN 'Medium (50-99)'
-                        WHEN quality_score >= 10 THEN 'Low (10-49)'
-                        ELSE 'Very Low (0-9)'
-                    END as quality_tier,
-                    COUNT(*) as count
-                FROM civitai_prompts
-                GROUP BY quality_tier
-                ORDER BY MIN(quality_score) DESC
-            """
-
-            quality_df = pd.read_sql_query(quality_query, conn)
-
-            return {
-                'basic': basic_df.iloc[0].to_dict(),
-                'quality_distribution': quality_df
-            }
-
-    def analyze_prompt_trends(self) -> dict:
-        """プロンプトトレンド分析"""
-        with self.get_connection() as conn:
-            # 時系列データ
-            timeline_query = """
-                SELECT
-                    DATE(collected_at) as collection_date,
-                    COUNT(*) as daily_count,
-                    AVG(quality_score) as daily_avg_quality
-                FROM civitai_prompts
-                WHERE collected_at IS NOT NULL
-                GROUP BY DATE(collected_at)
-                ORDER BY collection_date
-            """
-
-            timeline_df = pd.read_sql_query(timeline_query, conn)
+        return {
+            'basic': basic,
+            'quality_distribution': quality_df
+        }
 
-            # 長さ分布
-            length_query = """
-                SELECT
-                    CASE
-                        WHEN prompt_length >= 1000 THEN 'Very Long (1000+)'
-                        WHEN prompt_length >= 500 THEN 'Long (500-999)'
-                        WHEN prompt_length >= 200 THEN 'Medium (200-499)'
-                        WHEN prompt_length >= 50 THEN 'Short (50-199)'
-                        ELSE 'Very Short (0-49)'
-                    END as length_category,
-                    COUNT(*) as count,
-                    AVG(quality_score) as avg_quality
-                FROM civitai_prompts
-                GROUP BY length_category
-                ORDER BY MIN(prompt_length)
-            """
-
-            length_df = pd.read_sql_query(length_query, conn)
-
-            return {
-                'timeline': timeline_df,
-                'length_distribution': length_df
-            }
+    def analyze_prompt_trends(self, since=None, until=None) -> dict:
+        """プロンプトトレンド分析（日別・長さ帯別の集計行を使用）
+
+        since / until（ISO 文字列・datetime）を指定すると、時系列はその期間の行だけを
+        collected_at の索引の範囲走査で集計する
+        """
+        # 時系列データ
+        if since is not None or until is not None:
+            day_rows = [{'key': r['day'], 'prompt_count': r['prompt_count'], 'avg_quality': r['avg_quality']}
+                        for r in self._read(lambda conn: rollups.read_daily(conn, since, until), []) if r['day']]
+        else:
+            day_rows = [r for r in self._read(lambda conn: rollups.read_dimension(conn, 'day'), []) if r['key']]
+        timeline_df = pd.DataFrame(
+            [{'collection_date': r['key'], 'daily_count': r['prompt_count'],
+              'daily_avg_quality': r['avg_quality']} for r in day_rows],
+            columns=['collection_date', 'daily_count', 'daily_avg_quality']
+        )
+
+        # 長さ分布
+        length_rows = self._read(lambda conn: rollups.read_dimension(conn, 'length_tier'), [])
+        length_df = pd.DataFrame(
+            [{'length_category': r['key'], 'count': r['prompt_count'],
+              'avg_quality': r['avg_quality']} for r in length_rows],
+            columns=['length_category', 'count', 'avg_quality']
+        )
+
+        return {
+            'timeline': timeline_df,
+            'length_distribution': length_df
+        }
 
     def analyze_model_performance(self) -> dict:
-        """モデル性能分析"""
-        with self.get_connection() as conn:
-            model_query = """
-                SELECT
-                    model_name,
-                    COUNT(*) as prompt_count,
-                    AVG(quality_score) as avg_quality,
-                    MAX(quality_score) as max_quality,
-                    AVG(reaction_count) as avg_reactions,
-                    AVG(prompt_length) as avg_length
-                FROM civitai_prompts
-                WHERE model_name IS NOT NULL
-                GROUP BY model_name
-                HAVING prompt_count >= 5
-                ORDER BY avg_quality DESC
-            """
-
-            model_df = pd.read_sql_query(model_query, conn)
-
-            return {'models': model_df}
-
-    def extract_keyword_trends(self) -> dict:
-        """キーワードトレンド分析"""
-        with self.get_connection() as conn:
-            # 全プロンプト取得
-            cursor = conn.cursor()
-            cursor.execute("SELECT full_prompt, quality_score FROM civitai_prompts WHERE full_prompt IS NOT NULL")
-            prompts_data = cursor.fetchall()
-
-            # キーワード抽出・分析
-            keyword_stats = Counter()
-            quality_by_keyword = {}
-
-            # 一般的なキーワード定義
-            target_keywords = [
-                'masterpiece', 'best quality', 'high quality', 'detailed', 'ultra detailed',
-                'realistic', 'photorealistic', 'anime', 'portrait', 'landscape',
-                '8k', '4k', 'high resolution', 'sharp', 'focus', 'depth of field',
-                'lighting', 'cinematic', 'dramatic', 'beautiful', 'stunning',
-                'girl', 'woman', 'man', 'boy', 'character', 'background'
-            ]
-
-            for prompt, quality in prompts_data:
-                if not prompt:
-                    continue
-
-                prompt_lower = prompt.lower()
-                for keyword in target_keywords:
-                    if keyword in prompt_lower:
-                        keyword_stats[keyword] += 1
-                        if keyword not in quality_by_keyword:
-                            quality_by_keyword[keyword] = []
-                        quality_by_keyword[keyword].append(quality)
-
-            # 品質統計計算
-            keyword_quality_stats = {}
-            for keyword, qualities in quality_by_keyword.items():
-                if len(qualities) >= 5:  # 5件以上のデータがあるもののみ
-                    keyword_quality_stats[keyword] = {
-                        'count': len(qualities),
-                        'avg_quality': sum(qualities) / len(qualities),
-                        'max_quality': max(qualities),
-                        'min_quality': min(qualities)
-                    }
-
-            return {
-                'keyword_frequency': dict(keyword_stats.most_common(20)),
-                'keyword_quality': keyword_quality_stats
-            }
+        """モデル性能分析（モデル別の集計行を使用）
+
+        従来どおりモデル名が NULL の行だけを除く。集計行のキー '' は NULL と空文字列の両方を含むため、
+        空文字列の名前の行は別に集計し直す。
+        """
+        def read(conn):
+            rows = [r for r in rollups.read_dimension(conn, 'model') if r['key']]
+            empty = rollups.read_empty_model_name(conn)
+            return rows + [empty] if empty else rows
+
+        model_rows = [r for r in self._read(read, []) if r['prompt_count'] >= 5]
+        model_df = pd.DataFrame(
+            [{'model_name': r['key'], 'prompt_count': r['prompt_count'], 'avg_quality': r['avg_quality'],
+              'max_quality': r['max_quality'], 'avg_reactions': r['avg_reactions'],
+              'avg_length': r['avg_length']} for r in model_rows],
+            columns=['model_name', 'prompt_count', 'avg_quality', 'max_quality', 'avg_reactions', 'avg_length']
+        )
+        if not model_df.empty:
+            model_df = model_df.sort_values('avg_quality', ascending=False).reset_index(drop=True)
+
+        return {'models': model_df}
+
+    def extract_keyword_trends(self, session: Optional[AnalysisSession] = None) -> dict:
+        """キーワードトレンド分析
+
+        対象キーワードは src.analysis_session.KEYWORD_TREND_TERMS。
+        session を渡すと、同じセッションの他の分析と 1 回の走査を共有する。
+        """
+        session = session or AnalysisSession(self.db_path, sections=('keyword_trends',))
+        return session.keyword_trends()
 
     def generate_recommendations(self) -> dict:
         """データに基づく推奨事項生成"""
@@ -188,6 +134,7 @@ class StatisticsManager:
             'collection_strategy': [],
             'prompt_optimization': [],
             'model_selection': [],
+            'tag_associations': [],
             'data_quality': []
         }
 
@@ -213,6 +160,11 @@ class StatisticsManager:
                 f"最高性能モデル: {top_model['model_name']} (平均品質: {top_model['avg_quality']:.1f})"
             )
 
+        # タグ共起に基づく推奨（高品質キーワードと一緒に使われやすいタグ）
+        recommendations['tag_associations'].extend(
+            self.recommend_associated_tags([k for k, _ in best_keywords[:3]])
+        )
+
         # データ品質推奨
         total_prompts = stats['basic']['total_prompts']
         if total_prompts < 1000:
@@ -222,6 +174,22 @@ class StatisticsManager:
 
         return recommendations
 
+    def recommend_associated_tags(self, seeds: list, k: int = 5) -> list:
+        """各シードタグと共起しやすいタグ（リフト順）を推奨文にする（NumPy がなければ空）"""
+        if not NUMPY_AVAILABLE or not seeds:
+            return []
+        try:
+            index = load_or_build(self.db_path)
+        except Exception as e:
+            print(f"[Stats] co-occurrence index unavailable: {e}")
+            return []
+        lines = []
+        for seed in seeds:
+            related = index.top_associated(seed, k=k, by='lift')
+            if related:
+                lines.append(f"{seed} と相性の良いタグ: {[r['tag'] for r in related]}")
+        return lines
+
 def create_statistics_dashboard():
     """Streamlit統計ダッシュボード"""
     st.set_page_config(page_title="CivitAI プロンプト統計", layout="wide")
@@ -238,6 +206,8 @@ def create_statistics_dashboard():
     show_models = st.sidebar.checkbox("モデル分析", value=True)
     show_keywords = st.sidebar.checkbox("キーワード分析", value=True)
     show_recommendations = st.sidebar.checkbox("推奨事項", value=True)
+    trend_days = st.sidebar.selectbox("トレンドの期間", [0, 7, 30, 90], index=0,
+                                      format_func=lambda d: "全期間" if d == 0 else f"直近{d}日")
 
     # メイン表示
     if show_basic:
@@ -272,7 +242,8 @@ def create_statistics_dashboard():
         st.header("📈 トレンド分析")
 
         try:
-            trend_stats = stats_manager.analyze_prompt_trends()
+            since = datetime.now() - timedelta(days=trend_days) if trend_days else None
+            trend_stats = stats_manager.analyze_prompt_trends(since=since)
 
             # タイムライン
             if not trend_stats['timeline'].empty:
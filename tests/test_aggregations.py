@@ -0,0 +1,56 @@
+import sqlite3
+import statistics
+
+from src.database import DatabaseManager
+from src.prompt_syntax import syntax_features
+
+
+PROMPTS = [
+    'masterpiece, (best quality:1.2), 1girl',
+    'a cat on a sofa',
+    'portrait, <lora:detail:0.8>, [soft light]',
+    'night city, neon',
+    'x' * 1200,
+]
+
+
+def _db(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'agg.db'))
+    for i, text in enumerate(PROMPTS):
+        db.save_prompt_data({'civitai_id': str(i), 'full_prompt': text, 'negative_prompt': '',
+                             'prompt_length': len(text), 'quality_score': i * 10})
+    return db
+
+
+def test_syntax_usage_matches_python_features(tmp_path):
+    db = _db(tmp_path)
+    # 特徴量列を設定しない経路（生の INSERT）で入った行は集計時に補完される
+    conn = sqlite3.connect(db.db_path)
+    conn.execute("INSERT INTO civitai_prompts (civitai_id, full_prompt, prompt_length) VALUES ('raw', 'a: 2, b', 7)")
+    conn.commit()
+    conn.close()
+
+    features = [syntax_features(t) for t in PROMPTS + ['a: 2, b']]
+    usage = db.get_syntax_usage()
+    assert usage['total'] == len(features)
+    assert usage['has_comma'] == sum(f['has_comma'] for f in features)
+    assert usage['has_weights'] == sum(f['has_weights'] for f in features) == 3
+    assert usage['has_parens'] == sum(f['paren_count'] > 0 for f in features) == 2
+    assert usage['has_embedding'] == 1
+
+
+def test_histograms_and_length_stats_are_binned_in_sql(tmp_path):
+    db = _db(tmp_path)
+    lengths = [len(t) for t in PROMPTS]
+
+    bins = db.get_histogram('prompt_length', bins=4)
+    assert len(bins) == 4
+    assert sum(b['count'] for b in bins) == len(PROMPTS)
+    assert bins[0]['bin_start'] == min(lengths) and bins[-1]['bin_end'] == max(lengths)
+    assert bins[-1]['count'] == 1
+
+    stats = db.get_length_stats()
+    assert stats['median'] == statistics.median(lengths)
+    assert abs(stats['std'] - statistics.stdev(lengths)) < 1e-6
+    assert (stats['min'], stats['max']) == (min(lengths), max(lengths))
+    assert db.get_histogram('confidence') == []
@@ -0,0 +1,96 @@
+import pytest
+
+from src.analysis_session import AnalysisSession
+from src.corpus import NUMPY_AVAILABLE
+from src.database import DatabaseManager
+
+# SQLite の走査とプロンプトコーパスからの計算は同じ結果になる
+SOURCES = [False, pytest.param(True, marks=pytest.mark.skipif(not NUMPY_AVAILABLE, reason='numpy is not installed'))]
+
+
+PROMPTS = [
+    'masterpiece, best quality, 1girl, anime',
+    'realistic photo of a woman, depth of field, (sharp:1.2)',
+    'fantasy dragon, <lora:magic:0.7>, lighting',
+    'a cat on a sofa',
+    None,
+]
+
+
+def _db(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'session.db'))
+    for i, text in enumerate(PROMPTS):
+        db.save_prompt_data({'civitai_id': str(i), 'full_prompt': text, 'negative_prompt': 'lowres',
+                             'prompt_length': len(text or ''), 'tag_count': len((text or '').split(',')),
+                             'quality_score': i * 10})
+    return db
+
+
+@pytest.mark.parametrize('use_corpus', SOURCES)
+def test_all_sections_share_one_scan(tmp_path, use_corpus):
+    db = _db(tmp_path)
+    session = AnalysisSession(db.db_path, use_corpus=use_corpus)
+
+    patterns = session.patterns()
+    categories = session.categories()
+    structure = session.structure()
+    trends = session.keyword_trends()
+    assert session.scans == 1
+
+    assert structure['total_prompts'] == len(PROMPTS)
+    assert structure['max_length'] == max(len(t or '') for t in PROMPTS)
+    assert len(structure['samples']) == len(PROMPTS)
+
+    assert patterns['comma_separated'] == 3
+    assert patterns['weight_usage'] == 2
+    assert patterns['parentheses_usage'] == 1
+    assert patterns['embedding_usage'] == 1
+    assert patterns['quality_terms']['masterpiece'] == 1
+    assert patterns['character_terms']['man'] == 1  # 'woman' にも部分一致する
+
+    assert [c[0] for c in categories['anime_character']] == [1]
+    assert [c[0] for c in categories['realistic_portrait']] == [2]
+    assert [c[0] for c in categories['fantasy_creature']] == [3]
+    assert [c[0] for c in categories['uncategorized']] == [4]
+
+    assert trends['keyword_frequency']['girl'] == 1
+    assert trends['keyword_quality'] == {}
+
+
+@pytest.mark.parametrize('use_corpus', SOURCES)
+def test_partial_session_scans_again_for_missing_section(tmp_path, use_corpus):
+    db = _db(tmp_path)
+    session = AnalysisSession(db.db_path, sections=('patterns',), use_corpus=use_corpus)
+    session.patterns()
+    session.patterns()
+    assert session.scans == 1
+    session.categories()
+    assert session.scans == 2
+
+
+@pytest.mark.parametrize('use_corpus', SOURCES)
+def test_keyword_counters_keep_sequential_tie_order(tmp_path, use_corpus):
+    db = DatabaseManager(str(tmp_path / 'ties.db'))
+    # 同数のキーワードは、行ごとにキーワード表の順で数えていた従来の Counter と同じ順に並ぶ
+    for i, text in enumerate(['Realistic anime', 'cartoon, anime', 'portrait, cartoon']):
+        db.save_prompt_data({'civitai_id': str(i), 'full_prompt': text, 'negative_prompt': ''})
+    styles = AnalysisSession(db.db_path, sections=('patterns',), use_corpus=use_corpus).patterns()['style_terms']
+    assert styles.most_common() == [('anime', 2), ('cartoon', 2), ('realistic', 1), ('portrait', 1)]
+
+
+@pytest.mark.skipif(not NUMPY_AVAILABLE, reason='numpy is not installed')
+def test_corpus_results_match_the_sqlite_scan(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'same.db'))
+    texts = PROMPTS + ['STUNNING \u0130stanbul 8\u212a, Anime girl', 'weight:\u3000\uff11 detailed', '', 'Anime, (cute:1.1)']
+    for i, text in enumerate(texts * 3):
+        db.save_prompt_data({'civitai_id': str(i), 'full_prompt': text, 'negative_prompt': '',
+                             'prompt_length': len(text or ''), 'tag_count': len((text or '').split(',')),
+                             'quality_score': None if i % 4 == 0 else i})
+    expected = AnalysisSession(db.db_path, use_corpus=False)
+    actual = AnalysisSession(db.db_path, use_corpus=True)
+    for section in ('structure', 'patterns', 'categories', 'keyword_trends'):
+        assert actual.get(section) == expected.get(section), section
+    trends = actual.keyword_trends()
+    assert list(trends['keyword_frequency']) == list(expected.keyword_trends()['keyword_frequency'])
+    assert trends['keyword_frequency']['8k'] == 3 and trends['keyword_quality']['anime']['count'] == 7
+    assert actual.patterns()['weight_usage'] == 12
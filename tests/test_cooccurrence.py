@@ -0,0 +1,65 @@
+import math
+import os
+
+import pytest
+
+from src.cooccurrence import split_tags
+
+
+def test_split_tags_normalizes_weights_embeddings_and_duplicates():
+    prompt = 'Masterpiece, (best quality:1.2), [1girl], <lora:detail:0.8> solo,\nmasterpiece,  long   hair '
+    assert split_tags(prompt) == ['masterpiece', 'best quality', '1girl', 'solo', 'long hair']
+    assert split_tags(None) == []
+
+
+def test_incremental_index_matches_rebuild(tmp_path):
+    pytest.importorskip('numpy')
+    from src.cooccurrence import CooccurrenceIndex, load_or_build
+    from src.database import DatabaseManager
+
+    db = DatabaseManager(str(tmp_path / 'co.db'))
+    prompts = ['1girl, solo, smile', '1girl, solo', '1girl, dragon', 'dragon, castle', 'solo, smile']
+    for i, text in enumerate(prompts[:3]):
+        db.save_prompt_data({'civitai_id': str(i), 'full_prompt': text, 'negative_prompt': '', 'quality_score': 10 * i})
+    path = str(tmp_path / 'co.npz')
+    load_or_build(db.db_path, path)
+    for i, text in enumerate(prompts[3:], start=3):
+        db.save_prompt_data({'civitai_id': str(i), 'full_prompt': text, 'negative_prompt': '', 'quality_score': 10 * i})
+    index = load_or_build(db.db_path, path)
+    full = CooccurrenceIndex.rebuild(db.db_path)
+
+    assert index.n_prompts == full.n_prompts == len(prompts)
+    top = index.top_associated('solo', k=5, by='count', min_count=1)
+    assert top == full.top_associated('solo', k=5, by='count', min_count=1)
+    assert [(r['tag'], r['count']) for r in top] == [('1girl', 2), ('smile', 2)]
+    # P(solo, smile) = 2/5, P(solo) = 3/5, P(smile) = 2/5
+    assert math.isclose(top[1]['lift'], (2 / 5) / ((3 / 5) * (2 / 5)))
+    assert math.isclose(top[1]['avg_quality'], (0 + 40) / 2)
+
+
+def test_index_belongs_to_its_db(tmp_path):
+    pytest.importorskip('numpy')
+    from src.cooccurrence import index_path_for, load_or_build
+    from src.database import DatabaseManager
+
+    first = DatabaseManager(str(tmp_path / 'first.db'))
+    second = DatabaseManager(str(tmp_path / 'second.db'))
+    first.save_prompt_data({'civitai_id': '1', 'full_prompt': 'cat, hat', 'negative_prompt': ''})
+    for civitai_id in ('1', '2'):
+        second.save_prompt_data({'civitai_id': civitai_id, 'full_prompt': 'dog, ball', 'negative_prompt': ''})
+    assert index_path_for(first.db_path) != index_path_for(second.db_path)
+    assert load_or_build(first.db_path).tag_stats('cat')['count'] == 1
+    assert load_or_build(second.db_path).tag_stats('cat') is None
+
+    # 同じファイルを別の DB に渡しても、その DB から作り直す
+    shared = str(tmp_path / 'shared.npz')
+    load_or_build(first.db_path, shared)
+    index = load_or_build(second.db_path, shared)
+    assert index.tag_stats('cat') is None and index.tag_stats('dog')['count'] == 2
+
+    # DB を作り直して id が戻った場合も作り直す
+    os.remove(second.db_path)
+    second = DatabaseManager(second.db_path)
+    second.save_prompt_data({'civitai_id': '9', 'full_prompt': 'fox', 'negative_prompt': ''})
+    index = load_or_build(second.db_path, shared)
+    assert index.n_prompts == 1 and index.tag_stats('dog') is None
@@ -0,0 +1,63 @@
+import sqlite3
+
+import pytest
+
+from src import corpus
+from src.analysis_session import AnalysisSession, PATTERN_KEYWORDS
+from src.database import DatabaseManager
+
+pytestmark = pytest.mark.skipif(not corpus.NUMPY_AVAILABLE, reason='numpy is not installed')
+
+PROMPTS = ['Masterpiece, best quality, 1girl', 'realistic woman, depth of field', None,
+           'anime girl, masterpiece, masterpiece', 'ドラゴン, fantasy']
+
+
+def _save(db, i, text, quality):
+    db.save_prompt_data({'civitai_id': str(i), 'full_prompt': text, 'negative_prompt': '', 'quality_score': quality,
+                         'prompt_length': len(text or ''), 'model_version_id': '200' if i % 2 else ''})
+
+
+def test_corpus_is_appended_and_matches_sql_scans(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'corpus.db'))
+    for i, text in enumerate(PROMPTS[:3]):
+        _save(db, i, text, i * 10)
+    assert corpus.refresh_corpus(db.db_path)['rebuilt'] is True
+    for i, text in enumerate(PROMPTS[3:], start=3):
+        _save(db, i, text, i * 10)
+    assert corpus.refresh_corpus(db.db_path) == {'rows': 5, 'appended': 2, 'updated': 0, 'rebuilt': False}
+    with corpus.open_corpus(db.db_path, refresh=False) as c:
+        assert c.ids.tolist() == [1, 2, 3, 4, 5]
+        assert c.text(0) == PROMPTS[0] and c.text(2) == '' and c.text(4) == PROMPTS[4]
+        assert c.column('model_version_id').tolist() == [corpus.NULL_INT, 200, corpus.NULL_INT, 200, corpus.NULL_INT]
+        assert c.histogram('quality_score', 4) == db.get_histogram('quality_score', 4)
+        # SQL 側の走査（小文字化した本文での部分一致）と同じ件数
+        keywords = PATTERN_KEYWORDS['quality_terms'] + PATTERN_KEYWORDS['character_terms']
+        expected = AnalysisSession(db.db_path, sections=('patterns',)).patterns()
+        counts = c.count_keywords(keywords)
+        for name in ('quality_terms', 'character_terms'):
+            assert {k: v for k, v in counts.items() if k in PATTERN_KEYWORDS[name] and v} == dict(expected[name])
+        assert c.keyword_stats(['masterpiece'])['masterpiece'] == {'count': 2, 'avg': 15.0, 'max': 30, 'min': 0}
+
+    # 値が変わらない upsert は記録されず、変わった行だけがその場で書き換わる
+    _save(db, 3, PROMPTS[3], 30)
+    assert corpus.refresh_corpus(db.db_path) == {'rows': 5, 'appended': 0, 'updated': 0, 'rebuilt': False}
+    conn = sqlite3.connect(db.db_path)
+    conn.execute("UPDATE civitai_prompts SET full_prompt = 'Masterpiece, best quality, woman' WHERE id = 1")
+    conn.execute("UPDATE civitai_prompts SET quality_score = 99 WHERE id = 2")
+    conn.commit()
+    assert corpus.refresh_corpus(db.db_path) == {'rows': 5, 'appended': 0, 'updated': 2, 'rebuilt': False}
+    assert conn.execute('SELECT COUNT(*) FROM prompt_changes').fetchone()[0] == 0
+    with corpus.open_corpus(db.db_path, refresh=False) as c:
+        assert c.text(0) == 'Masterpiece, best quality, woman' and c.column('quality_score')[1] == 99
+        assert c.count_keywords(['woman'])['woman'] == 2
+
+    # 本文の長さが変わった行・削除された行があれば作り直す
+    conn.execute("UPDATE civitai_prompts SET full_prompt = 'castle' WHERE id = 1")
+    conn.commit()
+    assert corpus.refresh_corpus(db.db_path)['rebuilt'] is True
+    with corpus.PromptCorpus(corpus.corpus_path_for(db.db_path)) as c:
+        assert c.text(0) == 'castle' and c.count_keywords(['masterpiece'])['masterpiece'] == 1
+    conn.execute('DELETE FROM civitai_prompts WHERE id = 5')
+    conn.commit()
+    conn.close()
+    assert corpus.refresh_corpus(db.db_path) == {'rows': 4, 'appended': 4, 'updated': 0, 'rebuilt': True}
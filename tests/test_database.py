@@ -0,0 +1,208 @@
+import sqlite3
+
+import pytest
+
+from src.database import DatabaseManager, build_fts_query
+from src.strategy_job import _load_cursor
+
+
+def _prompt(civitai_id, full_prompt, negative_prompt='', **extra):
+    data = {
+        'civitai_id': str(civitai_id),
+        'full_prompt': full_prompt,
+        'negative_prompt': negative_prompt,
+        'quality_score': extra.pop('quality_score', 0),
+        'prompt_length': len(full_prompt),
+    }
+    data.update(extra)
+    return data
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager(str(tmp_path / 'test.db'))
+    manager.save_prompt_data(_prompt(1, 'masterpiece, best quality, 1girl, (smile:1.2)', 'lowres, bad hands', quality_score=30))
+    manager.save_prompt_data(_prompt(2, 'anime style, best_quality, night city', 'nsfw', quality_score=10))
+    manager.save_prompt_data(_prompt(3, 'photo of a cat, masterful lighting', quality_score=20))
+    return manager
+
+
+def test_build_fts_query_quotes_barewords():
+    assert build_fts_query('1girl, (smile:1.2)') == '"1girl," ( "smile:1.2" )'
+    assert build_fts_query('mast*') == '"mast"*'
+    assert build_fts_query('anime AND NOT cat') == '"anime" NOT "cat"'
+
+
+def test_search_phrase_prefix_and_boolean(db):
+    assert db.count_search_results('"best quality"') == 2
+    assert {r['civitai_id'] for r in db.search_prompts('mast*')} == {'1', '3'}
+    assert [r['civitai_id'] for r in db.search_prompts('anime AND NOT cat')] == ['2']
+    assert db.count_search_results('cat OR anime') == 2
+
+
+def test_search_highlights_and_filters(db):
+    rows = db.search_prompts('lowres', highlight=('<b>', '</b>'))
+    assert len(rows) == 1
+    assert '<b>lowres</b>' in rows[0]['negative_snippet']
+    assert db.count_search_results('"best quality"', min_quality=20) == 1
+    ordered = db.search_prompts('"best quality"', order_by='quality')
+    assert [r['civitai_id'] for r in ordered] == ['1', '2']
+
+
+def test_search_index_follows_updates(db):
+    db.save_prompt_data(_prompt(3, 'photo of a dog'))
+    assert db.count_search_results('cat') == 0
+    assert db.count_search_results('dog') == 1
+    assert db.count_search_results('(unbalanced') == 0
+
+
+def test_rollups_follow_writes_and_match_rebuild(db):
+    db.save_prompt_data(_prompt(4, 'portrait', quality_score=600, model_name='m1', model_version_id='7'))
+    db.save_prompt_data(_prompt(5, 'portrait, smile', quality_score=40, model_name='m1', model_version_id='7'))
+    db.save_prompt_categories(4, {'composition': {'keywords': ['portrait'], 'confidence': 0.5}})
+    db.save_prompt_categories(5, {'composition': {'keywords': ['portrait'], 'confidence': 1.0}})
+    # quality max held by the updated row must be recomputed
+    db.save_prompt_data(_prompt(4, 'portrait', quality_score=1, model_name='m1', model_version_id='7'))
+
+    models = {r['key']: r for r in db.get_rollup('model')}
+    assert models['m1']['prompt_count'] == 2
+    assert models['m1']['max_quality'] == 40
+    assert db.get_prompt_count_by_version('7') == 2
+    assert db.get_total_prompts_count() == 5
+    assert db.get_category_statistics() == {'m1': {'composition': 2}}
+
+    before = (db.get_rollup('model'), db.get_rollup('quality_tier'), db.get_category_rollup())
+    db.rebuild_rollups()
+    assert (db.get_rollup('model'), db.get_rollup('quality_tier'), db.get_category_rollup()) == before
+
+
+def test_categories_saved_before_their_prompt_are_rolled_up(db):
+    # まだない prompt_id へのカテゴリは、その id の行が追加された時点で集計に入る
+    db.save_prompt_categories(4, {'style': {'keywords': ['anime'], 'confidence': 0.5}})
+    assert db.get_category_statistics() == {}
+    db.save_prompt_data(_prompt(4, 'anime girl', model_name='m2'))
+    assert db.get_category_statistics() == {'m2': {'style': 1}}
+
+    before = db.get_category_rollup()
+    db.rebuild_rollups()
+    assert db.get_category_rollup() == before
+
+
+def test_iter_prompts_pages_by_id_with_projection(db):
+    batches = list(db.iter_prompt_batches(columns=('civitai_id', 'quality_score'), batch_size=2))
+    assert [len(b) for b in batches] == [2, 1]
+    first = batches[0][0]
+    assert (first.civitai_id, first.quality_score) == ('1', 30)
+    assert not hasattr(first, '__dict__')
+
+    rows = list(db.iter_prompts(columns=('id',), where='quality_score >= ?', params=(20,), records=False))
+    assert rows == [(1,), (3,)]
+    with pytest.raises(ValueError):
+        list(db.iter_prompts(columns=('id; DROP TABLE x',)))
+
+
+def test_browse_prompts_keyset_pages(db):
+    db.save_prompt_data(_prompt(4, 'portrait', quality_score=30, model_version_id='9'))
+    db.save_prompt_data(_prompt(5, 'no score', quality_score=None))
+    db.save_prompt_categories(1, {'style': {'keywords': ['a'], 'confidence': 0.4}, 'technical': {'keywords': ['b'], 'confidence': 0.9}})
+
+    seen, cursor = [], None
+    while True:
+        rows, cursor = db.browse_prompts(after=cursor, limit=2)
+        seen += [r['civitai_id'] for r in rows]
+        if cursor is None:
+            break
+    # quality DESC, id DESC, NULL quality last
+    assert seen == ['4', '1', '3', '2', '5']
+
+    first, _ = db.browse_prompts(limit=5)
+    assert first[1]['category'] == 'technical'
+    assert [r['civitai_id'] for r in db.browse_prompts(min_quality=20, category='style')[0]] == ['1']
+    assert db.count_prompts() == 5
+    assert db.count_prompts(version_id='9') == 1
+    assert db.count_prompts(min_quality=20) == 3
+
+
+def test_data_version_tracks_appends_and_mutations(db):
+    from src.database import read_data_version
+
+    v0 = read_data_version(db.db_path)
+    db.save_prompt_data(_prompt(10, 'new prompt'))
+    v1 = read_data_version(db.db_path)
+    assert v1.max_id > v0.max_id and v1.prompts == v0.prompts
+
+    # 同じ内容の再取得（collected_at だけ新しい）では世代を進めない
+    db.save_prompt_data(_prompt(10, 'new prompt', collected_at='2030-01-01T00:00:00'))
+    db.save_prompts_bulk([_prompt(10, 'new prompt', collected_at='2030-01-02T00:00:00')])
+    assert read_data_version(db.db_path) == v1
+
+    db.save_prompt_data(_prompt(10, 'edited prompt'))
+    v2 = read_data_version(db.db_path)
+    assert v2.prompts > v1.prompts and v2.max_id == v1.max_id
+
+    db.save_prompt_categories(1, {'style': {'keywords': [], 'confidence': 1.0}})
+    assert read_data_version(db.db_path).categories > v2.categories
+    assert read_data_version(db.db_path) == read_data_version(db.db_path)
+
+
+def test_save_prompts_bulk_upserts_in_one_batch(db):
+    db.save_prompt_data(_prompt(4, 'kept version', model_version_id='111'))
+    result = db.save_prompts_bulk([
+        _prompt(4, 'kept version, updated', model_version_id='222'),
+        _prompt(5, 'new prompt', model_version_id='222',
+                resources=[{'index': 0, 'type': 'checkpoint', 'name': 'base', 'modelVersionId': '222'}]),
+        _prompt(5, 'new prompt, last wins', model_version_id='222'),
+        _prompt(6, 'with resources', model_version_id='222',
+                resources=[{'index': 0, 'type': 'lora', 'name': 'detail'}]),
+    ])
+    assert result == {'inserted': 2, 'updated': 1}
+    updated = db.get_prompt_by_civitai_id('4')
+    assert updated['full_prompt'] == 'kept version, updated'
+    assert updated['model_version_id'] == '111'
+    assert db.get_prompt_by_civitai_id('5')['full_prompt'] == 'new prompt, last wins'
+    assert [r['name'] for r in db.get_prompt_resources(db.get_prompt_by_civitai_id('6')['id'])] == ['detail']
+    assert db.get_total_prompts_count() == 6
+    assert db.count_search_results('"last wins"') == 1
+
+
+def test_collection_state_without_version_uses_null(tmp_path):
+    path = str(tmp_path / 'state.db')
+    conn = sqlite3.connect(path)
+    # ID を TEXT で宣言していた版（バージョンのない行は ''）
+    conn.execute("CREATE TABLE collection_state (id INTEGER PRIMARY KEY AUTOINCREMENT, model_id TEXT NOT NULL, "
+                 "version_id TEXT DEFAULT '', next_page_cursor TEXT DEFAULT NULL, "
+                 "last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE(model_id, version_id))")
+    conn.execute("INSERT INTO collection_state (model_id, next_page_cursor) VALUES ('7', 'c1')")
+    conn.execute("INSERT INTO collection_state (model_id, version_id, next_page_cursor) VALUES ('7', '70', 'c2')")
+    conn.commit()
+    conn.close()
+    DatabaseManager(path)
+
+    conn = sqlite3.connect(path)
+    assert conn.execute('SELECT version_id FROM collection_state ORDER BY id').fetchall() == [(None,), (70,)]
+    assert conn.execute("SELECT dflt_value FROM pragma_table_info('collection_state') WHERE name = 'version_id'").fetchone()[0] == 'NULL'
+    conn.close()
+    assert _load_cursor(path, '') == 'c1'
+    assert _load_cursor(path, '70') == 'c2'
+
+
+def test_collection_state_returns_text_ids(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'state_ids.db'))
+    conn = sqlite3.connect(db.db_path)
+    conn.execute("INSERT INTO collection_state (model_id, version_id, status) VALUES (7, 70, 'running')")
+    conn.commit()
+    conn.close()
+    for rows in (db.get_collection_state(), db.get_collection_state_for_version('70')):
+        assert [(r['model_id'], r['version_id'], r['status']) for r in rows] == [('7', '70', 'running')]
+
+
+def test_change_log_is_capped(db):
+    from src.config import CHANGE_LOG_LIMIT
+
+    conn = sqlite3.connect(db.db_path)
+    conn.executemany('INSERT INTO prompt_changes (seq, prompt_id) VALUES (?, 1)', [(1,), (2,), (999,)])
+    conn.execute('INSERT INTO prompt_changes (seq, prompt_id) VALUES (?, 1)', (CHANGE_LOG_LIMIT + 1000,))
+    conn.commit()
+    # 1000 件ごとに、直近 CHANGE_LOG_LIMIT 件より古い記録を消す
+    assert [r[0] for r in conn.execute('SELECT seq FROM prompt_changes ORDER BY seq')] == [CHANGE_LOG_LIMIT + 1000]
+    conn.close()
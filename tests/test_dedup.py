@@ -0,0 +1,47 @@
+import sqlite3
+
+from src.database import DatabaseManager
+from src.dedup import minhash_signature, similarity
+from src.exporter import PromptExporter
+
+BASE = 'masterpiece, best quality, 1girl, solo, long hair, blue eyes, smile, school uniform, outdoors, cherry blossoms'
+
+
+def _save(db, civitai_id, prompt):
+    db.save_prompt_data({'civitai_id': civitai_id, 'full_prompt': prompt, 'negative_prompt': ''})
+
+
+def test_signature_ignores_weights_order_and_seeds():
+    reordered = 'solo, (1girl:1.2), masterpiece, best quality, long hair, blue eyes, smile, school uniform, outdoors, cherry blossoms, 12345'
+    assert similarity(minhash_signature(BASE), minhash_signature(reordered)) == 1.0
+    assert similarity(minhash_signature(BASE), minhash_signature('dragon, castle, night, fire, mountains')) < 0.3
+    assert minhash_signature('') is None
+
+
+def test_near_duplicates_share_cluster_and_representatives_filter(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'dedup.db'))
+    _save(db, 'a', BASE)
+    _save(db, 'b', BASE.replace('smile', '(smile:1.1)') + ', 42')
+    _save(db, 'c', 'landscape, mountains, lake, sunset, no humans, scenery, clouds, reflection')
+    _save(db, 'd', BASE.replace('outdoors', 'indoors'))
+
+    dups = db.get_near_duplicates(1)
+    assert [d['id'] for d in dups][0] == 2 and dups[0]['similarity'] == 1.0
+    assert 3 not in [d['id'] for d in dups]
+    assert db.get_duplicate_cluster(2)['cluster_id'] == 1
+    assert db.get_duplicate_cluster(3) == {'cluster_id': 3, 'members': [3]}
+
+    stats = db.get_dedup_stats()
+    assert stats['indexed'] == 4 and stats['clusters'] + stats['duplicates'] == 4
+
+    rows = PromptExporter(db.db_path).preview(['id'], limit=10, representatives_only=True)
+    representatives = {r['id'] for r in rows}
+    assert 1 in representatives and 3 in representatives and 2 not in representatives
+
+    # 代表を削除するとクラスタは解体され、残りの行が再登録される
+    conn = sqlite3.connect(db.db_path)
+    conn.execute('DELETE FROM civitai_prompts WHERE id = 1')
+    conn.commit()
+    conn.close()
+    db.backfill_dedup_index()
+    assert db.get_duplicate_cluster(2)['cluster_id'] == 2
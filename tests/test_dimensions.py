@@ -0,0 +1,172 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from src.column_types import epoch_to_iso, now_epoch, to_epoch
+from src.database import DatabaseManager
+
+LEGACY_SCHEMA = [
+    '''CREATE TABLE civitai_prompts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, civitai_id TEXT UNIQUE, full_prompt TEXT, negative_prompt TEXT,
+        quality_score INTEGER, reaction_count INTEGER, comment_count INTEGER, download_count INTEGER,
+        prompt_length INTEGER, tag_count INTEGER, model_name TEXT, model_id TEXT, model_version_id TEXT,
+        collected_at TIMESTAMP, raw_metadata TEXT)''',
+    '''CREATE TABLE prompt_resources (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, prompt_id INTEGER, resource_index INTEGER, resource_type TEXT,
+        resource_name TEXT, resource_model_id TEXT, resource_model_version_id TEXT, resource_id TEXT, resource_raw TEXT)''',
+]
+
+
+def _legacy_db(path):
+    conn = sqlite3.connect(path)
+    for stmt in LEGACY_SCHEMA:
+        conn.execute(stmt)
+    conn.executemany(
+        'INSERT INTO civitai_prompts (id, civitai_id, full_prompt, quality_score, model_name, model_id, model_version_id) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [(1, 'a', 'masterpiece, 1girl', 10, 'Pony', '100', '200'),
+         (2, 'b', 'night city, neon', 50, 'Pony', '100', ''),
+         (5, 'c', 'a cat on a sofa', None, None, None, None),
+         (9, 'gone', 'deleted row', 1, 'SDXL', '300', '400')])
+    conn.execute('DELETE FROM civitai_prompts WHERE id = 9')
+    conn.executemany(
+        'INSERT INTO prompt_resources (prompt_id, resource_index, resource_type, resource_name, resource_model_version_id) '
+        'VALUES (?, ?, ?, ?, ?)',
+        [(1, 0, 'checkpoint', 'Pony', '200'), (1, 1, 'lora', 'detail', '7'), (2, 0, 'checkpoint', 'Pony', '200')])
+    conn.commit()
+    conn.close()
+
+
+def test_legacy_tables_are_migrated_behind_compatible_views(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    _legacy_db(path)
+    db = DatabaseManager(path)
+
+    conn = sqlite3.connect(path)
+    types = dict(conn.execute("SELECT name, type FROM sqlite_master WHERE name IN ('civitai_prompts', 'prompt_resources')"))
+    assert types == {'civitai_prompts': 'view', 'prompt_resources': 'view'}
+    rows = conn.execute('SELECT id, civitai_id, model_name, model_id, model_version_id FROM civitai_prompts ORDER BY id').fetchall()
+    assert rows == [(1, 'a', 'Pony', 100, 200), (2, 'b', 'Pony', 100, ''), (5, 'c', None, None, None)]
+    # 繰り返し現れる文字列は次元テーブルに 1 回だけ入る
+    assert conn.execute('SELECT COUNT(*) FROM models').fetchone()[0] == 1
+    assert conn.execute('SELECT COUNT(*) FROM resources').fetchone()[0] == 2
+    conn.close()
+
+    assert [r['name'] for r in db.get_prompt_resources(1)] == ['Pony', 'detail']
+    assert [r['id'] for r in db.search_prompts('neon')] == [2]
+    assert db.get_value_counts('model_name') == [{'value': 'Pony', 'count': 2}]
+    assert {r['key']: r['prompt_count'] for r in db.get_rollup('version')} == {'': 2, '200': 1}
+
+    # 削除済みの id は再利用されず、空のバージョンは後から埋まる
+    db.save_prompt_data({'civitai_id': 'd', 'full_prompt': 'castle', 'negative_prompt': '',
+                         'model_name': 'SDXL', 'model_id': 300, 'model_version_id': 400})
+    db.save_prompts_bulk([{'civitai_id': 'b', 'full_prompt': 'night city, neon', 'model_name': 'Pony',
+                           'model_id': '100', 'model_version_id': '200'}])
+    assert db.get_prompt_by_civitai_id('d')['id'] == 10
+    assert db.get_prompt_by_civitai_id('d')['model_id'] == '300'
+    assert db.get_prompt_count_by_version('200') == 2
+
+
+def test_writes_through_the_view_intern_dimensions(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'view.db'))
+    conn = sqlite3.connect(db.db_path)
+    conn.execute("INSERT INTO civitai_prompts (civitai_id, full_prompt, model_name, model_id) VALUES ('x', 'a', 'M', 1)")
+    conn.execute("INSERT INTO civitai_prompts (civitai_id, full_prompt, model_name, model_id) VALUES ('y', 'b', 'M', '1')")
+    conn.execute("UPDATE civitai_prompts SET model_name = 'N' WHERE civitai_id = 'y'")
+    conn.commit()
+    assert conn.execute('SELECT model_id, model_name FROM models ORDER BY id').fetchall() == [(1, 'M'), (1, 'N')]
+    conn.close()
+
+    # ビュー経由で増えた次元キーも取り込み時のキャッシュと食い違わない
+    db.save_prompt_data({'civitai_id': 'z', 'full_prompt': 'c', 'negative_prompt': '', 'model_name': 'N', 'model_id': '1'})
+    assert db.get_value_counts('model_name') == [{'value': 'N', 'count': 2}, {'value': 'M', 'count': 1}]
+
+
+TEXT_ID_SCHEMA = [
+    'CREATE TABLE models (id INTEGER PRIMARY KEY, model_id TEXT, model_name TEXT)',
+    'CREATE TABLE model_versions (id INTEGER PRIMARY KEY, model_version_id TEXT NOT NULL UNIQUE)',
+    '''CREATE TABLE resources (id INTEGER PRIMARY KEY, resource_type TEXT, resource_name TEXT,
+        resource_model_id TEXT, resource_model_version_id TEXT)''',
+    '''CREATE TABLE prompts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, civitai_id TEXT UNIQUE, full_prompt TEXT, negative_prompt TEXT,
+        quality_score INTEGER, reaction_count INTEGER, comment_count INTEGER, download_count INTEGER,
+        prompt_length INTEGER, tag_count INTEGER, model_key INTEGER, version_key INTEGER,
+        collected_at TIMESTAMP, raw_metadata TEXT)''',
+    '''CREATE TABLE prompt_resource_rows (id INTEGER PRIMARY KEY AUTOINCREMENT, prompt_id INTEGER,
+        resource_index INTEGER, resource_key INTEGER, resource_id TEXT, resource_raw TEXT)''',
+]
+
+
+def test_text_ids_and_iso_timestamps_are_retyped(tmp_path):
+    path = str(tmp_path / 'text_ids.db')
+    conn = sqlite3.connect(path)
+    for stmt in TEXT_ID_SCHEMA:
+        conn.execute(stmt)
+    conn.execute("INSERT INTO models VALUES (1, '100', 'Pony')")
+    conn.executemany('INSERT INTO model_versions VALUES (?, ?)', [(1, '200'), (2, '')])
+    conn.executemany(
+        'INSERT INTO prompts (id, civitai_id, full_prompt, quality_score, model_key, version_key, collected_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [(1, '11', 'castle', 10, 1, 1, '2024-03-01T10:00:00.123456'),
+         (2, 'abc', 'forest', 20, 1, 2, '2024-03-02 23:59:59'),
+         (3, '13', 'lake', 30, None, None, 'yesterday'),
+         (4, '15', 'hill', 40, None, None, '2024-03-03T20:30:00.999900+09:00')])
+    conn.commit()
+    conn.close()
+    db = DatabaseManager(path)
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT type FROM pragma_table_info('prompts') WHERE name = 'civitai_id'").fetchone()[0] == 'INTEGER'
+    # 数字の ID は整数に、解釈できない値は元の文字列のまま残る。
+    # タイムゾーンのない日時はローカル時刻として UTC に直し、マイクロ秒まで保つ
+    rows = conn.execute('SELECT civitai_id, collected_at FROM prompts ORDER BY id').fetchall()
+    assert [r[0] for r in rows] == [11, 'abc', 13, 15]
+    assert rows[2][1] == 'yesterday'
+    assert rows[3][1] == 1709465400.9999
+    assert datetime.fromtimestamp(rows[0][1]) == datetime(2024, 3, 1, 10, 0, 0, 123456)
+    assert rows[1][1] == to_epoch('2024-03-02 23:59:59') == int(datetime(2024, 3, 2, 23, 59, 59).timestamp())
+    # 互換ビューは移行前と同じ表記（ローカル時刻）で見せる
+    assert conn.execute('SELECT collected_at FROM civitai_prompts WHERE id IN (1, 2) ORDER BY id').fetchall() == [
+        ('2024-03-01T10:00:00.123456',), ('2024-03-02T23:59:59',)]
+    plan = ' '.join(r[3] for r in conn.execute(
+        'EXPLAIN QUERY PLAN SELECT COUNT(*) FROM prompts WHERE collected_at >= ? AND collected_at < ?', (0, 1)))
+    assert 'idx_prompts_collected_at' in plan
+    conn.close()
+
+    assert db.get_prompt_by_civitai_id('11')['model_version_id'] == '200'
+    assert db.get_prompt_count_by_version('200') == 1
+    day_of_hill = datetime.fromtimestamp(1709465400).date().isoformat()
+    days = {'2024-03-01': 1, '2024-03-02': 1, '': 1}
+    days[day_of_hill] = days.get(day_of_hill, 0) + 1
+    assert {r['key']: r['prompt_count'] for r in db.get_rollup('day')} == days
+    # 文字列の ID・ISO 形式の日時をそのまま渡せる
+    db.save_prompts_bulk([{'civitai_id': '14', 'full_prompt': 'river', 'collected_at': '2024-03-02T12:00:00'}])
+    assert [(r['day'], r['prompt_count']) for r in db.get_daily_stats('2024-03-02', '2024-03-03')] == [('2024-03-02', 2)]
+    assert db.get_rollup_totals()['first_collected'] == '2024-03-01T10:00:00.123456'
+
+
+def test_epochs_are_utc_and_keep_microseconds():
+    assert to_epoch('2024-03-01T10:00:00+09:00') == to_epoch('2024-03-01T01:00:00Z') == 1709254800
+    assert to_epoch('2024-03-01T01:00:00.249966+00:00') == 1709254800.249966
+    assert epoch_to_iso(to_epoch('2024-03-01T10:00:00.249966')) == '2024-03-01T10:00:00.249966'
+    # 現在時刻は壁時計ではなく UTC の UNIX 秒
+    assert abs(now_epoch() - datetime.now().timestamp()) < 5
+
+
+def test_model_rows_stay_unique(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'unique.db'))
+    conn = sqlite3.connect(db.db_path)
+    # ビュー経由の追加・保存処理のどちらでも、同じ値の組は 1 行だけ
+    for civitai_id in ('1', '2'):
+        conn.execute("INSERT INTO civitai_prompts (civitai_id, full_prompt, model_name) VALUES (?, 'a', 'SDXL')",
+                     (civitai_id,))
+    conn.commit()
+    for civitai_id in ('3', '4'):
+        db.save_prompt_data({'civitai_id': civitai_id, 'full_prompt': 'b', 'negative_prompt': '', 'model_name': 'Pony'})
+    assert conn.execute('SELECT model_id, model_name FROM models ORDER BY id').fetchall() == [
+        (None, 'SDXL'), (None, 'Pony')]
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO models (model_id, model_name) VALUES (NULL, 'SDXL')")
+    conn.close()
+    assert db.get_value_counts('model_name') == [{'value': 'Pony', 'count': 2}, {'value': 'SDXL', 'count': 2}]
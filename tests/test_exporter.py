@@ -0,0 +1,43 @@
+import csv
+import json
+
+from src.database import DatabaseManager
+from src.exporter import PromptExporter, detect_format
+
+
+def _seed(path):
+    db = DatabaseManager(path)
+    for i in range(1, 8):
+        db.save_prompt_data({
+            'civitai_id': str(i), 'full_prompt': f'prompt {i}', 'negative_prompt': '',
+            'quality_score': i * 10, 'model_version_id': '1' if i % 2 else '2',
+        })
+        db.save_prompt_categories(i, {'style': {'keywords': ['x'], 'confidence': 0.5}})
+    db.save_prompt_categories(3, {'style': {'keywords': ['x'], 'confidence': 0.5},
+                                  'mood': {'keywords': ['y'], 'confidence': 1.0}})
+    return db
+
+
+def test_export_csv_pages_through_all_rows(tmp_path):
+    db_path = str(tmp_path / 'test.db')
+    _seed(db_path)
+    out = tmp_path / 'out.csv'
+    written = PromptExporter(db_path, batch_size=2).export(str(out))
+    with open(out, encoding='utf-8-sig', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert written == len(rows) == 8
+    assert [r['civitai_id'] for r in rows] == ['1', '2', '3', '3', '4', '5', '6', '7']
+
+
+def test_export_jsonl_with_filters_and_projection(tmp_path):
+    db_path = str(tmp_path / 'test.db')
+    _seed(db_path)
+    out = tmp_path / 'out.jsonl'
+    assert detect_format(str(out)) == 'jsonl'
+    exporter = PromptExporter(db_path, batch_size=3)
+    written = exporter.export(str(out), columns=['civitai_id', 'category'],
+                              version_id='1', category='mood', min_quality=20)
+    lines = [json.loads(line) for line in out.read_text(encoding='utf-8').splitlines()]
+    assert written == 1
+    assert lines == [{'civitai_id': '3', 'category': 'mood'}]
+    assert [r['civitai_id'] for r in exporter.preview(['civitai_id'], limit=2)] == ['1', '2']
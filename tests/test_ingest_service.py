@@ -0,0 +1,97 @@
+import os
+import stat
+import sys
+import threading
+
+import pytest
+
+from src import registry
+from src.ingest_service import (IngestService, IngestClient, IngestError, _Request, authkey_path, load_authkey,
+                                ping)
+
+
+def _prompt(civitai_id, text, **extra):
+    return dict({'civitai_id': civitai_id, 'full_prompt': text, 'negative_prompt': ''}, **extra)
+
+
+class _RecordingConn:
+    """返事をそのまま記録する接続（書き込みスレッドだけを動かすテスト用）"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_bytes(self, data):
+        self.sent.append(data)
+
+
+def test_concurrent_producers_are_committed_before_replying(tmp_path):
+    path = str(tmp_path / 'ingest.db')
+    service = IngestService(path, window=0.05).start()
+    try:
+        replies = {}
+
+        def produce(n):
+            client = IngestClient(service.address, service.authkey)
+            replies[n] = client.ingest_prompts([_prompt(f'{n}{i}', f'prompt {n} {i}') for i in range(5)])
+            client.close()
+
+        threads = [threading.Thread(target=produce, args=(n,)) for n in range(1, 5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # 返された id はコミット済みで、別の接続からも読める
+        db = registry.get_database(path)
+        assert db.get_total_prompts_count() == 20
+        assert db.get_prompt_by_civitai_id('31')['id'] == replies[3]['ids'][31]
+        assert service.stats['requests'] == 4
+
+        # 失敗した要求だけが拒否され、同じ接続でそのまま書き続けられる
+        writer = registry.get_writer(path)
+        assert isinstance(writer, IngestClient)
+        with pytest.raises(IngestError):
+            writer.ingest_prompts([_prompt('99', 'x', collected_at={'not': 'a timestamp'})])
+        prompt_id = writer.ingest_prompts([_prompt('100', 'castle, night',
+                                                   resources=[{'index': 0, 'type': 'lora', 'name': 'detail'}])])['ids'][100]
+        assert writer.save_prompt_categories_bulk([(prompt_id, {'style': {'keywords': ['castle'], 'confidence': 0.5}})]) == 1
+        assert [r['name'] for r in db.get_prompt_resources(prompt_id)] == ['detail']
+        assert db.get_category_statistics()
+    finally:
+        registry.release(f'ingest:{tmp_path / "ingest.db"}')
+        service.stop()
+
+
+def test_queued_requests_share_one_commit(tmp_path):
+    service = IngestService(str(tmp_path / 'group.db'), window=0)
+    conn = _RecordingConn()
+    lock = threading.Lock()
+    # 書き込みスレッドの開始前に積んだ要求は、待ち時間なしでも 1 回のコミットにまとまる
+    for n in range(4):
+        service._queue.put(_Request(conn, lock, 'prompts', [_prompt(n, f'prompt {n}')]))
+    service.start()
+    service.stop()
+    assert (service.stats['commits'], service.stats['requests'], service.stats['prompts']) == (1, 4, 4)
+    assert len(conn.sent) == 4
+
+
+def test_authkey_is_random_per_db_and_private(tmp_path, monkeypatch):
+    monkeypatch.delenv('CIVITAI_INGEST_AUTHKEY', raising=False)
+    first = str(tmp_path / 'a.db')
+    assert load_authkey(first) is None
+    key = load_authkey(first, create=True)
+    assert key and load_authkey(first) == key
+    assert load_authkey(str(tmp_path / 'b.db'), create=True) != key
+    if sys.platform != 'win32':
+        assert stat.S_IMODE(os.stat(authkey_path(first)).st_mode) == 0o600
+        # 他のユーザーも読めるキーは作り直す
+        os.chmod(authkey_path(first), 0o644)
+        assert load_authkey(first, create=True) != key
+
+    service = IngestService(first).start()
+    try:
+        with pytest.raises(IngestError):
+            IngestClient(service.address, b'wrong key')
+        assert ping(service.address, load_authkey(first))
+    finally:
+        service.stop()
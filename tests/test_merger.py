@@ -0,0 +1,38 @@
+from src.database import DatabaseManager
+from src.merger import merge_databases
+
+
+def _db(path, ids, quality=0):
+    db = DatabaseManager(str(path))
+    for cid in ids:
+        db.save_prompt_data({'civitai_id': cid, 'full_prompt': f'prompt {cid}', 'negative_prompt': '',
+                             'quality_score': quality, 'model_name': 'm'})
+        prompt = db.get_prompt_by_civitai_id(cid)
+        db.save_prompt_categories(prompt['id'], {'style': {'keywords': ['a'], 'confidence': 0.5}})
+        db.save_prompt_resources(prompt['id'], [{'index': 0, 'type': 'lora', 'name': f'r{cid}'},
+                                                {'index': 1, 'type': 'checkpoint', 'name': 'ckpt'}])
+    return db
+
+
+def test_merge_remaps_children_and_reports_counts(tmp_path):
+    dst = _db(tmp_path / 'dst.db', ['a', 'b'])
+    _db(tmp_path / 's1.db', ['z', 'b', 'c'], quality=9)
+    _db(tmp_path / 's2.db', ['c', 'd'])
+
+    dry = merge_databases(dst.db_path, [str(tmp_path / 's1.db')], dry_run=True)
+    assert dry['totals']['civitai_prompts']['inserted'] == 2
+    assert dst.get_total_prompts_count() == 2
+
+    report = merge_databases(dst.db_path, [str(tmp_path / 's1.db'), str(tmp_path / 's2.db')])
+    assert report['totals']['civitai_prompts'] == {'source': 5, 'inserted': 3, 'updated': 0, 'skipped': 2}
+    assert report['totals']['prompt_categories']['inserted'] == 3
+    assert report['totals']['prompt_resources']['inserted'] == 6
+
+    assert dst.get_total_prompts_count() == 5
+    assert dst.get_category_statistics() == {'m': {'style': 5}}
+    z = dst.get_prompt_by_civitai_id('z')
+    assert [r['name'] for r in dst.get_prompt_resources(z['id'])] == ['rz', 'ckpt']
+    assert dst.count_search_results('z') == 1
+
+    merge_databases(dst.db_path, [str(tmp_path / 's1.db')], update_existing=True)
+    assert dst.get_prompt_by_civitai_id('b')['quality_score'] == 9
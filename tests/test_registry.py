@@ -0,0 +1,27 @@
+import os
+
+from src import registry
+
+
+def test_database_is_shared_and_recreated_when_unhealthy(tmp_path, monkeypatch):
+    path = str(tmp_path / 'shared.db')
+    db = registry.get_database(path)
+    assert registry.get_database(path) is db
+    assert registry.health_check()[f'db:{os.path.abspath(path)}'] is True
+
+    # DB ファイルが消えたら次のヘルスチェックで作り直される
+    os.remove(path)
+    monkeypatch.setattr(registry, 'HEALTH_CHECK_INTERVAL', 0)
+    recreated = registry.get_database(path)
+    assert recreated is not db
+    assert os.path.exists(path) and recreated.ping()
+    assert registry.release(f'db:{os.path.abspath(path)}') is True
+
+
+def test_release_closes_resource():
+    closed = []
+    value = registry.get_resource('test-resource', object, close=closed.append)
+    assert registry.get_resource('test-resource', object) is value
+    assert registry.release('test-resource') is True
+    assert closed == [value]
+    assert registry.release('test-resource') is False
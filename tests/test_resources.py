@@ -0,0 +1,45 @@
+import json
+import sqlite3
+
+from src.database import DatabaseManager
+from src.resources import backfill_resources, parse_resources_from_raw
+
+ITEM = {'id': 1, 'meta': {'prompt': 'x', 'civitaiResources': [
+    {'type': 'checkpoint', 'modelVersionId': 2091367, 'modelVersionName': 'v1'},
+    {'type': 'lora', 'weight': 0.8, 'modelVersionId': 5, 'nsfw': False},
+]}}
+
+
+def test_parser_accepts_json_and_python_repr():
+    from_json = parse_resources_from_raw(json.dumps(ITEM))
+    from_repr = parse_resources_from_raw(str(ITEM))
+    assert from_json == from_repr
+    assert [(r['type'], r['modelVersionId']) for r in from_repr] == [('checkpoint', '2091367'), ('lora', '5')]
+    assert parse_resources_from_raw("{'broken': ") == []
+    assert parse_resources_from_raw("__import__('os')") == []
+
+
+def test_backfill_is_chunked_and_resumable(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'test.db'))
+    for i in range(1, 8):
+        raw = str(ITEM) if i % 2 else json.dumps(ITEM)
+        db.save_prompt_data({'civitai_id': str(i), 'full_prompt': 'p', 'negative_prompt': '',
+                             'raw_metadata': raw if i != 4 else 'not metadata'})
+
+    stats = backfill_resources(db.db_path, chunk_size=3, workers=0)
+    assert stats['rows'] == 7 and stats['chunks'] == 3
+    assert stats['prompts_with_resources'] == 6
+    assert stats['resources_inserted'] == 12
+
+    # second run resumes after the checkpoint and does nothing
+    assert backfill_resources(db.db_path, chunk_size=3, workers=0)['rows'] == 0
+    # a full re-run only writes links that changed (none here)
+    stats = backfill_resources(db.db_path, chunk_size=3, workers=2, resume=False)
+    assert stats['resources_inserted'] == 0
+    conn = sqlite3.connect(db.db_path)
+    assert conn.execute('SELECT COUNT(*) FROM prompt_resources').fetchone()[0] == 12
+    # the same checkpoint / LoRA is stored once in the catalog, weight lives on the link
+    assert conn.execute('SELECT COUNT(*) FROM resources').fetchone()[0] == 2
+    assert conn.execute('SELECT DISTINCT weight FROM prompt_resource_links WHERE idx = 1').fetchall() == [(0.8,)]
+    conn.close()
+    assert [r['id'] for r in db.get_prompts_using_resource(5, resource_type='lora', limit=2)] == [7, 6]
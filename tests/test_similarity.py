@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+from src import similarity
+from src.database import DatabaseManager
+from src.similarity import SimilarityIndex, load_or_build
+
+
+def _save(db, civitai_id, prompt):
+    db.save_prompt_data({'civitai_id': civitai_id, 'full_prompt': prompt, 'negative_prompt': ''})
+
+
+def test_incremental_index_matches_rebuild_and_ranks_by_tfidf(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'sim.db'))
+    _save(db, 'a', 'masterpiece, 1girl, silver hair, night city, neon lights')
+    _save(db, 'b', 'masterpiece, 1girl, night city, rain')
+    _save(db, 'c', 'masterpiece, landscape, mountains, lake')
+    path = similarity.index_path_for(db.db_path)
+    load_or_build(db.db_path, path)
+    _save(db, 'd', 'masterpiece, 1boy, silver hair, night city, neon lights')
+    index = load_or_build(db.db_path, path)
+    full = SimilarityIndex.rebuild(db.db_path)
+
+    assert len(index) == len(full) == 4
+    assert (index.codes == full.codes).all()
+    ranked = index.similar_to_id(1, k=3)
+    assert ranked == full.similar_to_id(1, k=3)
+    # 共通タグ "masterpiece" は IDF が低いため、固有のタグを多く共有する行が上位になる
+    assert [pid for pid, _ in ranked] == [4, 2, 3]
+    assert index.similar_to_text('night city, neon lights', k=1)[0][0] in (1, 4)
+
+
+def test_find_similar_prompts_skips_near_duplicates(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'sim.db'))
+    base = 'masterpiece, best quality, 1girl, solo, silver hair, red eyes, night city, neon lights, rain, umbrella'
+    _save(db, 'a', base)
+    _save(db, 'b', base + ', 12345')
+    _save(db, 'c', 'masterpiece, 1girl, silver hair, night city, street')
+
+    assert [r['id'] for r in db.find_similar_prompts(1, k=5)] == [2, 3]
+    assert [r['id'] for r in db.find_similar_prompts(1, k=5, skip_duplicates=True)] == [3]
+    assert db.find_similar_prompts(text='umbrella, rain', k=1)[0]['id'] in (1, 2)
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from src.database import DatabaseManager
+from src.snapshot import MAX_BACKUP_RESTARTS, create_snapshot, list_snapshots, open_snapshot, rotate_snapshots, run_scheduled_snapshots
+
+
+def test_snapshot_is_consistent_and_read_only(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'live.db'))
+    db.save_prompt_data({'civitai_id': '1', 'full_prompt': 'a cat', 'negative_prompt': ''})
+    snap_dir = str(tmp_path / 'snaps')
+
+    path = create_snapshot(db.db_path, snapshot_dir=snap_dir, pages=1, verify=True)
+    db.save_prompt_data({'civitai_id': '2', 'full_prompt': 'a dog', 'negative_prompt': ''})
+
+    conn = open_snapshot(snapshot_dir=snap_dir, db_path=db.db_path)
+    try:
+        assert conn.execute('SELECT COUNT(*) FROM civitai_prompts').fetchone()[0] == 1
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM civitai_prompts")
+    finally:
+        conn.close()
+    assert list_snapshots(snap_dir)[0]['path'] == path
+
+
+def test_rotation_keeps_newest(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'live.db'))
+    snap_dir = tmp_path / 'snaps'
+    for stamp in ('20250101_000000', '20250102_000000', '20250103_000000'):
+        create_snapshot(db.db_path, dest=str(snap_dir / f'live.{stamp}.snapshot.db'), method='vacuum')
+    removed = rotate_snapshots(str(snap_dir), keep=2)
+    assert [os.path.basename(p) for p in removed] == ['live.20250101_000000.snapshot.db']
+    assert run_scheduled_snapshots(db.db_path, interval=0, keep=2, snapshot_dir=str(snap_dir), max_runs=1) == 1
+    assert len(list_snapshots(str(snap_dir))) == 2
+
+
+def _fill(db, n):
+    db.save_prompts_bulk([{'civitai_id': str(i), 'full_prompt': f'prompt {i} ' + 'x' * 400, 'negative_prompt': ''}
+                          for i in range(1, n + 1)])
+
+
+def test_snapshot_finishes_while_writer_runs(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'live.db'))
+    _fill(db, 500)
+    stop, started = threading.Event(), threading.Event()
+    written = []
+
+    def writer():
+        conn = sqlite3.connect(db.db_path, timeout=10)
+        i = 1000
+        while not stop.is_set():
+            i += 1
+            conn.execute("INSERT INTO civitai_prompts (civitai_id, full_prompt) VALUES (?, 'w')", (str(i),))
+            conn.commit()
+            written.append(i)
+            started.set()
+        conn.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        assert started.wait(10)
+        path = create_snapshot(db.db_path, dest=str(tmp_path / 'live.snapshot.db'), verify=True)
+    finally:
+        stop.set()
+        thread.join()
+    conn = sqlite3.connect(path)
+    count = conn.execute('SELECT COUNT(*) FROM civitai_prompts').fetchone()[0]
+    conn.close()
+    assert 500 + 1 <= count <= 500 + len(written)
+
+
+def test_restarting_backup_falls_back_to_vacuum(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'live.db'))
+    _fill(db, 200)
+    writer = sqlite3.connect(db.db_path)
+    steps = []
+
+    def write_each_step(status, remaining, total):
+        # 1 ステップごとに別の接続から書き込み、backup を毎回やり直しにする
+        steps.append(remaining)
+        writer.execute("INSERT INTO civitai_prompts (civitai_id, full_prompt) VALUES (?, 'w')", (f'w{len(steps)}',))
+        writer.commit()
+
+    path = create_snapshot(db.db_path, dest=str(tmp_path / 'live.snapshot.db'), method='backup',
+                           pages=1, sleep=0, progress=write_each_step, verify=True)
+    writer.close()
+    conn = sqlite3.connect(path)
+    count = conn.execute('SELECT COUNT(*) FROM civitai_prompts').fetchone()[0]
+    conn.close()
+    assert count == 200 + len(steps)
+    assert len(steps) == MAX_BACKUP_RESTARTS
@@ -0,0 +1,128 @@
+import os
+import sqlite3
+
+from src import registry, strategy_job
+from src.spool import (SpoolWriter, ingest_spool, load_cursor, page_record, read_segment, sealed_segments,
+                       spool_stats)
+
+
+def _page(*ids):
+    return {'items': [{'id': i, 'meta': {'prompt': f'prompt {i}'}, 'stats': {'likeCount': i}} for i in ids],
+            'metadata': {'nextCursor': None}}
+
+
+def test_pages_are_spooled_then_ingested_and_replayed(tmp_path):
+    spool_dir = str(tmp_path / 'pages.spool')
+    db_path = str(tmp_path / 'spool.db')
+    with SpoolWriter(spool_dir) as spool:
+        spool.append(page_record(_page(1, 2), 200, 'Pony'))
+        spool.append(page_record(_page(3), 200, 'Pony'))
+    assert [len(r['page']['items']) for r in read_segment(sealed_segments(spool_dir)[0])] == [2, 1]
+
+    # 書き手が落ちて残ったセグメント（末尾のレコードが途中で切れている）
+    crashed = SpoolWriter(spool_dir)
+    crashed.append(page_record(_page(4), 200, 'Pony'))
+    crashed.append(page_record(_page(5), 200, 'Pony'))
+    crashed._file.truncate(crashed._file.tell() - 3)
+    crashed._file.close()
+
+    stats = ingest_spool(spool_dir, db_path, keep=True, stale_seconds=0)
+    assert stats == {'segments': 2, 'records': 3, 'prompts': 4, 'inserted': 4, 'updated': 0}
+    assert spool_stats(spool_dir) == {'open': 0, 'sealed': 0, 'ingested': 2, 'pending_bytes': 0}
+    db = registry.get_database(db_path)
+    assert db.get_prompt_by_civitai_id('3')['model_version_id'] == '200'
+
+    # ネットワークなしで取り込み済みのページから作り直せる
+    os.remove(db_path)
+    registry.release(f'db:{os.path.abspath(db_path)}')
+    stats = ingest_spool(spool_dir, db_path, replay_ingested=True)
+    assert stats['inserted'] == 4
+    assert spool_stats(spool_dir)['ingested'] == 2
+    registry.release(f'db:{os.path.abspath(db_path)}')
+
+
+class _FlakyWriter:
+    """save_prompts_bulk の要求ごとの件数を記録し、fail_at 回目で失敗する"""
+
+    def __init__(self, db, fail_at=None):
+        self.db = db
+        self.fail_at = fail_at
+        self.calls = []
+
+    def save_prompts_bulk(self, prompts):
+        self.calls.append(len(prompts))
+        if len(self.calls) == self.fail_at:
+            raise OSError('connection lost')
+        return self.db.save_prompts_bulk(prompts)
+
+
+def test_segment_is_sent_one_page_per_request(tmp_path, monkeypatch):
+    spool_dir = str(tmp_path / 'pages.spool')
+    db_path = str(tmp_path / 'pages.db')
+    with SpoolWriter(spool_dir) as spool:
+        for ids in ((1, 2), (3,), (4, 5, 6)):
+            spool.append(page_record(_page(*ids), 200, 'Pony'))
+    db = registry.get_database(db_path)
+
+    # 2 ページ目で失敗したらセグメントを残し、次回は先頭から送り直す
+    flaky = _FlakyWriter(db, fail_at=2)
+    monkeypatch.setattr(registry, 'get_writer', lambda path: flaky)
+    assert ingest_spool(spool_dir, db_path)['segments'] == 0
+    assert spool_stats(spool_dir)['sealed'] == 1
+
+    writer = _FlakyWriter(db)
+    monkeypatch.setattr(registry, 'get_writer', lambda path: writer)
+    stats = ingest_spool(spool_dir, db_path)
+    assert writer.calls == [2, 1, 3]
+    assert stats == {'segments': 1, 'records': 3, 'prompts': 6, 'inserted': 4, 'updated': 2}
+    assert db.get_total_prompts_count() == 6
+    registry.release(f'db:{os.path.abspath(db_path)}')
+
+
+class _FakeResponse:
+    status_code = 200
+
+    def __init__(self, page):
+        self._page = page
+
+    def json(self):
+        return self._page
+
+
+class _FakeSession:
+    """API の代わりにページを順に返し、各リクエスト時にディスク上のカーソルを記録する"""
+
+    def __init__(self, spool_dir, pages):
+        self.spool_dir = spool_dir
+        self.pages = list(pages)
+        self.calls = []
+
+    def get(self, url, params=None, timeout=None):
+        self.calls.append((dict(params), load_cursor(self.spool_dir, '200')))
+        return _FakeResponse(self.pages.pop(0))
+
+
+def test_spool_mode_collects_while_the_db_is_locked(tmp_path, monkeypatch):
+    monkeypatch.setattr(strategy_job, 'SPOOL_DB_TIMEOUT', 0.01)
+    spool_dir = str(tmp_path / 'pages.spool')
+    db_path = str(tmp_path / 'locked.db')
+    first = dict(_page(1, 2), metadata={'nextCursor': 'c1'})
+    session = _FakeSession(spool_dir, [first, _page(3)])
+    lock = sqlite3.connect(db_path)
+    lock.execute('BEGIN EXCLUSIVE')
+    try:
+        summary = strategy_job.run_strategy_collection('200', ['X'], ['Newest'], max_items=10, db_path=db_path,
+                                                       job_id='job1', request_interval=0, session=session,
+                                                       spool_dir=spool_dir)
+    finally:
+        lock.rollback()
+        lock.close()
+
+    assert summary['strategies'][0]['spooled'] == 3
+    # 2 ページ目は続きのカーソルで取得するが、1 ページ目を封印するまでカーソルはディスクに書かない
+    assert session.calls[1] == ({'modelVersionId': '200', 'nsfw': 'X', 'sort': 'Newest', 'limit': 8, 'cursor': 'c1'}, None)
+    assert load_cursor(spool_dir, '200') == 'c1'
+    assert [len(r['page']['items']) for r in read_segment(sealed_segments(spool_dir)[0])] == [2, 1]
+    # DB に書けなかった進捗はスプールから読める
+    job = strategy_job.get_job(db_path, 'job1', spool_dir)
+    assert (job['status'], job['fetched'], job['strategies_done']) == ('completed', 3, 1)
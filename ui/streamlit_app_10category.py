@@ -14,6 +14,7 @@ sys.path.insert(0, str(project_root))
 import pandas as pd
 import requests
 from src.database import DatabaseManager
+from src.column_types import to_int_id
 try:
     import plotly.express as px  # type: ignore[import]
     PLOTLY_AVAILABLE = True
@@ -603,7 +604,7 @@ def main():
                     conn = db._get_connection()
                     cur = conn.cursor()
                     try:
-                        cur.execute('SELECT COUNT(*) FROM civitai_prompts WHERE model_version_id = ?', (str(version_id).strip(),))
+                        cur.execute('SELECT COUNT(*) FROM civitai_prompts WHERE model_version_id = ?', (to_int_id(str(version_id).strip()),))
                         vcount = cur.fetchone()[0]
                         # also count raw_metadata contains as a hint
                         cur.execute('SELECT COUNT(*) FROM civitai_prompts WHERE raw_metadata LIKE ?', (f"%{str(version_id).strip()}%",))
@@ -634,7 +635,7 @@ def main():
                 conn = db._get_connection()
                 cur = conn.cursor()
                 try:
-                    cur.execute('SELECT COUNT(*) FROM civitai_prompts WHERE model_version_id = ?', (str(version_id).strip(),))
+                    cur.execute('SELECT COUNT(*) FROM civitai_prompts WHERE model_version_id = ?', (to_int_id(str(version_id).strip()),))
                     vcount = cur.fetchone()[0]
                     cur.execute('SELECT COUNT(*) FROM civitai_prompts WHERE raw_metadata LIKE ?', (f"%{str(version_id).strip()}%",))
                     rawcount = cur.fetchone()[0]
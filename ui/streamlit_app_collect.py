@@ -12,8 +12,11 @@ from pathlib import Path
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 import pandas as pd
-import requests
-from src.database import DatabaseManager
+from src.database import read_data_version
+from src.column_types import to_int_id
+from src.registry import get_database, get_http_session
+from src.strategy_job import get_job as get_strategy_job
+from src.exporter import PromptExporter, EXPORT_COLUMNS, DEFAULT_EXPORT_COLUMNS, PYARROW_AVAILABLE
 try:
     import plotly.express as px  # type: ignore[import]
     PLOTLY_AVAILABLE = True
@@ -78,12 +81,7 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-@st.cache_data
-def load_data():
-    try:
-        conn = sqlite3.connect(DEFAULT_DB_PATH)
-        query = """
-        SELECT
+_LOAD_DATA_COLUMNS = """
             id,
             civitai_id,
             full_prompt,
@@ -98,50 +96,109 @@ def load_data():
             model_id,
             collected_at,
             model_version_id
-        FROM civitai_prompts
-        WHERE full_prompt IS NOT NULL
-        ORDER BY quality_score DESC
-        """
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+"""
+
+@st.cache_resource
+def _prompt_frame_holder():
+    """直近に読み込んだ DataFrame とその時点の変更トークン（差分追記用、全セッション共有）"""
+    import threading
+    return {'token': None, 'df': None, 'lock': threading.Lock()}
+
+def _read_prompt_frame(token):
+    """変更トークンに応じて全件再読み込み、または新しい id の行だけを追記する"""
+    holder = _prompt_frame_holder()
+    with holder['lock']:
+        prev_token, prev_df = holder['token'], holder['df']
+        if prev_token == token and prev_df is not None:
+            return prev_df
+        conn = sqlite3.connect(DEFAULT_DB_PATH)
+        try:
+            appended_only = (
+                prev_df is not None and prev_token is not None
+                and prev_token.prompts == token.prompts and token.max_id >= prev_token.max_id
+            )
+            if appended_only:
+                # 既存行の更新・削除がなければ、増えた id の行だけを読んで追記する
+                new_rows = pd.read_sql_query(
+                    f"SELECT {_LOAD_DATA_COLUMNS} FROM civitai_prompts WHERE id > ? AND full_prompt IS NOT NULL",
+                    conn, params=(int(prev_token.max_id),)
+                )
+                df = prev_df
+                if not new_rows.empty:
+                    df = pd.concat([prev_df, new_rows], ignore_index=True)
+                    df = df.sort_values('quality_score', ascending=False, kind='stable').reset_index(drop=True)
+            else:
+                df = pd.read_sql_query(
+                    f"SELECT {_LOAD_DATA_COLUMNS} FROM civitai_prompts WHERE full_prompt IS NOT NULL ORDER BY quality_score DESC",
+                    conn
+                )
+        finally:
+            conn.close()
+        holder['token'], holder['df'] = token, df
         return df
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def _load_data_for(token):
+    return _read_prompt_frame(token)
+
+def load_data():
+    """プロンプト一覧を読み込む（DB が変わったときだけ再読み込み）"""
+    try:
+        return _load_data_for(read_data_version(DEFAULT_DB_PATH))
     except Exception as e:
         st.error(f"データの読み込みに失敗しました: {e}")
         return pd.DataFrame()
 
-@st.cache_data
+@st.cache_data(max_entries=2, show_spinner=False)
+def _database_stats_for(token):
+    db_manager = get_database(DEFAULT_DB_PATH)
+    total_prompts = db_manager.get_prompt_count()
+    # category_rollups はモデル×カテゴリ単位なのでカテゴリ単位に合算する
+    rollup = pd.DataFrame(db_manager.get_category_rollup())
+    if rollup.empty:
+        category_stats = pd.DataFrame(columns=['category', 'count', 'avg_confidence'])
+    else:
+        grouped = rollup.groupby('category', as_index=False)[['count', 'confidence_sum', 'confidence_n']].sum()
+        grouped['avg_confidence'] = grouped['confidence_sum'] / grouped['confidence_n'].where(grouped['confidence_n'] > 0)
+        category_stats = grouped[['category', 'count', 'avg_confidence']].sort_values('count', ascending=False).reset_index(drop=True)
+    return {
+        'total_prompts': total_prompts,
+        'total_categorized': len(category_stats) > 0,
+        'category_stats': category_stats
+    }
+
 def get_database_stats():
     try:
-        db_manager = DatabaseManager()
-        total_prompts = db_manager.get_prompt_count()
-        query = """
-        SELECT category, COUNT(*) as count, AVG(confidence) as avg_confidence
-        FROM prompt_categories
-        GROUP BY category
-        ORDER BY count DESC
-        """
-        conn = db_manager._get_connection()
-        category_stats = pd.read_sql_query(query, conn)
-        conn.close()
-        return {
-            'total_prompts': total_prompts,
-            'total_categorized': len(category_stats) > 0,
-            'category_stats': category_stats
-        }
+        return _database_stats_for(read_data_version(DEFAULT_DB_PATH))
     except Exception as e:
         st.error(f"統計情報の取得に失敗しました: {e}")
         return {'total_prompts': 0, 'total_categorized': False, 'category_stats': pd.DataFrame()}
 
-def create_category_distribution_chart(df):
-    if df.empty:
+@st.cache_data(max_entries=2, show_spinner=False)
+def _chart_aggregates_for(token):
+    """グラフ用の集計（SQL でビン分けした小さな結果のみ）を変更トークン単位でキャッシュする"""
+    db_manager = get_database(DEFAULT_DB_PATH)
+    return {
+        'category_counts': pd.DataFrame(db_manager.get_category_counts(), columns=['category', 'count', 'avg_confidence']),
+        'confidence_hist': pd.DataFrame(db_manager.get_histogram('confidence', bins=20), columns=['bin_start', 'bin_end', 'count']),
+        'length_hist': pd.DataFrame(db_manager.get_histogram('prompt_length', bins=20), columns=['bin_start', 'bin_end', 'count']),
+        'length_stats': db_manager.get_length_stats(),
+        'syntax': db_manager.get_syntax_usage(),
+    }
+
+def get_chart_aggregates():
+    try:
+        return _chart_aggregates_for(read_data_version(DEFAULT_DB_PATH))
+    except Exception as e:
+        st.error(f"集計の取得に失敗しました: {e}")
         return None
 
-    # categoryカラムが存在するかチェック
-    if 'category' not in df.columns:
+def create_category_distribution_chart(counts):
+    """カテゴリ別件数（category, count）から円グラフを作る"""
+    if counts is None or counts.empty:
         return None
 
-    category_counts = df['category'].value_counts()
-    df_counts = category_counts.rename_axis('category').reset_index(name='count')
+    df_counts = counts[['category', 'count']]
     colors = {
         'NSFW': '#ff6b6b',
         'style': '#4ecdc4',
@@ -163,23 +220,29 @@ def create_category_distribution_chart(df):
         plt.tight_layout()
         return fig
 
-def create_confidence_histogram(df):
-    if df.empty or 'confidence' not in df.columns:
+def create_binned_histogram(bins, title, x_label, color='#1f77b4'):
+    """SQL で集計済みのビン（bin_start, bin_end, count）を棒グラフとして描く"""
+    if bins is None or bins.empty or not bins['count'].sum():
         return None
+    centers = (bins['bin_start'] + bins['bin_end']) / 2
+    widths = bins['bin_end'] - bins['bin_start']
     if PLOTLY_AVAILABLE:
-        fig = px.histogram(df, x='confidence', nbins=20, title='分類信頼度の分布', labels={'confidence': '信頼度', 'count': 'プロンプト数'}, color_discrete_sequence=['#1f77b4'])
-        fig.update_layout(xaxis_title="信頼度", yaxis_title="プロンプト数", font=dict(size=12), height=400)
+        fig = px.bar(x=centers, y=bins['count'], title=title, labels={'x': x_label, 'y': 'プロンプト数'}, color_discrete_sequence=[color])
+        fig.update_traces(width=widths)
+        fig.update_layout(xaxis_title=x_label, yaxis_title="プロンプト数", font=dict(size=12), height=400, bargap=0.05)
         return fig
-
     else:
         fig, ax = plt.subplots(figsize=(6, 4))
-        ax.hist(df['confidence'].dropna(), bins=20, color='#1f77b4')
-        ax.set_title('分類信頼度の分布')
-        ax.set_xlabel('信頼度')
+        ax.bar(centers, bins['count'], width=widths, color=color)
+        ax.set_title(title)
+        ax.set_xlabel(x_label)
         ax.set_ylabel('プロンプト数')
         plt.tight_layout()
         return fig
 
+def create_confidence_histogram(bins):
+    return create_binned_histogram(bins, '分類信頼度の分布', '信頼度')
+
 
 def display_chart(fig):
     """Display a figure produced by either plotly or matplotlib safely.
@@ -243,6 +306,7 @@ def display_prompt_card(row):
                 st.text_area("ポジティブプロンプト", value=row.get('full_prompt', ''), height=100, disabled=True, key=full_key)
                 if pd.notna(row.get('negative_prompt')) and str(row.get('negative_prompt')).strip():
                     st.text_area("ネガティブプロンプト", value=row.get('negative_prompt', ''), height=80, disabled=True, key=neg_key)
+                st.button("🧭 似たプロンプト", key=f"similar_{prompt_id}", on_click=_show_similar, args=(prompt_id,))
                 if st.button("閉じる", key=f"close_{prompt_id}"):
                     st.session_state[show_key] = False
                     try:
@@ -264,6 +328,36 @@ def display_prompt_card(row):
                 except Exception:
                     st.stop()
 
+def _show_similar(prompt_id):
+    """カードの「似たプロンプト」ボタン: 類似検索パネルの対象 ID を設定する"""
+    st.session_state['similar_prompt_id'] = int(prompt_id)
+    st.session_state['similar_text'] = ''
+
+def render_similar_prompts():
+    """類似プロンプト検索（More like this）パネル"""
+    db = get_database(DEFAULT_DB_PATH)
+    with st.expander("🧭 似たプロンプトを探す", expanded=bool(st.session_state.get('similar_prompt_id'))):
+        cols1, cols2, cols3 = st.columns([1, 3, 1])
+        with cols1:
+            prompt_id = st.number_input("プロンプトID", min_value=0, step=1, format="%d", key='similar_prompt_id',
+                                        help='0 の場合は右のテキストで検索')
+        with cols2:
+            text = st.text_input("またはプロンプト本文", key='similar_text')
+        with cols3:
+            k = st.number_input("件数", min_value=1, max_value=100, value=10, step=1, key='similar_k')
+        skip_duplicates = st.checkbox("近似重複をまとめる", value=True, key='similar_skip_duplicates')
+        if not prompt_id and not text.strip():
+            return
+        with st.spinner("類似プロンプトを検索中..."):
+            results = db.find_similar_prompts(prompt_id=int(prompt_id) or None, text=text.strip() or None,
+                                              k=int(k), skip_duplicates=skip_duplicates)
+        if not results:
+            st.info("類似プロンプトが見つかりませんでした（NumPy が必要です）")
+            return
+        for row in results:
+            st.markdown(f"**#{row['id']}** 類似度 {row['similarity']:.2f} ・ 品質 {row.get('quality_score') or 0} ・ {row.get('model_name') or ''}")
+            st.caption((row.get('full_prompt') or '')[:300])
+
 def read_log_tail(path, lines=50):
     from pathlib import Path
     log_path = Path(path)
@@ -272,9 +366,18 @@ def read_log_tail(path, lines=50):
     if not log_path.exists():
         return ''
     try:
-        with log_path.open('r', encoding='utf-8', errors='replace') as f:
-            data = f.read()
-            return '\n'.join(data.splitlines()[-lines:])
+        # ファイル全体は読まず、末尾から必要な行数が揃うまでブロック単位で遡る
+        block = 64 * 1024
+        with log_path.open('rb') as f:
+            f.seek(0, 2)
+            pos = f.tell()
+            data = b''
+            while pos > 0 and data.count(b'\n') <= lines:
+                step = min(block, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+        return '\n'.join(data.decode('utf-8', errors='replace').splitlines()[-lines:])
     except Exception:
         return ''
 
@@ -403,33 +506,342 @@ def parse_job_summary(tail: str) -> dict:
 
     return summary
 
-@st.cache_data(ttl=2)
-def load_data_no_cache():
-    """キャッシュを使わないデータ読み込み"""
+@st.cache_data(max_entries=2, show_spinner=False)
+def _load_data_with_categories_for(token):
+    query = """
+    SELECT
+        p.id,
+        p.full_prompt,
+        p.negative_prompt,
+        p.model_name,
+        p.model_id,
+        p.collected_at,
+        pc.category,
+        pc.confidence
+    FROM civitai_prompts p
+    LEFT JOIN prompt_categories pc ON p.id = pc.prompt_id
+    ORDER BY p.collected_at DESC
+    """
+    conn = sqlite3.connect(DEFAULT_DB_PATH)
     try:
-        db_manager = DatabaseManager()
-        query = """
-        SELECT
-            p.id,
-            p.full_prompt,
-            p.negative_prompt,
-            p.model_name,
-            p.model_id,
-            p.collected_at,
-            pc.category,
-            pc.confidence
-        FROM civitai_prompts p
-        LEFT JOIN prompt_categories pc ON p.id = pc.prompt_id
-        ORDER BY p.collected_at DESC
-        """
-        conn = db_manager._get_connection()
-        df = pd.read_sql_query(query, conn)
+        return pd.read_sql_query(query, conn)
+    finally:
         conn.close()
-        return df
+
+def load_data_no_cache():
+    """カテゴリ付きデータ読み込み（時間ではなく DB の変更トークンで再読み込みを判定）"""
+    try:
+        return _load_data_with_categories_for(read_data_version(DEFAULT_DB_PATH))
     except Exception as e:
         st.error(f"データの読み込みに失敗しました: {e}")
         return pd.DataFrame()
 
+# 検索スニペットの強調マーカー（HTML エスケープ後に <mark> へ置換する）
+_HL_OPEN = '\x02'
+_HL_CLOSE = '\x03'
+
+def snippet_to_html(snippet):
+    """FTS スニペットを HTML エスケープし、強調部分を <mark> で囲む"""
+    import html
+    text = html.escape(snippet or '')
+    return text.replace(_HL_OPEN, '<mark>').replace(_HL_CLOSE, '</mark>')
+
+def render_search_results(search_query, page_size):
+    """全文検索 (FTS5) の結果をページ単位で表示"""
+    db = get_database(DEFAULT_DB_PATH)
+    total_items = db.count_search_results(search_query)
+    total_pages = max(1, math.ceil(total_items / page_size))
+    colp1, colp2 = st.columns([1, 3])
+    with colp1:
+        page = st.number_input("ページ", min_value=1, max_value=total_pages, value=1, step=1, format="%d", key='search_page')
+    with colp2:
+        st.write(f"検索結果: {total_items} 件 / 全 {total_pages} ページ（関連度順）")
+    results = db.search_prompts(search_query, limit=page_size, offset=(page - 1) * page_size, highlight=(_HL_OPEN, _HL_CLOSE))
+    for row in results:
+        st.markdown(f"<div style='font-size:0.9rem'>{snippet_to_html(row.get('prompt_snippet'))}</div>", unsafe_allow_html=True)
+        if row.get('negative_snippet') and _HL_OPEN in row.get('negative_snippet'):
+            st.markdown(f"<div style='font-size:0.8rem;color:#888'>NEG: {snippet_to_html(row.get('negative_snippet'))}</div>", unsafe_allow_html=True)
+        display_prompt_card(row)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _count_browse_prompts_for(token, version_id, model_name, min_quality, category):
+    return get_database(DEFAULT_DB_PATH).count_prompts(version_id=version_id, model_name=model_name, min_quality=min_quality, category=category)
+
+def render_prompt_list(page_size):
+    """検索語なしの場合の一覧表示（品質スコア順）
+
+    表示中のページだけを DB から取得する（(quality_score, id) のキーセットページング）。
+    前のページに戻れるよう、各ページ先頭のカーソルを session_state に積んでおく。
+    """
+    db = get_database(DEFAULT_DB_PATH)
+    colf1, colf2, colf3, colf4 = st.columns(4)
+    with colf1:
+        version_options = [''] + sorted(r['key'] for r in db.get_rollup('version') if r['key'])
+        version_id = st.selectbox("バージョンID", options=version_options, format_func=lambda v: v or '(すべて)', key='browse_version')
+    with colf2:
+        model_options = [''] + sorted(r['key'] for r in db.get_rollup('model') if r['key'])
+        model_name = st.selectbox("モデル", options=model_options, format_func=lambda v: v or '(すべて)', key='browse_model')
+    with colf3:
+        category_options = [''] + sorted({r['category'] for r in db.get_category_rollup() if r['category']})
+        category = st.selectbox("カテゴリ", options=category_options, format_func=lambda v: v or '(すべて)', key='browse_category')
+    with colf4:
+        min_quality = st.number_input("最低品質スコア", min_value=0, value=0, step=10, key='browse_min_quality')
+    filters = {
+        'version_id': version_id or None,
+        'model_name': model_name or None,
+        'min_quality': int(min_quality) if min_quality else None,
+        'category': category or None,
+    }
+
+    # 絞り込み条件が変わったら先頭ページに戻す
+    filter_key = tuple(sorted(filters.items()))
+    if st.session_state.get('browse_filter_key') != filter_key:
+        st.session_state['browse_filter_key'] = filter_key
+        st.session_state['browse_cursors'] = [None]
+    cursors = st.session_state.setdefault('browse_cursors', [None])
+
+    total_items = _count_browse_prompts_for(read_data_version(DEFAULT_DB_PATH), **filters)
+    total_pages = max(1, math.ceil(total_items / page_size))
+    rows, next_cursor = db.browse_prompts(after=cursors[-1], limit=page_size, **filters)
+    page = len(cursors)
+
+    # ボタンの on_click で session_state を更新すると、その直後の再実行で新しいページが描画される
+    def _browse_first():
+        st.session_state['browse_cursors'] = [None]
+
+    def _browse_prev():
+        if len(st.session_state['browse_cursors']) > 1:
+            st.session_state['browse_cursors'].pop()
+
+    def _browse_next(cursor=next_cursor):
+        st.session_state['browse_cursors'].append(cursor)
+
+    colp1, colp2, colp3, colp4 = st.columns([1, 1, 1, 3])
+    with colp1:
+        st.button("⏮ 先頭", disabled=page == 1, key='browse_first', on_click=_browse_first)
+    with colp2:
+        st.button("◀ 前へ", disabled=page == 1, key='browse_prev', on_click=_browse_prev)
+    with colp3:
+        st.button("次へ ▶", disabled=next_cursor is None, key='browse_next', on_click=_browse_next)
+    with colp4:
+        st.write(f"表示: {page_size} 件/ページ — 合計 {total_items} 件 / 全 {total_pages} ページ（ページ {page}）")
+    for row in rows:
+        display_prompt_card(row)
+
+# ジョブ監視パネルの再描画間隔（秒）。フラグメントのみ再実行され、他のタブは再計算されない
+JOB_MONITOR_INTERVAL = 2
+
+def _fragment(run_every=None):
+    """st.fragment（旧 experimental_fragment）があれば部分再実行にする。なければ通常の関数のまま"""
+    frag = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None)
+    if frag is None:
+        return lambda func: func
+    return frag(run_every=run_every)
+
+def render_strategy_jobs(jobs):
+    """効率的収集ジョブ（scripts/collect_strategies.py）の進捗表示"""
+    st.subheader("効率的収集ジョブ")
+    for j in jobs:
+        info = get_strategy_job(DEFAULT_DB_PATH, j['id'])
+        status = info.get('status') if info else 'pending'
+        label = {'pending': '⏳ 開始待ち', 'running': '🔄 実行中', 'completed': '✅ 完了',
+                 'stopped': '⏹ 停止', 'failed': '❌ 失敗'}.get(status, status)
+        with st.expander(f"ジョブ {j['id']} — バージョン {j.get('version_id', '')} — {label}", expanded=(status in ('pending', 'running'))):
+            if not info:
+                st.write('ジョブの起動を待っています...')
+                st.code(read_log_tail(j.get('log_file'), lines=20) or '(ログなし)')
+                continue
+            total = info.get('strategies_total') or 0
+            done = info.get('strategies_done') or 0
+            if total:
+                st.progress(min(1.0, done / total), text=f"戦略 {done}/{total}" + (f"（実行中: {info['current_strategy']}）" if info.get('current_strategy') else ''))
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("🎯 保存成功", f"{info.get('saved') or 0}件")
+            col2.metric("📥 取得", f"{info.get('fetched') or 0}件")
+            col3.metric("🔁 重複", f"{info.get('duplicates') or 0}件")
+            col4.metric("❌ エラー", f"{info.get('errors') or 0}件")
+            summary = info.get('summary') or {}
+            for sr in summary.get('strategies', []):
+                st.write(f"**{sr['strategy']}**: 取得{sr['fetched']}件 → 保存{sr['saved']}件（重複{sr['duplicates']}件、エラー{sr['errors']}件）")
+            if summary.get('errors'):
+                with st.expander("⚠️ エラー詳細"):
+                    for error in summary['errors']:
+                        st.write(f"- {error}")
+            if status not in ('pending', 'running') and st.button('リストから削除', key=f'remove_strategy_{j["id"]}'):
+                st.session_state['collect_jobs'] = [x for x in st.session_state['collect_jobs'] if x['id'] != j['id']]
+
+@_fragment(run_every=JOB_MONITOR_INTERVAL)
+def render_job_monitor():
+    """収集ジョブの状態パネル（各ジョブの collection_state / collection_jobs の 1 行とログ末尾だけを読む）"""
+    all_jobs = st.session_state.get('collect_jobs', [])
+    strategy_jobs = [j for j in all_jobs if j.get('kind') == 'strategy']
+    if strategy_jobs:
+        render_strategy_jobs(strategy_jobs)
+    if not SHOW_LEGACY_UI_COMPONENTS:
+        return
+    st.subheader("収集ジョブの状態")
+
+    jobs = [j for j in all_jobs if j.get('kind') != 'strategy']
+    if not jobs:
+        # ジョブがなければ DB にもログにも触れずに終わる（定期実行のコストをほぼゼロにする）
+        st.info('収集中のジョブはありません。')
+        return
+    db_manager = get_database(DEFAULT_DB_PATH)
+
+    for j in list(jobs):
+        with st.expander(f"ジョブ {j['id']} — モデル {j.get('model_id','')} / バージョン {j.get('version_id','')}"):
+            lf = str(Path(j.get('log_file')).as_posix())
+            tail = read_log_tail(lf, lines=80)
+            version_id_str = str(j.get('version_id')) if j.get('version_id') is not None else ''
+            cs_list = db_manager.get_collection_state_for_version(version_id_str)
+            cs = cs_list[0] if cs_list else None
+            # 完了判定: ログtailまたはDB進捗に完了キーワードがあれば必ず'完了'
+            status = None
+            tail_lower = tail.lower() if tail else ''
+            is_finished = False
+            if cs and 'status' in cs and cs['status'] in ('completed', '完了'):
+                is_finished = True
+            if '=== collection finished' in tail_lower or 'job summary' in tail_lower:
+                is_finished = True
+            if is_finished:
+                status = '完了'
+            else:
+                if cs and 'status' in cs:
+                    status = cs['status']
+                else:
+                    status = infer_status_from_tail(tail)
+            # 進捗・予定件数
+            total_collected = cs['total_collected'] if cs and 'total_collected' in cs else None
+            planned_total = cs['planned_total'] if cs and 'planned_total' in cs else j.get('requested_max_items', None)
+            last_update = cs['last_update'] if cs and 'last_update' in cs else None
+            started_at = j.get('started_at')
+            def to_jst(dtstr):
+                try:
+                    dt = datetime.fromisoformat(str(dtstr).replace('Z',''))
+                    jst = dt.astimezone(timezone(timedelta(hours=9)))
+                    return jst.strftime('%Y-%m-%d %H:%M:%S JST')
+                except Exception:
+                    return str(dtstr)
+            elapsed_sec = None
+            if started_at and last_update:
+                try:
+                    dt_start = datetime.fromisoformat(str(started_at).replace('Z',''))
+                    dt_last = datetime.fromisoformat(str(last_update).replace('Z',''))
+                    elapsed_sec = (dt_last - dt_start).total_seconds()
+                except Exception:
+                    elapsed_sec = None
+            # ステータス・進捗バー（上部）
+            st.markdown("### ステータス")
+            cols_status = st.columns([2,2,2,2])
+            with cols_status[0]:
+                if status in ('running', '収集中'):
+                    st.info('状態: 実行中')
+                elif status in ('completed', '完了'):
+                    st.success('状態: 完了')
+                elif status in ('failed', '失敗'):
+                    st.error('状態: 失敗')
+                elif status in ('idle', '未開始/待機中', None):
+                    st.write('状態: 未開始/待機中')
+                else:
+                    st.write(f'状態: {status}')
+            with cols_status[1]:
+                # 進捗バーは常に表示。予定件数が不明/無制限なら仮の最大値（1000）で割合計算
+                bar_max = 1000
+                if planned_total and planned_total not in (None, 0, '0', 'unlimited'):
+                    try:
+                        bar_max = int(planned_total)
+                    except Exception:
+                        bar_max = 1000
+                bar_val = int(total_collected) if total_collected is not None else 0
+                # 完了時は100%表示
+                if status in ('completed', '完了'):
+                    progress = 1.0
+                else:
+                    progress = min(1.0, bar_val / bar_max) if bar_max > 0 else 0.0
+                st.progress(progress, text=f"進捗: {bar_val} / {bar_max} 件 ({progress*100:.1f}%)")
+                if planned_total in (None, 0, '0', 'unlimited'):
+                    st.write(f"進捗: {bar_val} 件（予定件数不明/無制限）")
+            with cols_status[2]:
+                if elapsed_sec is not None:
+                    mins = int(elapsed_sec // 60)
+                    secs = int(elapsed_sec % 60)
+                    st.write(f"経過時間: {mins}分{secs}秒")
+            with cols_status[3]:
+                st.write(f"開始: {to_jst(started_at)}")
+                if last_update:
+                    st.write(f"最終更新: {to_jst(last_update)}")
+            # ログ・サマリー（下部）
+            st.markdown("### ログ（末尾）")
+            if tail:
+                st.code(tail, language='text')
+            else:
+                st.info('ログはまだありません。')
+            try:
+                summary = parse_job_summary(tail)
+                if any(v is not None for k,v in summary.items() if k in ('collected','saved','duplicates','new_saved')) or summary['sample_ids'] or summary['updated_count']:
+                    st.markdown('### ジョブサマリー')
+                    planned_display = planned_total if planned_total not in (None, 0, '0', '', 'None') else (j.get('requested_max_items') if j.get('requested_max_items', None) not in (None, 0, '0', '', 'None') else 'unlimited')
+                    fetched = summary.get('collected') or summary.get('attempted') or summary.get('total_unique') or total_collected or 'N/A'
+                    duplicates = summary.get('duplicates')
+                    if duplicates is None and summary.get('attempted') is not None and summary.get('new_saved') is not None:
+                        try:
+                            duplicates = int(summary.get('attempted')) - int(summary.get('new_saved'))
+                        except Exception:
+                            duplicates = None
+                    # 保存された総件数を計算（新規保存 + 更新件数）
+                    new_saved = summary.get('new_saved') if summary.get('new_saved') is not None else (summary.get('saved') if summary.get('saved') is not None else 0)
+                    updated_count = summary.get('updated_count') or 0
+                    total_saved = (new_saved or 0) + updated_count
+
+                    # メイン表示: 最も重要な情報を強調
+                    st.markdown("#### 📊 収集結果サマリー")
+                    cols_main = st.columns(3)
+                    cols_main[0].metric('🎯 **今回保存成功件数**', f"{total_saved}件", help="この実行でデータベースに新規保存/更新された件数")
+                    cols_main[1].metric('📥 API から取得', f"{fetched}件" if fetched != 'N/A' else 'N/A', help="CivitAI APIから実際に取得したデータ件数")
+                    cols_main[2].metric('📋 取得予定', planned_display, help="当初予定していた収集件数")
+
+                    # 詳細情報
+                    with st.expander("📋 詳細内訳", expanded=False):
+                        cols_detail = st.columns(4)
+                        cols_detail[0].metric('🆕 新規保存', new_saved or 0)
+                        cols_detail[1].metric('🔄 既存更新', updated_count)
+                        cols_detail[2].metric('🔁 重複スキップ', duplicates if duplicates is not None else 'N/A')
+                        if summary.get('api_total') is not None:
+                            cols_detail[3].metric('📊 API総件数', summary.get('api_total'))
+
+                    # 取得と保存の関係を説明
+                    if fetched != 'N/A' and total_saved > 0:
+                        fetch_count = int(fetched) if str(fetched).isdigit() else 0
+                        if fetch_count > total_saved:
+                            st.info(f"💡 **説明**: APIから{fetch_count}件取得しましたが、{fetch_count - total_saved}件は既にデータベースに存在していたため重複としてスキップされました。")
+                        elif total_saved > 0:
+                            st.success(f"✅ **結果**: {total_saved}件のデータがデータベースに保存されました！")
+
+                    if summary.get('sample_ids'):
+                        st.write('📝 サンプル civitai_id: ' + ', '.join(summary.get('sample_ids')))
+            except Exception:
+                pass
+            col_refresh, col_open, col_remove = st.columns([1,2,1])
+            with col_refresh:
+                if st.button('更新', key=f'refresh_{j["id"]}'):
+                    try:
+                        st.session_state['__refresh_ts'] = time.time()
+                        if hasattr(st, 'experimental_rerun'):
+                            st.experimental_rerun()
+                    except Exception:
+                        pass
+            with col_open:
+                if st.button('ログを別ウィンドウで開く', key=f'open_{j["id"]}'):
+                    st.write(f"PowerShell コマンド: Get-Content {j.get('log_file')} -Wait -Tail 200")
+            with col_remove:
+                if st.button('リストから削除', key=f'remove_{j["id"]}'):
+                    try:
+                        st.session_state['collect_jobs'] = [x for x in st.session_state['collect_jobs'] if x['id'] != j['id']]
+                        if hasattr(st, 'experimental_rerun'):
+                            st.experimental_rerun()
+                    except Exception:
+                        pass
+
 def main():
     global sys
     import sys
@@ -437,11 +849,8 @@ def main():
     from pathlib import Path
     project_root = Path(__file__).parent.parent
     from pathlib import Path
-    # 収集ジョブ状態の自動更新（3秒ごと）
-    st_autorefresh = getattr(st, 'autorefresh', None)
-    # intervalを1000ms（1秒）に短縮し、確実に自動更新
-    if st_autorefresh:
-        st_autorefresh(interval=1000, key="job_status_autorefresh")
+    # 収集ジョブの状態は render_job_monitor（フラグメント）だけが定期更新する。
+    # アプリ全体の自動リロードは行わない
     st.title("🎨 CivitAI Prompt Collector - Collect")
     st.markdown("プロンプトデータの分析・表示・収集タブを提供します")
 
@@ -452,6 +861,8 @@ def main():
     if st.sidebar.button("🔄 リフレッシュ（最新データ読み込み）"):
         try:
             st.cache_data.clear()
+            # 差分追記用に保持している DataFrame も破棄して全件を読み直す
+            _prompt_frame_holder()['token'] = None
         except Exception:
             try:
                 st.experimental_memo_clear()
@@ -506,7 +917,7 @@ def main():
                     headers = {"User-Agent": USER_AGENT}
                     if CIVITAI_API_KEY:
                         headers['Authorization'] = f"Bearer {CIVITAI_API_KEY}"
-                    resp = requests.get(model_url, headers=headers, timeout=REQUEST_TIMEOUT)
+                    resp = get_http_session().get(model_url, headers=headers, timeout=REQUEST_TIMEOUT)
                     if resp.status_code == 200:
                         j = resp.json()
                         mname = j.get('name') or j.get('title') or j.get('modelName')
@@ -595,7 +1006,7 @@ def main():
         # Status check: show DB counts and API totalItems when requested
         if status_check:
             try:
-                db = DatabaseManager()
+                db = get_database(DEFAULT_DB_PATH)
                 # Count records that reference this version in model_version_id OR raw_metadata
                 vcount = 0
                 rawcount = 0
@@ -603,7 +1014,7 @@ def main():
                     conn = db._get_connection()
                     cur = conn.cursor()
                     try:
-                        cur.execute('SELECT COUNT(*) FROM civitai_prompts WHERE model_version_id = ?', (str(version_id).strip(),))
+                        cur.execute('SELECT COUNT(*) FROM civitai_prompts WHERE model_version_id = ?', (to_int_id(str(version_id).strip()),))
                         vcount = cur.fetchone()[0]
                         # also count raw_metadata contains as a hint
                         cur.execute('SELECT COUNT(*) FROM civitai_prompts WHERE raw_metadata LIKE ?', (f"%{str(version_id).strip()}%",))
@@ -630,11 +1041,11 @@ def main():
         # Immediate preview: always show DB counts + API total (helps explain 0/少数の原因)
         try:
             if version_id and str(version_id).strip():
-                db = DatabaseManager()
+                db = get_database(DEFAULT_DB_PATH)
                 conn = db._get_connection()
                 cur = conn.cursor()
                 try:
-                    cur.execute('SELECT COUNT(*) FROM civitai_prompts WHERE model_version_id = ?', (str(version_id).strip(),))
+                    cur.execute('SELECT COUNT(*) FROM civitai_prompts WHERE model_version_id = ?', (to_int_id(str(version_id).strip()),))
                     vcount = cur.fetchone()[0]
                     cur.execute('SELECT COUNT(*) FROM civitai_prompts WHERE raw_metadata LIKE ?', (f"%{str(version_id).strip()}%",))
                     rawcount = cur.fetchone()[0]
@@ -802,168 +1213,7 @@ def main():
                 st.error(f"バックグラウンドジョブの開始に失敗しました: {e}")
 
         # --- Job status display ---
-        if SHOW_LEGACY_UI_COMPONENTS:
-            st.subheader("収集ジョブの状態")
-
-        jobs = st.session_state.get('collect_jobs', [])
-        db_manager = DatabaseManager()
-
-        if SHOW_LEGACY_UI_COMPONENTS and jobs:
-            for j in list(jobs):
-                with st.expander(f"ジョブ {j['id']} — モデル {j.get('model_id','')} / バージョン {j.get('version_id','')}"):
-                    lf = str(Path(j.get('log_file')).as_posix())
-                    tail = read_log_tail(lf, lines=80)
-                    version_id_str = str(j.get('version_id')) if j.get('version_id') is not None else ''
-                    cs_list = db_manager.get_collection_state_for_version(version_id_str)
-                    cs = cs_list[0] if cs_list else None
-                    # 完了判定: ログtailまたはDB進捗に完了キーワードがあれば必ず'完了'
-                    status = None
-                    tail_lower = tail.lower() if tail else ''
-                    is_finished = False
-                    if cs and 'status' in cs and cs['status'] in ('completed', '完了'):
-                        is_finished = True
-                    if '=== collection finished' in tail_lower or 'job summary' in tail_lower:
-                        is_finished = True
-                    if is_finished:
-                        status = '完了'
-                    else:
-                        if cs and 'status' in cs:
-                            status = cs['status']
-                        else:
-                            status = infer_status_from_tail(tail)
-                    # 進捗・予定件数
-                    total_collected = cs['total_collected'] if cs and 'total_collected' in cs else None
-                    planned_total = cs['planned_total'] if cs and 'planned_total' in cs else j.get('requested_max_items', None)
-                    last_update = cs['last_update'] if cs and 'last_update' in cs else None
-                    started_at = j.get('started_at')
-                    def to_jst(dtstr):
-                        try:
-                            dt = datetime.fromisoformat(str(dtstr).replace('Z',''))
-                            jst = dt.astimezone(timezone(timedelta(hours=9)))
-                            return jst.strftime('%Y-%m-%d %H:%M:%S JST')
-                        except Exception:
-                            return str(dtstr)
-                    elapsed_sec = None
-                    if started_at and last_update:
-                        try:
-                            dt_start = datetime.fromisoformat(str(started_at).replace('Z',''))
-                            dt_last = datetime.fromisoformat(str(last_update).replace('Z',''))
-                            elapsed_sec = (dt_last - dt_start).total_seconds()
-                        except Exception:
-                            elapsed_sec = None
-                    # ステータス・進捗バー（上部）
-                    st.markdown("### ステータス")
-                    cols_status = st.columns([2,2,2,2])
-                    with cols_status[0]:
-                        if status in ('running', '収集中'):
-                            st.info('状態: 実行中')
-                        elif status in ('completed', '完了'):
-                            st.success('状態: 完了')
-                        elif status in ('failed', '失敗'):
-                            st.error('状態: 失敗')
-                        elif status in ('idle', '未開始/待機中', None):
-                            st.write('状態: 未開始/待機中')
-                        else:
-                            st.write(f'状態: {status}')
-                    with cols_status[1]:
-                        # 進捗バーは常に表示。予定件数が不明/無制限なら仮の最大値（1000）で割合計算
-                        bar_max = 1000
-                        if planned_total and planned_total not in (None, 0, '0', 'unlimited'):
-                            try:
-                                bar_max = int(planned_total)
-                            except Exception:
-                                bar_max = 1000
-                        bar_val = int(total_collected) if total_collected is not None else 0
-                        # 完了時は100%表示
-                        if status in ('completed', '完了'):
-                            progress = 1.0
-                        else:
-                            progress = min(1.0, bar_val / bar_max) if bar_max > 0 else 0.0
-                        st.progress(progress, text=f"進捗: {bar_val} / {bar_max} 件 ({progress*100:.1f}%)")
-                        if planned_total in (None, 0, '0', 'unlimited'):
-                            st.write(f"進捗: {bar_val} 件（予定件数不明/無制限）")
-                    with cols_status[2]:
-                        if elapsed_sec is not None:
-                            mins = int(elapsed_sec // 60)
-                            secs = int(elapsed_sec % 60)
-                            st.write(f"経過時間: {mins}分{secs}秒")
-                    with cols_status[3]:
-                        st.write(f"開始: {to_jst(started_at)}")
-                        if last_update:
-                            st.write(f"最終更新: {to_jst(last_update)}")
-                    # ログ・サマリー（下部）
-                    st.markdown("### ログ（末尾）")
-                    if tail:
-                        st.code(tail, language='text')
-                    else:
-                        st.info('ログはまだありません。')
-                    try:
-                        summary = parse_job_summary(tail)
-                        if any(v is not None for k,v in summary.items() if k in ('collected','saved','duplicates','new_saved')) or summary['sample_ids'] or summary['updated_count']:
-                            st.markdown('### ジョブサマリー')
-                            planned_display = planned_total if planned_total not in (None, 0, '0', '', 'None') else (j.get('requested_max_items') if j.get('requested_max_items', None) not in (None, 0, '0', '', 'None') else 'unlimited')
-                            fetched = summary.get('collected') or summary.get('attempted') or summary.get('total_unique') or total_collected or 'N/A'
-                            duplicates = summary.get('duplicates')
-                            if duplicates is None and summary.get('attempted') is not None and summary.get('new_saved') is not None:
-                                try:
-                                    duplicates = int(summary.get('attempted')) - int(summary.get('new_saved'))
-                                except Exception:
-                                    duplicates = None
-                            # 保存された総件数を計算（新規保存 + 更新件数）
-                            new_saved = summary.get('new_saved') if summary.get('new_saved') is not None else (summary.get('saved') if summary.get('saved') is not None else 0)
-                            updated_count = summary.get('updated_count') or 0
-                            total_saved = (new_saved or 0) + updated_count
-
-                            # メイン表示: 最も重要な情報を強調
-                            st.markdown("#### 📊 収集結果サマリー")
-                            cols_main = st.columns(3)
-                            cols_main[0].metric('🎯 **今回保存成功件数**', f"{total_saved}件", help="この実行でデータベースに新規保存/更新された件数")
-                            cols_main[1].metric('📥 API から取得', f"{fetched}件" if fetched != 'N/A' else 'N/A', help="CivitAI APIから実際に取得したデータ件数")
-                            cols_main[2].metric('📋 取得予定', planned_display, help="当初予定していた収集件数")
-
-                            # 詳細情報
-                            with st.expander("📋 詳細内訳", expanded=False):
-                                cols_detail = st.columns(4)
-                                cols_detail[0].metric('🆕 新規保存', new_saved or 0)
-                                cols_detail[1].metric('🔄 既存更新', updated_count)
-                                cols_detail[2].metric('🔁 重複スキップ', duplicates if duplicates is not None else 'N/A')
-                                if summary.get('api_total') is not None:
-                                    cols_detail[3].metric('📊 API総件数', summary.get('api_total'))
-
-                            # 取得と保存の関係を説明
-                            if fetched != 'N/A' and total_saved > 0:
-                                fetch_count = int(fetched) if str(fetched).isdigit() else 0
-                                if fetch_count > total_saved:
-                                    st.info(f"💡 **説明**: APIから{fetch_count}件取得しましたが、{fetch_count - total_saved}件は既にデータベースに存在していたため重複としてスキップされました。")
-                                elif total_saved > 0:
-                                    st.success(f"✅ **結果**: {total_saved}件のデータがデータベースに保存されました！")
-
-                            if summary.get('sample_ids'):
-                                st.write('📝 サンプル civitai_id: ' + ', '.join(summary.get('sample_ids')))
-                    except Exception:
-                        pass
-                    col_refresh, col_open, col_remove = st.columns([1,2,1])
-                    with col_refresh:
-                        if st.button('更新', key=f'refresh_{j["id"]}'):
-                            try:
-                                st.session_state['__refresh_ts'] = time.time()
-                                if hasattr(st, 'experimental_rerun'):
-                                    st.experimental_rerun()
-                            except Exception:
-                                pass
-                    with col_open:
-                        if st.button('ログを別ウィンドウで開く', key=f'open_{j["id"]}'):
-                            st.write(f"PowerShell コマンド: Get-Content {j.get('log_file')} -Wait -Tail 200")
-                    with col_remove:
-                        if st.button('リストから削除', key=f'remove_{j["id"]}'):
-                            try:
-                                st.session_state['collect_jobs'] = [x for x in st.session_state['collect_jobs'] if x['id'] != j['id']]
-                                if hasattr(st, 'experimental_rerun'):
-                                    st.experimental_rerun()
-                            except Exception:
-                                pass
-        elif SHOW_LEGACY_UI_COMPONENTS:
-            st.info('収集中のジョブはありません。')
+        render_job_monitor()
 
         # Enhanced NSFW Collection Strategy
         st.markdown("---")
@@ -972,7 +1222,7 @@ def main():
 
         # データベース状況確認
         try:
-            db_manager = DatabaseManager()
+            db_manager = get_database(DEFAULT_DB_PATH)
             conn = db_manager._get_connection()
             cursor = conn.cursor()
             cursor.execute('SELECT COUNT(*) FROM civitai_prompts')
@@ -1119,250 +1369,42 @@ def main():
             )
 
             if enhanced_collect_button and version_id:
-                with st.spinner("� 効率的収集を実行中..."):
-                    try:
-                        # Simple API-based collection for working UI
-                        collection_results = {
-                            'total_collected': 0,
-                            'strategies_executed': 0,
-                            'errors': []
-                        }
-
-                        # 戦略別結果記録用
-                        strategy_results = []
-                        total_saved_this_run = 0
-                        total_fetched_this_run = 0
-
-                        # Execute multiple strategies
-                        for nsfw_level in nsfw_levels:
-                            for sort_strategy in sort_strategies:
-                                try:
-                                    # 継続収集モードの場合、既存の最新IDを取得
-                                    start_after_id = None
-                                    # CivitAI APIの制限: limit最大200
-                                    actual_limit = min(enhanced_max_items, 200)
-
-                                    # 継続収集用のcursor準備
-                                    next_cursor = None
-                                    if continuous_mode:
-                                        try:
-                                            # collection_stateテーブルから最後のcursorを取得
-                                            db_temp = DatabaseManager(DEFAULT_DB_PATH)
-                                            conn = db_temp._get_connection()
-                                            cursor = conn.cursor()
-                                            cursor.execute(
-                                                """SELECT next_page_cursor FROM collection_state
-                                                   WHERE version_id = ?
-                                                   ORDER BY last_update DESC LIMIT 1""",
-                                                (str(version_id),)
-                                            )
-                                            result = cursor.fetchone()
-                                            if result and result[0]:
-                                                next_cursor = result[0]
-                                                st.write(f"🔄 継続モード: 前回の続きから収集中... (cursor: {next_cursor[:20]}...)")
-                                            else:
-                                                st.write(f"🔄 継続モード: 初回収集または前回完了済み")
-                                            conn.close()
-                                        except Exception as e:
-                                            st.warning(f"継続収集準備エラー: {e}")
-
-                                    # Direct API call with NSFW parameters
-                                    api_params = {
-                                        'modelVersionId': version_id,
-                                        'nsfw': nsfw_level,
-                                        'sort': sort_strategy,
-                                        'limit': actual_limit
-                                    }
-
-                                    # 継続収集用のcursorパラメータ追加
-                                    if continuous_mode and next_cursor:
-                                        api_params['cursor'] = next_cursor
-
-
-                                    # Make API request (simplified)
-                                    response = requests.get(
-                                        "https://civitai.com/api/v1/images",
-                                        params=api_params,
-                                        timeout=30
-                                    )
-
-                                    if response.status_code == 200:
-                                        data = response.json()
-                                        items = data.get('items', [])
-
-                                        # データベース保存処理を追加
-                                        saved_count = 0
-                                        duplicate_count = 0
-                                        error_count = 0
-                                        db = DatabaseManager(DEFAULT_DB_PATH)
-
-                                        # 継続収集モードでの結果確認
-                                        if continuous_mode:
-                                            if items:
-                                                st.write(f"🆕 新しいデータ: {len(items)}件取得しました ({nsfw_level}+{sort_strategy})")
-                                            else:
-                                                st.info(f"📭 データなし: このページは空です ({nsfw_level}+{sort_strategy})")
-                                                continue  # このAPIリクエストをスキップ
-
-                                        for item in items:
-                                            try:
-                                                # Null チェック
-                                                if item is None:
-                                                    continue
-
-                                                # 安全なデータ抽出
-                                                item_id = item.get('id') if item else None
-                                                if not item_id:
-                                                    continue
-
-                                                meta = item.get('meta') or {}
-                                                stats = item.get('stats') or {}
-
-                                                full_prompt = meta.get('prompt', '') if isinstance(meta, dict) else ''
-                                                negative_prompt = meta.get('negativePrompt', '') if isinstance(meta, dict) else ''
-
-                                                prompt_data = {
-                                                    'civitai_id': str(item_id),
-                                                    'full_prompt': full_prompt,
-                                                    'negative_prompt': negative_prompt,
-                                                    'model_version_id': str(version_id),
-                                                    'model_id': str(item.get('modelVersionId', '') or ''),
-                                                    'model_name': st.session_state.get('model_name_input', 'Unknown'),
-                                                    'quality_score': stats.get('likeCount', 0) if isinstance(stats, dict) else 0,
-                                                    'reaction_count': stats.get('reactionCount', 0) if isinstance(stats, dict) else 0,
-                                                    'comment_count': stats.get('commentCount', 0) if isinstance(stats, dict) else 0,
-                                                    'download_count': stats.get('downloadCount', 0) if isinstance(stats, dict) else 0,
-                                                    'prompt_length': len(full_prompt) if full_prompt else 0,
-                                                    'tag_count': len(full_prompt.split(',')) if full_prompt else 0,
-                                                    'collected_at': datetime.now().isoformat(),
-                                                    'raw_metadata': str(item)
-                                                }
-
-                                                # データベースに保存（結果を詳細記録）
-                                                save_result = db.save_prompt_data(prompt_data)
-                                                if save_result:
-                                                    saved_count += 1
-                                                else:
-                                                    # 保存失敗の理由を推測（通常は重複）
-                                                    duplicate_count += 1
-                                            except Exception as save_error:
-                                                error_count += 1
-                                                st.warning(f"保存エラー (Item ID: {item.get('id', 'Unknown') if item else 'None'}): {save_error}")
-
-                                        # 戦略別結果記録
-                                        strategy_result = {
-                                            'strategy': f"{nsfw_level}+{sort_strategy}",
-                                            'fetched': len(items),
-                                            'saved': saved_count,
-                                            'duplicates': duplicate_count,
-                                            'errors': error_count
-                                        }
-                                        strategy_results.append(strategy_result)
-
-                                        collection_results['total_collected'] += len(items)
-                                        collection_results['strategies_executed'] += 1
-                                        total_saved_this_run += saved_count
-                                        total_fetched_this_run += len(items)
-
-                                        # 継続収集用のnextCursorを保存
-                                        if continuous_mode:
-                                            try:
-                                                metadata = data.get('metadata', {})
-                                                next_cursor_to_save = metadata.get('nextCursor')
-                                                if next_cursor_to_save:
-                                                    db_temp = DatabaseManager(DEFAULT_DB_PATH)
-                                                    conn = db_temp._get_connection()
-                                                    cursor = conn.cursor()
-                                                    cursor.execute(
-                                                        """UPDATE collection_state
-                                                           SET next_page_cursor = ?, last_update = datetime('now')
-                                                           WHERE version_id = ?""",
-                                                        (next_cursor_to_save, str(version_id))
-                                                    )
-                                                    conn.commit()
-                                                    conn.close()
-                                            except Exception as e:
-                                                st.warning(f"nextCursor保存エラー: {e}")
-
-                                        # 戦略別結果表示（詳細版）
-                                        if duplicate_count > 0:
-                                            st.write(f"✅ {nsfw_level}+{sort_strategy}: {len(items)}件取得、{saved_count}件保存、{duplicate_count}件重複スキップ")
-                                        else:
-                                            st.write(f"✅ {nsfw_level}+{sort_strategy}: {len(items)}件取得、{saved_count}件保存")
-                                    else:
-                                        # エラー詳細を取得
-                                        try:
-                                            error_detail = response.json()
-                                            error_msg = f"{nsfw_level}+{sort_strategy}: HTTP {response.status_code} - {error_detail.get('error', {}).get('message', 'Unknown error')}"
-                                        except:
-                                            error_msg = f"{nsfw_level}+{sort_strategy}: HTTP {response.status_code}"
-
-                                        collection_results['errors'].append(error_msg)
-                                        st.error(error_msg)
-
-                                    time.sleep(0.5)  # API制限対策
-
-                                except Exception as e:
-                                    error_msg = f"{nsfw_level}+{sort_strategy}: {str(e)}"
-                                    collection_results['errors'].append(error_msg)
-                                    st.error(error_msg)
-
-                        # 結果表示の改善
-                        st.success(f"🎉 包括的収集完了！")
-
-                        # メインの結果表示（今回の実行結果にフォーカス）
-                        col1, col2, col3 = st.columns(3)
-                        col1.metric("🎯 今回保存成功", f"{total_saved_this_run}件", help="この実行で実際にデータベースに保存された件数")
-                        col2.metric("📥 今回取得総件数", f"{total_fetched_this_run}件", help="この実行でCivitAI APIから取得したデータ件数")
-                        col3.metric("⚙️ 実行戦略数", f"{collection_results['strategies_executed']}個", help="実行された収集戦略の組み合わせ数")
-
-                        # 保存されなかった件数とその理由
-                        not_saved = total_fetched_this_run - total_saved_this_run
-                        if not_saved > 0:
-                            total_duplicates = sum(sr['duplicates'] for sr in strategy_results)
-                            total_errors = sum(sr['errors'] for sr in strategy_results)
-
-                            st.markdown("#### 🔍 保存されなかった理由の内訳")
-                            col_dup, col_err, col_other = st.columns(3)
-                            col_dup.metric("🔁 重複データ", f"{total_duplicates}件", help="既にデータベースに存在していたため保存されなかった")
-                            col_err.metric("❌ エラー", f"{total_errors}件", help="データ形式やその他のエラーで保存に失敗")
-                            col_other.metric("❓ その他", f"{not_saved - total_duplicates - total_errors}件", help="その他の理由（プロンプトが空、必須項目不足等）")
-
-                            st.info(f"""
-                            **💡 保存されなかった{not_saved}件について:**
-                            - **重複データ**: {total_duplicates}件 → 既にデータベースに存在するため正常にスキップ
-                            - **エラー**: {total_errors}件 → データ形式の問題等で保存失敗
-                            - **その他**: {not_saved - total_duplicates - total_errors}件 → プロンプトが空、必須項目不足等
-
-                            **重複が多い理由**: 継続収集モードでは同じデータが含まれることがあります。これは正常な動作です。
-                            """)
-
-                        # 戦略別詳細結果
-                        if strategy_results:
-                            with st.expander("📊 戦略別詳細結果", expanded=False):
-                                for sr in strategy_results:
-                                    st.write(f"**{sr['strategy']}**: 取得{sr['fetched']}件 → 保存{sr['saved']}件（重複{sr['duplicates']}件、エラー{sr['errors']}件）")
-
-                        # 詳細説明
-                        st.markdown("#### 📋 収集結果まとめ")
-                        if total_saved_this_run > 0:
-                            st.success(f"""
-                            **✅ 成功**: 今回{total_saved_this_run}件の新しいデータをデータベースに保存しました！
-                            **🔄 継続収集**: 次回実行時はさらに新しいデータが追加されます。
-                            """)
-                        else:
-                            st.warning(f"""
-                            **ℹ️ 結果**: 今回新しいデータは保存されませんでした。
-                            **💡 理由**: 取得したデータが全て重複または無効なデータだった可能性があります。
-                            """)
-
-                        if collection_results['errors']:
-                            with st.expander("⚠️ エラー詳細"):
-                                for error in collection_results['errors']:
-                                    st.write(f"- {error}")
-
-                    except Exception as e:
-                        st.error(f"包括的収集でエラー: {e}")
+                # 収集はバックグラウンドのプロセスで実行し、進捗はジョブ監視パネルで表示する
+                job_id = 'strategy_' + str(uuid.uuid4())[:8]
+                log_dir = Path(project_root) / 'logs' / 'collect_jobs'
+                log_file = log_dir / f'collect_{job_id}.log'
+                args = [
+                    sys.executable,
+                    str(Path(project_root) / 'scripts' / 'collect_strategies.py'),
+                    '--version-id', str(version_id).strip().rstrip('/'),
+                    '--model-name', st.session_state.get('model_name_input', 'Unknown') or 'Unknown',
+                    '--max-items', str(int(enhanced_max_items)),
+                    '--job-id', job_id,
+                    '--db', DEFAULT_DB_PATH,
+                    '--log-file', str(log_file),
+                    '--nsfw', *nsfw_levels,
+                    '--sort', *sort_strategies,
+                ]
+                if not continuous_mode:
+                    args.append('--no-continuous')
+                try:
+                    subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=str(project_root))
+                    job = {
+                        'id': job_id,
+                        'kind': 'strategy',
+                        'log_file': str(log_file),
+                        'model_id': '',
+                        'version_id': str(version_id),
+                        'model_name': st.session_state.get('model_name_input', ''),
+                        'started_at': datetime.utcnow().isoformat() + 'Z',
+                        'status': 'running',
+                        'last_tail': ''
+                    }
+                    st.session_state.setdefault('collect_jobs', []).insert(0, job)
+                    st.success(f"🚀 効率的収集ジョブを開始しました: {job_id}（{len(nsfw_levels) * len(sort_strategies)} 戦略）")
+                    st.caption("ブラウザを閉じてもジョブは継続します。進捗は上の「収集ジョブの状態」に表示されます。")
+                except Exception as e:
+                    st.error(f"包括的収集ジョブの開始に失敗しました: {e}")
 
             # 簡易キーワード統計表示
             with st.expander("📊 収集統計予測"):
@@ -1410,32 +1452,31 @@ def main():
             else:
                 st.metric("カテゴリ数", "未実装")
 
+        aggregates = get_chart_aggregates()
         col1, col2 = st.columns(2)
         with col1:
-            pie_chart = create_category_distribution_chart(df)
+            pie_chart = create_category_distribution_chart(aggregates['category_counts']) if aggregates else None
             if pie_chart:
                 display_chart(pie_chart)
         with col2:
-            hist_chart = create_confidence_histogram(df)
+            hist_chart = create_confidence_histogram(aggregates['confidence_hist']) if aggregates else None
             if hist_chart:
                 display_chart(hist_chart)
 
     with tab2:
         st.header("プロンプト一覧")
         page_size = 50
-        total_items = len(df)
-        total_pages = max(1, math.ceil(total_items / page_size))
-        colp1, colp2 = st.columns([1, 3])
-        with colp1:
-            page = st.number_input("ページ", min_value=1, max_value=total_pages, value=1, step=1, format="%d")
-        with colp2:
-            st.write(f"表示: {page_size} 件/ページ — 合計 {total_items} 件 / 全 {total_pages} ページ")
-        start_idx = (page - 1) * page_size
-        end_idx = start_idx + page_size
-        display_df = df.iloc[start_idx:end_idx]
-        st.write(f"表示中: {len(display_df)} / {len(df)} 件 (ページ {page}/{total_pages})")
-        for idx, row in display_df.iterrows():
-            display_prompt_card(row)
+        search_query = st.text_input(
+            "🔍 全文検索",
+            value="",
+            key='prompt_search_query',
+            help='フレーズ: "best quality" / 前方一致: mast* / ブール: anime AND NOT nsfw（空欄で全件表示）'
+        )
+        render_similar_prompts()
+        if search_query.strip():
+            render_search_results(search_query, page_size)
+        else:
+            render_prompt_list(page_size)
 
     with tab3:
         st.header("詳細分析")
@@ -1454,124 +1495,50 @@ def main():
 
         # 🔍 プロンプト構造分析 - 新機能追加
         st.subheader("🔍 プロンプト構造分析")
-        if not df.empty and 'full_prompt' in df.columns:
+        aggregates = get_chart_aggregates()
+        syntax = (aggregates or {}).get('syntax') or {}
+        total_prompts = syntax.get('total', 0)
+        if total_prompts > 0:
             try:
-                # プロンプトデータの基本分析
-                valid_prompts = df[df['full_prompt'].notna() & (df['full_prompt'] != '')]
-                total_prompts = len(valid_prompts)
-
-                if total_prompts > 0:
-                    # デバッグ情報（開発時のみ - 本番では非表示）
-                    if False:  # デバッグフラグ - 必要時にTrueに変更
-                        with st.expander("🔧 デバッグ情報", expanded=False):
-                            st.write(f"DataFrameカラム数: {len(df.columns)}")
-                            st.write(f"利用可能なカラム: {list(df.columns)}")
-                            st.write(f"total_prompts: {total_prompts}")
-                            if 'prompt_length' in df.columns:
-                                st.write(f"prompt_lengthカラム存在: ✅")
-                                st.write(f"prompt_length非NULL数: {df['prompt_length'].notna().sum()}")
-                            else:
-                                st.write(f"prompt_lengthカラム存在: ❌")
-
-                    # 構造パターン分析
-                    comma_separated = len(valid_prompts[valid_prompts['full_prompt'].str.contains(',', na=False)])
-                    weight_usage = len(valid_prompts[valid_prompts['full_prompt'].str.contains(r':\s*\d+\.?\d*', regex=True, na=False)])
-                    parentheses_usage = len(valid_prompts[valid_prompts['full_prompt'].str.contains(r'[(\[]', regex=True, na=False)])
-                    embedding_usage = len(valid_prompts[valid_prompts['full_prompt'].str.contains(r'<[^>]+>', regex=True, na=False)])
-
-                    # メトリクス表示
-                    col1, col2, col3, col4 = st.columns(4)
-
-                    with col1:
-                        st.metric(
-                            "カンマ区切り使用率",
-                            f"{comma_separated/total_prompts*100:.1f}%",
-                            f"{comma_separated}/{total_prompts}"
-                        )
-
-                    with col2:
-                        st.metric(
-                            "重み付け記法",
-                            f"{weight_usage/total_prompts*100:.1f}%",
-                            f"{weight_usage}/{total_prompts}"
-                        )
-
-                    with col3:
-                        st.metric(
-                            "括弧使用率",
-                            f"{parentheses_usage/total_prompts*100:.1f}%",
-                            f"{parentheses_usage}/{total_prompts}"
-                        )
-
-                    with col4:
-                        st.metric(
-                            "エンベッディング",
-                            f"{embedding_usage/total_prompts*100:.1f}%",
-                            f"{embedding_usage}/{total_prompts}"
-                        )
-
-                    # 長さ分布分析
-                    st.subheader("📏 プロンプト長さ統計")
-
-                    # prompt_lengthカラムの存在確認とデータ処理
-                    if 'prompt_length' in df.columns:
-                        length_data = df['prompt_length'].dropna()
-                    else:
-                        # prompt_lengthが無い場合は動的計算（静かに実行）
-                        length_data = valid_prompts['full_prompt'].str.len()
-
-                    if len(length_data) > 0:
-                        col_left, col_right = st.columns(2)
-
-                        with col_left:
-                            st.write("**基本統計**")
-                            st.metric("平均文字数", f"{length_data.mean():.1f}")
-                            st.metric("中央値", f"{length_data.median():.1f}")
-                            st.write(f"最短: **{length_data.min()}** 文字")
-                            st.write(f"最長: **{length_data.max()}** 文字")
-                            st.write(f"標準偏差: **{length_data.std():.1f}**")
-
-                        with col_right:
-                            # 長さ分布のヒストグラム
-                            try:
-                                if PLOTLY_AVAILABLE:
-                                    # DataFrameを作成してplotly用に整形
-                                    hist_df = pd.DataFrame({'prompt_length': length_data})
-                                    length_hist = px.histogram(
-                                        hist_df,
-                                        x='prompt_length',
-                                        nbins=min(20, len(length_data.unique())),
-                                        title='プロンプト長さ分布',
-                                        labels={'prompt_length': '文字数', 'count': '件数'}
-                                    )
-                                    display_chart(length_hist)
-                                else:
-                                    # Plotlyが無い場合のフォールバック
-                                    st.write("**長さ分布**")
-                                    length_counts = length_data.value_counts().sort_index()
-                                    st.bar_chart(length_counts.head(10))
-                            except Exception as e:
-                                st.warning(f"グラフ表示エラー: {str(e)}")
-                                # シンプルな統計表示
-                                st.write("**長さ範囲別分布**")
-                                bins = [0, 100, 300, 500, 1000, float('inf')]
-                                labels = ['0-99', '100-299', '300-499', '500-999', '1000+']
-                                length_ranges = pd.cut(length_data, bins=bins, labels=labels, include_lowest=True)
-                                range_counts = length_ranges.value_counts()
-                                st.write(range_counts)
-                    else:
-                        st.warning("プロンプト長さのデータが見つかりません")
-
-                    # ComfyUI連携のヒント
-                    st.info("""
-                    💡 **ComfyUI連携のポイント**
-                    - **97%以上**がカンマ区切り → パーサーはカンマベース実装を推奨
-                    - **50%以上**が重み付け使用 → `:数値` パターンの処理が重要
-                    - 括弧使用が多い場合 → グループ化機能の実装を検討
-                    """)
-
+                # 構造パターン分析（保存時に計算した記法の特徴量列を SQL で合計したもの）
+                col1, col2, col3, col4 = st.columns(4)
+                for col, label, key in (
+                    (col1, "カンマ区切り使用率", 'has_comma'),
+                    (col2, "重み付け記法", 'has_weights'),
+                    (col3, "括弧使用率", 'has_parens'),
+                    (col4, "エンベッディング", 'has_embedding'),
+                ):
+                    with col:
+                        st.metric(label, f"{syntax[key]/total_prompts*100:.1f}%", f"{syntax[key]}/{total_prompts}")
+
+                # 長さ分布分析
+                st.subheader("📏 プロンプト長さ統計")
+                length_stats = aggregates.get('length_stats') or {}
+                if length_stats.get('count'):
+                    col_left, col_right = st.columns(2)
+
+                    with col_left:
+                        st.write("**基本統計**")
+                        st.metric("平均文字数", f"{length_stats['mean']:.1f}")
+                        st.metric("中央値", f"{length_stats['median']:.1f}")
+                        st.write(f"最短: **{length_stats['min']}** 文字")
+                        st.write(f"最長: **{length_stats['max']}** 文字")
+                        st.write(f"標準偏差: **{length_stats['std']:.1f}**")
+
+                    with col_right:
+                        length_hist = create_binned_histogram(aggregates['length_hist'], 'プロンプト長さ分布', '文字数', color='#636efa')
+                        if length_hist:
+                            display_chart(length_hist)
                 else:
-                    st.warning("有効なプロンプトデータがありません")
+                    st.warning("プロンプト長さのデータが見つかりません")
+
+                # ComfyUI連携のヒント
+                st.info("""
+                💡 **ComfyUI連携のポイント**
+                - **97%以上**がカンマ区切り → パーサーはカンマベース実装を推奨
+                - **50%以上**が重み付け使用 → `:数値` パターンの処理が重要
+                - 括弧使用が多い場合 → グループ化機能の実装を検討
+                """)
             except Exception as e:
                 st.error(f"プロンプト構造分析エラー: {str(e)}")
         else:
@@ -1774,16 +1741,47 @@ def main():
 
     with tab4:
         st.header("データエクスポート")
-        export_df = df.copy()
-        available_columns = export_df.columns.tolist()
-        selected_columns = st.multiselect("エクスポートするカラムを選択", options=available_columns, default=available_columns, key='selected_columns')
+        # DB から直接キーセットページングで書き出す（全件を DataFrame/文字列に載せない）
+        exp_c1, exp_c2, exp_c3, exp_c4 = st.columns(4)
+        with exp_c1:
+            export_formats = ['csv', 'jsonl'] + (['parquet'] if PYARROW_AVAILABLE else [])
+            export_format = st.selectbox("形式", options=export_formats, key='export_format')
+        with exp_c2:
+            version_options = [''] + sorted(r['key'] for r in get_database(DEFAULT_DB_PATH).get_rollup('version') if r['key'])
+            export_version = st.selectbox("バージョンID", options=version_options, format_func=lambda v: v or '(すべて)', key='export_version')
+        with exp_c3:
+            category_options = [''] + sorted({r['category'] for r in get_database(DEFAULT_DB_PATH).get_category_rollup() if r['category']})
+            export_category = st.selectbox("カテゴリ", options=category_options, format_func=lambda v: v or '(すべて)', key='export_category')
+        with exp_c4:
+            export_min_quality = st.number_input("最低品質スコア", min_value=0, value=0, step=10, key='export_min_quality')
+        selected_columns = st.multiselect("エクスポートするカラムを選択", options=list(EXPORT_COLUMNS), default=DEFAULT_EXPORT_COLUMNS, key='selected_columns')
+        export_dedup = st.checkbox("近似重複を除く（クラスタの代表のみ）", value=False, key='export_dedup')
+        export_filters = {
+            'version_id': export_version or None,
+            'category': export_category or None,
+            'min_quality': int(export_min_quality) if export_min_quality else None,
+            'representatives_only': export_dedup,
+        }
         if selected_columns:
-            export_df = export_df[selected_columns]
-        st.subheader("プレビュー")
-        st.dataframe(export_df.head(5), use_container_width=True)
-        csv_data = export_df.to_csv(index=False, encoding='utf-8-sig')
-        st.download_button(label="📥 CSVダウンロード", data=csv_data, file_name=f"civitai_prompts_{len(export_df)}件.csv", mime="text/csv")
-        st.info(f"エクスポート対象: {len(export_df)} 件")
+            exporter = PromptExporter(DEFAULT_DB_PATH)
+            st.subheader("プレビュー")
+            st.dataframe(pd.DataFrame(exporter.preview(selected_columns, limit=5, **export_filters), columns=selected_columns), use_container_width=True)
+            if st.button("📦 エクスポートファイルを作成", key='export_build'):
+                export_dir = project_root / 'data' / 'exports'
+                export_path = export_dir / f"civitai_prompts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+                with st.spinner("エクスポート中..."):
+                    try:
+                        written = exporter.export(str(export_path), fmt=export_format, columns=selected_columns, **export_filters)
+                        st.session_state['export_file'] = (str(export_path), written)
+                    except Exception as e:
+                        st.error(f"エクスポートに失敗しました: {e}")
+            export_file = st.session_state.get('export_file')
+            if export_file and os.path.exists(export_file[0]):
+                export_path, written = export_file
+                mime = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson', 'parquet': 'application/octet-stream'}.get(Path(export_path).suffix.lstrip('.'), 'application/octet-stream')
+                with open(export_path, 'rb') as export_fh:
+                    st.download_button(label="📥 ダウンロード", data=export_fh, file_name=Path(export_path).name, mime=mime)
+                st.info(f"エクスポート対象: {written} 件 ({export_path})")
 
 if __name__ == "__main__":
     main()